@@ -3,7 +3,8 @@ import streamlit as st
 import re # Import regex for basic email validation
 
 # Import db functions (which are now using MongoDB)
-from db import save_contact, get_contacts, delete_contact
+from db import save_contact, get_contacts, delete_contact, add_contacts, iter_contacts
+import contacts_io # Bulk CSV/vCard import and export
 
 def add_contacts_page():
     """Renders the Add Contacts page UI and handles contact management using the database."""
@@ -74,7 +75,7 @@ def add_contacts_page():
 
     # Display current contacts from the list returned by the database function
     if current_contacts_from_db:
-        # Display contacts in a table (converting ObjectId to string for display)
+        # Display contacts in a table
         contact_data_for_table = [
             {"Name": c.get('name', 'N/A'), "Email": c.get('email', 'N/A'), "Phone": c.get('phone', 'N/A')}
             for c in current_contacts_from_db
@@ -101,7 +102,7 @@ def add_contacts_page():
                 # Create a display string (name and email)
                 display_string = f"{c.get('name', 'N/A')} <{c.get('email', 'N/A')}>"
                 # Store the relationship between display string and MongoDB _id
-                st.session_state.contact_id_map[display_string] = str(c.get('_id'))
+                st.session_state.contact_id_map[display_string] = c.get('_id')
                 contact_display_options.append(display_string)
 
         # Only show the selector if we have valid contacts
@@ -125,7 +126,7 @@ def add_contacts_page():
                     if contact_id:
                         try:
                             # Pass the MongoDB _id string to the delete function
-                            if delete_contact(contact_id):
+                            if delete_contact(user_id, contact_id):
                                 remove_status.success(f"Contact removed: {contact_to_remove_display}")
                                 st.rerun()  # Refresh the page
                             else:
@@ -142,7 +143,63 @@ def add_contacts_page():
     else:
         st.info("No contacts added yet. Add contacts using the form above.")
 
+    st.markdown("---")
+    _import_export_section(user_id, current_contacts_from_db)
+
     st.markdown("---")
     if st.button("⬅️ Back to Dashboard", key="back_to_dashboard_contacts"):
         st.session_state.page = 'dashboard'
         st.rerun()
+
+
+def _import_export_section(user_id, current_contacts):
+    """Bulk import from a CSV/vCard upload (one database write) and export of the contact list."""
+    st.subheader("Import / Export Contacts")
+    message = st.session_state.pop('contacts_import_message', None)
+    if message:
+        st.success(message)
+
+    with st.expander("Import contacts from a file"):
+        st.caption("Upload a CSV file with name, email and (optionally) phone columns, or a vCard (.vcf) "
+                   "file exported from your phone's address book.")
+        # The uploader's key changes after an import, which clears the uploaded file
+        nonce = st.session_state.get('contacts_import_nonce', 0)
+        uploaded = st.file_uploader("Contacts file", type=["csv", "vcf", "vcard"], key=f"contacts_import_file_{nonce}")
+        if uploaded is not None:
+            try:
+                parsed = contacts_io.parse_contacts_file(uploaded.name, uploaded.getvalue())
+            except ValueError as e:
+                st.error(str(e))
+                parsed = None
+            if parsed is not None:
+                valid, rejected = contacts_io.validate_contacts(parsed, [c.get('email') for c in current_contacts])
+                st.write(f"{len(valid)} of {len(parsed)} contacts are ready to import.")
+                if len(rejected):
+                    st.warning(f"{len(rejected)} rows will be skipped:")
+                    st.dataframe(rejected, use_container_width=True)
+                if len(valid):
+                    st.dataframe(valid.head(20), use_container_width=True, hide_index=True)
+                    if st.button(f"Import {len(valid)} Contacts", key="contacts_import_button"):
+                        try:
+                            inserted = add_contacts(user_id, valid.to_dict("records"))
+                        except Exception as e:
+                            st.error(f"An error occurred while importing contacts: {e}")
+                            print(f"Import Contacts DB Call Error: {e}")
+                        else:
+                            if inserted:
+                                st.session_state.contacts_import_nonce = nonce + 1
+                                st.session_state.contacts_import_message = f"Imported {inserted} contacts."
+                                st.rerun() # One rerun for the whole file
+                            st.error("Failed to import contacts.")
+
+    if current_contacts:
+        # Exports are generated only when a button is clicked, straight from the database cursor
+        col_csv, col_vcf = st.columns(2)
+        with col_csv:
+            st.download_button("Download as CSV", key="contacts_export_csv", file_name="emergency_contacts.csv",
+                               mime="text/csv", on_click="ignore",
+                               data=lambda: contacts_io.export_contacts(iter_contacts(user_id), "csv"))
+        with col_vcf:
+            st.download_button("Download as vCard", key="contacts_export_vcf", file_name="emergency_contacts.vcf",
+                               mime="text/vcard", on_click="ignore",
+                               data=lambda: contacts_io.export_contacts(iter_contacts(user_id), "vcf"))
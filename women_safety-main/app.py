@@ -8,6 +8,8 @@ st.set_page_config(layout="wide")
 
 import os
 import json
+import page_profiler # Opt-in page render profiling (SEFI_PROFILE or ?profile= for admins)
+import session_memory # Per-session state size accounting and trimming
 
 # Import db module early to ensure init_db() is called (place after set_page_config)
 # Also ensures bcrypt and pymongo are imported early
@@ -83,10 +85,42 @@ current_page_key = st.session_state.page
 # Get the function corresponding to the current page key from the session state dictionary
 current_page_func = st.session_state.pages.get(current_page_key)
 
+# Keep this session's state bounded (trim growing lists, drop stale page data) before rendering
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    _run_ctx = get_script_run_ctx()
+    session_id = _run_ctx.session_id if _run_ctx else None
+except ImportError:
+    session_id = None
+memory_manager = session_memory.get_session_memory_manager()
+memory_manager.enforce(st.session_state, current_page_key, session_id)
+
+# Admins can see the session memory report and the risk model server's statistics with ?memory=1
+if st.query_params.get("memory") and page_profiler.is_admin(st.session_state.get('user')):
+    with st.sidebar.expander("Session memory", expanded=True):
+        rows = session_memory.inspect(st.session_state)
+        st.write(f"This session: ~{sum(size for _, size, _ in rows) / 1024:.0f} KiB")
+        st.dataframe([{"key": key, "KiB": round(size / 1024, 1), "type": kind} for key, size, kind in rows], use_container_width=True)
+        totals = memory_manager.totals()
+        st.write(f"All sessions: {totals['sessions']} reported, ~{totals['total_bytes'] / 1e6:.1f} MB, {totals['evicted']} values evicted")
+        st.dataframe([{"session": sid, "KiB": round(total / 1024, 1), "page": page, "largest keys": ", ".join(k for k, _, _ in keys)}
+                      for sid, total, page, keys in memory_manager.top_sessions()], use_container_width=True)
+    with st.sidebar.expander("Risk model serving", expanded=False):
+        from model_serving import get_model_server
+        serving = get_model_server().stats()
+        st.write(f"Model {serving['model_version']}: {serving['batches']} batches, {serving['errors']} errors, "
+                 f"{serving['swaps']} swaps, {serving['queued']} queued")
+        st.dataframe([{"histogram": name, **{k: v for k, v in serving[name].items() if k != "buckets"}}
+                      for name in ("latency_ms", "batch_size")], use_container_width=True)
+
 # Execute the function for the current page
 if current_page_func:
     try:
-        current_page_func()
+        profile_mode = page_profiler.requested_mode(st.query_params.get("profile"), st.session_state.get('user'))
+        if profile_mode:
+            page_profiler.profile_page(current_page_key, current_page_func, profile_mode)
+        else:
+            current_page_func()
     except Exception as e:
         # Catch potential errors within page execution
         st.error(f"An error occurred while rendering the page: {e}")
@@ -0,0 +1,208 @@
+# audio_trigger.py
+# Server-side loud-sound detection for the Triggers page.
+# Audio frames arrive through streamlit-webrtc's audio_frame_callback on a worker thread.
+# They are buffered and analysed in batches with NumPy (RMS level, spectral centroid and
+# high-band energy per analysis frame), and a hysteresis detector turns the per-frame
+# features into trigger events. Events are pushed onto a thread-safe queue that the page
+# polls, because the callback thread must never touch Streamlit session state.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+
+# --- Configuration ---
+# Level (dBFS) a frame must reach to count as loud, and the lower level it must drop below to end the event
+LOUD_ON_DBFS = float(os.environ.get("SEFI_AUDIO_LOUD_ON_DBFS", "-18"))
+LOUD_OFF_DBFS = float(os.environ.get("SEFI_AUDIO_LOUD_OFF_DBFS", "-28"))
+# How long the sound must stay above LOUD_ON_DBFS before it triggers (filters out single clicks/bumps)
+MIN_LOUD_SECONDS = float(os.environ.get("SEFI_AUDIO_MIN_LOUD_SECONDS", "0.25"))
+# Minimum time between two trigger events from the same stream
+REFRACTORY_SECONDS = float(os.environ.get("SEFI_AUDIO_REFRACTORY_SECONDS", "10"))
+ANALYSIS_FRAME_SECONDS = 0.02 # 20 ms analysis frames
+BATCH_SECONDS = 0.2 # Audio is analysed in 200 ms batches
+HIGH_BAND_HZ = 2000.0 # Screams and breaking glass carry much of their energy above this
+
+
+def to_mono_float(frame):
+    """Converts an av.AudioFrame to a mono float32 array in [-1, 1]."""
+    samples = frame.to_ndarray()
+    # Scale integer formats (WebRTC delivers s16) before mixing: the mean below returns float64
+    if np.issubdtype(samples.dtype, np.integer):
+        samples = samples.astype(np.float32) / float(np.iinfo(samples.dtype).max + 1)
+    else:
+        samples = samples.astype(np.float32)
+    channels = len(frame.layout.channels)
+    if frame.format.is_planar:
+        samples = samples.reshape(channels, -1).mean(axis=0)
+    else:
+        # Packed formats interleave channels in a single row
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32)
+
+
+def frame_features(samples, sample_rate, frame_seconds=ANALYSIS_FRAME_SECONDS):
+    """
+    Features for consecutive analysis frames of a mono signal, computed for the whole batch at once.
+    Returns a dict of arrays (one value per analysis frame): 'rms_dbfs', 'centroid_hz', 'high_band_ratio'.
+    Trailing samples that do not fill a whole frame are ignored; callers carry them over.
+    """
+    frame_length = max(1, int(sample_rate * frame_seconds))
+    count = len(samples) // frame_length
+    if count == 0:
+        empty = np.empty(0, dtype=np.float32)
+        return {"rms_dbfs": empty, "centroid_hz": empty, "high_band_ratio": empty}
+    frames = samples[:count * frame_length].reshape(count, frame_length)
+
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    rms_dbfs = 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame_length, d=1.0 / sample_rate)
+    total = np.maximum(power.sum(axis=1), 1e-20)
+    centroid_hz = (power * freqs).sum(axis=1) / total
+    high_band_ratio = power[:, freqs >= HIGH_BAND_HZ].sum(axis=1) / total
+    return {"rms_dbfs": rms_dbfs, "centroid_hz": centroid_hz, "high_band_ratio": high_band_ratio}
+
+
+class HysteresisDetector:
+    """
+    Loud-sound state machine over per-frame levels.
+    Enters the loud state once the level has been above `on_dbfs` for `min_loud_seconds`,
+    leaves it when the level drops below `off_dbfs`, and fires at most once per `refractory_seconds`.
+    """
+
+    def __init__(self, on_dbfs=LOUD_ON_DBFS, off_dbfs=LOUD_OFF_DBFS, min_loud_seconds=MIN_LOUD_SECONDS,
+                 refractory_seconds=REFRACTORY_SECONDS, frame_seconds=ANALYSIS_FRAME_SECONDS):
+        self.on_dbfs = on_dbfs
+        self.off_dbfs = off_dbfs
+        self.min_loud_frames = max(1, int(round(min_loud_seconds / frame_seconds)))
+        self.refractory_seconds = refractory_seconds
+        self.frame_seconds = frame_seconds
+        self.loud = False
+        self._run = 0 # Consecutive frames above on_dbfs
+        self._last_fired = None
+
+    def update(self, features, batch_start):
+        """Feeds one batch of features; returns a list of trigger event dicts (usually empty)."""
+        events = []
+        levels = features["rms_dbfs"]
+        above = levels >= self.on_dbfs
+        below = levels < self.off_dbfs
+        # The per-frame loop only runs over booleans; all signal processing is already vectorised
+        for i in range(len(levels)):
+            if self.loud:
+                if below[i]:
+                    self.loud = False
+                    self._run = 0
+                continue
+            self._run = self._run + 1 if above[i] else 0
+            if self._run >= self.min_loud_frames:
+                self.loud = True
+                at = batch_start + (i + 1) * self.frame_seconds
+                if self._last_fired is None or at - self._last_fired >= self.refractory_seconds:
+                    self._last_fired = at
+                    start = i + 1 - self.min_loud_frames
+                    events.append({
+                        "action": "trigger",
+                        "source": "sound",
+                        "keyword": "loud_sound",
+                        "detector": "server",
+                        "level": float(np.max(levels[max(0, start):i + 1])),
+                        "centroid_hz": float(np.mean(features["centroid_hz"][max(0, start):i + 1])),
+                        "high_band_ratio": float(np.mean(features["high_band_ratio"][max(0, start):i + 1])),
+                        "stream_time": round(at, 3),
+                    })
+        return events
+
+
+class AudioTriggerProcessor:
+    """
+    Per-stream processor used as streamlit-webrtc's `audio_frame_callback`.
+    Frames are buffered until BATCH_SECONDS of audio is available, then analysed in one go.
+    The CPU time spent on analysis (thread CPU time, so waiting is not counted) is tracked
+    against the amount of audio processed, giving a per-stream real-time cost.
+    """
+
+    def __init__(self, detector=None, events=None, batch_seconds=BATCH_SECONDS, keyword_spotter=None):
+        self.detector = detector or HysteresisDetector()
+        # Optional keyword_spotting.KeywordSpotter fed with the same audio
+        self.keyword_spotter = keyword_spotter
+        self.events = events if events is not None else queue.Queue()
+        self.batch_seconds = batch_seconds
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._sample_rate = None
+        self._stream_time = 0.0 # Seconds of audio analysed so far
+        self.cpu_seconds = 0.0
+        self.batches = 0
+        self.last_level = None
+
+    def __call__(self, frame):
+        try:
+            self.push(to_mono_float(frame), frame.sample_rate)
+        except Exception as e:
+            print(f"Audio: Could not analyse audio frame: {e}")
+        return frame
+
+    def push(self, samples, sample_rate):
+        """Adds mono samples; analyses them once a full batch is buffered."""
+        with self._lock:
+            if self._sample_rate != sample_rate:
+                # New stream or renegotiated rate; stale samples cannot be mixed in
+                self._buffer, self._buffered = [], 0
+                self._sample_rate = sample_rate
+            self._buffer.append(samples)
+            self._buffered += len(samples)
+            if self._buffered < self.batch_seconds * sample_rate:
+                return
+            self._process_batch()
+
+    def _process_batch(self):
+        started = time.thread_time()
+        samples = np.concatenate(self._buffer)
+        features = frame_features(samples, self._sample_rate)
+        used = len(features["rms_dbfs"]) * max(1, int(self._sample_rate * ANALYSIS_FRAME_SECONDS))
+        # Keep the partial analysis frame for the next batch
+        self._buffer = [samples[used:]] if used < len(samples) else []
+        self._buffered = len(samples) - used
+        events = self.detector.update(features, self._stream_time)
+        if self.keyword_spotter is not None:
+            # Only the samples analysed in this batch; the carried-over tail is passed on with the next one
+            events.extend(self.keyword_spotter.push(samples[:used], self._sample_rate))
+        self._stream_time += used / float(self._sample_rate)
+        if len(features["rms_dbfs"]):
+            self.last_level = float(features["rms_dbfs"][-1])
+        self.cpu_seconds += time.thread_time() - started
+        self.batches += 1
+        for event in events:
+            event["event_id"] = uuid.uuid4().hex # Idempotency key for trigger_events
+            event["detected_at"] = time.time()
+            print(f"Audio: Trigger '{event['keyword']}' detected at {event['stream_time']}s.")
+            self.events.put(event)
+
+    def poll_events(self):
+        """Returns all events queued since the last call. Safe to call from the Streamlit script thread."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stats(self):
+        with self._lock:
+            return {
+                "audio_seconds": round(self._stream_time, 2),
+                "cpu_seconds": round(self.cpu_seconds, 4),
+                # CPU seconds per second of audio; 0.01 means 1% of one core for this stream
+                "cpu_per_audio_second": round(self.cpu_seconds / self._stream_time, 5) if self._stream_time else None,
+                "batches": self.batches,
+                "last_level_dbfs": round(self.last_level, 1) if self.last_level is not None else None,
+                "loud": self.detector.loud,
+            }
@@ -0,0 +1,415 @@
+# backends.py
+# Local stand-ins for the app's external services, for load tests and offline runs.
+# Setting SEFI_BACKEND=local switches all of them at once:
+#   - MongoDB (db.py)            -> an in-process document store (mongomock if installed,
+#                                   otherwise the small InMemoryMongoClient below)
+#   - SMTP (email_alert.py)      -> LocalMailSink, which writes each alert to local_mail/*.eml
+#   - Firebase (video_upload.py) -> video_upload.LocalFileStorageBackend (local_blob_store/)
+#   - Nominatim / OpenCage       -> FixtureGeocoder, which answers from a JSON fixture file or,
+#                                   without one, from the district/city names in the bundled
+#                                   hospital dataset
+# Everything else in the app runs unchanged, so throughput measured against these backends is
+# the app's own cost. SEFI_GEOCODER_LATENCY_MS / SEFI_MAIL_LATENCY_MS add an artificial delay
+# to mimic the network round trip of the real services.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import copy
+import json
+import os
+import re
+import threading
+import time
+from email.utils import make_msgid
+
+# Optional full MongoDB emulation
+try:
+    import mongomock
+    _MONGOMOCK_AVAILABLE = True
+except ImportError:
+    _MONGOMOCK_AVAILABLE = False
+
+# --- Configuration ---
+BACKEND = os.environ.get("SEFI_BACKEND", "production").strip().lower()
+LOCAL_DATABASE_NAME = os.environ.get("SEFI_LOCAL_DATABASE", "sefi_local")
+MAIL_SINK_DIR = os.environ.get("SEFI_MAIL_SINK_DIR", "local_mail")
+MAIL_LATENCY_MS = float(os.environ.get("SEFI_MAIL_LATENCY_MS", "0"))
+GEOCODER_FIXTURES_PATH = os.environ.get("SEFI_GEOCODER_FIXTURES", "geocoder_fixtures.json")
+GEOCODER_LATENCY_MS = float(os.environ.get("SEFI_GEOCODER_LATENCY_MS", "0"))
+LOCAL_SENDER_EMAIL = "sos-alerts@localhost"
+
+
+def use_local_backends():
+    """True when SEFI_BACKEND=local: no MongoDB, SMTP, Firebase or geocoding service is contacted."""
+    return BACKEND == "local"
+
+
+# --- In-memory document store ---
+class _InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class _DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class _BulkWriteResult:
+    def __init__(self, inserted_count, deleted_count):
+        self.inserted_count = inserted_count
+        self.deleted_count = deleted_count
+
+
+def _matches(document, query):
+    """Equality, $in, $ne and $exists conditions on top-level fields (what the app's queries use)."""
+    for field, condition in (query or {}).items():
+        value = document.get(field)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$exists" and (field in document) != bool(operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        result = {k: copy.deepcopy(document[k]) for k in included if k in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    return {k: copy.deepcopy(v) for k, v in document.items() if projection.get(k, 1)}
+
+
+class _Cursor:
+    """List-backed stand-in for a pymongo cursor (iteration, sort, limit, batch_size)."""
+
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, key, direction=1):
+        self._documents.sort(key=lambda d: (d.get(key) is None, d.get(key)), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        if n:
+            self._documents = self._documents[:n]
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        return iter(self._documents)
+
+
+class InMemoryCollection:
+    """The subset of pymongo.collection.Collection used by db.py, kept in a dict under one lock."""
+
+    def __init__(self, name):
+        self.name = name
+        self._documents = {}
+        self._indexes = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        self._lock = threading.RLock()
+
+    # Indexes (unique indexes are enforced on insert)
+    def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = kwargs.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            self._indexes[name] = {"key": list(keys), "unique": unique}
+        return name
+
+    def index_information(self):
+        with self._lock:
+            return copy.deepcopy(self._indexes)
+
+    def _check_unique(self, document):
+        from pymongo.errors import DuplicateKeyError
+
+        for name, index in self._indexes.items():
+            if not index["unique"] or name == "_id_":
+                continue
+            fields = [field for field, _ in index["key"]]
+            key = tuple(document.get(f) for f in fields)
+            if any(tuple(other.get(f) for f in fields) == key for other in self._documents.values()):
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name} dup key: {key}")
+
+    # Writes
+    def insert_one(self, document):
+        from bson.objectid import ObjectId
+
+        with self._lock:
+            document.setdefault("_id", ObjectId())
+            if document["_id"] in self._documents:
+                from pymongo.errors import DuplicateKeyError
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+            self._check_unique(document)
+            self._documents[document["_id"]] = copy.deepcopy(document)
+            return _InsertOneResult(document["_id"])
+
+    def delete_one(self, query):
+        with self._lock:
+            for _id, document in self._documents.items():
+                if _matches(document, query):
+                    del self._documents[_id]
+                    return _DeleteResult(1)
+            return _DeleteResult(0)
+
+    def delete_many(self, query):
+        with self._lock:
+            doomed = [_id for _id, document in self._documents.items() if _matches(document, query)]
+            for _id in doomed:
+                del self._documents[_id]
+            return _DeleteResult(len(doomed))
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        InsertOne / DeleteOne / DeleteMany requests (pymongo operation objects). As with pymongo,
+        failed writes are collected and raised as one BulkWriteError: an ordered bulk stops at the
+        first failure, an unordered one carries on with the remaining requests.
+        """
+        from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+        requests = list(requests)
+        kinds = [type(request).__name__ for request in requests]
+        for kind in kinds:
+            if kind not in ("InsertOne", "DeleteOne", "DeleteMany"):
+                raise TypeError(f"{kind} is not a valid request for the in-memory backend's bulk_write")
+        inserted = deleted = 0
+        write_errors = []
+        with self._lock:
+            for index, (request, kind) in enumerate(zip(requests, kinds)):
+                if kind == "InsertOne":
+                    try:
+                        self.insert_one(request._doc)
+                    except DuplicateKeyError as e:
+                        write_errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": request._doc})
+                        if ordered:
+                            break
+                        continue
+                    inserted += 1
+                elif kind == "DeleteOne":
+                    deleted += self.delete_one(request._filter).deleted_count
+                else:
+                    deleted += self.delete_many(request._filter).deleted_count
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": [], "nInserted": inserted,
+                                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": deleted, "upserted": []})
+        return _BulkWriteResult(inserted, deleted)
+
+    # Reads
+    def find(self, query=None, projection=None, **kwargs):
+        with self._lock:
+            found = [_project(d, projection) for d in self._documents.values() if _matches(d, query)]
+        return _Cursor(found)
+
+    def find_one(self, query=None, projection=None):
+        with self._lock:
+            for document in self._documents.values():
+                if _matches(document, query):
+                    return _project(document, projection)
+        return None
+
+    def count_documents(self, query):
+        with self._lock:
+            return sum(1 for d in self._documents.values() if _matches(d, query))
+
+
+class InMemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def create_collection(self, name):
+        return self[name]
+
+    def list_collection_names(self):
+        with self._lock:
+            return list(self._collections)
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = InMemoryCollection(name)
+            return self._collections[name]
+
+
+class InMemoryMongoClient:
+    """Process-wide stand-in for MongoClient; data lives as long as the server process."""
+
+    def __init__(self):
+        self._databases = {}
+        self._lock = threading.Lock()
+        self.admin = self
+
+    def command(self, name, *args, **kwargs):
+        return {"ok": 1.0, "ismaster": True}
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = InMemoryDatabase(name)
+            return self._databases[name]
+
+
+_mongo_client = None
+_mongo_lock = threading.Lock()
+
+def get_local_mongo_client():
+    """The shared local document store: mongomock if installed, otherwise InMemoryMongoClient."""
+    global _mongo_client
+    with _mongo_lock:
+        if _mongo_client is None:
+            _mongo_client = mongomock.MongoClient() if _MONGOMOCK_AVAILABLE else InMemoryMongoClient()
+            print(f"Backends: Using local {'mongomock' if _MONGOMOCK_AVAILABLE else 'in-memory'} document store.")
+        return _mongo_client
+
+
+# --- Mail sink ---
+class LocalMailSink:
+    """
+    Accepts the same calls email_alert.py makes on smtplib.SMTP (login, starttls, sendmail)
+    and writes each message to MAIL_SINK_DIR as an .eml file instead of sending it.
+    """
+
+    sent_count = 0
+    _count_lock = threading.Lock()
+
+    def __init__(self, sink_dir=MAIL_SINK_DIR, latency_ms=MAIL_LATENCY_MS):
+        self.sink_dir = sink_dir
+        self.latency = latency_ms / 1000.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def starttls(self, *args, **kwargs):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, message):
+        if self.latency:
+            time.sleep(self.latency)
+        os.makedirs(self.sink_dir, exist_ok=True)
+        message_id = re.sub(r"[^\w.-]", "", make_msgid(domain="localhost"))
+        path = os.path.join(self.sink_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{message_id}.eml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"X-Envelope-From: {from_addr}\nX-Envelope-To: {', '.join(to_addrs)}\n{message}")
+        with LocalMailSink._count_lock:
+            LocalMailSink.sent_count += 1
+        print(f"Backends: Wrote alert for {len(to_addrs)} recipients to {path}.")
+        return {}
+
+
+# --- Geocoder ---
+class FixtureGeocoder:
+    """
+    Reverse geocoding from a fixture list of places; a point resolves to the nearest place.
+    Fixture file format (JSON list): [{"lat": .., "lon": .., "city": .., "district": .., "state": ..,
+    "road": .. (optional), "postcode": .. (optional)}, ...]
+    """
+
+    def __init__(self, places, latency_ms=GEOCODER_LATENCY_MS):
+        import numpy as np
+        from service_index import ServiceIndex
+
+        self.places = places
+        self.latency = latency_ms / 1000.0
+        self.index = ServiceIndex(np.array([p["lat"] for p in places], dtype=float),
+                                  np.array([p["lon"] for p in places], dtype=float))
+
+    @classmethod
+    def load(cls, path=GEOCODER_FIXTURES_PATH):
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                places = json.load(f)
+            print(f"Backends: Loaded {len(places)} geocoder fixtures from {path}.")
+            return cls(places)
+        return cls(cls._places_from_hospitals())
+
+    @staticmethod
+    def _places_from_hospitals():
+        """One place per (city, district, state) of the hospital dataset, at the mean hospital position."""
+        import pandas as pd
+        from emergency_services import HOSPITAL_CSV_PATH
+
+        try:
+            df = pd.read_csv(HOSPITAL_CSV_PATH)
+            df["Latitude"] = pd.to_numeric(df["Latitude"], errors='coerce')
+            df["Longitude"] = pd.to_numeric(df["Longitude"], errors='coerce')
+            grouped = df.dropna(subset=["Latitude", "Longitude"]).groupby(["City", "District", "State"], as_index=False)[["Latitude", "Longitude"]].mean()
+            places = [{"lat": r.Latitude, "lon": r.Longitude, "city": r.City, "district": r.District, "state": r.State}
+                      for r in grouped.itertuples(index=False)]
+            print(f"Backends: Geocoder fixtures built from {len(places)} places in {HOSPITAL_CSV_PATH}.")
+            return places
+        except Exception as e:
+            print(f"Backends: Could not build geocoder fixtures from {HOSPITAL_CSV_PATH}: {e}")
+            # A single place so lookups still answer
+            return [{"lat": 28.6139, "lon": 77.2090, "city": "New Delhi", "district": "New Delhi", "state": "Delhi"}]
+
+    def nearest(self, lat, lon):
+        if self.latency:
+            time.sleep(self.latency)
+        rows, _ = self.index.query([lat], [lon], k=1)
+        return self.places[rows[0, 0]] if rows[0, 0] >= 0 else None
+
+    def reverse_address(self, lat, lon):
+        """Same shape as emergency_services.get_address_from_coords (Nominatim)."""
+        place = self.nearest(lat, lon)
+        if place is None:
+            return {"error": "No detailed address found for coordinates", "source": "Fixture"}
+        return self._address(place)
+
+    @staticmethod
+    def _address(place):
+        road = place.get("road", "N/A")
+        parts = [p for p in (place.get("road"), place.get("city"), place.get("district"), place.get("state"), place.get("postcode"), "India") if p]
+        return {
+            'full_address': ", ".join(str(p) for p in parts),
+            'house_number': 'N/A', 'building': 'N/A', 'road': road, 'street': road,
+            'neighbourhood': 'N/A', 'suburb': 'N/A',
+            'city': place.get("city", 'N/A'), 'district': place.get("district", 'N/A'),
+            'state': place.get("state", 'N/A'), 'postcode': place.get("postcode", 'N/A'),
+            'country': 'India', 'source': 'Fixture',
+        }
+
+    def reverse_formatted(self, lat, lon):
+        """(formatted address, district) like check_area_safety_page.reverse_geocode (OpenCage)."""
+        place = self.nearest(lat, lon)
+        if place is None:
+            return "Location not found", None
+        return self._address(place)['full_address'], place.get("district") or place.get("city")
+
+
+_geocoder = None
+_geocoder_version = None
+_geocoder_lock = threading.Lock()
+
+def get_fixture_geocoder():
+    """The fixture geocoder, built again when the fixture file (or the hospital dataset it is built from) changes."""
+    global _geocoder, _geocoder_version
+    from datasets import dataset_version
+    from emergency_services import HOSPITAL_CSV_PATH
+    version = dataset_version(GEOCODER_FIXTURES_PATH) or dataset_version(HOSPITAL_CSV_PATH)
+    with _geocoder_lock:
+        if _geocoder is None or version != _geocoder_version:
+            _geocoder = FixtureGeocoder.load()
+            _geocoder_version = version
+        return _geocoder
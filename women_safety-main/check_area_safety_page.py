@@ -4,6 +4,10 @@ import requests
 import json
 from datetime import datetime
 import streamlit_js_eval
+import backends
+from coverage_grid import nearest_help_km
+from model_serving import get_model_server
+from risk_scoring import CRIME_DATA_PATH
 
 # Initialize session state variables
 if 'page' not in st.session_state:
@@ -21,6 +25,9 @@ if 'location_requested' not in st.session_state:
 
 # Function to reverse geocode (convert lat/lon to human-readable address)
 def reverse_geocode(lat, lon):
+    # Local backend: answer from the fixture geocoder instead of OpenCage
+    if backends.use_local_backends():
+        return backends.get_fixture_geocoder().reverse_formatted(lat, lon)
     api_key = "995fb40a98f24267a32528a5e5f3aa4b"  # Your OpenCage API key
     url = f"https://api.opencagedata.com/geocode/v1/json?q={lat}+{lon}&key={api_key}"
     try:
@@ -41,12 +48,41 @@ def reverse_geocode(lat, lon):
         return "Error fetching location", None
 
 # Function to check the safety of the area
+# One model server per process, shared by all sessions (the model is loaded once and predictions
+# from concurrent sessions are batched together)
+if hasattr(st, "cache_resource"):
+    model_server = st.cache_resource(get_model_server)
+else:
+    model_server = get_model_server
+
+def score_location_risk(lat, lon, total_crimes):
+    """Risk score for the current location, reused across reruns while location, crimes and time (to the minute) are unchanged."""
+    now = datetime.now()
+    key = (round(lat, 5), round(lon, 5), total_crimes, now.strftime("%Y-%m-%d %H:%M"))
+    cached = st.session_state.get('risk_result')
+    if cached and cached[0] == key:
+        return cached[1]
+    risk = model_server().predict(lat, lon, when=now, total_crimes=total_crimes)
+    st.session_state['risk_result'] = (key, risk)
+    return risk
+
 def check_area_safety_page():
     st.title("🛰️ Check Area Safety")
     
     # Create a container for location data
     location_container = st.container()
 
+    # Live tracking reloads the page with the new position in the URL
+    if 'track_lat' in st.query_params and 'track_lon' in st.query_params:
+        try:
+            st.session_state['lat'] = float(st.query_params['track_lat'])
+            st.session_state['lon'] = float(st.query_params['track_lon'])
+        except (ValueError, TypeError) as e:
+            st.error(f"Invalid tracking coordinates: {e}")
+        # Clear params to avoid reprocessing
+        del st.query_params['track_lat']
+        del st.query_params['track_lon']
+
     # Process location data if available in session state from streamlit_js_eval
     if "location_data" in st.session_state and st.session_state["location_data"] is not None:
         location_data = st.session_state["location_data"]
@@ -185,11 +221,20 @@ def check_area_safety_page():
         st.write(f"Detected location: {location}")
         if district:
             st.write(f"District/City: {district}")
+
+        # Distance to the nearest police station / hospital from the precomputed coverage grid
+        coverage = nearest_help_km(lat, lon)
+        if coverage:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Nearest Police Station", f"~{coverage['police_km']} km" if coverage.get('police_km') is not None else "Unknown")
+            with col2:
+                st.metric("Nearest Hospital", f"~{coverage['hospital_km']} km" if coverage.get('hospital_km') is not None else "Unknown")
         
         try:
             # For demonstration, create dummy crime data if file not found
             try:
-                df = pd.read_csv("assets/combined_crime_data.csv")
+                df = pd.read_csv(CRIME_DATA_PATH)
             except FileNotFoundError:
                 # No crime data means the area is considered safe
                 st.success("✅ No crime data available - this typically indicates a very safe area.")
@@ -249,12 +294,20 @@ def check_area_safety_page():
                             # Calculate total crimes for safety assessment
                             total_crimes = int(recent["Rape"].values[0]) + int(recent["Murder"].values[0])
                             
-                            # Display safety assessment
-                            is_safe = total_crimes <= 20
+                            # Display safety assessment: crime, distance to help, danger zones and time of day combined
+                            risk = score_location_risk(lat, lon, total_crimes)
+                            is_safe = risk['label'] == 'safe'
                             if is_safe:
-                                st.success("✅ This area is marked *Safe* based on recent data.")
+                                st.success(f"✅ This area is marked *Safe* based on recent data (risk score {risk['score']:.2f}).")
                             else:
-                                st.error("❌ This area is marked *Unsafe* based on recent data.")
+                                st.error(f"❌ This area is marked *Unsafe* based on recent data (risk score {risk['score']:.2f}).")
+                            if risk['contributions']:
+                                with st.expander("What affects this score?"):
+                                    labels = {'crime': "Recent crimes", 'police_km': "Distance to police", 'hospital_km': "Distance to hospital",
+                                              'danger_zone': "Inside a danger zone", 'hour_sin': "Time of day", 'hour_cos': "Time of day (night)"}
+                                    for name, value in sorted(risk['contributions'].items(), key=lambda item: -abs(item[1])):
+                                        if value:
+                                            st.write(f"{labels.get(name, name)}: {'raises' if value > 0 else 'lowers'} risk ({value:+.2f})")
                             
                             # Record this safety check in history
                             st.session_state['safety_history'].append({
@@ -263,7 +316,8 @@ def check_area_safety_page():
                                 'district': district if district else "Unknown",
                                 'coordinates': f"{lat:.6f}, {lon:.6f}",
                                 'safe': is_safe,
-                                'total_crimes': total_crimes
+                                'total_crimes': total_crimes,
+                                'risk_score': risk['score']
                             })
                             st.session_state['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                             
@@ -0,0 +1,185 @@
+# contacts_io.py
+# Bulk import and export of emergency contacts.
+# Uploaded CSV or vCard files are parsed into one DataFrame and validated in a single vectorised
+# pass (missing fields, email format, duplicates in the file and contacts the user already has),
+# so the page can save every valid row with one db.add_contacts call (one bulk_write) and one rerun.
+# Exports are produced in chunks from an iterator of contacts (db.iter_contacts reads the cursor in
+# batches), so a long list is never held as documents and text at the same time.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import csv
+import io
+import os
+
+import pandas as pd
+
+# --- Configuration ---
+MAX_IMPORT_ROWS = int(os.environ.get("SEFI_CONTACTS_IMPORT_MAX_ROWS", "5000"))
+MAX_IMPORT_BYTES = int(os.environ.get("SEFI_CONTACTS_IMPORT_MAX_KB", "2048")) * 1024
+EXPORT_CHUNK_ROWS = 500
+FIELDS = ("name", "phone", "email")
+# Same pattern as the single-contact form
+EMAIL_PATTERN = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
+
+# Header names accepted for each field (compared lower-cased, spaces trimmed); covers the
+# exports of the common phone and mail address books
+CSV_HEADER_ALIASES = {
+    "name": ("name", "full name", "display name", "contact name", "contact"),
+    "phone": ("phone", "phone number", "mobile", "mobile phone", "mobile number", "telephone", "tel",
+              "phone 1 - value", "primary phone"),
+    "email": ("email", "e-mail", "email address", "e-mail address", "e-mail 1 - value", "email 1",
+              "primary email"),
+}
+VCARD_EXTENSIONS = (".vcf", ".vcard")
+
+
+# --- Parsing ---
+def _csv_frame(data):
+    try:
+        raw = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, skipinitialspace=True,
+                          encoding="utf-8-sig", on_bad_lines="skip")
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise ValueError(f"The CSV file could not be read: {e}")
+    headers = {str(column).strip().lower(): column for column in raw.columns}
+    columns = {}
+    for field, aliases in CSV_HEADER_ALIASES.items():
+        source = next((headers[alias] for alias in aliases if alias in headers), None)
+        if source is not None:
+            columns[field] = raw[source]
+    if "email" not in columns:
+        raise ValueError(f"The CSV file needs an email column (one of: {', '.join(CSV_HEADER_ALIASES['email'])}).")
+    if "name" not in columns and {"first name", "last name"} & set(headers):
+        # Address books that split the name (e.g. Google/Outlook exports)
+        first = raw[headers["first name"]] if "first name" in headers else ""
+        last = raw[headers["last name"]] if "last name" in headers else ""
+        columns["name"] = (first + " " + last).str.strip()
+    return pd.DataFrame({field: columns.get(field, pd.Series("", index=raw.index)) for field in FIELDS})
+
+
+def _vcard_unescape(value):
+    return value.replace("\\n", " ").replace("\\N", " ").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _vcard_frame(data):
+    text = data.decode("utf-8-sig", errors="replace")
+    # Unfold continuation lines (RFC 6350 3.2): a line starting with a space or tab continues the previous one
+    text = text.replace("\r\n", "\n").replace("\n ", "").replace("\n\t", "")
+    rows = []
+    card = None
+    for line in text.split("\n"):
+        if ":" not in line:
+            continue
+        prop, value = line.split(":", 1)
+        name = prop.split(";", 1)[0].split(".")[-1].strip().upper() # Drops "item1." groups and parameters
+        value = value.strip()
+        if name == "BEGIN" and value.upper() == "VCARD":
+            card = {}
+        elif name == "END" and value.upper() == "VCARD":
+            if card is not None:
+                rows.append(card)
+            card = None
+        elif card is not None:
+            if name == "FN":
+                card.setdefault("name", _vcard_unescape(value))
+            elif name == "N":
+                # N:Family;Given;Additional;Prefix;Suffix, used when there is no FN
+                parts = [_vcard_unescape(p) for p in value.split(";")]
+                card.setdefault("n", " ".join(p for p in (parts[1:2] + parts[:1]) if p))
+            elif name == "EMAIL":
+                card.setdefault("email", _vcard_unescape(value))
+            elif name == "TEL":
+                card.setdefault("phone", _vcard_unescape(value).removeprefix("tel:"))
+    if not rows:
+        raise ValueError("No contacts (BEGIN:VCARD ... END:VCARD blocks) were found in the vCard file.")
+    return pd.DataFrame([{"name": r.get("name") or r.get("n", ""), "phone": r.get("phone", ""),
+                          "email": r.get("email", "")} for r in rows], columns=list(FIELDS))
+
+
+def parse_contacts_file(file_name, data):
+    """
+    Reads an uploaded CSV or vCard file into a DataFrame with name/phone/email string columns
+    (one row per contact, in file order). Raises ValueError for files that cannot be used.
+    """
+    if len(data) > MAX_IMPORT_BYTES:
+        raise ValueError(f"The file is larger than {MAX_IMPORT_BYTES // 1024} KB.")
+    is_vcard = str(file_name).lower().endswith(VCARD_EXTENSIONS) or data.lstrip()[:11].upper() == b"BEGIN:VCARD"
+    df = _vcard_frame(data) if is_vcard else _csv_frame(data)
+    if len(df) > MAX_IMPORT_ROWS:
+        raise ValueError(f"The file has {len(df)} contacts; at most {MAX_IMPORT_ROWS} can be imported at once.")
+    return df
+
+
+# --- Validation ---
+def validate_contacts(df, existing_emails=()):
+    """
+    Validates parsed contacts in one vectorised pass.
+    Returns (valid, rejected): `valid` holds the rows to save (name/phone/email), `rejected` the
+    other rows with a `problem` column. Emails are compared case-insensitively, both within the
+    file and against `existing_emails` (the user's current contacts).
+    """
+    df = df.reindex(columns=list(FIELDS)).fillna("").astype(str)
+    df = df.apply(lambda column: column.str.strip())
+    email_key = df["email"].str.lower()
+    existing = {str(e).strip().lower() for e in existing_emails if e}
+
+    # Checked in order; each row gets the first problem that applies
+    checks = [
+        ("missing name", df["name"] == ""),
+        ("missing email", df["email"] == ""),
+        ("invalid email", ~df["email"].str.match(EMAIL_PATTERN)),
+        ("already a contact", email_key.isin(existing)),
+        ("duplicate email in the file", email_key.duplicated(keep="first")),
+    ]
+    problem = pd.Series("", index=df.index)
+    for label, mask in checks:
+        problem = problem.mask((problem == "") & mask, label)
+    ok = problem == ""
+    rejected = df[~ok].assign(problem=problem[~ok])
+    rejected.index = rejected.index + 1 # Row numbers as the user sees them in the file
+    return df[ok].reset_index(drop=True), rejected
+
+
+# --- Export ---
+def csv_chunks(contacts, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields the CSV text (header first) for an iterable of contact dicts, `chunk_rows` rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for count, contact in enumerate(contacts, start=1):
+        writer.writerow([contact.get(field, "") for field in FIELDS])
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _vcard_escape(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace(";", "\\;").replace("\n", "\\n")
+
+
+def vcard_chunks(contacts, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields vCard 3.0 text for an iterable of contact dicts, `chunk_rows` cards at a time."""
+    cards = []
+    for contact in contacts:
+        lines = ["BEGIN:VCARD", "VERSION:3.0", f"FN:{_vcard_escape(contact.get('name', ''))}"]
+        if contact.get("email"):
+            lines.append(f"EMAIL;TYPE=INTERNET:{_vcard_escape(contact['email'])}")
+        if contact.get("phone"):
+            lines.append(f"TEL;TYPE=CELL:{_vcard_escape(contact['phone'])}")
+        lines.append("END:VCARD")
+        cards.append("\r\n".join(lines) + "\r\n")
+        if len(cards) >= chunk_rows:
+            yield "".join(cards)
+            cards = []
+    if cards:
+        yield "".join(cards)
+
+
+def export_contacts(contacts, file_format="csv"):
+    """The whole export as bytes, built chunk by chunk (used as a deferred download)."""
+    chunks = vcard_chunks(contacts) if file_format == "vcf" else csv_chunks(contacts)
+    buffer = io.BytesIO()
+    for chunk in chunks:
+        buffer.write(chunk.encode("utf-8"))
+    return buffer.getvalue()
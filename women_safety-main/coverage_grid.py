@@ -0,0 +1,252 @@
+# coverage_grid.py
+# Precomputed police/hospital coverage for India.
+# An offline job computes, for every cell of a regular lat/lon grid, the distance from the cell
+# centre to the nearest police station and the nearest hospital (using service_index.py), and
+# stores the result as tiled uint16 arrays in one compressed .npz file. The app loads the grid
+# once and answers "nearest help is X km away" for any point with an array lookup, without
+# touching the service datasets; the crime page uses it to map coverage gaps. The grid records the
+# dataset registry's versions it was built from (base file plus published deltas), and is ignored
+# once the registry serves different data, until it is rebuilt.
+#
+# Build / query from the command line:
+#     python coverage_grid.py build [--resolution 0.02]
+#     python coverage_grid.py lookup 13.0827 80.2707
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from datasets import DATA_DIR, get_service_datasets
+
+# --- Configuration ---
+# Relative paths are under DATA_DIR, like the datasets
+COVERAGE_GRID_PATH = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_COVERAGE_GRID", "coverage_grid.npz")))
+# Bounding box covering India (degrees)
+INDIA_BOUNDS = {"lat_min": 6.0, "lat_max": 37.5, "lon_min": 68.0, "lon_max": 97.5}
+DEFAULT_RESOLUTION = 0.02 # Degrees per cell, about 2.2 km
+TILE_SIZE = 256 # Cells per tile side
+DISTANCE_UNIT_KM = 0.1 # Stored distances are multiples of this
+NODATA = np.iinfo(np.uint16).max # No service data for the cell
+MAX_STORED = NODATA - 1 # Distances beyond this many units are stored as this value
+LAYERS = ("police", "hospital")
+# The bounding box also covers sea and neighbouring countries; cells this far from every service
+# are treated as outside the datasets' coverage (no data) so they do not show up as coverage gaps
+MAX_COVERAGE_KM = float(os.environ.get("SEFI_COVERAGE_MAX_KM", "150"))
+
+
+class CoverageGrid:
+    """Tiled distance-to-nearest-service grid. Lookups are O(1) array indexing."""
+
+    def __init__(self, tiles, meta):
+        self.tiles = tiles # layer -> uint16 array (tiles_y, tiles_x, TILE_SIZE, TILE_SIZE)
+        self.meta = meta
+        self.lat_min = meta["lat_min"]
+        self.lon_min = meta["lon_min"]
+        self.resolution = meta["resolution"]
+        self.rows = meta["rows"]
+        self.cols = meta["cols"]
+        self.tile_size = meta["tile_size"]
+        self.unit_km = meta["unit_km"]
+
+    @classmethod
+    def load(cls, path=COVERAGE_GRID_PATH):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            tiles = {layer: data[layer] for layer in meta["layers"]}
+        return cls(tiles, meta)
+
+    def save(self, path=COVERAGE_GRID_PATH):
+        # Write to a temporary file first so readers never see a half-written grid
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, meta=np.array(json.dumps(self.meta)), **self.tiles)
+        os.replace(tmp_path, path)
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats, dtype=float) - self.lat_min) / self.resolution)
+        cols = np.floor((np.asarray(lons, dtype=float) - self.lon_min) / self.resolution)
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.where(inside, rows, 0).astype(np.int64), np.where(inside, cols, 0).astype(np.int64), inside
+
+    def lookup_many(self, lats, lons, layer="police"):
+        """Distances (km) to the nearest service for arrays of points; NaN outside the grid or without data."""
+        rows, cols, inside = self._cells(lats, lons)
+        t = self.tile_size
+        raw = self.tiles[layer][rows // t, cols // t, rows % t, cols % t]
+        return np.where(inside & (raw != NODATA), raw * self.unit_km, np.nan)
+
+    def lookup(self, lat, lon):
+        """{'police_km': ..., 'hospital_km': ...} for one point (values None where unknown), or None outside the grid."""
+        # Plain arithmetic for a single point; NumPy would only add call overhead here
+        row = math.floor((lat - self.lat_min) / self.resolution)
+        col = math.floor((lon - self.lon_min) / self.resolution)
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            return None
+        t = self.tile_size
+        result = {}
+        for layer in self.meta["layers"]:
+            raw = int(self.tiles[layer][row // t, col // t, row % t, col % t])
+            result[f"{layer}_km"] = None if raw == NODATA else round(raw * self.unit_km, 1)
+        # Distances are measured from the cell centre, so they are accurate to about half a cell
+        result["cell_km"] = round(self.resolution * 111.32, 1)
+        return result
+
+    def layer(self, layer):
+        """Whole layer as a (rows, cols) float array in km (NaN without data)."""
+        tiles = self.tiles[layer]
+        ty, tx, t, _ = tiles.shape
+        grid = tiles.transpose(0, 2, 1, 3).reshape(ty * t, tx * t)[:self.rows, :self.cols]
+        return np.where(grid == NODATA, np.nan, grid * self.unit_km)
+
+    def gaps(self, layer="police", min_km=20.0, max_points=20000):
+        """
+        Centres of cells farther than `min_km` from the nearest service, as (lats, lons, km) arrays.
+        Larger areas are thinned on a regular stride so at most about `max_points` are returned.
+        """
+        grid = self.layer(layer)
+        stride = 1
+        while np.count_nonzero(grid[::stride, ::stride] > min_km) > max_points:
+            stride += 1
+        sub = grid[::stride, ::stride]
+        rows, cols = np.nonzero(sub > min_km)
+        lats = self.lat_min + (rows * stride + 0.5) * self.resolution
+        lons = self.lon_min + (cols * stride + 0.5) * self.resolution
+        return lats, lons, sub[rows, cols]
+
+
+def _to_tiles(values, tile_size):
+    """(rows, cols) uint16 array -> (tiles_y, tiles_x, tile_size, tile_size), padded with NODATA."""
+    rows, cols = values.shape
+    ty, tx = -(-rows // tile_size), -(-cols // tile_size)
+    padded = np.full((ty * tile_size, tx * tile_size), NODATA, dtype=np.uint16)
+    padded[:rows, :cols] = values
+    return np.ascontiguousarray(padded.reshape(ty, tile_size, tx, tile_size).transpose(0, 2, 1, 3))
+
+
+def build_coverage_grid(hospital_df, police_df, resolution=DEFAULT_RESOLUTION, bounds=INDIA_BOUNDS, tile_size=TILE_SIZE,
+                        max_km=MAX_COVERAGE_KM):
+    """Computes the coverage grid from the service datasets (the frames handed out by datasets.get_service_datasets)."""
+    from service_index import ServiceIndex, SERVICE_PRESETS
+
+    rows = int(np.ceil((bounds["lat_max"] - bounds["lat_min"]) / resolution))
+    cols = int(np.ceil((bounds["lon_max"] - bounds["lon_min"]) / resolution))
+    center_lats = bounds["lat_min"] + (np.arange(rows) + 0.5) * resolution
+    center_lons = bounds["lon_min"] + (np.arange(cols) + 0.5) * resolution
+    meta = {
+        "lat_min": bounds["lat_min"], "lon_min": bounds["lon_min"], "resolution": resolution,
+        "rows": rows, "cols": cols, "tile_size": tile_size, "unit_km": DISTANCE_UNIT_KM,
+        "layers": list(LAYERS), "built_at": time.time(), "dataset_versions": {}, "max_km": max_km,
+    }
+    layers = {}
+    for layer, services_df in (("police", police_df), ("hospital", hospital_df)):
+        if services_df is None:
+            print(f"Coverage: No {layer} data, layer left empty.")
+            layers[layer] = np.full((rows, cols), NODATA, dtype=np.uint16)
+            continue
+        started = time.perf_counter()
+        preset = SERVICE_PRESETS[layer]
+        index = ServiceIndex.from_frame(services_df, preset["lat_col"], preset["lon_col"])
+        values = np.empty((rows, cols), dtype=np.uint16)
+        # One band of grid rows at a time keeps memory flat
+        band = max(1, 200000 // cols)
+        for start in range(0, rows, band):
+            lat_band = np.repeat(center_lats[start:start + band], cols)
+            lon_band = np.tile(center_lons, len(lat_band) // cols)
+            _, distances = index.query(lat_band, lon_band, k=1)
+            units = np.minimum(np.round(distances[:, 0] / DISTANCE_UNIT_KM), MAX_STORED)
+            values[start:start + band] = np.where(np.isfinite(units), units, NODATA).reshape(-1, cols)
+        layers[layer] = values
+        meta["dataset_versions"][layer] = services_df.attrs.get("dataset_version")
+        print(f"Coverage: {layer} layer ({rows}x{cols} cells) computed in {time.perf_counter() - started:.1f}s.")
+
+    # Cells beyond max_km from both services are outside the covered area
+    if max_km is not None:
+        outside = np.ones((rows, cols), dtype=bool)
+        for values in layers.values():
+            outside &= (values == NODATA) | (values > max_km / DISTANCE_UNIT_KM)
+        for values in layers.values():
+            values[outside] = NODATA
+        print(f"Coverage: {outside.mean() * 100:.0f}% of cells are outside the covered area.")
+    return CoverageGrid({layer: _to_tiles(values, tile_size) for layer, values in layers.items()}, meta)
+
+
+_grid = None
+_grid_mtime = None
+_grid_stale_for = None
+_grid_lock = threading.Lock()
+
+def get_coverage_grid(path=COVERAGE_GRID_PATH):
+    """
+    The precomputed grid, loaded once (and again if the file is rebuilt). None if it has not been
+    built, or if it was built from different hospital/police data than the registry now serves
+    (a published delta counts as different data).
+    """
+    global _grid, _grid_mtime, _grid_stale_for
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    current = dict(zip(("hospital", "police"), get_service_datasets().versions))
+    with _grid_lock:
+        if _grid is None or mtime != _grid_mtime:
+            try:
+                _grid = CoverageGrid.load(path)
+                _grid_mtime = mtime
+                print(f"Coverage: Loaded coverage grid {path} ({_grid.rows}x{_grid.cols} cells).")
+            except Exception as e:
+                print(f"Coverage: Could not load coverage grid {path}: {e}")
+                return None
+        built_from = _grid.meta.get("dataset_versions", {})
+        stale = [layer for layer, version in current.items() if version and built_from.get(layer) and built_from[layer] != version]
+        if stale:
+            if _grid_stale_for != (mtime, tuple(current.values())):
+                _grid_stale_for = (mtime, tuple(current.values()))
+                print(f"Coverage: Grid {path} was built from older {' and '.join(stale)} data; ignoring it until it is rebuilt "
+                      f"(python coverage_grid.py build).")
+            return None
+        return _grid
+
+
+def nearest_help_km(lat, lon):
+    """Precomputed distances to the nearest police station / hospital for a point, or None if unavailable."""
+    grid = get_coverage_grid()
+    if grid is None or lat is None or lon is None:
+        return None
+    return grid.lookup(lat, lon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Police/hospital coverage grid.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Compute the grid from the service datasets.")
+    build.add_argument("--resolution", type=float, default=DEFAULT_RESOLUTION, help="Cell size in degrees.")
+    build.add_argument("--max-km", type=float, default=MAX_COVERAGE_KM, help="Cells farther than this from every service get no data.")
+    build.add_argument("--out", default=COVERAGE_GRID_PATH)
+    lookup = sub.add_parser("lookup", help="Look up one point.")
+    lookup.add_argument("lat", type=float)
+    lookup.add_argument("lon", type=float)
+    lookup.add_argument("--grid", default=COVERAGE_GRID_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        # The registry's frames include the published deltas and carry its versions
+        datasets = get_service_datasets()
+        if datasets.hospital is None and datasets.police is None:
+            raise SystemExit(f"No service data to build the grid from: {'; '.join(datasets.errors)}")
+        grid = build_coverage_grid(datasets.hospital_df, datasets.police_df, resolution=args.resolution, max_km=args.max_km)
+        grid.save(args.out)
+        print(f"Coverage: Wrote {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB).")
+    else:
+        grid = CoverageGrid.load(args.grid)
+        started = time.perf_counter()
+        result = grid.lookup(args.lat, args.lon)
+        print(f"{result} (lookup {1e6 * (time.perf_counter() - started):.0f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,16 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 from datetime import datetime
+from coverage_grid import get_coverage_grid
+from datasets import dataset_path, dataset_version
 
-# Define the path to the CSV file
-CSV_PATH = "assets/combined_crime_data.csv"
+# Define the path to the CSV file (SEFI_CRIME_DATA or SEFI_DATA_DIR to move it; see datasets.dataset_path)
+CSV_PATH = dataset_path("crime")
+
+# The CSV is read once per content version (the version is part of the cache key), not on every rerun
+@st.cache_data(max_entries=2)
+def load_crime_data(path, version):
+    return pd.read_csv(path)
 
 def show_crime_analysis():
     # Set page title
@@ -36,7 +43,7 @@ def show_crime_analysis():
     # Check if the CSV file exists before trying to read it
     if not os.path.exists(CSV_PATH):
         st.error(f"Error: CSV file not found at {CSV_PATH}")
-        st.write("Please make sure 'combined_crime_data.csv' is in the 'assets' folder.")
+        st.write("Please make sure 'combined_crime_data.csv' is in the 'assets' folder, or set SEFI_CRIME_DATA to its location.")
         if st.button("⬅️ Back to Dashboard", key="back_to_dashboard_analysis_error"):
             st.session_state['page'] = 'dashboard'
             st.rerun()
@@ -44,7 +51,7 @@ def show_crime_analysis():
 
     try:
         # Load data
-        df = pd.read_csv(CSV_PATH)
+        df = load_crime_data(CSV_PATH, dataset_version(CSV_PATH))
         
         # Check required columns
         required_columns = ['STATE/UT', 'RAPE', 'MURDER', 'YEAR', 'DISTRICT']
@@ -212,6 +219,25 @@ def show_crime_analysis():
             - Implement targeted intervention programs based on crime patterns
             """)
         
+        # Coverage gaps from the precomputed police/hospital coverage grid
+        st.header("Emergency Service Coverage Gaps")
+        coverage_grid = get_coverage_grid()
+        if coverage_grid is None:
+            st.info("Coverage grid not built yet. Run: python coverage_grid.py build")
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                gap_service = st.selectbox("Service", ["police", "hospital"], format_func=lambda s: "Police stations" if s == "police" else "Hospitals")
+            with col2:
+                gap_km = st.slider("Show areas farther than (km)", min_value=5, max_value=100, value=25, step=5)
+            gap_lats, gap_lons, gap_distances = coverage_grid.gaps(gap_service, min_km=gap_km)
+            if len(gap_lats):
+                st.map(pd.DataFrame({"lat": gap_lats, "lon": gap_lons}))
+                st.caption(f"{len(gap_lats)} grid points (of ~{coverage_grid.meta['resolution'] * 111.32:.1f} km cells) are more than {gap_km} km "
+                           f"from the nearest {'police station' if gap_service == 'police' else 'hospital'}; the farthest is {gap_distances.max():.0f} km away.")
+            else:
+                st.success(f"Every covered area is within {gap_km} km of a {'police station' if gap_service == 'police' else 'hospital'}.")
+
         # Data Explorer (Optional - can be expanded/collapsed)
         with st.expander("Data Explorer", expanded=False):
             st.subheader("Explore Raw Data")
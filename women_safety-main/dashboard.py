@@ -1,8 +1,5 @@
 import streamlit as st
-import time
 # import base64 # Removed base64 import as background image is removed
-import os      # Keep os for path manipulation (e.g., loading CSVs)
-import pandas as pd # Import pandas for reading CSV
 
 # Import db module for contact management (MongoDB)
 # Make sure your db.py file is in the same directory or accessible
@@ -44,28 +41,15 @@ except ImportError:
     st.error("Database module (db.py) not found. Please ensure db.py is in the correct directory.")
 
 
-# Import geopy for reverse geocoding and distance calculation
-# you'll need to install this: pip install geopy
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable # Import specific exceptions
-    from geopy.distance import geodesic # Import geodesic for distance calculation
-    _GEOPY_AVAILABLE = True
-except ImportError:
+# Location enrichment (reverse geocoding, nearest services) lives in emergency_services.py and
+# the SOS pipeline runs in the dispatch service (sos_dispatch.py), outside of Streamlit reruns
+from emergency_services import _GEOPY_AVAILABLE, HOSPITAL_CSV_PATH, POLICE_CSV_PATH
+from datasets import get_dataset_registry # Shared read-only service datasets
+from sos_dispatch import enqueue_sos, attach_sos_location, get_sos_job, STATUS_DONE, STATUS_FAILED, FINAL_STATUSES
+from coverage_grid import nearest_help_km
+
+if not _GEOPY_AVAILABLE:
     st.error("Geopy library not found. Please install it: pip install geopy")
-    _GEOPY_AVAILABLE = False
-    # Define dummy function if geopy is missing
-    def get_address_from_coords(latitude, longitude):
-        print("Dummy get_address_from_coords called. Geopy not available.")
-        return {"error": "Geopy library not installed", "source": "Dummy Geopy"}
-    # Define a dummy distance function
-    def geodesic(coords1, coords2):
-        print("Dummy geodesic distance called. Geopy not available.")
-        # Return a dummy object with an infinite km attribute
-        class DummyDistance:
-            def __init__(self):
-                self.km = float('inf')
-        return DummyDistance()
 
 
 # Import email_alert module (make sure email_alert.py exists and is configured)
@@ -136,6 +120,9 @@ if 'sos_button_processing' not in st.session_state: st.session_state.sos_button_
 if 'nearest_hospitals' not in st.session_state: st.session_state.nearest_hospitals = None
 if 'nearest_police_stations' not in st.session_state: st.session_state.nearest_police_stations = None
 
+# Add session state for the SOS dispatch job started by the SOS button (see sos_dispatch.py)
+if 'sos_job_id' not in st.session_state: st.session_state.sos_job_id = None
+
 
 # Add placeholders for status and location display (defined at the top of the script)
 # Define these outside the function so they persist across reruns
@@ -146,451 +133,115 @@ nearest_services_placeholder = st.empty() # Placeholder for nearest services dis
 
 
 # --- Load Service Datasets ---
-# Use st.cache_data to load the datasets only once
-@st.cache_data
+# The datasets are shared, read-only resources (datasets.py): st.cache_resource hands every
+# session the same registry, and with it the same frames, instead of the per-caller copies
+# st.cache_data would make. The registry reloads the files when their content changes.
+dataset_registry = st.cache_resource(get_dataset_registry)
+
 def load_service_data(hospital_csv_path, police_csv_path):
     """
-    Loads hospital and police station data from CSV files.
-    Includes checks for file existence, column validity, and data integrity.
-    Returns two dataframes and any loading errors encountered.
+    Returns the shared hospital and police station dataframes (read-only; see datasets.py)
+    and displays any loading errors encountered.
     """
-    hospital_df = None
-    police_df = None
-    load_errors = []
+    datasets = dataset_registry().service_datasets(hospital_csv_path, police_csv_path)
 
-    # --- Load Hospital Data ---
-    try:
-        if not os.path.exists(hospital_csv_path):
-            load_errors.append(f"Hospital CSV file not found: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
-        else:
-            hospital_df = pd.read_csv(hospital_csv_path)
-            print(f"Successfully loaded hospital data from {os.path.basename(hospital_csv_path)}. Shape: {hospital_df.shape}") # Debug
-
-            # Define required columns for search and display (adjust 'id' if name column is different)
-            required_hosp_cols_for_search = ['Latitude', 'Longitude', 'id'] # Assuming 'id' is used as name_col
-            missing_hosp_cols_for_search = [col for col in required_hosp_cols_for_search if col not in hospital_df.columns]
-
-            if missing_hosp_cols_for_search:
-                load_errors.append(f"Hospital CSV ({os.path.basename(hospital_csv_path)}) missing essential columns for search: {', '.join(missing_hosp_cols_for_search)}. Hospital data will not be available for search.")
-                hospital_df = None # Invalidate if essential coordinate/name columns are missing
-            elif hospital_df.empty:
-                load_errors.append(f"Hospital CSV file is empty after reading: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
-                hospital_df = None
-            else:
-                # Ensure lat/lon are numeric, drop rows with invalid coords and missing 'id'
-                hospital_df['Latitude'] = pd.to_numeric(hospital_df['Latitude'], errors='coerce')
-                hospital_df['Longitude'] = pd.to_numeric(hospital_df['Longitude'], errors='coerce')
-                # Drop rows where lat or lon became NaN after coercion or 'id' is missing/empty string
-                hospital_df.dropna(subset=['Latitude', 'Longitude', 'id'], inplace=True)
-                # Also drop rows where 'id' might be an empty string after reading/dropna
-                hospital_df = hospital_df[hospital_df['id'].astype(str).str.strip() != '']
-
-
-                if hospital_df.empty:
-                    load_errors.append(f"Hospital data became empty after cleaning invalid coordinates/names or missing names. Hospital data will not be available for search.")
-                    hospital_df = None
-                else:
-                    print(f"Hospital data after cleaning: {hospital_df.shape}") # Debug
-                    # Optional: Add checks for *other* expected columns if needed for display
-                    # if 'City' not in hospital_df.columns:
-                    #     load_errors.append(f"Hospital CSV missing 'City' column. Address details might be incomplete.")
-
-    except pd.errors.EmptyDataError:
-            load_errors.append(f"Hospital CSV file is empty: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
-            hospital_df = None
-    except Exception as e:
-        load_errors.append(f"Error loading hospital CSV ({os.path.basename(hospital_csv_path)}): {e}. Hospital data will not be available.")
-        hospital_df = None
+    # Display data loading errors
+    for error in datasets.errors:
+        st.error(f"Data Loading Error: {error}")
 
-    # --- Load Police Station Data ---
+    # Return both dataframes
+    return datasets.hospital_df, datasets.police_df
+
+def _format_km(km):
+    return f"{km} km away" if km is not None else "unknown distance"
+
+# --- SOS Job Progress ---
+# Human readable labels for the dispatch stages (see sos_dispatch.run_pipeline)
+_SOS_STAGE_LABELS = {
+    "queued": "Waiting for the SOS dispatch service...",
+    "geocoding": "Fetching address details...",
+    "geocoded": "Address lookup finished.",
+    "finding_services": "Finding nearest emergency services...",
+    "services_found": "Nearest emergency services found.",
+    "notifying": "Sending email alert...",
+}
+
+def sync_sos_job():
+    """
+    Copies the progress of the current SOS job (st.session_state.sos_job_id) into session state,
+    so the location/services display below shows what the dispatch service has found so far.
+    Clears the processing flag once the job has finished.
+    """
+    global sos_status_placeholder
+    job_id = st.session_state.get('sos_job_id')
+    if job_id is None:
+        return None
     try:
-        if not os.path.exists(police_csv_path):
-            load_errors.append(f"Police Station CSV file not found: {os.path.basename(police_csv_path)}. Police station data will not be available.")
-        else:
-            police_df = pd.read_csv(police_csv_path)
-            print(f"Successfully loaded police station data from {os.path.basename(police_csv_path)}. Shape: {police_df.shape}") # Debug
-
-            # Define required columns for search and display
-            required_police_cols_for_search = ['lat', 'lng', 'name']
-            missing_police_cols_for_search = [col for col in required_police_cols_for_search if col not in police_df.columns]
-
-            if missing_police_cols_for_search:
-                load_errors.append(f"Police Station CSV ({os.path.basename(police_csv_path)}) missing essential columns for search: {', '.join(missing_police_cols_for_search)}. Police station data will not be available for search.")
-                police_df = None # Invalidate if essential coordinate/name columns are missing
-            elif police_df.empty:
-                load_errors.append(f"Police Station CSV file is empty after reading: {os.path.basename(police_csv_path)}. Police station data will not be available.")
-                police_df = None
-            else:
-                # Ensure lat/lng are numeric, drop rows with invalid coords and missing name
-                police_df['lat'] = pd.to_numeric(police_df['lat'], errors='coerce')
-                police_df['lng'] = pd.to_numeric(police_df['lng'], errors='coerce')
-                # Drop rows where lat or lng became NaN after coercion OR 'name' is missing/empty string
-                police_df.dropna(subset=['lat', 'lng', 'name'], inplace=True)
-                # Also drop rows where 'name' might be an empty string after reading/dropna
-                police_df = police_df[police_df['name'].astype(str).str.strip() != '']
-
-
-                if police_df.empty:
-                    load_errors.append(f"Police data became empty after cleaning invalid coordinates/names or missing names. Police station data will not be available for search.")
-                    police_df = None
-                else:
-                    print(f"Police data after cleaning: {police_df.shape}") # Debug
-                    # Optional: Add checks for *other* expected columns if needed for display
-                    # if 'address' not in police_df.columns:
-                    #     load_errors.append(f"Police Station CSV missing 'address' column. Address details might be incomplete.")
-
-
-    except pd.errors.EmptyDataError:
-            load_errors.append(f"Police Station CSV file is empty: {os.path.basename(police_csv_path)}. Police station data will not be available.")
-            police_df = None
+        job = get_sos_job(job_id)
     except Exception as e:
-        load_errors.append(f"Error loading police station CSV ({os.path.basename(police_csv_path)}): {e}. Police station data will not be available.")
-        police_df = None
-
-
-    # Display data loading errors immediately within this function's scope when called
-    if load_errors:
-        for error in load_errors:
-            st.error(f"Data Loading Error: {error}")
-            print(f"Logged Data Loading Error: {error}") # Also print to console
-
-
-    # Return both dataframes
-    return hospital_df, police_df
-
-# --- Helper Function for Reverse Geocoding ---
-# Only define and use if geopy is available
-if _GEOPY_AVAILABLE:
-    def get_address_from_coords(latitude, longitude):
-        """
-        Convert latitude and longitude to a detailed address using Nominatim.
-        Returns a dictionary of address components or None/error dict on error.
-        Includes basic input validation.
-        """
-        # Skip if latitude or longitude are None or clearly invalid
-        if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
-            print("Invalid latitude or longitude type provided for geocoding.")
-            return {"error": "Invalid coordinates type provided", "source": "Nominatim Prep Error"}
-        if latitude is None or longitude is None: # Should be covered by type check but double-check
-            print("None latitude or longitude provided for geocoding.")
-            return {"error": "None coordinates provided", "source": "Nominatim Prep Error"}
-
-
-        try:
-            geolocator = Nominatim(user_agent="women_safety_app")
-            print(f"Attempting reverse geocoding for {latitude}, {longitude} using Nominatim...") # Debug print
-            # Use timeout for robustness
-            location = geolocator.reverse((latitude, longitude), exactly_one=True, timeout=15) # Increased timeout slightly
-            print(f"Nominatim raw response: {location.raw if location else 'None'}") # Debug print raw response
-
-            if location and location.raw.get('address'):
-                address = location.raw['address']
-                address_details = {
-                    'full_address': location.address,
-                    'house_number': address.get('house_number', 'N/A'),
-                    'building': address.get('building', 'N/A'),
-                    'road': address.get('road', 'N/A'),
-                    'street': address.get('street', address.get('road', 'N/A')), # Use road if street is missing
-                    'neighbourhood': address.get('neighbourhood', 'N/A'),
-                    'suburb': address.get('suburb', 'N/A'),
-                    'city': address.get('city', address.get('town', address.get('village', 'N/A'))), # Handle variations
-                    'district': address.get('district', address.get('county', 'N/A')), # Handle variations
-                    'state': address.get('state', 'N/A'),
-                    'postcode': address.get('postcode', 'N/A'),
-                    'country': address.get('country', 'N/A'),
-                    'source': 'Nominatim'
-                }
-                print(f"Successfully retrieved address details from Nominatim: {address_details}")
-                return address_details
-            else:
-                print("No address details found for the coordinates using Nominatim.")
-                return {"error": "No detailed address found for coordinates", "source": "Nominatim"}
-        except (GeocoderTimedOut, GeocoderUnavailable) as e:
-            print(f"Geocoding service error (timeout or unavailable): {e}")
-            return {"error": f"Geocoding service error: {e}", "source": "Nominatim API Error"}
-        except Exception as e:
-            print(f"An unexpected error occurred during reverse geocoding: {e}")
-            return {"error": f"Reverse geocoding failed: {e}", "source": "Nominatim Processing Error"}
-
-# --- Helper Function to Find Nearest Services ---
-# Only define and use if geopy is available
-if _GEOPY_AVAILABLE:
-    # Added radius_km parameter with a default of infinity
-    def find_nearest_services(user_lat, user_lon, services_df, service_type='Service', name_col='Name', lat_col='Latitude', lon_col='Longitude', num_results=5, radius_km=10.0): # Default radius to 10 km
-        """
-        Finds the nearest services from a pandas DataFrame based on user coordinates.
-        Can filter by a specified radius (km) or return the top N results.
-        Assumes DataFrame has Latitude, Longitude, and Name columns (as specified by lat_col, lon_col, name_col).
-        Returns a list of dictionaries for the nearest services, including distance,
-        or an error/info dictionary.
-        """
-        nearest_list = []
-
-        if services_df is None or services_df.empty:
-            print(f"Warning: Service DataFrame ({service_type}) is empty or None.")
-            return [{"info": f"No {service_type} data available to search."}]
-
-        # Check if required columns actually exist in the dataframe before proceeding
-        required_cols = [lat_col, lon_col, name_col]
-        # Check if *all* required columns exist
-        if not all(col in services_df.columns for col in required_cols):
-            missing = [col for col in required_cols if col not in services_df.columns]
-            print(f"Error: Missing essential columns {missing} in {service_type} DataFrame for search.")
-            return [{"error": f"Data for {service_type} is missing essential columns for search: {', '.join(missing)}."}]
-
-        # Create user coordinates tuple
-        user_coords = (user_lat, user_lon)
-
-        # Calculate distances
-        try:
-            # Use .copy() to avoid SettingWithCopyWarning
-            services_df_temp = services_df.copy()
-
-            # Ensure coordinate columns are numeric before calculating distance
-            services_df_temp[lat_col] = pd.to_numeric(services_df_temp[lat_col], errors='coerce')
-            services_df_temp[lon_col] = pd.to_numeric(services_df_temp[lon_col], errors='coerce')
-
-            services_df_temp['distance_km'] = services_df_temp.apply(
-                lambda row: geodesic(user_coords, (row[lat_col], row[lon_col])).km if pd.notnull(row[lat_col]) and pd.notnull(row[lon_col]) else float('inf'),
-                axis=1
-            )
-
-            # Filter out rows where distance calculation failed (coords were not valid numbers)
-            filtered_services = services_df_temp[services_df_temp['distance_km'] != float('inf')]
-
-            if filtered_services.empty:
-                return [{"info": f"No {service_type} found in the dataset with valid coordinates."}]
-
-            # --- Filter by radius if specified ---
-            if radius_km is not None and radius_km != float('inf'):
-                nearby_services = filtered_services[filtered_services['distance_km'] <= radius_km]
-                sorted_services = nearby_services.sort_values(by='distance_km')
-
-                if sorted_services.empty:
-                    return [{"info": f"No {service_type} found within {radius_km} km based on available data."}]
-
-                # Limit by num_results *after* filtering by radius if both are specified and valid
-                if num_results is not None and num_results > 0:
-                    services_to_return = sorted_services.head(num_results)
-                else:
-                    services_to_return = sorted_services # Return all within radius if num_results is not specified or invalid
-
-            # --- Otherwise, return the top N results (fallback) ---
-            else:
-                sorted_services = filtered_services.sort_values(by='distance_km')
-                # Use the num_results parameter here if radius is not used
-                if num_results is not None and num_results > 0:
-                    services_to_return = sorted_services.head(num_results)
-                else:
-                    services_to_return = sorted_services # Return all if neither radius nor num_results is specified/valid
-
-
-            if services_to_return.empty:
-                # This might happen if radius was tight or num_results was 0/None
-                return [{"info": f"No {service_type} found matching search criteria (within radius or top N)."}]
-
-            # Format results from services_to_return DataFrame
-            for index, row in services_to_return.iterrows():
-                # Attempt to get Address from common column names if 'Address' doesn't exist
-                # Prioritize a column named 'address' or 'Address'
-                address = row.get('address', row.get('Address', row.get('Location', 'N/A Address')))
-
-                nearest_list.append({
-                    'Type': service_type,
-                    'Name': row.get(name_col, f'Unknown {service_type}'), # Use get with default
-                    'Latitude': row.get(lat_col, 'N/A'),
-                    'Longitude': row.get(lon_col, 'N/A'),
-                    'Distance (km)': round(row['distance_km'], 2), # Round distance
-                    'Address': address
-                })
-
-            if not nearest_list and not services_to_return.empty:
-                # If nearest_list is empty after formatting (e.g. name_col issues)
-                return [{"info": f"Found locations within radius/top N, but could not format details for {service_type} (missing name column?)."}]
-
-
-        except Exception as e:
-            print(f"Error finding nearest {service_type} services: {e}")
-            return [{"error": f"Error finding nearest {service_type}: {e}"}]
-
-        return nearest_list
-
-# --- Helper Function to Send Email Alert (Defined within dashboard.py scope) ---
-# This function is called *after* location data is processed and available
-# Only define and use if email_alert is available
-if _EMAIL_ALERT_AVAILABLE:
-    def send_sos_email_alert():
-        global sos_status_placeholder  # Need to access global placeholder
-
-        print(f"\n--- Preparing Email Alert ---")  # Debug print
-
-        user_name = st.session_state.user.get('name', 'User')
-        user_email = st.session_state.user.get('email', 'N/A User')
-        # Use the data exactly as it was retrieved/processed
-        location_data = st.session_state.get('last_known_location_data')
-        address_details = st.session_state.get('address_details') # Get detailed address
-        nearest_hospitals = st.session_state.get('nearest_hospitals') # Get nearest services
-        nearest_police_stations = st.session_state.get('nearest_police_stations') # Get nearest services
-
-
-        contacts_to_notify = st.session_state.get('dashboard_contacts_list', [])
-        # Filter for valid email addresses
-        contact_emails = [contact['email'] for contact in contacts_to_notify
-                            if isinstance(contact, dict) and 'email' in contact and contact['email'] and "@" in str(contact['email'])]
-
-        if not contact_emails:
-            print("Warning: Email sending skipped because contacts list is empty after processing.")
-            sos_status_placeholder.warning("No valid email contacts found for sending.")
-            # Clear processing flag immediately if no contacts to notify
-            st.session_state.sos_button_processing = False
-            st.session_state.last_known_location_source = "SOS Failed (No email contacts)"
-            return
-
-        print(f"Notifying contacts: {contact_emails}")
-
-        body = f"URGENT: SOS Alert from {user_name} ({user_email})!\n\n"
-        body += "Please check on them immediately.\n\n"
-
-        # --- Building Email Body based on available data ---
-        body += "--- Last Known Location Details ---\n"
-        if location_data is not None and isinstance(location_data, dict):
-            # Check for error FIRST from browser geolocation
-            if 'error' in location_data:
-                body += f"Could not retrieve initial location details: {location_data['error']}\n"
-                body += f"Source: {location_data.get('source', 'Browser Geolocation Error')}\n"
-            # Then check for valid coordinates if no error
-            elif 'latitude' in location_data and 'longitude' in location_data:
-                lat = location_data['latitude']
-                lon = location_data['longitude']
-                acc = location_data.get('accuracy', 'Unknown')
-                src = location_data.get('source', 'N/A')
-                body += f"Source: {src}\n"
-                body += f"Coordinates: Latitude {lat}, Longitude {lon}\n"
-                body += f"Accuracy: {acc} meters\n"
-                # Use the modern Google Maps URL format
-                Maps_link = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
-                body += f"View Location on Map: {Maps_link}\n"
-
-                # Add detailed address information if available from Nominatim
-                body += "\nAddress Details (if available):\n"
-                if address_details:
-                    if address_details.get('error'):
-                        body += f"  Address Lookup Error: {address_details['error']}\n"
-                    elif address_details.get('info'): # Handle info messages from geocoding failure
-                        body += f"  Address Lookup Info: {address_details['info']}\n"
-                    elif address_details.get('full_address'):
-                        body += f"  Full Address: {address_details['full_address']}\n"
-                        # Add specific components if available and not 'N/A'
-                        if address_details.get('street') and address_details['street'] != 'N/A': body += f"  Street/Road: {address_details['street']}\n"
-                        if address_details.get('house_number') and address_details['house_number'] != 'N/A': body += f"  House/Building: {address_details['house_number']}\n"
-                        if address_details.get('neighbourhood') and address_details['neighbourhood'] != 'N/A': body += f"  Neighborhood: {address_details['neighbourhood']}\n"
-                        if address_details.get('suburb') and address_details.get('suburb') != 'N/A': body += f"  Suburb: {address_details.get('suburb')}\n"
-                        if address_details.get('city') and address_details.get('city') != 'N/A': body += f"  City: {address_details.get('city')}\n"
-                        if address_details.get('district') and address_details.get('district') != 'N/A': body += f"  District: {address_details.get('district')}\n"
-                        if address_details.get('state') and address_details.get('state') != 'N/A': body += f"  State: {address_details.get('state')}\n"
-                        if address_details.get('postcode') and address_details.get('postcode') != 'N/A': body += f"  Postal Code: {address_details.get('postcode')}\n"
-                        if address_details.get('country') and address_details.get('country') != 'N/A': body += f"  Country: {address_details.get('country')}\n"
-                    else:
-                        body += "  Detailed address information could not be parsed.\n"
-                else:
-                    body += "  Detailed address information not available.\n" # Case where address_details is None or empty
-
-
-            else: # Handle unexpected location_data format
-                body += "Location data available but format is unexpected.\n"
-        else: # This else is for the outer if location_data is None or not a dict
-            body += "Location information not available.\n"
-        body += "---------------------------------------\n\n"
-
-
-        # --- Add Nearest Services Details to Email Body ---
-        body += "--- Nearest Emergency Services (if available) ---\n"
-        services_added = False
-
-        # Hospitals
-        if isinstance(nearest_hospitals, list) and nearest_hospitals:
-            # Check if it's an error/info message or actual results
-            if nearest_hospitals[0].get('error'):
-                body += f"Nearest Hospitals: {nearest_hospitals[0]['error']}\n"
-                services_added = True
-            elif nearest_hospitals[0].get('info'):
-                body += f"Nearest Hospitals: {nearest_hospitals[0]['info']}\n"
-                services_added = True
-            else: # Actual list of services
-                body += "Nearest Hospitals:\n"
-                for hosp in nearest_hospitals:
-                    hosp_name = hosp.get('Name', 'Unknown Hospital')
-                    hosp_dist = hosp.get('Distance (km)', 'N/A')
-                    hosp_addr = hosp.get('Address', 'N/A')
-                    hosp_lat = hosp.get('Latitude')
-                    hosp_lon = hosp.get('Longitude')
-
-                    item_line = f"- {hosp_name} ({hosp_dist} km)"
-                    if hosp_addr != 'N/A': item_line += f", Address: {hosp_addr}"
-                    if hosp_lat is not None and hosp_lon is not None:
-                        hosp_map_link = f"https://www.google.com/maps/search/?api=1&query={hosp_lat},{hosp_lon}"
-                        item_line += f" [Map: {hosp_map_link}]"
-                    body += item_line + "\n"
-                services_added = True
-
-        # Police Stations
-        if isinstance(nearest_police_stations, list) and nearest_police_stations:
-            if nearest_police_stations[0].get('error'):
-                body += f"Nearest Police Stations: {nearest_police_stations[0]['error']}\n"
-                services_added = True
-            elif nearest_police_stations[0].get('info'):
-                body += f"Nearest Police Stations: {nearest_police_stations[0]['info']}\n"
-                services_added = True
-            else: # Actual list of services
-                body += "Nearest Police Stations:\n"
-                for station in nearest_police_stations:
-                    police_name = station.get('Name', 'Unknown Police Station')
-                    police_dist = station.get('Distance (km)', 'N/A')
-                    police_addr = station.get('Address', 'N/A')
-                    police_lat = station.get('Latitude') # Get raw lat/lon
-                    police_lon = station.get('Longitude') # Get raw lat/lon
-
-                    item_line = f"- {police_name} ({police_dist} km)"
-                    if police_addr != 'N/A': item_line += f", Address: {police_addr}"
-                    if police_lat is not None and police_lon is not None:
-                        police_map_link = f"https://www.google.com/maps/search/?api=1&query={police_lat},{police_lon}"
-                        item_line += f" [Map: {police_map_link}]"
-                    body += item_line + "\n"
-                services_added = True
-
-        if not services_added:
-            body += "No nearest emergency service data available.\n"
-
-        body += "-------------------------------------------\n\n"
-
-
-        body += "This is an automated alert from the Women Safety App."
-        body += f"\nTimestamp (IST): {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))}"
-
-        email_subject = f"EMERGENCY ALERT from {user_name}!"
-
-        try:
-            print("Attempting to send email via send_alert_email function...")
-            # Call the function from the imported email_alert module
-            # Pass the raw location data, detailed address, and the full body string
-            send_alert_email(
-                contacts=contact_emails,
-                location={'raw': location_data, 'detailed': address_details, 'email_body_string': body},
-                video_link=None # Assuming no video link is used in this flow
-            )
-            print("Email sending function called successfully.")
-            # Display success message after the attempt
+        print(f"Dashboard: Could not read SOS job {job_id}: {e}")
+        return None
+    if job is None:
+        return None
+
+    result = job.get('result') or {}
+    if 'address_details' in result:
+        st.session_state.address_details = result['address_details']
+    if 'nearest_hospitals' in result:
+        st.session_state.nearest_hospitals = result['nearest_hospitals']
+        st.session_state.nearest_police_stations = result.get('nearest_police_stations')
+
+    if job['status'] == STATUS_DONE:
+        if result.get('notify_info'):
+            sos_status_placeholder.warning(f"SOS processed: {result['notify_info']} No email was sent.")
+        else:
             sos_status_placeholder.success("SOS alert email sent to your trusted contacts.")
+    elif job['status'] == STATUS_FAILED:
+        sos_status_placeholder.error(f"Failed to send SOS email alert: {job.get('error')}")
+    elif job.get('error'):
+        sos_status_placeholder.warning(f"SOS alert attempt {job['attempts']} failed, retrying: {job['error']}")
+    else:
+        sos_status_placeholder.info(_SOS_STAGE_LABELS.get(job.get('stage'), "Processing SOS alert..."))
 
-        except Exception as e:
-            # Catch any exceptions during email sending (e.g., SMTP errors)
-            print(f"Email Sending Failed: {e}")
-            sos_status_placeholder.error(f"Failed to send SOS email alert: {e}")
+    if job['status'] in FINAL_STATUSES:
+        st.session_state.sos_button_processing = False
+    return job
 
-        finally:
-            # Clear general processing flag regardless of email success/failure
-            print("Dashboard: Email sending finished, clearing processing flag.")
-            st.session_state.sos_button_processing = False
+def poll_sos_job():
+    """Runs inside a fragment while the SOS job is in progress; reruns the page whenever the job advances."""
+    job_id = st.session_state.get('sos_job_id')
+    if job_id is None:
+        return
+    try:
+        job = get_sos_job(job_id)
+    except Exception as e:
+        print(f"Dashboard: Could not poll SOS job {job_id}: {e}")
+        return
+    if job is None:
+        return
+    progress = (job['status'], job.get('stage'), job.get('attempts'))
+    if progress != st.session_state.get('sos_job_progress'):
+        st.session_state.sos_job_progress = progress
+        st.rerun()
+
+def _last_valid_location(*candidates):
+    """The first candidate (then the last known locations in session state) with coordinates, or None."""
+    for location in candidates + (st.session_state.get('last_known_location_data'), st.session_state.get('last_known_location')):
+        if isinstance(location, dict) and 'latitude' in location and 'longitude' in location and 'error' not in location:
+            return location
+    return None
+
+def _release_sos_without_location():
+    """Stops the queued button SOS from waiting for a location that is not coming."""
+    job_id = st.session_state.get('sos_job_id')
+    if job_id is None:
+        st.session_state.sos_button_processing = False
+        return
+    try:
+        attach_sos_location(job_id, None)
+    except Exception as e:
+        # The job is still sent once its location wait runs out
+        print(f"Dashboard: Could not release SOS job {job_id}: {e}")
 
 # --- Helper function to handle button actions (page navigation) ---
 def handle_dashboard_action(action):
@@ -607,6 +258,10 @@ def handle_dashboard_action(action):
     st.session_state.nearest_hospitals = None
     st.session_state.nearest_police_stations = None
 
+    # Stop following the SOS job; the dispatch service still sends it in the background (after its
+    # short wait for a location, if the browser had not answered yet)
+    st.session_state.sos_job_id = None
+
     # Also clear the component result key from session state just in case
     if _DASHBOARD_LOCATION_KEY in st.session_state:
         del st.session_state[_DASHBOARD_LOCATION_KEY]
@@ -624,7 +279,8 @@ def handle_dashboard_action(action):
                          'last_known_location_data', 'last_known_location',
                          'last_known_location_source', 'sos_button_processing',
                          'dashboard_contacts_list', 'user_contacts', 'address_details',
-                         'nearest_hospitals', 'nearest_police_stations', _DASHBOARD_LOCATION_KEY] # Include component key
+                         'nearest_hospitals', 'nearest_police_stations', 'sos_job_id', 'sos_job_progress',
+                         _DASHBOARD_LOCATION_KEY] # Include component key
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
@@ -938,11 +594,10 @@ def dashboard():
 
 
     # --- Load Service Data (Hospitals and Police Stations) ---
-    # Define the paths to the CSV files. It's best to use relative paths if possible,
-    # or ensure absolute paths are correct for the environment where the app runs.
-    # Using the user-provided absolute paths:
-    hospital_csv_path = r"C:\Users\dhivy\Downloads\women_safety_app_complete\Hospitals In India (Anonymized).csv"
-    police_csv_path = r"C:\Users\dhivy\Downloads\women_safety_app_complete\indian_police_stations_10000.csv"
+    # The paths to the CSV files are shared with the SOS dispatch worker (see datasets.dataset_path);
+    # set SEFI_DATA_DIR or SEFI_HOSPITAL_CSV / SEFI_POLICE_CSV to point them at the files on this machine.
+    hospital_csv_path = HOSPITAL_CSV_PATH
+    police_csv_path = POLICE_CSV_PATH
 
     # Load data using the cached function - Returns dataframes and logs errors
     hospital_df, police_df = load_service_data(hospital_csv_path, police_csv_path)
@@ -986,8 +641,8 @@ def dashboard():
 
 
     # --- Location and SOS Logic ---
-    # This section handles the SOS button click, triggering location retrieval,
-    # geocoding, finding nearest services, and sending email.
+    # This section handles the SOS button click and location retrieval, then queues the SOS
+    # with the dispatch service (geocoding, nearest services and email run there).
 
     # --- Step 2: Process Location Result from Component ---
     # This block runs on any rerun triggered by the js_eval component returning a result.
@@ -1015,138 +670,60 @@ def dashboard():
             if 'error' in st.session_state.last_known_location_data:
                 error_msg = st.session_state.last_known_location_data['error']
                 error_source = st.session_state.last_known_location_data.get('source', 'Error')
-                sos_status_placeholder.error(f"Location error: {error_msg} (Source: {error_source})")
+                sos_status_placeholder.error(f"Location error: {error_msg} (Source: {error_source}). Your SOS alert is being sent without the current location.")
                 st.session_state.last_known_location_source = error_source
                 print("Dashboard: Location error feedback displayed.")
-                st.session_state.sos_button_processing = False # Processing finished due to location error
-                # Clear nearest services results and address details on location failure
-                st.session_state.nearest_hospitals = None
-                st.session_state.nearest_police_stations = None
-                st.session_state.address_details = None
-                # Do NOT send email if location failed
-                return # Stop further processing (geocoding/email/services) if location failed
+                # The SOS was queued when the button was pressed; send it now with what it has
+                _release_sos_without_location()
 
             # If no error, check for valid coordinates
             elif 'latitude' in st.session_state.last_known_location_data and 'longitude' in st.session_state.last_known_location_data:
-                # Keep the initial success message or update it as processing continues
-                # sos_status_placeholder.success("Location retrieved successfully from browser.") # This will be updated by later steps
                 st.session_state.last_known_location_source = st.session_state.last_known_location_data.get('source', 'Browser Geolocation')
                 print("Dashboard: Location success feedback displayed.")
 
-                lat = st.session_state.last_known_location_data['latitude']
-                lon = st.session_state.last_known_location_data['longitude']
-
-                # --- Attempt Reverse Geocoding ---
-                # Only attempt geocoding if geopy is available
-                if _GEOPY_AVAILABLE:
-                    sos_status_placeholder.info("Fetching address details...")
-                    print("Dashboard: Coordinates available, attempting reverse geocoding with Nominatim.")
-                    address_details = get_address_from_coords(lat, lon)
-                    st.session_state.address_details = address_details
-
-                    if address_details and not address_details.get('error'):
-                        # Handle info messages from geocoding failure
-                        if address_details.get('info'):
-                            # sos_status_placeholder.warning(f"Address Info: {address_details['info']}") # Keep the email status
-                            st.session_state.last_known_location_source = "Browser Geolocation (Nominatim Info)"
-                            print(f"Dashboard: Address info: {address_details['info']}")
-                        else: # Successful detailed address
-                            # sos_status_placeholder.success("Address details retrieved successfully.") # Keep the email status
-                            # Update source to reflect successful geocoding if applicable
-                            st.session_state.last_known_location_source = "Combined (Browser+Nominatim)"
-                            print("Dashboard: Address details retrieved.")
-                    elif address_details and address_details.get('error'):
-                        # Keep previous status message, add a warning
-                        # sos_status_placeholder.warning(f"Could not retrieve detailed address: {address_details['error']}") # Keep the email status
-                        # Keep source as Browser if Nominatim failed
-                        st.session_state.last_known_location_source = "Browser Geolocation (Nominatim Error)"
-                        print(f"Dashboard: Address details failed: {address_details['error']}")
-                    else: # address_details is None or empty dict without 'error' or 'info'
-                        # sos_status_placeholder.warning("Could not retrieve detailed address information.") # Keep the email status
-                        # Keep source as Browser if Nominatim returned no data
-                        st.session_state.last_known_location_source = "Browser Geolocation (No Nominatim Data)"
-                        print("Dashboard: Address details not found.")
-                else:
-                    # Geopy warning is already displayed at the top if missing
-                    st.session_state.address_details = {"info": "Geopy not available. Cannot fetch address details."}
-                    st.session_state.last_known_location_source = "Browser Geolocation (Geopy Missing)"
-                    print("Dashboard: Geopy not available for address details.")
-
-
-                # --- Find Nearest Services (After Location & Geocoding Attempt) ---
-                # We have valid lat/lon here, attempt to find nearest services if data and geopy are available
-                print("Dashboard: Attempting to find nearest services.")
-                # Only check if Geopy is available AND at least one DataFrame loaded successfully
-                if _GEOPY_AVAILABLE and (hospital_df is not None or police_df is not None):
-                    sos_status_placeholder.info("Finding nearest emergency services...") # Update status
-
-                    # Only attempt to find hospitals if hospital_df loaded and has required columns
-                    if hospital_df is not None:
-                        st.session_state.nearest_hospitals = find_nearest_services(
-                            lat, lon, hospital_df, service_type='Hospital',
-                            name_col='id', lat_col='Latitude', lon_col='Longitude',
-                            num_results=5, radius_km=10.0 # Use default 10km radius
-                        )
-                        print(f"Dashboard: Nearest hospitals search result: {st.session_state.nearest_hospitals}")
-                    else: # hospital_df was None after loading/cleaning
-                        st.session_state.nearest_hospitals = [{"info": "Hospital data not available for search."}] # Indicate data not available
-
-                    # Only attempt to find police stations if police_df loaded and has required columns
-                    if police_df is not None:
-                        st.session_state.nearest_police_stations = find_nearest_services(
-                            lat, lon, police_df, service_type='Police Station',
-                            name_col='name', lat_col='lat', lon_col='lng',
-                            num_results=5, radius_km=10.0 # Use default 10km radius
+                # --- Give the SOS job (queued when the button was pressed) its location ---
+                # Reverse geocoding, the nearest services search and the email fan-out run in the
+                # dispatch worker, so the alert completes even if this page reruns or is closed.
+                # Progress is copied back into session state by sync_sos_job() below.
+                try:
+                    if st.session_state.get('sos_job_id') is None:
+                        st.session_state.sos_job_id = enqueue_sos(
+                            st.session_state.user, source='button',
+                            location=st.session_state.last_known_location_data,
+                            contacts=st.session_state.get('dashboard_contacts_list', []),
+                            hospital_csv_path=hospital_csv_path, police_csv_path=police_csv_path,
                         )
-                        print(f"Dashboard: Nearest police stations search result: {st.session_state.nearest_police_stations}")
-                    else: # police_df was None after loading/cleaning
-                        st.session_state.nearest_police_stations = [{"info": "Police station data not available for search."}] # Indicate data not available
-
-                elif _GEOPY_AVAILABLE: # Geopy available, but neither DataFrame loaded
-                    sos_status_placeholder.warning("Service data not loaded. Cannot find nearest services.")
-                    st.session_state.nearest_hospitals = [{"info": "Service data not loaded."}]
-                    st.session_state.nearest_police_stations = [{"info": "Service data not loaded."}]
-                    print("Dashboard: Service data not available for nearest search.")
-
-
-                elif not _GEOPY_AVAILABLE: # Geopy not available at all
-                    sos_status_placeholder.warning("Geopy not available. Cannot find nearest services.")
-                    st.session_state.nearest_hospitals = [{"info": "Geopy not available. Cannot find nearest services."}]
-                    st.session_state.nearest_police_stations = [{"info": "Geopy not available. Cannot find nearest services."}]
-                    print("Dashboard: Geopy not available for nearest search.")
-
-
-                # --- Attempt to Send Email Alert (After Location, Geocoding, Services Search) ---
-                # Email is sent if the email module is available, regardless of geocoding or service search success/failure,
-                # as long as browser location data was successfully retrieved.
-                if _EMAIL_ALERT_AVAILABLE:
-                    print("Dashboard: Browser location successfully processed, proceeding to send email.")
-                    sos_status_placeholder.info("Sending email alert...") # Update status
-                    # The send_sos_email_alert function will use the data already in session state
-                    send_sos_email_alert() # Call the helper function to send the email
-                    print("Dashboard: Email sending function called. Processing flag will be cleared in its finally block.")
-                else:
-                    print("Dashboard: Email sending skipped - email_alert module not available.")
-                    sos_status_placeholder.warning("Email alerts disabled (email_alert.py not found). No email sent.")
-                    st.session_state.sos_button_processing = False # Clear processing flag if email module is missing
-                    st.session_state.last_known_location_source += " (Email Disabled)"
+                    else:
+                        st.session_state.sos_job_id = attach_sos_location(st.session_state.sos_job_id,
+                                                                          st.session_state.last_known_location_data)
+                    st.session_state.sos_job_progress = None
+                    sos_status_placeholder.info("SOS alert queued. Fetching address, nearest services and notifying your contacts...")
+                    print(f"Dashboard: SOS job {st.session_state.sos_job_id} queued.")
+                except Exception as e:
+                    print(f"Dashboard: Could not queue SOS job: {e}")
+                    sos_status_placeholder.error(f"Failed to start SOS alert: {e}")
+                    st.session_state.sos_button_processing = False
+                    st.session_state.last_known_location_source += " (SOS dispatch failed)"
 
 
             else: # Location data is a dict but doesn't have lat/lon or error keys - unexpected format
-                sos_status_placeholder.warning("Could not retrieve location (unexpected format).")
+                sos_status_placeholder.warning("Could not retrieve location (unexpected format). Your SOS alert is being sent without the current location.")
                 st.session_state.last_known_location_source = "Unknown (Result format error)"
                 print("Dashboard: Location unexpected format warning displayed.")
-                st.session_state.sos_button_processing = False # Processing finished due to location format error
-                # Clear nearest services results on location failure
-                st.session_state.nearest_hospitals = None
-                st.session_state.nearest_police_stations = None
-                st.session_state.address_details = None # Also clear address details
-                # Do NOT send email if location format is bad
-                return # Stop execution here
+                _release_sos_without_location()
 
         # Execution continues after this block...
         # The general processing flag st.session_state.sos_button_processing is cleared
-        # either in the send_sos_email_alert's finally block or immediately if email is skipped.
+        # by sync_sos_job() once the dispatch service has finished the job.
+
+
+    # --- Step 2b: Follow the SOS Job ---
+    # Pull the dispatch service's progress (address, nearest services, email status) into session state
+    sync_sos_job()
+    if st.session_state.get('sos_button_processing', False) and st.session_state.get('sos_job_id') is not None:
+        # Check the job again every couple of seconds without blocking the page
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=2)(poll_sos_job)()
 
 
     # --- Step 3: Display Current Location Status (Conditional Rendering) ---
@@ -1186,6 +763,12 @@ def dashboard():
             Maps_link = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
             st.markdown(f"[View Location on Google Maps]({Maps_link})")
 
+            # Precomputed coverage answers instantly, before the SOS job has searched the datasets
+            coverage = nearest_help_km(lat, lon)
+            if coverage:
+                st.markdown(f"**Nearest help:** police station ~{_format_km(coverage.get('police_km'))}, "
+                            f"hospital ~{_format_km(coverage.get('hospital_km'))}")
+
             # Display detailed address information if available
             if address_details:
                 # Check if address_details has data beyond just an error or info message
@@ -1380,11 +963,13 @@ def dashboard():
         st.session_state.sos_button_processing = True
         st.session_state.sos_triggered = True  # Mark SOS as triggered
 
-        # Clear previous results/data when starting a new request
+        # Clear previous results/data when starting a new request (the old location is the SOS fallback)
+        previous_location = st.session_state.get('last_known_location_data')
         st.session_state.last_known_location_data = None
         st.session_state.address_details = None # Clear address details
         st.session_state.nearest_hospitals = None # Clear previous nearest services
         st.session_state.nearest_police_stations = None # Clear previous nearest services
+        st.session_state.sos_job_id = None # A new SOS gets a new dispatch job
         st.session_state.last_known_location_source = "Requesting location..."
 
         # Clear previous display elements immediately using the placeholders
@@ -1405,6 +990,24 @@ def dashboard():
         # Get contacts list loaded at the start of dashboard()
         user_contacts_list = st.session_state.get('dashboard_contacts_list', [])
 
+        # --- Queue the SOS now, so nothing that happens before the browser answers can lose it ---
+        # The job waits a few seconds for the location requested below (attached in Step 2) and is
+        # sent with the last known location, or none, if that never arrives.
+        try:
+            st.session_state.sos_job_id = enqueue_sos(
+                st.session_state.user, source='button', location=_last_valid_location(previous_location),
+                contacts=user_contacts_list, hospital_csv_path=hospital_csv_path, police_csv_path=police_csv_path,
+                wait_for_location=True,
+            )
+            st.session_state.sos_job_progress = None
+            print(f"Dashboard: SOS job {st.session_state.sos_job_id} queued, waiting for the browser location.")
+        except Exception as e:
+            print(f"Dashboard: Could not queue SOS job: {e}")
+            sos_status_placeholder.error(f"Failed to start SOS alert: {e}")
+            st.session_state.sos_button_processing = False
+            st.session_state.last_known_location_source = "SOS Failed (dispatch error)"
+            return
+
         valid_email_contacts_exist = any(isinstance(contact, dict) and 'email' in contact and contact['email'] and "@" in str(contact['email']) for contact in user_contacts_list)
 
         # Check if email alert is possible BEFORE triggering location
@@ -1453,15 +1056,9 @@ def dashboard():
         except Exception as e:
             # Catch errors specifically during the rendering of the JS component
             print(f"Dashboard: Error rendering JS location component directly: {e}") # Debug print
-            sos_status_placeholder.error(f"Location component failed to load or execute: {e}")
-            st.session_state.sos_button_processing = False # Reset flag on component failure
-            st.session_state.last_known_location_source = "SOS Failed (Component Load Error)"
-            # Clear nearest services results on failure
-            st.session_state.nearest_hospitals = None
-            st.session_state.nearest_police_stations = None
-            st.session_state.address_details = None # Also clear address details
-            # Do NOT send email if location component failed
-            return # Stop execution here
+            sos_status_placeholder.error(f"Location component failed to load or execute: {e}. Your SOS alert is being sent without the current location.")
+            st.session_state.last_known_location_source = "Not available (Component Load Error)"
+            _release_sos_without_location()
 
 
     # Close the custom div for the SOS button styling
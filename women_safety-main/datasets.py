@@ -0,0 +1,486 @@
+# datasets.py
+# Process-wide registry of the read-only service datasets (hospitals, police stations).
+# The datasets are loaded once per process and shared by every session and by the SOS dispatch
+# worker. Frames handed out by the registry are frozen: their column arrays are marked read-only,
+# so callers can take zero-copy views (df[col].to_numpy(), .iloc of a few rows) without copying
+# the whole frame to protect it, and an accidental in-place write raises instead of changing the
+# data for every other session. Code that needs to modify a dataset must take its own .copy().
+# Each Dataset also carries its coordinate columns as float arrays and the spatial index built on
+# them, so hot paths never convert or copy the 10k-row frames again.
+#
+# Dataset locations come from configuration (dataset_path): an environment variable per dataset,
+# with relative paths resolved against SEFI_DATA_DIR (default: the app directory), so the datasets
+# load the same way whatever the working directory or platform. Every dataset is versioned by a
+# hash of its content (dataset_version); the caches derived from a dataset (spatial indexes,
+# nearest-service candidates, the coverage grid, the risk scorer's crime table, the training
+# feature cache) are keyed by that version, so they are rebuilt exactly when the data changes
+# and never merely because a file was touched or copied.
+#
+# Updates: instead of replacing a CSV, publish a delta file (python datasets.py publish police
+# changes.csv). A delta is a CSV with an `op` column (add, update or delete), the dataset's key
+# column (hospital: id, police: name) and the data columns; an update only needs the columns it
+# changes. Deltas live in SEFI_DATASET_DELTAS_DIR/<dataset>/ and are applied in file name order on
+# top of the base CSV. Running processes notice new deltas (checked every few seconds), apply only
+# the new ones to the dataset already in memory and update its spatial index in place of
+# rebuilding it, all on the side; callers keep getting the current version until the new one is
+# complete and then get the new one in a single swap, so a refresh has no reload and no downtime.
+#     python datasets.py status | publish <dataset> <delta.csv> | compact <dataset>
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# --- Dataset locations ---
+DATA_DIR = os.path.abspath(os.environ.get("SEFI_DATA_DIR", os.path.dirname(os.path.abspath(__file__))))
+# Dataset name -> (environment variable, default path relative to DATA_DIR)
+DATASET_LOCATIONS = {
+    "hospital": ("SEFI_HOSPITAL_CSV", "Hospitals In India (Anonymized).csv"),
+    "police": ("SEFI_POLICE_CSV", "indian_police_stations_10000.csv"),
+    "crime": ("SEFI_CRIME_DATA", os.path.join("assets", "combined_crime_data.csv")),
+    "danger_zones": ("SEFI_DANGER_ZONES", "danger_zones.json"),
+}
+HASH_CHUNK_BYTES = 1 << 20
+DELTAS_DIR = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_DATASET_DELTAS_DIR", "deltas")))
+# How often a running process looks for changed base files or new deltas
+CHECK_INTERVAL_SECONDS = float(os.environ.get("SEFI_DATASET_CHECK_SECONDS", "5"))
+DELTA_OPS = ("add", "update", "delete")
+
+# Column layout of the service datasets (as cleaned by emergency_services.load_service_frames);
+# key_col identifies a row in delta files
+SERVICE_COLUMNS = {
+    "hospital": {"service_type": "Hospital", "name_col": "id", "key_col": "id", "lat_col": "Latitude", "lon_col": "Longitude"},
+    "police": {"service_type": "Police Station", "name_col": "name", "key_col": "name", "lat_col": "lat", "lon_col": "lng"},
+}
+
+
+def dataset_path(name):
+    """Absolute path of a named dataset: its environment variable if set, else the default; relative paths are under DATA_DIR."""
+    variable, default = DATASET_LOCATIONS[name]
+    path = os.path.expanduser(os.environ.get(variable) or default)
+    return os.path.normpath(path if os.path.isabs(path) else os.path.join(DATA_DIR, path))
+
+
+# --- Content versions ---
+# path -> ((size, mtime_ns), digest); a file is only hashed again when its size or mtime changes
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+def content_hash(path):
+    """SHA-256 (hex, first 16 characters) of a file's content. Raises OSError if the file cannot be read."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        cached = _hashes.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()[:16]
+    with _hashes_lock:
+        _hashes[path] = (signature, value)
+    return value
+
+
+def dataset_version(path):
+    """Version tag of a dataset file ("sha256:<hash>"), or None if the file does not exist."""
+    try:
+        return f"sha256:{content_hash(path)}"
+    except OSError:
+        return None
+
+
+def float_column(df, column):
+    """A column as a float64 array: a view when it already is float64, else a coerced copy (invalid values become NaN)."""
+    series = df[column]
+    if series.dtype == np.float64:
+        return series.to_numpy()
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+
+
+def freeze_frame(df):
+    """
+    Read-only version of a DataFrame: one array per column (no shared 2-D blocks), each marked
+    non-writeable. With pandas copy-on-write the arrays are already protected; without it, any
+    in-place write to the frozen frame raises ValueError. Arrays that are read-only already
+    (memory-mapped artifacts, copy-on-write views) are used as they are, without a copy.
+    """
+    df = df.reset_index(drop=True)
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if values.flags.writeable:
+            values = values.copy()
+            values.flags.writeable = False
+        columns[column] = values
+    frozen = pd.DataFrame(columns, copy=False)
+    frozen.attrs.update(df.attrs)
+    return frozen
+
+
+# --- Deltas ---
+def delta_files(kind):
+    """[(path, content version)] of the delta files for a dataset, in the order they apply."""
+    directory = os.path.join(DELTAS_DIR, kind)
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".csv"))
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        version = dataset_version(os.path.join(directory, name))
+        if version: # Skip files that disappeared while listing
+            files.append((os.path.join(directory, name), version))
+    return files
+
+
+def read_delta(path, kind):
+    """
+    Reads and checks a delta file. Raises ValueError if any row is unusable, so a delta is
+    applied completely or not at all. When a key appears more than once, its last row wins.
+    """
+    layout = SERVICE_COLUMNS[kind]
+    key_col, lat_col, lon_col = layout["key_col"], layout["lat_col"], layout["lon_col"]
+    delta = pd.read_csv(path, dtype={key_col: str})
+    for column in ("op", key_col):
+        if column not in delta.columns:
+            raise ValueError(f"missing column '{column}'")
+    delta["op"] = delta["op"].astype(str).str.strip().str.lower()
+    bad_ops = sorted(set(delta["op"]) - set(DELTA_OPS))
+    if bad_ops:
+        raise ValueError(f"unknown op(s) {bad_ops}; use {', '.join(DELTA_OPS)}")
+    # Checked before astype(str): with the pandas string dtype an empty cell stays missing
+    missing_keys = delta[key_col].isna()
+    delta[key_col] = delta[key_col].astype(str).str.strip()
+    if missing_keys.any() or (delta[key_col] == "").any() or delta[key_col].isin(["nan", "None"]).any():
+        raise ValueError(f"rows without a {key_col}")
+    for column in (lat_col, lon_col):
+        if column in delta.columns:
+            delta[column] = pd.to_numeric(delta[column], errors='coerce')
+    adds = delta["op"] == "add"
+    if adds.any():
+        if lat_col not in delta.columns or lon_col not in delta.columns:
+            raise ValueError(f"'add' rows need {lat_col} and {lon_col}")
+        if delta.loc[adds, [lat_col, lon_col]].isna().any(axis=None):
+            raise ValueError(f"'add' rows with missing or non-numeric {lat_col}/{lon_col}")
+    return delta.drop_duplicates(subset=[key_col], keep="last").reset_index(drop=True)
+
+
+def apply_delta(frame, delta, kind):
+    """
+    Applies a checked delta to a dataset frame. Returns (new frame, remap, added positions, counts):
+    remap[i] is the new position of old row i (-1 if removed or replaced) and the rows at
+    `added positions` of the new frame are the added or updated ones.
+    An update fills the columns it leaves blank from the current row; an add of an existing key
+    replaces it, and an update of a missing key adds it.
+    """
+    key_col = SERVICE_COLUMNS[kind]["key_col"]
+    keys = frame[key_col].astype(str).str.strip()
+    present = delta[key_col].isin(set(keys))
+    deletes = delta["op"] == "delete"
+    updates = delta["op"] == "update"
+
+    # Every row whose key the delta mentions goes; adds and updates come back as new rows
+    keep = ~keys.isin(set(delta[key_col])).to_numpy()
+    remap = np.where(keep, np.cumsum(keep) - 1, -1)
+
+    columns = list(frame.columns)
+    value_columns = [c for c in columns if c != key_col]
+    order = delta.loc[~deletes, key_col]
+    new_rows = delta.loc[~deletes].set_index(key_col).reindex(columns=value_columns)
+    update_keys = delta.loc[updates & present, key_col]
+    if len(update_keys):
+        current = frame.assign(**{key_col: keys}).drop_duplicates(subset=[key_col], keep="last").set_index(key_col)
+        new_rows = new_rows.combine_first(current.loc[update_keys, value_columns]).loc[order]
+    new_rows = new_rows.reset_index().reindex(columns=columns)
+
+    result = pd.concat([frame.iloc[np.flatnonzero(keep)], new_rows], ignore_index=True)
+    added_positions = np.arange(int(keep.sum()), len(result))
+    counts = {
+        "added": int((~deletes & ~present).sum()),
+        "updated": int((~deletes & present).sum()),
+        "deleted": int((deletes & present).sum()),
+        "missing_deletes": int((deletes & ~present).sum()),
+    }
+    return result, remap, added_positions, counts
+
+
+def _chained_version(base_version, deltas):
+    """Version of a base file with deltas applied: the base version alone when there are none."""
+    if not deltas:
+        return base_version
+    digest = hashlib.sha256("|".join([str(base_version)] + [version for _, version in deltas]).encode()).hexdigest()
+    return f"sha256:{digest[:16]}"
+
+
+class Dataset:
+    """One frozen service dataset with its version, coordinate arrays and spatial index."""
+
+    def __init__(self, kind, path, frame, version, base_version=None, deltas=()):
+        layout = SERVICE_COLUMNS[kind]
+        self.kind = kind
+        self.path = path
+        self.service_type = layout["service_type"]
+        self.name_col = layout["name_col"]
+        self.lat_col = layout["lat_col"]
+        self.lon_col = layout["lon_col"]
+        self.frame = freeze_frame(frame)
+        self.version = version
+        self.base_version = base_version or version
+        self.deltas = tuple(deltas) # (path, version) of the deltas applied on top of the base file
+        self.frame.attrs['dataset_version'] = version
+        # Views into the frozen frame (the cleaned coordinate columns are float64 already)
+        self.lats = float_column(self.frame, self.lat_col)
+        self.lons = float_column(self.frame, self.lon_col)
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def index(self):
+        """The ServiceIndex over this dataset, built on first use."""
+        with self._index_lock:
+            if self._index is None:
+                from service_index import get_service_index
+                self._index = get_service_index(self.frame, self.lat_col, self.lon_col)
+            return self._index
+
+    def nbytes(self):
+        return int(self.frame.memory_usage(deep=True).sum())
+
+    def with_delta(self, delta, delta_file):
+        """
+        New Dataset with a checked delta applied (this one is left unchanged). If this dataset's
+        index has been built, the new one gets an updated index (or a rebuilt one, once the
+        changes since the last build are too many) before it is handed out.
+        """
+        frame, remap, added, counts = apply_delta(self.frame, delta, self.kind)
+        # Rows without usable coordinates are dropped, as in load_service_frames
+        frame[self.lat_col] = pd.to_numeric(frame[self.lat_col], errors='coerce')
+        frame[self.lon_col] = pd.to_numeric(frame[self.lon_col], errors='coerce')
+        usable = frame[[self.lat_col, self.lon_col]].notna().all(axis=1).to_numpy()
+        if not usable.all():
+            positions = np.where(usable, np.cumsum(usable) - 1, -1)
+            remap = np.where(remap >= 0, positions[np.maximum(remap, 0)], -1)
+            added = positions[added[usable[added]]]
+            frame = frame[usable]
+        deltas = self.deltas + (delta_file,)
+        dataset = Dataset(self.kind, self.path, frame, _chained_version(self.base_version, deltas), self.base_version, deltas)
+        dataset.counts = counts
+        if self._index is not None:
+            from service_index import ServiceIndex, register_service_index
+            index = self._index.updated(remap, dataset.lats[added], dataset.lons[added], added)
+            if index.needs_compaction():
+                index = ServiceIndex(dataset.lats, dataset.lons)
+            register_service_index(dataset.frame, dataset.lat_col, dataset.lon_col, index)
+            dataset._index = index
+        return dataset
+
+
+class ServiceDatasets:
+    """The hospital and police datasets loaded from one pair of paths, plus any loading errors."""
+
+    def __init__(self, hospital, police, errors, sources=()):
+        self.hospital = hospital
+        self.police = police
+        self.errors = list(errors)
+        # (base file version, delta files) per dataset when this entry was built
+        self.sources = sources
+        self.checked_at = time.monotonic()
+
+    @property
+    def hospital_df(self):
+        return self.hospital.frame if self.hospital is not None else None
+
+    @property
+    def police_df(self):
+        return self.police.frame if self.police is not None else None
+
+    @property
+    def versions(self):
+        return tuple(d.version if d is not None else None for d in (self.hospital, self.police))
+
+
+class DatasetRegistry:
+    """
+    Loads each pair of service dataset paths once and hands out the shared, frozen result.
+    Every CHECK_INTERVAL_SECONDS a call also checks the base files' content versions and the
+    delta directories. New deltas are applied to the datasets in memory; a changed base file (or
+    a changed or removed delta) means loading from the files again. Either way the new entry is
+    prepared by one caller while the others keep getting the current one, and then replaces it.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sources(key):
+        return tuple((dataset_version(path), tuple(delta_files(kind))) for path, kind in zip(key, ("hospital", "police")))
+
+    def service_datasets(self, hospital_csv_path=None, police_csv_path=None):
+        """ServiceDatasets for the given paths (defaults: dataset_path("hospital") / dataset_path("police"))."""
+        key = (hospital_csv_path or dataset_path("hospital"), police_csv_path or dataset_path("police"))
+        with self._lock:
+            entry = self._entries.get(key)
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        if entry is not None and time.monotonic() - entry.checked_at < CHECK_INTERVAL_SECONDS:
+            return entry
+        sources = self._sources(key)
+        if entry is not None and entry.sources == sources:
+            entry.checked_at = time.monotonic()
+            return entry
+        # Only the first load makes callers wait; a refresh is prepared while the current entry is served
+        if not build_lock.acquire(blocking=entry is None):
+            return entry
+        try:
+            with self._lock:
+                current = self._entries.get(key)
+            if current is not None and current.sources == sources:
+                return current # Another caller finished it meanwhile
+            started = time.perf_counter()
+            new = self._build(key, sources, current)
+            with self._lock:
+                self._entries[key] = new
+            loaded = [d for d in (new.hospital, new.police) if d is not None]
+            print(f"Datasets: {'Loaded' if current is None else 'Swapped in'} "
+                  f"{', '.join(f'{len(d)} {d.kind} rows ({d.version}, {len(d.deltas)} deltas)' for d in loaded) or 'no datasets'} "
+                  f"in {time.perf_counter() - started:.2f}s (~{sum(d.nbytes() for d in loaded) / 1e6:.1f} MB, shared by all sessions).")
+            return new
+        finally:
+            build_lock.release()
+
+    def _build(self, key, sources, current):
+        from emergency_services import load_service_frames
+
+        reload = current is None or any(
+            base != old_base or (dataset is not None and deltas[:len(dataset.deltas)] != dataset.deltas)
+            for (base, deltas), (old_base, _), dataset in zip(sources, current.sources, (current.hospital, current.police)))
+        if reload:
+            hospital_df, police_df, errors = load_service_frames(*key)
+            datasets = [Dataset(kind, path, df, df.attrs.get('dataset_version')) if df is not None else None
+                        for kind, path, df in (("hospital", key[0], hospital_df), ("police", key[1], police_df))]
+        else:
+            datasets, errors = [current.hospital, current.police], current.errors
+
+        for i, (_, deltas) in enumerate(sources):
+            dataset = datasets[i]
+            if dataset is None:
+                continue
+            for delta_file in deltas[len(dataset.deltas):]:
+                try:
+                    dataset = dataset.with_delta(read_delta(delta_file[0], dataset.kind), delta_file)
+                except (ValueError, KeyError, OSError, pd.errors.ParserError) as e:
+                    # Later deltas may depend on this one, so stop here; it is retried when the deltas change
+                    print(f"Datasets: Delta {delta_file[0]} could not be applied to the {dataset.kind} data: {e}")
+                    break
+                print(f"Datasets: Applied delta {os.path.basename(delta_file[0])} to the {dataset.kind} data: {dataset.counts}.")
+            datasets[i] = dataset
+        return ServiceDatasets(datasets[0], datasets[1], errors, sources)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_dataset_registry():
+    """Returns the process-wide dataset registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DatasetRegistry()
+        return _registry
+
+
+def get_service_datasets(hospital_csv_path=None, police_csv_path=None):
+    """Shortcut for get_dataset_registry().service_datasets(...)."""
+    return get_dataset_registry().service_datasets(hospital_csv_path, police_csv_path)
+
+
+# --- Command line ---
+def _atomic_write(path, data):
+    """Writes bytes next to `path` and moves them into place, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # The temporary name does not end in .csv, so delta_files never lists it
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service dataset versions and delta ingestion.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Show the dataset files, versions and deltas.")
+    publish = sub.add_parser("publish", help="Check a delta file against the current data and install it for running processes.")
+    publish.add_argument("dataset", choices=sorted(SERVICE_COLUMNS))
+    publish.add_argument("delta", help="CSV with op, key and data columns.")
+    compact = sub.add_parser("compact", help="Write the base file with all deltas applied and remove the deltas.")
+    compact.add_argument("dataset", choices=sorted(SERVICE_COLUMNS))
+    args = parser.parse_args()
+
+    datasets = get_service_datasets()
+    if args.command == "status":
+        for kind, dataset in (("hospital", datasets.hospital), ("police", datasets.police)):
+            print(f"{kind}: {dataset_path(kind)}")
+            if dataset is None:
+                print("  not loaded")
+                continue
+            print(f"  base {dataset.base_version}, version {dataset.version}, {len(dataset)} rows")
+            for path, version in dataset.deltas:
+                print(f"  delta {os.path.basename(path)} ({version})")
+        for error in datasets.errors:
+            print(f"Error: {error}")
+        return
+
+    dataset = datasets.hospital if args.dataset == "hospital" else datasets.police
+    if dataset is None:
+        raise SystemExit(f"The {args.dataset} dataset could not be loaded: {'; '.join(datasets.errors)}")
+
+    if args.command == "publish":
+        try:
+            delta = read_delta(args.delta, args.dataset)
+            _, _, _, counts = apply_delta(dataset.frame, delta, args.dataset)
+        except (ValueError, KeyError, pd.errors.ParserError) as e:
+            raise SystemExit(f"Delta rejected: {e}")
+        now = time.time()
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{int(now * 1000) % 1000:03d}-{os.path.splitext(os.path.basename(args.delta))[0]}.csv"
+        target = os.path.join(DELTAS_DIR, args.dataset, name)
+        with open(args.delta, "rb") as f:
+            _atomic_write(target, f.read())
+        print(f"Published {target}: {counts}. Running processes pick it up within {CHECK_INTERVAL_SECONDS:.0f}s.")
+    elif args.command == "compact":
+        if not dataset.deltas:
+            print(f"No deltas to compact for the {args.dataset} data.")
+            return
+        # A process that sees the new base before the deltas are removed applies them once more,
+        # which changes nothing: applying a delta twice gives the same rows as applying it once
+        base = dataset_path(args.dataset)
+        _atomic_write(base, dataset.frame.to_csv(index=False).encode("utf-8"))
+        for path, _ in dataset.deltas:
+            os.remove(path)
+        print(f"Wrote {base} ({len(dataset)} rows) and removed {len(dataset.deltas)} deltas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,20 @@
 import bcrypt # For secure password hashing
 import pymongo # For MongoDB interaction
 from pymongo import MongoClient, InsertOne, DeleteOne, ReplaceOne # Specific imports for clarity
-from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError
+from pymongo.errors import ConnectionFailure, OperationFailure, DuplicateKeyError, BulkWriteError
 from bson.objectid import ObjectId # To handle MongoDB ObjectId
+from bson.errors import InvalidId
 import streamlit as st # Used here only for accessing st.secrets
 import os # Used to check for secrets file
+import backends # SEFI_BACKEND=local swaps MongoDB for an in-process store
 
 # --- Configuration (Gets details from Streamlit Secrets) ---
 def get_mongo_client():
     """Establishes and returns a MongoDB client connection using secrets."""
+    # Local backend: no secrets or server needed
+    if backends.use_local_backends():
+        return backends.get_local_mongo_client()
+
     # Check if secrets file exists and contains mongo config
     if not os.path.exists(".streamlit/secrets.toml"):
         print("DB: ERROR: .streamlit/secrets.toml not found. Cannot connect to MongoDB.")
@@ -47,6 +53,8 @@ def get_mongo_client():
 def get_database():
     """Gets the specified database from the MongoDB client."""
     client = get_mongo_client()
+    if backends.use_local_backends():
+        return client[backends.LOCAL_DATABASE_NAME]
     try:
         db_name = st.secrets["mongodb"]["mongo_database_name"]
         db = client[db_name]
@@ -64,6 +72,17 @@ def get_database():
 USERS_COLLECTION = "users"
 CONTACTS_COLLECTION = "contacts"
 
+# --- Contacts schema ---
+# Only these fields are read back (plus _id, which is returned as a string so no ObjectId reaches
+# the pages or session state); user_id is the filter and is not returned
+CONTACT_FIELDS = ("name", "phone", "email")
+CONTACT_PROJECTION = {"_id": 1, **{field: 1 for field in CONTACT_FIELDS}}
+# Compound index: serves the per-user lookup (its user_id prefix) and per-user email checks
+CONTACTS_INDEX = [("user_id", pymongo.ASCENDING), ("email", pymongo.ASCENDING)]
+CONTACTS_INDEX_NAME = "user_id_1_email_1"
+# Documents per cursor batch, so a user's whole list normally arrives in the first reply
+CONTACTS_BATCH_SIZE = int(os.environ.get("SEFI_CONTACTS_BATCH_SIZE", "1000"))
+
 
 # --- Database Initialization (MongoDB specific) ---
 def init_db():
@@ -97,6 +116,11 @@ def init_db():
              print(f"DB: Creating index on '{CONTACTS_COLLECTION}.user_id'.")
              db[CONTACTS_COLLECTION].create_index("user_id")
 
+        # Compound (user_id, email) index used by the contacts repository functions below
+        if CONTACTS_INDEX_NAME not in db[CONTACTS_COLLECTION].index_information():
+             print(f"DB: Creating index on '{CONTACTS_COLLECTION}.(user_id, email)'.")
+             db[CONTACTS_COLLECTION].create_index(CONTACTS_INDEX, name=CONTACTS_INDEX_NAME)
+
         print("DB: MongoDB initialization checked/completed.")
 
     except ConnectionFailure:
@@ -201,7 +225,26 @@ def create_user(name, email, password):
         raise e
 
 # --- Contact Management Functions (Dynamic using MongoDB) ---
-# These functions now link contacts to a user_id (which is the string ObjectId from MongoDB)
+# These functions now link contacts to a user_id (which is the string ObjectId from MongoDB).
+# Every operation is one round trip whatever the number of contacts: reads use a projected,
+# batched cursor and bulk adds/removes go through a single unordered bulk_write. Deletes are
+# always scoped to the owning user.
+
+def _contact_document(user_id, contact):
+    """The stored document for a contact dict with name/phone/email keys."""
+    return {"user_id": user_id, **{field: contact.get(field, "") for field in CONTACT_FIELDS}}
+
+
+def _object_ids(contact_ids):
+    """ObjectIds for the given id strings; ids that are not valid ObjectIds are skipped."""
+    object_ids = []
+    for contact_id in contact_ids:
+        try:
+            object_ids.append(ObjectId(contact_id))
+        except (InvalidId, TypeError):
+            print(f"DB: Ignoring invalid contact ID: {contact_id!r}")
+    return object_ids
+
 
 def save_contact(user_id, name, phone, email):
     """
@@ -214,13 +257,8 @@ def save_contact(user_id, name, phone, email):
         db = get_database()
         contacts_collection = db[CONTACTS_COLLECTION]
 
-        # Create the contact document, storing user_id as a string
-        contact_document = {
-            "user_id": user_id, # Store the user's ObjectId as a string
-            "name": name,
-            "phone": phone,
-            "email": email
-        }
+        # Create the contact document, storing user_id (the user's ObjectId) as a string
+        contact_document = _contact_document(user_id, {"name": name, "phone": phone, "email": email})
 
         # Insert the new contact document
         insert_result = contacts_collection.insert_one(contact_document)
@@ -235,27 +273,54 @@ def save_contact(user_id, name, phone, email):
         return False # Indicate a database error
 
 
-def get_contacts(user_id):
+def add_contacts(user_id, contacts):
     """
-    Retrieves contacts for a user from the database.
-    Returns a list of contact dictionaries [{ '_id': ObjectId(...), 'name': '...', ... }, ...]
-    (Note: _id will be ObjectId, user_id is string)
+    Saves many contacts (dicts with name/phone/email) for a user in one bulk_write.
+    Returns the number of contacts inserted (0 on a database error).
     """
-    print(f"DB: Getting contacts for User ID: {user_id}")
-    db = None
-    contacts_list = []
+    contacts = list(contacts)
+    if not contacts:
+        return 0
+    print(f"DB: Saving {len(contacts)} contacts for User ID {user_id}")
     try:
         db = get_database()
-        contacts_collection = db[CONTACTS_COLLECTION]
+        requests = [InsertOne(_contact_document(user_id, contact)) for contact in contacts]
+        # Unordered: one failed document does not stop the rest of the batch
+        result = db[CONTACTS_COLLECTION].bulk_write(requests, ordered=False)
+        print(f"DB: Saved {result.inserted_count} contacts for User ID {user_id}.")
+        return result.inserted_count
+
+    except BulkWriteError as e:
+        inserted = e.details.get("nInserted", 0)
+        print(f"DB: add_contacts saved {inserted} of {len(contacts)} contacts: {e.details.get('writeErrors', [])[:3]}")
+        return inserted
+    except ConnectionFailure:
+        print("DB: add_contacts failed due to MongoDB connection issues.")
+        raise
+    except Exception as e:
+        print(f"DB Error during add_contacts: {e}")
+        return 0
+
 
-        # Find contact documents filtering by user_id (which is stored as a string)
-        # Use a cursor and convert documents to dictionaries if needed, although pymongo results are dict-like
-        for contact_document in contacts_collection.find({"user_id": user_id}):
-            # You can optionally convert _id to string here if needed by the calling code
-            # contact_document['_id'] = str(contact_document['_id'])
-            contacts_list.append(contact_document)
+def iter_contacts(user_id, batch_size=CONTACTS_BATCH_SIZE):
+    """
+    Yields a user's contacts as {'_id': str, 'name', 'phone', 'email'} dicts, reading the cursor
+    in batches of `batch_size` documents (for streaming large lists, e.g. an export).
+    """
+    db = get_database()
+    cursor = db[CONTACTS_COLLECTION].find({"user_id": user_id}, CONTACT_PROJECTION).batch_size(batch_size)
+    for contact_document in cursor:
+        contact_document["_id"] = str(contact_document["_id"])
+        yield contact_document
 
 
+def get_contacts(user_id):
+    """
+    Retrieves contacts for a user from the database.
+    Returns a list of contact dictionaries [{ '_id': '<ObjectId string>', 'name': '...', 'phone': '...', 'email': '...' }, ...]
+    """
+    try:
+        contacts_list = list(iter_contacts(user_id))
         print(f"DB: Retrieved {len(contacts_list)} contacts for User ID {user_id}.")
         return contacts_list
 
@@ -267,36 +332,37 @@ def get_contacts(user_id):
         return [] # Return empty list on error
 
 
-def delete_contact(contact_id):
+def delete_contact(user_id, contact_id):
     """
-    Deletes a contact by its ID from the database.
-    Returns True on success, False if not found, or None on DB error.
+    Deletes one of a user's contacts by its ID (a contact of another user is never deleted).
+    Returns True on success, False if not found or the ID is invalid.
     """
-    print(f"DB: Deleting contact ID: {contact_id}")
-    db = None
-    try:
-        db = get_database()
-        contacts_collection = db[CONTACTS_COLLECTION]
+    return delete_contacts(user_id, [contact_id]) > 0
 
-        # Delete the contact by its ObjectId
-        # Ensure contact_id passed in is a valid ObjectId string
-        object_id_to_delete = ObjectId(contact_id)
 
-        delete_result = contacts_collection.delete_one({'_id': object_id_to_delete})
-
-        # Check if a document was deleted
-        if delete_result.deleted_count > 0:
-            print(f"DB: Contact ID {contact_id} deleted successfully.")
-            return True
-        else:
-            print(f"DB: Contact ID {contact_id} not found for deletion.")
-            return False # Contact ID not found
+def delete_contacts(user_id, contact_ids):
+    """
+    Deletes many of a user's contacts by ID in one bulk_write.
+    Returns the number of contacts deleted.
+    """
+    object_ids = _object_ids(contact_ids)
+    if not object_ids:
+        return 0
+    print(f"DB: Deleting {len(object_ids)} contacts for User ID {user_id}")
+    try:
+        db = get_database()
+        requests = [DeleteOne({"_id": object_id, "user_id": user_id}) for object_id in object_ids]
+        result = db[CONTACTS_COLLECTION].bulk_write(requests, ordered=False)
+        if result.deleted_count < len(object_ids):
+            print(f"DB: {len(object_ids) - result.deleted_count} of the contacts were not found for User ID {user_id}.")
+        print(f"DB: Deleted {result.deleted_count} contacts for User ID {user_id}.")
+        return result.deleted_count
 
     except ConnectionFailure:
-        print("DB: delete_contact failed due to MongoDB connection issues.")
+        print("DB: delete_contacts failed due to MongoDB connection issues.")
         raise
     except Exception as e:
-        print(f"DB Error during delete_contact: {e}")
+        print(f"DB Error during delete_contacts: {e}")
         # Raise a generic exception or return None
         raise e
 
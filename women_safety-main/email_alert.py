@@ -5,27 +5,27 @@ import streamlit as st # Used here only for accessing st.secrets and potentially
 import os
 import ssl
 import time # Import time for timestamp
-import firebase_admin
-from firebase_admin import credentials, storage
+import backends # SEFI_BACKEND=local writes alerts to a local mail sink instead of SMTP
+from video_upload import enqueue_video_upload, wait_for_upload
 
-firebase_app = None
+# How long upload_video_to_firebase waits for the background upload before giving up
+UPLOAD_WAIT_TIMEOUT_SECONDS = float(os.environ.get("SEFI_UPLOAD_WAIT_SECONDS", "300"))
 
-def upload_video_to_firebase(local_video_path, video_filename):
-    global firebase_app
+def upload_video_to_firebase(local_video_path, video_filename, timeout=UPLOAD_WAIT_TIMEOUT_SECONDS):
+    """
+    Uploads a video through the background uploader and waits for its public URL.
+    The upload itself is chunked and resumable (see video_upload.py); callers that
+    should not block can use video_upload.enqueue_video_upload directly.
+    Waits at most `timeout` seconds (SEFI_UPLOAD_WAIT_SECONDS by default); the job keeps
+    running in the background after a timeout.
+    Returns the public URL, or None if the upload failed or timed out.
+    """
     try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate("firebase_key.json")
-            firebase_app = firebase_admin.initialize_app(cred, {
-                'storageBucket': 'sos-alert-1bf56.appspot.com'  # ✅ Use your bucket name
-            })
-
-        bucket = storage.bucket()
-        blob = bucket.blob(f"sos_videos/{video_filename}")
-        blob.upload_from_filename(local_video_path)
-        blob.make_public()
-
-        print(f"✅ Uploaded video: {blob.public_url}")
-        return blob.public_url
+        job_id = enqueue_video_upload(local_video_path, video_filename)
+        public_url = wait_for_upload(job_id, timeout=timeout)
+        if public_url is None:
+            print(f"❌ Firebase upload error: upload job {job_id} did not complete.")
+        return public_url
 
     except Exception as e:
         print(f"❌ Firebase upload error: {e}")
@@ -49,11 +49,17 @@ def send_alert_email(contacts, location=None, video_link=None):
                                     Defaults to None.
     """
     print("Attempting to send real email via smtplib...")
+    use_mail_sink = backends.use_local_backends()
 
     # --- Securely get email credentials from Streamlit secrets ---
     # Check if secrets are available (important for local testing without secrets file)
     # and if email section exists
-    if not os.path.exists(".streamlit/secrets.toml"):
+    if use_mail_sink:
+        # Local backend: no credentials needed, messages go to backends.MAIL_SINK_DIR
+        sender_email = backends.LOCAL_SENDER_EMAIL
+        sender_password = smtp_server = None
+        smtp_port = 0
+    elif not os.path.exists(".streamlit/secrets.toml"):
         print("WARNING: .streamlit/secrets.toml not found. Cannot send real emails.")
         # Use a placeholder to show message without disrupting flow significantly
         st.error("Email credentials not configured (.streamlit/secrets.toml missing). Cannot send real emails.")
@@ -63,29 +69,30 @@ def send_alert_email(contacts, location=None, video_link=None):
 
     # Using st.secrets might trigger a rerun if the file changes, but accessing
     # non-existent keys will raise a KeyError.
-    if "email" not in st.secrets:
+    elif "email" not in st.secrets:
          print("ERROR: '[email]' section missing in .streamlit/secrets.toml")
          st.error("Email configuration error: '[email]' section missing in secrets.toml.")
          raise Exception("Email secrets section missing.")
 
-    try:
-        # Access secrets - Streamlit makes these available via st.secrets
-        sender_email = st.secrets["email"]["sender_email"]
-        sender_password = st.secrets["email"]["sender_password"] # USE APP PASSWORD!
-        smtp_server = st.secrets["email"]["smtp_server"]
-        smtp_port = int(st.secrets["email"]["smtp_port"]) # Ensure port is integer
-        # Add a check for empty credentials
-        if not sender_email or not sender_password or not smtp_server or not smtp_port:
-             raise ValueError("Empty value found in email secrets.")
-
-    except KeyError as e:
-        print(f"ERROR: Missing email secret: {e}. Check your .streamlit/secrets.toml")
-        st.error(f"Email configuration error: Missing secret '{e}'. Cannot send real emails.")
-        raise Exception(f"Missing email secret: {e}")
-    except ValueError as e:
-        print(f"ERROR: Invalid value in email secrets: {e}. Check your .streamlit/secrets.toml port number or empty values.")
-        st.error(f"Email configuration error: Invalid value in secrets. {e}. Cannot send real emails.")
-        raise Exception(f"Invalid value in email secrets: {e}")
+    if not use_mail_sink:
+        try:
+            # Access secrets - Streamlit makes these available via st.secrets
+            sender_email = st.secrets["email"]["sender_email"]
+            sender_password = st.secrets["email"]["sender_password"] # USE APP PASSWORD!
+            smtp_server = st.secrets["email"]["smtp_server"]
+            smtp_port = int(st.secrets["email"]["smtp_port"]) # Ensure port is integer
+            # Add a check for empty credentials
+            if not sender_email or not sender_password or not smtp_server or not smtp_port:
+                 raise ValueError("Empty value found in email secrets.")
+
+        except KeyError as e:
+            print(f"ERROR: Missing email secret: {e}. Check your .streamlit/secrets.toml")
+            st.error(f"Email configuration error: Missing secret '{e}'. Cannot send real emails.")
+            raise Exception(f"Missing email secret: {e}")
+        except ValueError as e:
+            print(f"ERROR: Invalid value in email secrets: {e}. Check your .streamlit/secrets.toml port number or empty values.")
+            st.error(f"Email configuration error: Invalid value in secrets. {e}. Cannot send real emails.")
+            raise Exception(f"Invalid value in email secrets: {e}")
 
 
     if not contacts:
@@ -185,9 +192,13 @@ def send_alert_email(contacts, location=None, video_link=None):
         # Create a secure SSL context
         context = ssl.create_default_context()
 
+        # Local backend: same message, written to the mail sink
+        if use_mail_sink:
+            with backends.LocalMailSink() as server:
+                server.sendmail(sender_email, contacts, msg.as_string())
         # Use SMTP_SSL for more reliable connection when using SSL ports like 465
         # Gmail and many providers expect SMTP_SSL on port 465
-        if smtp_port == 465:
+        elif smtp_port == 465:
             print(f"Connecting to SMTP_SSL server {smtp_server}:{smtp_port}...")
             with smtplib.SMTP_SSL(smtp_server, smtp_port, context=context) as server:
                 print(f"Logging in as {sender_email}...")
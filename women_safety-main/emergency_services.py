@@ -0,0 +1,444 @@
+# emergency_services.py
+# Location enrichment for SOS alerts: loading the hospital/police datasets, reverse geocoding,
+# finding the nearest services and building the alert email body.
+# These used to live in dashboard.py; they are kept here so the SOS dispatch worker
+# (sos_dispatch.py) can run the same steps outside of a Streamlit rerun.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from datasets import dataset_path, dataset_version
+from validate_datasets import load_validated
+
+# Import geopy for reverse geocoding and distance calculation
+# you'll need to install this: pip install geopy
+try:
+    from geopy.geocoders import Nominatim
+    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable # Import specific exceptions
+    from geopy.distance import geodesic # Import geodesic for distance calculation
+    _GEOPY_AVAILABLE = True
+except ImportError:
+    print("Warning: Geopy library not found. Address lookup and nearest services are unavailable. Install it: pip install geopy")
+    _GEOPY_AVAILABLE = False
+    # Define a dummy distance function
+    def geodesic(coords1, coords2):
+        print("Dummy geodesic distance called. Geopy not available.")
+        # Return a dummy object with an infinite km attribute
+        class DummyDistance:
+            def __init__(self):
+                self.km = float('inf')
+        return DummyDistance()
+
+
+# --- Service Dataset Locations ---
+# Used by the dashboard and by SOS jobs that do not name their own dataset paths
+# (e.g. SOS alerts raised from the Triggers page). Set SEFI_HOSPITAL_CSV / SEFI_POLICE_CSV (or
+# SEFI_DATA_DIR) to move them; see datasets.dataset_path.
+HOSPITAL_CSV_PATH = dataset_path("hospital")
+POLICE_CSV_PATH = dataset_path("police")
+
+
+# --- Load Service Datasets ---
+
+def dataset_file_version(path):
+    """Version tag for a dataset file: a hash of its content, so it changes exactly when the data does."""
+    version = dataset_version(path)
+    if version is None:
+        raise FileNotFoundError(path)
+    return version
+
+
+def load_service_frames(hospital_csv_path, police_csv_path):
+    """
+    Loads hospital and police station data from CSV files.
+    Includes checks for file existence, column validity, and data integrity.
+    Returns two dataframes (None if unavailable) and a list of loading error messages.
+    """
+    # Clean artifacts built by validate_datasets.py for the current file contents are trusted as
+    # they are (no parsing or cleaning); the CSVs are only read and cleaned when there is none
+    hospital_df = load_validated("hospital", hospital_csv_path)
+    police_df = load_validated("police", police_csv_path)
+    load_errors = []
+
+    # --- Load Hospital Data ---
+    if hospital_df is None:
+        try:
+            if not os.path.exists(hospital_csv_path):
+                load_errors.append(f"Hospital CSV file not found: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
+            else:
+                hospital_df = pd.read_csv(hospital_csv_path)
+                print(f"Successfully loaded hospital data from {os.path.basename(hospital_csv_path)}. Shape: {hospital_df.shape}") # Debug
+
+                # Define required columns for search and display (adjust 'id' if name column is different)
+                required_hosp_cols_for_search = ['Latitude', 'Longitude', 'id'] # Assuming 'id' is used as name_col
+                missing_hosp_cols_for_search = [col for col in required_hosp_cols_for_search if col not in hospital_df.columns]
+
+                if missing_hosp_cols_for_search:
+                    load_errors.append(f"Hospital CSV ({os.path.basename(hospital_csv_path)}) missing essential columns for search: {', '.join(missing_hosp_cols_for_search)}. Hospital data will not be available for search.")
+                    hospital_df = None # Invalidate if essential coordinate/name columns are missing
+                elif hospital_df.empty:
+                    load_errors.append(f"Hospital CSV file is empty after reading: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
+                    hospital_df = None
+                else:
+                    # Ensure lat/lon are numeric, drop rows with invalid coords and missing 'id'
+                    hospital_df['Latitude'] = pd.to_numeric(hospital_df['Latitude'], errors='coerce')
+                    hospital_df['Longitude'] = pd.to_numeric(hospital_df['Longitude'], errors='coerce')
+                    # Drop rows where lat or lon became NaN after coercion or 'id' is missing/empty string
+                    hospital_df.dropna(subset=['Latitude', 'Longitude', 'id'], inplace=True)
+                    # Also drop rows where 'id' might be an empty string after reading/dropna
+                    hospital_df = hospital_df[hospital_df['id'].astype(str).str.strip() != '']
+
+
+                    if hospital_df.empty:
+                        load_errors.append("Hospital data became empty after cleaning invalid coordinates/names or missing names. Hospital data will not be available for search.")
+                        hospital_df = None
+                    else:
+                        print(f"Hospital data after cleaning: {hospital_df.shape}") # Debug
+                        # Optional: Add checks for *other* expected columns if needed for display
+                        # if 'City' not in hospital_df.columns:
+                        #     load_errors.append(f"Hospital CSV missing 'City' column. Address details might be incomplete.")
+
+        except pd.errors.EmptyDataError:
+                load_errors.append(f"Hospital CSV file is empty: {os.path.basename(hospital_csv_path)}. Hospital data will not be available.")
+                hospital_df = None
+        except Exception as e:
+            load_errors.append(f"Error loading hospital CSV ({os.path.basename(hospital_csv_path)}): {e}. Hospital data will not be available.")
+            hospital_df = None
+
+    # --- Load Police Station Data ---
+    if police_df is None:
+        try:
+            if not os.path.exists(police_csv_path):
+                load_errors.append(f"Police Station CSV file not found: {os.path.basename(police_csv_path)}. Police station data will not be available.")
+            else:
+                police_df = pd.read_csv(police_csv_path)
+                print(f"Successfully loaded police station data from {os.path.basename(police_csv_path)}. Shape: {police_df.shape}") # Debug
+
+                # Define required columns for search and display
+                required_police_cols_for_search = ['lat', 'lng', 'name']
+                missing_police_cols_for_search = [col for col in required_police_cols_for_search if col not in police_df.columns]
+
+                if missing_police_cols_for_search:
+                    load_errors.append(f"Police Station CSV ({os.path.basename(police_csv_path)}) missing essential columns for search: {', '.join(missing_police_cols_for_search)}. Police station data will not be available for search.")
+                    police_df = None # Invalidate if essential coordinate/name columns are missing
+                elif police_df.empty:
+                    load_errors.append(f"Police Station CSV file is empty after reading: {os.path.basename(police_csv_path)}. Police station data will not be available.")
+                    police_df = None
+                else:
+                    # Ensure lat/lng are numeric, drop rows with invalid coords and missing name
+                    police_df['lat'] = pd.to_numeric(police_df['lat'], errors='coerce')
+                    police_df['lng'] = pd.to_numeric(police_df['lng'], errors='coerce')
+                    # Drop rows where lat or lng became NaN after coercion OR 'name' is missing/empty string
+                    police_df.dropna(subset=['lat', 'lng', 'name'], inplace=True)
+                    # Also drop rows where 'name' might be an empty string after reading/dropna
+                    police_df = police_df[police_df['name'].astype(str).str.strip() != '']
+
+
+                    if police_df.empty:
+                        load_errors.append("Police data became empty after cleaning invalid coordinates/names or missing names. Police station data will not be available for search.")
+                        police_df = None
+                    else:
+                        print(f"Police data after cleaning: {police_df.shape}") # Debug
+                        # Optional: Add checks for *other* expected columns if needed for display
+                        # if 'address' not in police_df.columns:
+                        #     load_errors.append(f"Police Station CSV missing 'address' column. Address details might be incomplete.")
+
+
+        except pd.errors.EmptyDataError:
+                load_errors.append(f"Police Station CSV file is empty: {os.path.basename(police_csv_path)}. Police station data will not be available.")
+                police_df = None
+        except Exception as e:
+            load_errors.append(f"Error loading police station CSV ({os.path.basename(police_csv_path)}): {e}. Police station data will not be available.")
+            police_df = None
+
+
+    for error in load_errors:
+        print(f"Logged Data Loading Error: {error}") # Callers decide how to display these
+
+    # Tag each dataset with its content version so caches built on it (service_cache.py, service_index.py) are dropped when the data changes;
+    # frames from a validated artifact already carry the artifact's version (validate_datasets.artifact_version)
+    if hospital_df is not None:
+        hospital_df.attrs['dataset_version'] = hospital_df.attrs.get('dataset_version') or dataset_file_version(hospital_csv_path)
+    if police_df is not None:
+        police_df.attrs['dataset_version'] = police_df.attrs.get('dataset_version') or dataset_file_version(police_csv_path)
+
+    # Return both dataframes and the errors
+    return hospital_df, police_df, load_errors
+
+# --- Helper Function for Reverse Geocoding ---
+def get_address_from_coords(latitude, longitude):
+    """
+    Convert latitude and longitude to a detailed address using Nominatim.
+    Returns a dictionary of address components or None/error dict on error.
+    Includes basic input validation.
+    """
+    import backends
+    if backends.use_local_backends() and isinstance(latitude, (int, float)) and isinstance(longitude, (int, float)):
+        # Local backend: answer from the fixture geocoder instead of Nominatim
+        return backends.get_fixture_geocoder().reverse_address(latitude, longitude)
+
+    if not _GEOPY_AVAILABLE:
+        print("get_address_from_coords called but Geopy is not available.")
+        return {"error": "Geopy library not installed", "source": "Dummy Geopy"}
+
+    # Skip if latitude or longitude are None or clearly invalid
+    if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
+        print("Invalid latitude or longitude type provided for geocoding.")
+        return {"error": "Invalid coordinates type provided", "source": "Nominatim Prep Error"}
+    if latitude is None or longitude is None: # Should be covered by type check but double-check
+        print("None latitude or longitude provided for geocoding.")
+        return {"error": "None coordinates provided", "source": "Nominatim Prep Error"}
+
+
+    try:
+        geolocator = Nominatim(user_agent="women_safety_app")
+        print(f"Attempting reverse geocoding for {latitude}, {longitude} using Nominatim...") # Debug print
+        # Use timeout for robustness
+        location = geolocator.reverse((latitude, longitude), exactly_one=True, timeout=15) # Increased timeout slightly
+        print(f"Nominatim raw response: {location.raw if location else 'None'}") # Debug print raw response
+
+        if location and location.raw.get('address'):
+            address = location.raw['address']
+            address_details = {
+                'full_address': location.address,
+                'house_number': address.get('house_number', 'N/A'),
+                'building': address.get('building', 'N/A'),
+                'road': address.get('road', 'N/A'),
+                'street': address.get('street', address.get('road', 'N/A')), # Use road if street is missing
+                'neighbourhood': address.get('neighbourhood', 'N/A'),
+                'suburb': address.get('suburb', 'N/A'),
+                'city': address.get('city', address.get('town', address.get('village', 'N/A'))), # Handle variations
+                'district': address.get('district', address.get('county', 'N/A')), # Handle variations
+                'state': address.get('state', 'N/A'),
+                'postcode': address.get('postcode', 'N/A'),
+                'country': address.get('country', 'N/A'),
+                'source': 'Nominatim'
+            }
+            print(f"Successfully retrieved address details from Nominatim: {address_details}")
+            return address_details
+        else:
+            print("No address details found for the coordinates using Nominatim.")
+            return {"error": "No detailed address found for coordinates", "source": "Nominatim"}
+    except (GeocoderTimedOut, GeocoderUnavailable) as e:
+        print(f"Geocoding service error (timeout or unavailable): {e}")
+        return {"error": f"Geocoding service error: {e}", "source": "Nominatim API Error"}
+    except Exception as e:
+        print(f"An unexpected error occurred during reverse geocoding: {e}")
+        return {"error": f"Reverse geocoding failed: {e}", "source": "Nominatim Processing Error"}
+
+# --- Helper Function to Find Nearest Services ---
+def find_nearest_services(user_lat, user_lon, services_df, service_type='Service', name_col='Name', lat_col='Latitude', lon_col='Longitude', num_results=5, radius_km=10.0): # Default radius to 10 km
+    """
+    Finds the nearest services from a pandas DataFrame based on user coordinates.
+    Can filter by a specified radius (km) or return the top N results.
+    Assumes DataFrame has Latitude, Longitude, and Name columns (as specified by lat_col, lon_col, name_col).
+    Returns a list of dictionaries for the nearest services, including distance,
+    or an error/info dictionary.
+    """
+    nearest_list = []
+
+    if services_df is None or services_df.empty:
+        print(f"Warning: Service DataFrame ({service_type}) is empty or None.")
+        return [{"info": f"No {service_type} data available to search."}]
+
+    # Check if required columns actually exist in the dataframe before proceeding
+    required_cols = [lat_col, lon_col, name_col]
+    # Check if *all* required columns exist
+    if not all(col in services_df.columns for col in required_cols):
+        missing = [col for col in required_cols if col not in services_df.columns]
+        print(f"Error: Missing essential columns {missing} in {service_type} DataFrame for search.")
+        return [{"error": f"Data for {service_type} is missing essential columns for search: {', '.join(missing)}."}]
+
+    # Distances for the whole dataset at once. The frame is only read: the coordinate columns are
+    # taken as views (the shared datasets are read-only, see datasets.py) and only the rows being
+    # returned are looked up, so nothing the size of the dataset is copied.
+    try:
+        from datasets import float_column
+        from service_cache import ellipsoidal_km, haversine_km, DISTANCE_MARGIN
+
+        lats = float_column(services_df, lat_col)
+        lons = float_column(services_df, lon_col)
+        candidates = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+
+        if len(candidates) == 0:
+            return [{"info": f"No {service_type} found in the dataset with valid coordinates."}]
+
+        has_radius = radius_km is not None and radius_km != float('inf')
+        if has_radius:
+            # Cheap spherical pre-filter (with a margin for the ellipsoid), exact distances for the rest
+            candidates = candidates[haversine_km(user_lat, user_lon, lats[candidates], lons[candidates]) <= radius_km * DISTANCE_MARGIN]
+        distances = ellipsoidal_km(user_lat, user_lon, lats[candidates], lons[candidates])
+
+        # --- Filter by radius if specified ---
+        if has_radius:
+            within = distances <= radius_km
+            candidates, distances = candidates[within], distances[within]
+            if len(candidates) == 0:
+                return [{"info": f"No {service_type} found within {radius_km} km based on available data."}]
+
+        # Limit to the top N (after the radius filter, if both are given); all matches otherwise
+        order = np.argsort(distances, kind='stable')
+        if num_results is not None and num_results > 0:
+            order = order[:num_results]
+
+        if len(order) == 0:
+            # This might happen if radius was tight or num_results was 0/None
+            return [{"info": f"No {service_type} found matching search criteria (within radius or top N)."}]
+
+        # Format results from just the selected rows
+        positions = candidates[order]
+        rows = services_df.iloc[positions]
+        # Attempt to get Address from common column names if 'Address' doesn't exist
+        # Prioritize a column named 'address' or 'Address'
+        address_col = next((col for col in ('address', 'Address', 'Location') if col in rows.columns), None)
+        names = rows[name_col].tolist()
+        addresses = rows[address_col].tolist() if address_col else ['N/A Address'] * len(rows)
+        for i, position in enumerate(positions):
+            nearest_list.append({
+                'Type': service_type,
+                'Name': names[i],
+                'Latitude': float(lats[position]),
+                'Longitude': float(lons[position]),
+                'Distance (km)': round(float(distances[order[i]]), 2), # Round distance
+                'Address': addresses[i]
+            })
+
+    except Exception as e:
+        print(f"Error finding nearest {service_type} services: {e}")
+        return [{"error": f"Error finding nearest {service_type}: {e}"}]
+
+    return nearest_list
+
+
+def valid_contact_emails(contacts):
+    """Email addresses from a list of contact dicts, skipping entries without a usable address."""
+    return [contact['email'] for contact in contacts or []
+            if isinstance(contact, dict) and 'email' in contact and contact['email'] and "@" in str(contact['email'])]
+
+
+# --- SOS Email Body ---
+def build_sos_email_body(user_name, user_email, location_data, address_details, nearest_hospitals, nearest_police_stations):
+    """Builds the plain-text SOS email from the location, address and nearest services gathered for an alert."""
+    body = f"URGENT: SOS Alert from {user_name} ({user_email})!\n\n"
+    body += "Please check on them immediately.\n\n"
+
+    # --- Building Email Body based on available data ---
+    body += "--- Last Known Location Details ---\n"
+    if location_data is not None and isinstance(location_data, dict):
+        # Check for error FIRST from browser geolocation
+        if 'error' in location_data:
+            body += f"Could not retrieve initial location details: {location_data['error']}\n"
+            body += f"Source: {location_data.get('source', 'Browser Geolocation Error')}\n"
+        # Then check for valid coordinates if no error
+        elif 'latitude' in location_data and 'longitude' in location_data:
+            lat = location_data['latitude']
+            lon = location_data['longitude']
+            acc = location_data.get('accuracy', 'Unknown')
+            src = location_data.get('source', 'N/A')
+            body += f"Source: {src}\n"
+            body += f"Coordinates: Latitude {lat}, Longitude {lon}\n"
+            body += f"Accuracy: {acc} meters\n"
+            # Use the modern Google Maps URL format
+            Maps_link = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
+            body += f"View Location on Map: {Maps_link}\n"
+
+            # Add detailed address information if available from Nominatim
+            body += "\nAddress Details (if available):\n"
+            if address_details:
+                if address_details.get('error'):
+                    body += f"  Address Lookup Error: {address_details['error']}\n"
+                elif address_details.get('info'): # Handle info messages from geocoding failure
+                    body += f"  Address Lookup Info: {address_details['info']}\n"
+                elif address_details.get('full_address'):
+                    body += f"  Full Address: {address_details['full_address']}\n"
+                    # Add specific components if available and not 'N/A'
+                    if address_details.get('street') and address_details['street'] != 'N/A': body += f"  Street/Road: {address_details['street']}\n"
+                    if address_details.get('house_number') and address_details['house_number'] != 'N/A': body += f"  House/Building: {address_details['house_number']}\n"
+                    if address_details.get('neighbourhood') and address_details['neighbourhood'] != 'N/A': body += f"  Neighborhood: {address_details['neighbourhood']}\n"
+                    if address_details.get('suburb') and address_details.get('suburb') != 'N/A': body += f"  Suburb: {address_details.get('suburb')}\n"
+                    if address_details.get('city') and address_details.get('city') != 'N/A': body += f"  City: {address_details.get('city')}\n"
+                    if address_details.get('district') and address_details.get('district') != 'N/A': body += f"  District: {address_details.get('district')}\n"
+                    if address_details.get('state') and address_details.get('state') != 'N/A': body += f"  State: {address_details.get('state')}\n"
+                    if address_details.get('postcode') and address_details.get('postcode') != 'N/A': body += f"  Postal Code: {address_details.get('postcode')}\n"
+                    if address_details.get('country') and address_details.get('country') != 'N/A': body += f"  Country: {address_details.get('country')}\n"
+                else:
+                    body += "  Detailed address information could not be parsed.\n"
+            else:
+                body += "  Detailed address information not available.\n" # Case where address_details is None or empty
+
+
+        else: # Handle unexpected location_data format
+            body += "Location data available but format is unexpected.\n"
+    else: # This else is for the outer if location_data is None or not a dict
+        body += "Location information not available.\n"
+    body += "---------------------------------------\n\n"
+
+
+    # --- Add Nearest Services Details to Email Body ---
+    body += "--- Nearest Emergency Services (if available) ---\n"
+    services_added = False
+
+    # Hospitals
+    if isinstance(nearest_hospitals, list) and nearest_hospitals:
+        # Check if it's an error/info message or actual results
+        if nearest_hospitals[0].get('error'):
+            body += f"Nearest Hospitals: {nearest_hospitals[0]['error']}\n"
+            services_added = True
+        elif nearest_hospitals[0].get('info'):
+            body += f"Nearest Hospitals: {nearest_hospitals[0]['info']}\n"
+            services_added = True
+        else: # Actual list of services
+            body += "Nearest Hospitals:\n"
+            for hosp in nearest_hospitals:
+                hosp_name = hosp.get('Name', 'Unknown Hospital')
+                hosp_dist = hosp.get('Distance (km)', 'N/A')
+                hosp_addr = hosp.get('Address', 'N/A')
+                hosp_lat = hosp.get('Latitude')
+                hosp_lon = hosp.get('Longitude')
+
+                item_line = f"- {hosp_name} ({hosp_dist} km)"
+                if hosp_addr != 'N/A': item_line += f", Address: {hosp_addr}"
+                if hosp_lat is not None and hosp_lon is not None:
+                    hosp_map_link = f"https://www.google.com/maps/search/?api=1&query={hosp_lat},{hosp_lon}"
+                    item_line += f" [Map: {hosp_map_link}]"
+                body += item_line + "\n"
+            services_added = True
+
+    # Police Stations
+    if isinstance(nearest_police_stations, list) and nearest_police_stations:
+        if nearest_police_stations[0].get('error'):
+            body += f"Nearest Police Stations: {nearest_police_stations[0]['error']}\n"
+            services_added = True
+        elif nearest_police_stations[0].get('info'):
+            body += f"Nearest Police Stations: {nearest_police_stations[0]['info']}\n"
+            services_added = True
+        else: # Actual list of services
+            body += "Nearest Police Stations:\n"
+            for station in nearest_police_stations:
+                police_name = station.get('Name', 'Unknown Police Station')
+                police_dist = station.get('Distance (km)', 'N/A')
+                police_addr = station.get('Address', 'N/A')
+                police_lat = station.get('Latitude') # Get raw lat/lon
+                police_lon = station.get('Longitude') # Get raw lat/lon
+
+                item_line = f"- {police_name} ({police_dist} km)"
+                if police_addr != 'N/A': item_line += f", Address: {police_addr}"
+                if police_lat is not None and police_lon is not None:
+                    police_map_link = f"https://www.google.com/maps/search/?api=1&query={police_lat},{police_lon}"
+                    item_line += f" [Map: {police_map_link}]"
+                body += item_line + "\n"
+            services_added = True
+
+    if not services_added:
+        body += "No nearest emergency service data available.\n"
+
+    body += "-------------------------------------------\n\n"
+
+
+    body += "This is an automated alert from the Women Safety App."
+    body += f"\nTimestamp (IST): {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))}"
+
+    return body
@@ -0,0 +1,418 @@
+# keyword_spotting.py
+# Offline keyword spotting for SOS trigger words, running on the server's CPU.
+# Audio is converted to MFCC features with NumPy, and each user's enrolled recordings of their
+# trigger words (per language) are kept as compact MFCC templates in an .npz file. A sliding
+# window over the incoming audio is matched against every template with subsequence DTW, so
+# detection needs no cloud recognizer and its latency is bounded by the window and hop sizes.
+# Run `python keyword_spotting.py benchmark` to measure the real-time factor on this machine.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import functools
+import io
+import json
+import os
+import re
+import time
+import wave
+
+import numpy as np
+
+# --- Configuration ---
+TEMPLATE_DIR = os.environ.get("SEFI_KEYWORD_TEMPLATE_DIR", "keyword_templates")
+DEFAULT_KEYWORDS = [k.strip().lower() for k in os.environ.get("SEFI_TRIGGER_KEYWORDS", "help,danger,emergency,sos").split(",") if k.strip()]
+DEFAULT_LANGUAGE = os.environ.get("SEFI_TRIGGER_LANGUAGE", "en-US")
+SUPPORTED_LANGUAGES = ["en-US", "en-IN", "hi-IN", "ta-IN", "te-IN", "kn-IN", "ml-IN", "bn-IN", "mr-IN"]
+
+SAMPLE_RATE = 16000
+WIN_LENGTH = 400 # 25 ms
+HOP_LENGTH = 160 # 10 ms
+N_FFT = 512
+N_MELS = 26
+N_MFCC = 13
+WINDOW_SECONDS = 1.5 # Longest keyword we expect; the search window covers this much audio
+STEP_SECONDS = 0.1 # How often the window is searched (bounds detection latency together with the window)
+DEFAULT_THRESHOLD = 0.35 # Mean per-frame distance (0..2) below which a template counts as matched
+REFRACTORY_SECONDS = 3.0
+
+
+# --- Feature extraction ---
+
+def resample(samples, from_rate, to_rate=SAMPLE_RATE):
+    """Linear-interpolation resampling. Good enough for speech features at 16 kHz."""
+    if from_rate == to_rate or len(samples) == 0:
+        return samples.astype(np.float32, copy=False)
+    duration = len(samples) / float(from_rate)
+    target_length = int(round(duration * to_rate))
+    positions = np.linspace(0, len(samples) - 1, target_length)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=4)
+def mel_filterbank(sample_rate=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS):
+    """Triangular mel filters as an (n_mels, n_fft // 2 + 1) matrix."""
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(20.0), hz_to_mel(sample_rate / 2.0), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            filters[m - 1, left:center] = (np.arange(left, center) - left) / float(center - left)
+        if right > center:
+            filters[m - 1, center:right] = (right - np.arange(center, right)) / float(right - center)
+    return filters
+
+
+@functools.lru_cache(maxsize=4)
+def dct_matrix(n_mfcc=N_MFCC, n_mels=N_MELS):
+    """Orthonormal DCT-II basis used to turn log-mel energies into cepstral coefficients."""
+    n = np.arange(n_mels)
+    basis = np.cos(np.pi / n_mels * (n + 0.5)[None, :] * np.arange(n_mfcc)[:, None])
+    basis[0] *= 1.0 / np.sqrt(2.0)
+    return (basis * np.sqrt(2.0 / n_mels)).astype(np.float32)
+
+
+def mfcc(samples, sample_rate=SAMPLE_RATE):
+    """MFCC matrix of shape (frames, N_MFCC) for a mono float signal."""
+    samples = resample(np.asarray(samples, dtype=np.float32), sample_rate)
+    if len(samples) < WIN_LENGTH:
+        return np.empty((0, N_MFCC), dtype=np.float32)
+    # Pre-emphasis boosts the high frequencies that carry consonants
+    emphasized = np.append(samples[0], samples[1:] - 0.97 * samples[:-1])
+    count = 1 + (len(emphasized) - WIN_LENGTH) // HOP_LENGTH
+    # All frames are sliced at once through a strided view; no per-frame Python loop
+    frames = np.lib.stride_tricks.sliding_window_view(emphasized, WIN_LENGTH)[::HOP_LENGTH][:count]
+    spectrum = np.abs(np.fft.rfft(frames * np.hamming(WIN_LENGTH), n=N_FFT, axis=1)) ** 2 / N_FFT
+    log_mel = np.log(np.maximum(spectrum @ mel_filterbank().T, 1e-10))
+    return (log_mel @ dct_matrix().T).astype(np.float32)
+
+
+def normalize_features(features):
+    """
+    Drops c0 (overall energy) and scales every frame to unit length, so matching ignores loudness.
+    Each frame is normalised on its own: a keyword must look the same whether it fills the
+    search window or is surrounded by background noise.
+    """
+    cepstra = features[:, 1:]
+    return cepstra / (np.linalg.norm(cepstra, axis=1, keepdims=True) + 1e-8)
+
+
+def voiced_span(samples, sample_rate=SAMPLE_RATE, threshold_ratio=0.1):
+    """Trims leading/trailing silence from an enrollment recording."""
+    frame = max(1, int(sample_rate * 0.01))
+    count = len(samples) // frame
+    if count == 0:
+        return samples
+    energy = np.sqrt(np.mean(samples[:count * frame].reshape(count, frame) ** 2, axis=1))
+    voiced = np.nonzero(energy >= energy.max() * threshold_ratio)[0]
+    if len(voiced) == 0:
+        return samples
+    return samples[voiced[0] * frame:(voiced[-1] + 1) * frame]
+
+
+# --- Matching ---
+
+def subsequence_dtw(template, stream):
+    """
+    Best DTW distance of `template` against any subsequence of `stream`, averaged per template frame.
+    Steps are (1,1), (1,2) and (2,1), so the spoken keyword may be up to twice as fast or as slow
+    as the enrolled one. Each template row only depends on the two rows before it and is
+    computed with whole-array operations over the stream axis.
+    """
+    if len(stream) == 0 or len(template) == 0:
+        return np.inf
+    # Cost matrix: Euclidean distance between every template frame and every stream frame
+    cost = np.sqrt(np.maximum(
+        (template ** 2).sum(axis=1)[:, None] + (stream ** 2).sum(axis=1)[None, :] - 2.0 * template @ stream.T, 0.0))
+
+    def shift(row, n):
+        return np.concatenate((np.full(n, np.inf), row[:-n]))
+
+    previous2, previous = None, cost[0].copy() # Free start anywhere in the stream
+    for i in range(1, len(template)):
+        best = np.minimum(shift(previous, 1), shift(previous, 2))
+        if previous2 is not None:
+            best = np.minimum(best, shift(previous2, 1) + cost[i - 1])
+        previous2, previous = previous, cost[i] + best
+    return float(previous.min() / len(template))
+
+
+# --- Templates and per-user configuration ---
+
+def _user_dir(user_id):
+    safe_user = re.sub(r"[^A-Za-z0-9_.-]", "_", str(user_id)) if user_id else "default"
+    return os.path.join(TEMPLATE_DIR, safe_user)
+
+
+def load_keyword_config(user_id=None):
+    """Returns {'keywords': [...], 'language': '...'} for a user, falling back to the defaults."""
+    path = os.path.join(_user_dir(user_id), "config.json")
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    keywords = [k.strip().lower() for k in config.get("keywords", []) if k.strip()] or list(DEFAULT_KEYWORDS)
+    return {"keywords": keywords, "language": config.get("language") or DEFAULT_LANGUAGE}
+
+
+def save_keyword_config(user_id, keywords, language):
+    directory = _user_dir(user_id)
+    os.makedirs(directory, exist_ok=True)
+    config = {"keywords": [k.strip().lower() for k in keywords if k.strip()], "language": language}
+    tmp_path = os.path.join(directory, "config.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, "config.json"))
+    return config
+
+
+class KeywordTemplates:
+    """
+    Enrolled MFCC templates for one user and language, stored in a single .npz file.
+    Each keyword keeps several templates (one per enrollment recording) and a match threshold.
+    """
+
+    def __init__(self, user_id=None, language=DEFAULT_LANGUAGE):
+        self.user_id = user_id
+        self.language = language
+        self.path = os.path.join(_user_dir(user_id), f"{language}.npz")
+        self.templates = {} # keyword -> list of (frames, N_MFCC) arrays
+        self.thresholds = {}
+
+    @classmethod
+    def load(cls, user_id=None, language=DEFAULT_LANGUAGE):
+        templates = cls(user_id, language)
+        if os.path.exists(templates.path):
+            with np.load(templates.path, allow_pickle=False) as data:
+                for name in data.files:
+                    if name.startswith("threshold__"):
+                        templates.thresholds[name[len("threshold__"):]] = float(data[name])
+                    elif "__" in name:
+                        keyword = name.rsplit("__", 1)[0]
+                        templates.templates.setdefault(keyword, []).append(data[name])
+        return templates
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        arrays = {}
+        for keyword, items in self.templates.items():
+            for i, template in enumerate(items):
+                arrays[f"{keyword}__{i}"] = template
+            arrays[f"threshold__{keyword}"] = np.float32(self.thresholds.get(keyword, DEFAULT_THRESHOLD))
+        tmp_path = self.path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def keywords(self):
+        return sorted(self.templates)
+
+    def enroll(self, keyword, samples, sample_rate):
+        """Adds one recording of `keyword` and recalibrates its threshold. Returns the template count."""
+        keyword = keyword.strip().lower()
+        samples = resample(np.asarray(samples, dtype=np.float32), sample_rate)
+        features = normalize_features(mfcc(voiced_span(samples)))
+        if len(features) < 10:
+            raise ValueError("Recording is too short to enroll (need at least 0.1 s of speech).")
+        self.templates.setdefault(keyword, []).append(features)
+        self._calibrate(keyword)
+        return len(self.templates[keyword])
+
+    def remove(self, keyword):
+        self.templates.pop(keyword, None)
+        self.thresholds.pop(keyword, None)
+
+    def _calibrate(self, keyword):
+        # With several recordings, place the threshold just above how far apart they are from each other
+        items = self.templates[keyword]
+        if len(items) < 2:
+            self.thresholds[keyword] = DEFAULT_THRESHOLD
+            return
+        distances = [subsequence_dtw(a, b) for i, a in enumerate(items) for j, b in enumerate(items) if i != j and len(b) >= len(a) // 2]
+        if distances:
+            self.thresholds[keyword] = float(min(DEFAULT_THRESHOLD * 1.5, max(distances) * 1.5))
+
+
+class KeywordSpotter:
+    """
+    Streaming detector. `push` accepts audio chunks of any size and rate; every STEP_SECONDS the
+    last WINDOW_SECONDS of audio are matched against all templates of the configured keywords.
+    """
+
+    def __init__(self, templates, keywords=None, window_seconds=WINDOW_SECONDS, step_seconds=STEP_SECONDS,
+                 refractory_seconds=REFRACTORY_SECONDS):
+        self.templates = templates
+        self.keywords = [k for k in (keywords or templates.keywords()) if k in templates.templates]
+        self.window_samples = int(window_seconds * SAMPLE_RATE)
+        self.step_samples = int(step_seconds * SAMPLE_RATE)
+        self.refractory_seconds = refractory_seconds
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._since_search = 0
+        self._stream_time = 0.0
+        self._last_fired = None
+        self.cpu_seconds = 0.0
+        self.searches = 0
+
+    @property
+    def ready(self):
+        return bool(self.keywords)
+
+    def push(self, samples, sample_rate):
+        """Adds audio; returns a list of detection event dicts (usually empty)."""
+        samples = resample(np.asarray(samples, dtype=np.float32), sample_rate)
+        self._buffer = np.concatenate((self._buffer, samples))[-self.window_samples:]
+        self._since_search += len(samples)
+        self._stream_time += len(samples) / float(SAMPLE_RATE)
+        events = []
+        if self._since_search >= self.step_samples and len(self._buffer) >= self.window_samples // 2 and self.ready:
+            self._since_search = 0
+            event = self._search()
+            if event:
+                events.append(event)
+        return events
+
+    def _search(self):
+        started = time.thread_time()
+        features = normalize_features(mfcc(self._buffer))
+        best_keyword, best_distance, best_threshold = None, np.inf, None
+        for keyword in self.keywords:
+            threshold = self.templates.thresholds.get(keyword, DEFAULT_THRESHOLD)
+            for template in self.templates.templates[keyword]:
+                distance = subsequence_dtw(template, features)
+                if distance < threshold and distance < best_distance:
+                    best_keyword, best_distance, best_threshold = keyword, distance, threshold
+        self.cpu_seconds += time.thread_time() - started
+        self.searches += 1
+        if best_keyword is None:
+            return None
+        if self._last_fired is not None and self._stream_time - self._last_fired < self.refractory_seconds:
+            return None
+        self._last_fired = self._stream_time
+        # Start over so the same utterance is not matched again by the next window
+        self._buffer = np.zeros(0, dtype=np.float32)
+        return {
+            "action": "trigger",
+            "source": "voice",
+            "keyword": best_keyword,
+            "transcript": f"(offline keyword spotting, distance {best_distance:.2f} < {best_threshold:.2f})",
+            "detector": "server_kws",
+            "language": self.templates.language,
+            "stream_time": round(self._stream_time, 3),
+            "detected_at": time.time(),
+        }
+
+    def stats(self):
+        return {
+            "searches": self.searches,
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "real_time_factor": round(self.cpu_seconds / self._stream_time, 4) if self._stream_time else None,
+        }
+
+
+def load_spotter(user_id=None):
+    """Spotter for a user's configured keywords and language, or None if nothing is enrolled yet."""
+    config = load_keyword_config(user_id)
+    templates = KeywordTemplates.load(user_id, config["language"])
+    spotter = KeywordSpotter(templates, keywords=config["keywords"])
+    return spotter if spotter.ready else None
+
+
+# --- WAV helpers and command line ---
+
+def read_wav(source):
+    """Reads a 16-bit PCM WAV (path, bytes or file object) into (mono float32 samples, sample_rate)."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with wave.open(source, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError("Only 16-bit PCM WAV files are supported.")
+        channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        data = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+    samples = data.reshape(-1, channels).mean(axis=1) / 32768.0
+    return samples.astype(np.float32), sample_rate
+
+
+def benchmark(seconds=60.0, keywords=4, templates_per_keyword=3, chunk_seconds=0.02):
+    """
+    Streams synthetic audio through a spotter loaded with synthetic templates and reports
+    the real-time factor (CPU seconds per second of audio; below 1.0 keeps up with real time).
+    """
+    rng = np.random.default_rng(0)
+    templates = KeywordTemplates(user_id="benchmark")
+    for k in range(keywords):
+        for _ in range(templates_per_keyword):
+            length = int(SAMPLE_RATE * rng.uniform(0.4, 0.9))
+            tone = np.sin(2 * np.pi * rng.uniform(200, 900) * np.arange(length) / SAMPLE_RATE)
+            templates.enroll(f"keyword{k}", (tone + 0.05 * rng.standard_normal(length)).astype(np.float32), SAMPLE_RATE)
+    spotter = KeywordSpotter(templates, refractory_seconds=0)
+    audio = (0.1 * rng.standard_normal(int(seconds * 48000))).astype(np.float32)
+    chunk = int(chunk_seconds * 48000)
+    started = time.perf_counter()
+    for offset in range(0, len(audio), chunk):
+        spotter.push(audio[offset:offset + chunk], 48000)
+    wall = time.perf_counter() - started
+    stats = spotter.stats()
+    return {
+        "audio_seconds": seconds,
+        "keywords": keywords,
+        "templates": keywords * templates_per_keyword,
+        "searches": stats["searches"],
+        "wall_seconds": round(wall, 3),
+        "real_time_factor": round(wall / seconds, 4),
+        "cpu_real_time_factor": stats["real_time_factor"],
+        # Worst case from end of keyword to event: one step plus one search
+        "max_latency_ms": round((STEP_SECONDS + (wall / max(1, stats["searches"]))) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SOS keyword spotting tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("benchmark", help="Measure the real-time factor on this machine.")
+    bench.add_argument("--seconds", type=float, default=60.0)
+    bench.add_argument("--keywords", type=int, default=4)
+    bench.add_argument("--templates-per-keyword", type=int, default=3)
+
+    enroll = sub.add_parser("enroll", help="Enroll WAV recordings of a keyword for a user.")
+    enroll.add_argument("--user", default=None)
+    enroll.add_argument("--language", default=DEFAULT_LANGUAGE)
+    enroll.add_argument("keyword")
+    enroll.add_argument("wavs", nargs="+")
+
+    detect = sub.add_parser("detect", help="Run the spotter over a WAV file.")
+    detect.add_argument("--user", default=None)
+    detect.add_argument("wav")
+
+    args = parser.parse_args()
+    if args.command == "benchmark":
+        print(json.dumps(benchmark(args.seconds, args.keywords, args.templates_per_keyword), indent=2))
+    elif args.command == "enroll":
+        templates = KeywordTemplates.load(args.user, args.language)
+        for path in args.wavs:
+            samples, sample_rate = read_wav(path)
+            count = templates.enroll(args.keyword, samples, sample_rate)
+        templates.save()
+        print(f"Enrolled {count} template(s) for '{args.keyword.lower()}' ({args.language}), threshold {templates.thresholds[args.keyword.lower()]:.2f}.")
+    elif args.command == "detect":
+        spotter = load_spotter(args.user)
+        if spotter is None:
+            print("No keywords enrolled for this user.")
+            return
+        samples, sample_rate = read_wav(args.wav)
+        chunk = int(sample_rate * 0.02)
+        for offset in range(0, len(samples), chunk):
+            for event in spotter.push(samples[offset:offset + chunk], sample_rate):
+                print(json.dumps(event))
+        print(json.dumps(spotter.stats()))
+
+
+if __name__ == "__main__":
+    main()
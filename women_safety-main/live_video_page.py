@@ -1,96 +1,169 @@
 # live_video_page.py
 import streamlit as st
 import os
-import tempfile
 import time
 import shutil # Added for shutil.move
+from recording_segments import SegmentManifest, SegmentWatcher, SEGMENT_LIST_FILENAME, SEGMENT_PATTERN
+from video_processing import AdaptiveFrameProcessor, MAX_WIDTH, MAX_HEIGHT, MAX_FPS
+from recordings_catalog import get_catalog
+from recording_retention import get_retention_manager, USER_QUOTA_BYTES
 
 # Attempt to import necessary components for recording
 # Define variables and classes outside the function, but move st calls inside
 try:
+    import asyncio
+    from fractions import Fraction
     from streamlit_webrtc import webrtc_streamer, WebRtcMode
-    from streamlit_webrtc.record import MediaRecorderBase
+    from aiortc.mediastreams import MediaStreamError
     import av # Required for PyAV for recording
     RECORDING_AVAILABLE = True
+    ENCODER_TIME_BASE = Fraction(1, 1000)
 
     # Define the MediaRecorder class only if imports are successful
-    class MP4MediaRecorder(MediaRecorderBase):
-        def __init__(self) -> None:
-            self.output_path = ""
-            self.__container: av.Container | None = None
-            self.__output_file: tempfile._TemporaryFileWrapper | None = None
-
-        def init_container(self) -> av.Container:
-            self.__output_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-            self.output_path = self.__output_file.name
-            options = {"vcodec": "libx264"} # Use libx264 codec
+    class MP4MediaRecorder:
+        """
+        Records the stream as N-second MP4 segments using FFmpeg's segment muxer.
+        Each finished segment is recorded in the recording's manifest and queued for
+        upload right away, so evidence is off the device within one segment length and
+        survives the process dying mid-recording.
+        streamlit-webrtc creates one per stream (out_recorder_factory) and drives it like
+        aiortc's MediaRecorder: addTrack() with the processed video track, start() once the
+        connection is up, stop() when the track ends. The frames are read from the track here,
+        so the frame processor's frame-rate limit and encode timing see every recorded frame.
+        """
+        def __init__(self, owner=None, segment_seconds=None, frame_processor=None) -> None:
+            self.owner = owner
+            self.segment_seconds = segment_seconds or SEGMENT_SECONDS
+            # Downscales frames and limits the frame rate (see video_processing.py)
+            self.frame_processor = frame_processor or AdaptiveFrameProcessor()
+            self.recording_id = ""
+            self.output_path = "" # Recording directory holding the segments and manifest
+            self.__container: av.container.OutputContainer | None = None
+            self.__video_stream = None
+            self.__size_set = False
+            self.__last_pts = None
+            self.__watcher: SegmentWatcher | None = None
+            self.__track = None
+            self.__task = None
+
+        def init_container(self) -> av.container.OutputContainer:
+            timestamp_ms = int(time.time() * 1000)
+            self.recording_id = f"recording_{timestamp_ms}"
+            self.output_path = os.path.join(RECORDINGS_DIR, self.recording_id)
+            os.makedirs(self.output_path, exist_ok=True)
+
+            options = {
+                "segment_time": str(self.segment_seconds),
+                "segment_format": "mp4",
+                # Fragmented MP4 keeps the segment being written readable if the process dies
+                "segment_format_options": "movflags=+frag_keyframe+empty_moov+default_base_moof",
+                "segment_list": os.path.join(self.output_path, SEGMENT_LIST_FILENAME),
+                "segment_list_type": "csv",
+                "reset_timestamps": "1",
+            }
             try:
-                self.__container = av.open(self.output_path, mode="w", format="mp4", options=options)
-                # Moved st.info inside the main function or a method called later
+                self.__container = av.open(os.path.join(self.output_path, SEGMENT_PATTERN), mode="w", format="segment", options=options)
+                profile = self.frame_processor.start() # Picks the quality profile for this recording
+                self.__video_stream = self.__container.add_stream("libx264", rate=profile.max_fps)
+                self.__video_stream.pix_fmt = "yuv420p"
+                # Millisecond timestamps: the admitted frame rate varies, and rounding frame times to
+                # 1/max_fps could give two frames the same timestamp
+                self.__video_stream.codec_context.time_base = ENCODER_TIME_BASE
+                # ultrafast/superfast presets with a CRF keep per-stream CPU low under load
+                self.__video_stream.options = profile.encoder_options()
+                self.__size_set = False
+                self.__last_pts = None
+                manifest = SegmentManifest(self.output_path, self.recording_id, owner=self.owner, segment_seconds=self.segment_seconds)
+                # Each finished segment is indexed in the recordings catalog as well as uploaded
+                self.__watcher = SegmentWatcher(self.output_path, manifest, upload_prefix=self.recording_id,
+                                                on_segment=get_catalog(RECORDINGS_DIR).segment_hook(self.owner, self.recording_id))
+                self.__watcher.start()
                 return self.__container
             except Exception as e:
-                 # Moved st.error inside the main function or a method called later
-                 self.__output_file.close()
-                 if os.path.exists(self.output_path):
-                      try: os.remove(self.output_path)
+                 if self.__container:
+                      try: self.__container.close()
                       except: pass
+                      self.__container = None
+                 self.__video_stream = None
+                 self.frame_processor.close()
+                 shutil.rmtree(self.output_path, ignore_errors=True)
                  raise
 
-        def start_recording(self):
-             pass # File opened in init_container
+        # --- aiortc MediaRecorder interface, called by streamlit-webrtc ---
+        def addTrack(self, track):
+            """Only the (first) video track is recorded; audio is not requested from the browser."""
+            if track.kind == "video" and self.__track is None:
+                self.__track = track
+
+        async def start(self):
+            if self.__track is None or self.__task is not None:
+                return
+            self.init_container()
+            self.__task = asyncio.ensure_future(self.__record())
+
+        async def stop(self):
+            if self.__task is not None:
+                self.__task.cancel()
+                self.__task = None
+            self.stop_recording()
+
+        async def __record(self):
+            while True:
+                try:
+                    frame = await self.__track.recv()
+                except MediaStreamError:
+                    self.stop_recording() # The stream ended without a stop() call
+                    return
+                try:
+                    self.write_frame(frame)
+                except Exception as e:
+                    print(f"Recording: Error encoding a frame of {self.recording_id}: {e}")
+
+        def write_frame(self, frame):
+            """Encodes one video frame, skipping frames above the processor's current frame rate."""
+            if self.__container is None:
+                return
+            frame_time = frame.time if frame.time is not None else time.monotonic()
+            if not self.frame_processor.admit(frame_time):
+                return
+            if not self.__size_set:
+                # The processor fixes the output size on the stream's first frame
+                self.__video_stream.width = frame.width
+                self.__video_stream.height = frame.height
+                self.__size_set = True
+            pts = int(round(frame_time / ENCODER_TIME_BASE))
+            if self.__last_pts is not None and pts <= self.__last_pts:
+                pts = self.__last_pts + 1
+            self.__last_pts = pts
+            frame.pts, frame.time_base = pts, ENCODER_TIME_BASE
+            started = time.perf_counter()
+            for packet in self.__video_stream.encode(frame):
+                self.__container.mux(packet)
+            self.frame_processor.report_encode(time.perf_counter() - started)
 
         def stop_recording(self):
             if self.__container:
-                # Moved st.info inside the main function or a method called later
                 try:
-                    for stream in self.__container.streams:
-                         if stream.codec_context:
-                             while True:
-                                 packet = stream.codec_context.encode()
-                                 if not packet: break
-                                 self.__container.mux(packet)
-                    self.__container.close()
-                    self.__container = None
-                    self.__output_file.close()
-
-                    final_dir = RECORDINGS_DIR
-                    os.makedirs(final_dir, exist_ok=True)
-                    timestamp = int(time.time())
-                    base, ext = os.path.splitext(os.path.basename(self.output_path))
-                    final_filename = f"recording_{timestamp}{ext}"
-                    final_path = os.path.join(final_dir, final_filename)
-
-                    try:
-                        shutil.move(self.output_path, final_path)
-                        # Moved st.success inside the main function or a method called later
-                    except FileExistsError:
-                         # Moved st.warning inside the main function or a method called later
-                         timestamp_alt = int(time.time() * 1000)
-                         final_filename_alt = f"{base}_{timestamp_alt}{ext}"
-                         final_path_alt = os.path.join(final_dir, final_filename_alt)
-                         try:
-                              shutil.move(self.output_path, final_path_alt)
-                              # Moved st.success inside the main function or a method called later
-                         except Exception as alt_move_e:
-                              # Moved st.error inside the main function or a method called later
-                              pass # Error handled below
-
-                    except Exception as move_e:
-                        # Moved st.error inside the main function or a method called later
-                        pass # Error handled below
-
-
+                    if self.__size_set: # The encoder is only opened by the first frame
+                        for packet in self.__video_stream.encode(None):
+                            self.__container.mux(packet)
                 except Exception as e:
-                    # Moved st.error inside the main function or a method called later
-                    pass # Error handled below
+                    print(f"Recording: Error flushing encoder for {self.recording_id}: {e}")
                 finally:
-                     if os.path.exists(self.output_path):
-                          try:
-                               time.sleep(0.1) # Give move a moment
-                               if os.path.exists(self.output_path):
-                                   os.remove(self.output_path)
-                                   # print message moved
-                          except: pass
+                    try:
+                        # Closing the container finishes the last segment and appends it to the list
+                        self.__container.close()
+                    except Exception as e:
+                        print(f"Recording: Error closing container for {self.recording_id}: {e}")
+                    self.__container = None
+                    self.__video_stream = None
+                    print(f"Recording: {self.recording_id} stopped, frame stats: {self.frame_processor.stats()}")
+
+            self.frame_processor.close()
+            if self.__watcher:
+                self.__watcher.stop() # Final poll picks up the last segment
+                self.__watcher.finish()
+                self.__watcher = None
 
 except ImportError:
     # Define dummies if recording components are not installed
@@ -100,11 +173,6 @@ except ImportError:
     class WebRtcMode:
         SENDRECV = None # Dummy
         RECVONLY = None # Dummy
-    class MediaRecorderBase: # Dummy Base Class
-        def __init__(self, *args, **kwargs): pass
-        def init_container(self): pass
-        def start_recording(self): pass
-        def stop_recording(self): pass
     # Dummy webrtc_streamer
     def webrtc_streamer(*args, **kwargs):
         # Moved st.warning inside the main function
@@ -119,11 +187,11 @@ except ImportError:
         return DummyWebRtcContext()
 
     # Dummy recorder class (defined even if not used, for type hinting safety)
-    class MP4MediaRecorder(MediaRecorderBase):
+    class MP4MediaRecorder:
         def __init__(self, *args, **kwargs): pass
-        def init_container(self): return None
-        def start_recording(self): print("Dummy recorder start called")
-        def stop_recording(self): print("Dummy recorder stop called")
+        def addTrack(self, track): pass
+        async def start(self): print("Dummy recorder start called")
+        async def stop(self): print("Dummy recorder stop called")
     # Dummy av if not imported
     if 'av' not in locals(): av = None
     # Dummy shutil if not imported
@@ -135,6 +203,9 @@ except ImportError:
 
 # Recordings directory
 RECORDINGS_DIR = "recordings"
+# Length of each recorded segment; bounds the time from capture to off-device evidence
+SEGMENT_SECONDS = int(os.environ.get("SEFI_RECORDING_SEGMENT_SECONDS", "10"))
+RECORDINGS_PAGE_SIZE = 10
 # Check if os is available before calling os.makedirs
 if 'os' in locals() and hasattr(os, 'makedirs'):
     os.makedirs(RECORDINGS_DIR, exist_ok=True)
@@ -170,22 +241,37 @@ def live_video_page():
     st.write("Use this page to stream and record live video from your device's camera.")
     if RECORDING_AVAILABLE:
         st.info(f"Recordings will be saved in the '{RECORDINGS_DIR}' directory on the server running the app.")
+        st.info(f"Video is saved and uploaded in {SEGMENT_SECONDS}-second segments while you record, so evidence is kept even if the stream is interrupted.")
         st.info("Make sure your browser tab remains open and active for streaming/recording to continue.")
     else:
         st.warning("Recording functionality is not available due to installation issues.")
 
 
-    recorder_instance = MP4MediaRecorder() if RECORDING_AVAILABLE else None
+    current_user = st.session_state.get('user') or {}
+    stream_key = f"video_stream_{sos_trigger_id}" if sos_trigger_id else "video_stream_manual"
+    # One frame processor per stream and session: a new one on every rerun would register with the
+    # load governor again each time and lose the stream's adaptive frame rate
+    frame_processor = None
+    if RECORDING_AVAILABLE:
+        processor_key = f"frame_processor_{stream_key}"
+        if processor_key not in st.session_state:
+            st.session_state[processor_key] = AdaptiveFrameProcessor()
+        frame_processor = st.session_state[processor_key]
+    owner = current_user.get('id')
+    # streamlit-webrtc calls the factory when a stream starts; the recorder takes the output track,
+    # i.e. the frames after the processor has downscaled them
+    recorder_factory = (lambda: MP4MediaRecorder(owner=owner, frame_processor=frame_processor)) if RECORDING_AVAILABLE else None
 
     # If recording is not available, webrtc_streamer might still work for streaming,
-    # but without the recorder. We pass None to in_recorder.
+    # but without the recorder. We pass None as the recorder factory.
     ctx = webrtc_streamer(
-        key=f"video_stream_{sos_trigger_id}" if sos_trigger_id else "video_stream_manual",
+        key=stream_key,
         mode=WebRtcMode.SENDRECV if RECORDING_AVAILABLE else WebRtcMode.RECVONLY, # Use SENDRECV if recording is possible
-        media_constraints={"video": True, "audio": False},
+        # Ask the browser for no more than we will record, so oversized frames are not sent at all
+        media_stream_constraints={"video": {"width": {"max": MAX_WIDTH}, "height": {"max": MAX_HEIGHT}, "frameRate": {"max": MAX_FPS}}, "audio": False},
         rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
-        in_recorder=recorder_instance, # Provide recorder instance if available (will be None if not available)
-        video_frame_callback=None
+        out_recorder_factory=recorder_factory, # Creates the recorder if available (None if not available)
+        video_frame_callback=frame_processor # Downscales frames to the recording profile
     )
 
     if ctx.state.playing:
@@ -202,48 +288,52 @@ def live_video_page():
     st.markdown("---")
 
     st.subheader("Saved Recordings:")
-    # Ensure the recordings directory exists before listing
-    if 'os' in locals() and hasattr(os, 'path') and hasattr(os.path, 'exists') and os.path.exists(RECORDINGS_DIR) and hasattr(os, 'path') and hasattr(os.path, 'isdir') and os.path.isdir(RECORDINGS_DIR):
-        if 'os' in locals() and hasattr(os, 'listdir'):
-            recordings = [f for f in os.listdir(RECORDINGS_DIR) if f.endswith(".mp4")]
-            try:
-                 if 'os' in locals() and hasattr(os, 'path') and hasattr(os.path, 'join') and hasattr(os, 'path') and hasattr(os.path, 'getmtime'):
-                      recordings.sort(key=lambda x: os.path.getmtime(os.path.join(RECORDINGS_DIR, x)), reverse=True)
-                 else:
-                      recordings.sort(reverse=True) # Fallback sort
-            except:
-                 recordings.sort(reverse=True) # Fallback sort
-
-
-            if recordings:
-                st.write(f"Found {len(recordings)} recording(s).")
-                for recording in recordings:
-                    file_path = os.path.join(RECORDINGS_DIR, recording)
-                    try:
-                        if 'open' in globals() and 'Exception' in globals(): # Check if basic functions are available
-                            with open(file_path, "rb") as f:
-                                 st.download_button(label=f"Download {recording}", data=f, file_name=recording, mime="video/mp4", key=f"download_{recording}")
-                        else:
-                             st.warning(f"Cannot offer download for {recording} due to missing functions.")
-
-                    except Exception as e: st.error(f"Error reading file {recording}: {e}")
-
-                st.markdown("---")
-                st.subheader("Manage Recordings:")
-                if st.button("Clear All Recordings", key="clear_recordings"):
-                     count = 0
-                     if 'os' in locals() and hasattr(os, 'remove'):
-                         for recording in recordings:
-                              file_path = os.path.join(RECORDINGS_DIR, recording)
-                              try: os.remove(file_path); count += 1
-                              except Exception as e: st.error(f"Error deleting file {recording}: {e}")
-                         st.success(f"Cleared {count} recording(s).")
-                         st.rerun()
-                     else:
-                         st.warning("Cannot clear recordings due to missing functions.")
-            else: st.info("No recordings saved yet.")
-        else: st.info("Cannot list recordings due to missing functions.")
-    else: st.info("Recordings directory not found.")
+    # Recordings are listed from the catalog index (one query per page) instead of listing
+    # and stat-ing RECORDINGS_DIR; files are only opened when a download is requested.
+    catalog = get_catalog(RECORDINGS_DIR)
+    try:
+        catalog.sync_from_disk() # One-off import of recordings saved before the catalog existed
+    except Exception as e:
+        print(f"Catalog: Sync from disk failed: {e}")
+    owner_filter = current_user.get('id') # Recordings are only listed for their logged-in owner
+    # Age/quota eviction and compaction run on a background thread, never during a rerun
+    retention = get_retention_manager(RECORDINGS_DIR)
+
+    total_recordings = catalog.count_recordings(owner=owner_filter)
+    if owner_filter is None:
+        st.info("Log in to see your saved recordings.")
+    elif total_recordings:
+        total_pages = max(1, -(-total_recordings // RECORDINGS_PAGE_SIZE)) # Ceiling division
+        used_mb = catalog.total_size(owner=owner_filter) / (1024 * 1024)
+        st.write(f"Found {total_recordings} recording(s), {used_mb:.1f} MB in total.")
+        if USER_QUOTA_BYTES:
+            quota_mb = USER_QUOTA_BYTES / (1024 * 1024)
+            st.progress(min(1.0, used_mb / quota_mb), text=f"{used_mb:.1f} of {quota_mb:.0f} MB used. Oldest recordings are removed automatically above the quota.")
+        page_number = st.number_input("Page", min_value=1, max_value=total_pages, value=1, step=1, key="recordings_page") if total_pages > 1 else 1
+
+        for recording in catalog.list_recordings(owner=owner_filter, page=int(page_number) - 1, page_size=RECORDINGS_PAGE_SIZE):
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(recording['started_at']))
+            duration = f"{recording['duration']:.0f}s" if recording['duration'] else "unknown length"
+            name = recording['recording_key'].replace(os.sep, "_")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.write(f"**{name}** — {created}, {duration} in {recording['segments']} segment(s), {recording['size'] / (1024 * 1024):.1f} MB")
+            with col2:
+                # The archive (every segment plus the manifest) is only built when the button is clicked
+                st.download_button(label="Download", file_name=f"{name}.zip", mime="application/zip", on_click="ignore",
+                                   data=lambda key=recording['recording_key']: catalog.recording_archive(owner_filter, key),
+                                   key=f"download_{name}")
+
+        st.markdown("---")
+        st.subheader("Manage Recordings:")
+        if st.button("Clear All Recordings", key="clear_recordings"):
+             try:
+                 # Deleting many files can take a while, so it is handed to the retention thread
+                 retention.schedule_purge(owner_filter)
+                 st.info(f"Removing {total_recordings} recording(s) in the background. Refresh the page in a moment.")
+             except Exception as e:
+                 st.error(f"Error clearing recordings: {e}")
+    else: st.info("No recordings saved yet.")
 
 
     st.markdown("---")
@@ -0,0 +1,482 @@
+# load_test.py
+# Load generator for app.py, driving one real Streamlit server.
+# The script starts `streamlit run app.py` (local backends, see below) and connects virtual
+# users to it over the same websocket protocol the browser uses (/_stcore/stream): each one
+# sends reruns with widget values (text inputs, button clicks, the location component's value)
+# and waits for the script run to finish. All sessions live in that one server process, so the
+# run exercises what a deployment shares: the cache_resource datasets and indexes, the model
+# server's batching, the in-process SOS worker, and contention for the GIL.
+# Each user signs up and adds two contacts through the UI once (untimed), then walks through:
+#     dashboard -> SOS (button, then the browser location arriving) -> area check
+#     -> dashboard -> crime analysis -> dashboard
+# External services are replaced by the local backends (backends.py, SEFI_BACKEND=local).
+# A flow that fails (a widget missing from the page, an exception in the app, a lost
+# connection) is counted as an error and the user continues with a new session.
+# The client does not follow fragment auto-reruns (the dashboard's SOS polling), so the SOS
+# status on the page is only refreshed by the flow's own reruns.
+#
+# Reported per step: rerun latency percentiles, plus SOS end-to-end latency (queued -> alert
+# sent) from the dispatch queue. The ramp runs the flow at increasing concurrency and reports
+# the saturation point: the first level where throughput stops growing or p95 latency
+# exceeds the target. Memory is the server's resident set size: per level, and its growth per
+# connected session after the ramp.
+#
+#     python load_test.py --users 1 2 4 8 16 32 --iterations 3 [--p95-target-ms 2000]
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+# The local backends must be selected before the server (and any app module) is started
+os.environ.setdefault("SEFI_BACKEND", "local")
+os.environ.setdefault("SEFI_SOS_QUEUE_DB", os.path.join(tempfile.gettempdir(), "sefi_load_test_sos_jobs.db"))
+os.environ.setdefault("SEFI_MAIL_SINK_DIR", os.path.join(tempfile.gettempdir(), "sefi_load_test_mail"))
+
+import numpy as np
+
+# --- Configuration ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+DEFAULT_PORT = 8599
+# Where the simulated browser reports the user to be (Chennai Central)
+DEFAULT_LOCATION = (13.0827, 80.2707)
+# Widget key of the dashboard's location component (dashboard._DASHBOARD_LOCATION_KEY)
+DASHBOARD_LOCATION_KEY = "dashboard_location_data_component_result"
+RERUN_TIMEOUT_SECONDS = 60
+SERVER_START_TIMEOUT_SECONDS = 120
+SOS_TIMEOUT_SECONDS = 120
+USER_PASSWORD = "load-test-password"
+# Throughput must grow by at least this factor per concurrency step to count as scaling
+SCALING_THRESHOLD = 1.1
+# Label shared by the pages' way back (their keys differ per page and per error branch)
+BACK_TO_DASHBOARD = "label:⬅️ Back to Dashboard"
+# Text the app shows when a page raised (app.py catches page exceptions)
+PAGE_ERROR_TEXT = "An error occurred while rendering the page"
+_WIDGET_ID = re.compile(r"^\$\$ID-[0-9a-f]+-(.*)$")
+
+
+class StepLog:
+    """Thread-safe latency samples (seconds) and errors per step."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds):
+        with self._lock:
+            self.samples.setdefault(step, []).append(seconds)
+
+    def error(self, step, message):
+        with self._lock:
+            self.errors.setdefault(step, []).append(message)
+
+    def summary(self):
+        rows = {}
+        with self._lock:
+            for step, values in self.samples.items():
+                ms = np.asarray(values) * 1000
+                rows[step] = {"count": len(ms), "p50": np.percentile(ms, 50), "p95": np.percentile(ms, 95),
+                              "p99": np.percentile(ms, 99), "max": ms.max(), "errors": len(self.errors.get(step, []))}
+        return rows
+
+
+class AppServer:
+    """One `streamlit run app.py` process; its output goes to a log file."""
+
+    def __init__(self, port=DEFAULT_PORT):
+        self.port = port
+        self.log_path = os.path.join(tempfile.gettempdir(), f"sefi_load_test_server_{port}.log")
+        self.process = None
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def start(self, timeout=SERVER_START_TIMEOUT_SECONDS):
+        command = [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+                   "--server.address", "127.0.0.1", "--server.port", str(self.port),
+                   "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"]
+        with open(self.log_path, "w") as log_file:
+            self.process = subprocess.Popen(command, cwd=APP_DIR, env=dict(os.environ), stdout=log_file,
+                                            stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The server exited with code {self.process.returncode}; see {self.log_path}.")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=2) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"The server did not become healthy within {timeout}s; see {self.log_path}.")
+
+    def rss_bytes(self):
+        """The server's resident set size, or None where /proc is not available."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class SessionClient:
+    """
+    A stand-in for the browser: one websocket session on the server. Widgets are looked up by
+    their key (or, for widgets without one, by label) among the elements of the latest rerun.
+    """
+
+    def __init__(self, url, timeout=RERUN_TIMEOUT_SECONDS):
+        from websockets.sync.client import connect
+
+        self.timeout = timeout
+        self._stack = contextlib.ExitStack()
+        self.ws = self._stack.enter_context(connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=timeout))
+        self.widgets = {}
+        self.page_errors = []
+
+    def close(self):
+        self._stack.close()
+
+    def widget_id(self, key):
+        try:
+            return self.widgets[key]
+        except KeyError:
+            raise KeyError(f"widget '{key}' is not on the page") from None
+
+    def rerun(self, widget_states=()):
+        """Sends a rerun with the given WidgetState messages; returns once the script run has finished."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend(widget_states)
+        self.page_errors = []
+        self.widgets = {}
+        self.ws.send(message.SerializeToString())
+        self._wait_for_finish()
+
+    def click(self, key, **values):
+        """Clicks the button `key`, sending text values for the other widgets named in `values`."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        states = [WidgetState(id=self.widget_id(k), string_value=v) for k, v in values.items()]
+        states.append(WidgetState(id=self.widget_id(key), trigger_value=True))
+        self.rerun(states)
+
+    def set_component_value(self, key, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.rerun([WidgetState(id=self.widget_id(key), json_value=json.dumps(value))])
+
+    def _wait_for_finish(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        deadline = time.time() + self.timeout
+        while True:
+            message = ForwardMsg()
+            message.ParseFromString(self.ws.recv(timeout=max(0.1, deadline - time.time())))
+            kind = message.WhichOneof("type")
+            if kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                self._note_element(message.delta.new_element)
+            elif kind == "script_finished":
+                if message.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return
+                if message.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("the app failed to compile")
+                if message.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    self.widgets = {} # st.rerun(): the page is rendered again (possibly another page)
+
+    def _note_element(self, element):
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.page_errors.append(f"{element.exception.type}: {element.exception.message}")
+            return
+        if kind == "alert" and element.alert.body.startswith(PAGE_ERROR_TEXT):
+            self.page_errors.append(element.alert.body)
+            return
+        widget = getattr(element, kind)
+        widget_id = getattr(widget, "id", "")
+        if not widget_id:
+            return
+        match = _WIDGET_ID.match(widget_id)
+        if match and match.group(1) != "None":
+            self.widgets[match.group(1)] = widget_id
+        if getattr(widget, "label", ""):
+            self.widgets[f"label:{widget.label}"] = widget_id
+
+
+class VirtualUser:
+    """One scripted user of the server."""
+
+    def __init__(self, index, url, log, location=DEFAULT_LOCATION, timeout=RERUN_TIMEOUT_SECONDS):
+        self.index = index
+        self.email = f"loadtest{index}@example.com"
+        self.url = url
+        self.log = log
+        self.location = location
+        self.timeout = timeout
+        self.client = None
+        self.last_step = None
+
+    def _step(self, step, action, *args, **kwargs):
+        """Runs one rerun and records its latency (and any error the page showed)."""
+        self.last_step = step
+        started = time.perf_counter()
+        action(*args, **kwargs)
+        self.log.record(step, time.perf_counter() - started)
+        for message in self.client.page_errors:
+            self.log.error(step, message)
+
+    def connect(self, create_account=False):
+        """Opens a session and logs in (signing up and adding two contacts first when asked)."""
+        if self.client is not None:
+            self.client.close()
+        self.last_step = "connect"
+        self.client = SessionClient(self.url, self.timeout)
+        self.client.rerun()
+        if create_account:
+            self.last_step = "signup"
+            self.client.click("goto_signup_button")
+            self.client.click("signup_button", signup_name_input=f"Load Test {self.index}",
+                              signup_email_input=self.email, signup_password_input=USER_PASSWORD,
+                              signup_confirm_password_input=USER_PASSWORD)
+        self._step("login", self.client.click, "login_button", login_email=self.email, login_password=USER_PASSWORD)
+        if "button_sos_alert" not in self.client.widgets:
+            raise RuntimeError(f"{self.email} did not reach the dashboard")
+        if create_account:
+            self.last_step = "add_contacts"
+            self.client.click("button_add_contacts_page")
+            for j in range(2):
+                self.client.click("label:Add Contact", new_contact_name=f"Contact {j}",
+                                  new_contact_phone=f"+91900000{self.index:04d}{j}",
+                                  new_contact_email=f"contact{j}.user{self.index}@example.com")
+            self.client.click("back_to_dashboard_contacts")
+
+    def run_flow(self):
+        """Runs the whole flow once on the current session."""
+        client = self.client
+        self._step("dashboard", client.rerun)
+        # SOS: the button rerun, then the rerun triggered by the browser reporting the location
+        self._step("sos_button", client.click, "button_sos_alert")
+        self._step("sos_location", client.set_component_value, DASHBOARD_LOCATION_KEY,
+                   {"latitude": self.location[0], "longitude": self.location[1], "accuracy": 20, "source": "Load test"})
+        self._step("area_check", client.click, "button_check_area_safety_page")
+        self._step("dashboard_return", client.click, BACK_TO_DASHBOARD)
+        self._step("crime_analysis", client.click, "button_crime_analysis_page")
+        self._step("dashboard_return", client.click, BACK_TO_DASHBOARD)
+
+    def run(self, iterations):
+        """Runs `iterations` flows; a failed flow is logged and the next one starts a new session. Returns the flows completed."""
+        flows = 0
+        for _ in range(iterations):
+            try:
+                if self.client is None:
+                    self.connect()
+                self.run_flow()
+                flows += 1
+            except Exception as e:
+                self.log.error("flow", f"{self.email} after {self.last_step}: {type(e).__name__}: {e}")
+                self.close()
+        return flows
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            self.client = None
+
+
+def start_users(indices, url, log, created, timeout):
+    """Connects and logs in one VirtualUser per index, in parallel (untimed). Accounts are created once per server."""
+    users = [VirtualUser(i, url, log, timeout=timeout) for i in indices]
+
+    def setup(user):
+        try:
+            user.connect(create_account=user.index not in created)
+            created.add(user.index)
+        except Exception as e:
+            log.error("setup", f"{user.email} after {user.last_step}: {type(e).__name__}: {e}")
+            user.close()
+
+    threads = [threading.Thread(target=setup, args=(user,), name=f"setup-{user.index}") for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return users
+
+
+def wait_for_sos_jobs(since, log, timeout=SOS_TIMEOUT_SECONDS):
+    """Waits for the SOS jobs queued since `since` and records their queued -> finished time; returns their number."""
+    from sos_dispatch import SOSJobQueue, FINAL_STATUSES, STATUS_DONE
+
+    queue = SOSJobQueue(os.environ["SEFI_SOS_QUEUE_DB"])
+    job_ids = queue.ids_created_since(since)
+    deadline = time.time() + timeout
+    pending = set(job_ids)
+    while pending and time.time() < deadline:
+        for job_id in list(pending):
+            job = queue.get(job_id)
+            if job and job["status"] in FINAL_STATUSES:
+                pending.discard(job_id)
+                if job["status"] == STATUS_DONE:
+                    log.record("sos_end_to_end", job["updated_at"] - job["created_at"])
+                else:
+                    log.error("sos_end_to_end", job.get("error") or "failed")
+        time.sleep(0.1)
+    for job_id in pending:
+        log.error("sos_end_to_end", f"job {job_id} not finished after {timeout}s")
+    return len(job_ids)
+
+
+def run_level(server, level, iterations, created, timeout):
+    """
+    Runs `iterations` flows for `level` users at once on the server.
+    Returns (StepLog, wall seconds, completed flows, SOS jobs queued, server RSS bytes at the end).
+    """
+    log = StepLog()
+    users = start_users(range(level), server.url, log, created, timeout)
+    completed = []
+
+    def worker(user):
+        try:
+            completed.append(user.run(iterations))
+        except Exception as e: # run() logs flow failures itself; this is anything else
+            log.error("worker", f"{user.email}: {type(e).__name__}: {e}")
+
+    started_at = time.time()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(user,), name=f"virtual-user-{user.index}") for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    rss = server.rss_bytes()
+    for user in users:
+        user.close()
+    sos_jobs = wait_for_sos_jobs(started_at, log)
+    return log, elapsed, sum(completed), sos_jobs, rss
+
+
+def measure_session_memory(server, sessions, created, timeout):
+    """Growth of the server's RSS per connected, logged-in session that has run one flow, in bytes."""
+    log = StepLog()
+    before = server.rss_bytes()
+    users = start_users(range(sessions), server.url, log, created, timeout)
+    connected = 0
+    for user in users:
+        if user.client is not None and user.run(1):
+            connected += 1
+    after = server.rss_bytes()
+    for step, messages in log.errors.items():
+        print(f"Memory run: {len(messages)} error(s) in {step}, first: {messages[0]}")
+    for user in users:
+        user.close()
+    if before is None or after is None or not connected:
+        return None, connected
+    return (after - before) / connected, connected
+
+
+def print_summary(level, log, elapsed, flows, sos_jobs, rss):
+    throughput = flows / elapsed if elapsed else 0.0
+    memory = f", server RSS {rss / 2**20:.0f} MiB" if rss else ""
+    print(f"\n=== {level} concurrent users: {flows} flows in {elapsed:.1f}s ({throughput:.2f} flows/s), "
+          f"{sos_jobs} SOS job(s){memory} ===")
+    print(f"{'step':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for step, row in log.summary().items():
+        print(f"{step:<18}{row['count']:>7}{row['p50']:>10.0f}{row['p95']:>10.0f}{row['p99']:>10.0f}{row['max']:>10.0f}{row['errors']:>8}")
+    for step, messages in log.errors.items():
+        print(f"  {step}: {len(messages)} error(s), first: {messages[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent users on one `streamlit run app.py` server.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrency levels to ramp through.")
+    parser.add_argument("--iterations", type=int, default=3, help="Flows per user at each level.")
+    parser.add_argument("--p95-target-ms", type=float, default=2000, help="Rerun p95 above this counts as saturated.")
+    parser.add_argument("--memory-sessions", type=int, default=10, help="Sessions for the memory measurement (0 to skip).")
+    parser.add_argument("--timeout", type=float, default=RERUN_TIMEOUT_SECONDS, help="Per-rerun timeout in seconds.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port for the server under test.")
+    args = parser.parse_args()
+
+    import backends
+    if not backends.use_local_backends():
+        print("Warning: SEFI_BACKEND is not 'local'; the load test will hit the real services.")
+
+    server = AppServer(args.port)
+    server.start()
+    print(f"Server pid {server.process.pid} on port {args.port} (log: {server.log_path}).")
+    created = set() # Users with an account in this server's local store
+    try:
+        # Warm-up: module imports, dataset loads and caches, so the first level is not penalised
+        warm_up, _, _, _, _ = run_level(server, 1, 1, created, args.timeout)
+        for step, messages in warm_up.errors.items():
+            print(f"Warm-up: {len(messages)} error(s) in {step}, first: {messages[0]}")
+
+        results = []
+        saturation = None
+        for level in sorted(args.users):
+            log, elapsed, flows, sos_jobs, rss = run_level(server, level, args.iterations, created, args.timeout)
+            print_summary(level, log, elapsed, flows, sos_jobs, rss)
+            reruns = [s for step, samples in log.samples.items() if step != "sos_end_to_end" for s in samples]
+            p95_ms = float(np.percentile(reruns, 95) * 1000) if reruns else float("inf")
+            throughput = flows / elapsed if elapsed else 0.0
+            if saturation is None and results:
+                previous_level, previous_throughput, _ = results[-1]
+                if throughput < previous_throughput * SCALING_THRESHOLD or p95_ms > args.p95_target_ms:
+                    saturation = (previous_level, level, throughput, p95_ms)
+            elif saturation is None and p95_ms > args.p95_target_ms:
+                saturation = (None, level, throughput, p95_ms)
+            results.append((level, throughput, p95_ms))
+
+        print("\n=== Ramp ===")
+        print(f"{'users':>6}{'flows/s':>10}{'rerun p95 ms':>14}")
+        for level, throughput, p95_ms in results:
+            print(f"{level:>6}{throughput:>10.2f}{p95_ms:>14.0f}")
+        if saturation:
+            last_good, level, throughput, p95_ms = saturation
+            print(f"Saturation at {level} users ({throughput:.2f} flows/s, rerun p95 {p95_ms:.0f} ms); "
+                  f"last scaling level: {last_good if last_good is not None else 'none'}.")
+        else:
+            print(f"No saturation up to {max(args.users)} users (throughput still growing, p95 under {args.p95_target_ms:.0f} ms).")
+
+        if args.memory_sessions:
+            per_session, connected = measure_session_memory(server, args.memory_sessions, created, args.timeout)
+            if per_session is None:
+                print("\nMemory: server RSS not available (needs /proc) or no session connected.")
+            else:
+                print(f"\nMemory: server RSS grew ~{per_session / 1024:.0f} KiB per connected session "
+                      f"({connected} sessions after one flow each); now {server.rss_bytes() / 2**20:.0f} MiB.")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
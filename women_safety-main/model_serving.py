@@ -0,0 +1,281 @@
+# model_serving.py
+# Serving layer for the location risk model (risk_scoring.py).
+# One ModelServer per process holds the model, danger zones and crime table in memory and is
+# shared by every session. Predictions submitted from many sessions at about the same time
+# (e.g. live tracking updates from many users) are collected for a short window and scored
+# in a single batched predict_proba call; each caller waits on its own Future.
+# The server keeps a latency histogram (submit -> result) and a batch size histogram, and
+# swaps in a new model without a restart, either explicitly (swap_model) or when the model
+# file changes on disk. Admins see the running server's statistics in the app's sidebar (?memory=1).
+#
+# Benchmark a fresh server in this process (concurrent threads scoring random points) and print
+# its statistics:
+#     python model_serving.py benchmark [--threads 32] [--requests 50]
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+
+from risk_scoring import RISK_MODEL_PATH, get_risk_scorer, load_risk_model
+
+# --- Configuration ---
+# Longest time a request waits for others to join its batch
+BATCH_WINDOW_MS = float(os.environ.get("SEFI_SERVING_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("SEFI_SERVING_MAX_BATCH", "512"))
+# How often the model file is checked for a new version
+RELOAD_CHECK_SECONDS = float(os.environ.get("SEFI_SERVING_RELOAD_SECONDS", "10"))
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+# How long predict() waits for its batch before giving up
+PREDICT_TIMEOUT_SECONDS = 5.0
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are reported as the upper bound of the bucket they fall in."""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value, n=1):
+        bucket = int(np.searchsorted(self.bounds, value))
+        with self._lock:
+            self.counts[bucket] += n
+            self.total += value * n
+            self.count += n
+            self.max = max(self.max, value)
+
+    def percentile(self, q):
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q / 100.0 * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank and n:
+                    return self.bounds[i] if i < len(self.bounds) else self.max
+            return self.max
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+            counts = dict(zip(labels, self.counts))
+            count, total, largest = self.count, self.total, self.max
+        return {
+            "buckets": counts,
+            "count": count,
+            "mean": round(total / count, 3) if count else None,
+            "max": round(largest, 3),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class _Request:
+    __slots__ = ("lat", "lon", "hour", "total_crimes", "future", "submitted")
+
+    def __init__(self, lat, lon, hour, total_crimes):
+        self.lat = lat
+        self.lon = lon
+        self.hour = hour
+        self.total_crimes = total_crimes
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class ModelServer:
+    """Shared, warm risk model with micro-batching and hot model swaps."""
+
+    def __init__(self, scorer=None, model_path=RISK_MODEL_PATH, batch_window_ms=BATCH_WINDOW_MS,
+                 max_batch_size=MAX_BATCH_SIZE, reload_check_seconds=RELOAD_CHECK_SECONDS):
+        self.scorer = scorer or get_risk_scorer()
+        self.model = self.scorer.model
+        self.model_path = model_path
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.reload_check_seconds = reload_check_seconds
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.batches = 0
+        self.errors = 0
+        self.swaps = 0
+        self._model_mtime = self._file_mtime()
+        self._last_reload_check = time.monotonic()
+        self._queue = queue.Queue()
+        self._swap_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    # --- Requests ---
+    def submit(self, lat, lon, hour, total_crimes=0):
+        """Queues one prediction; returns a Future resolving to the score_location-style result dict."""
+        self._ensure_thread()
+        request = _Request(float(lat), float(lon), float(hour), float(total_crimes or 0))
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, lat, lon, when=None, total_crimes=None, district=None, timeout=PREDICT_TIMEOUT_SECONDS):
+        """Blocking single prediction, batched with whatever other sessions submit at the same time."""
+        when = when or datetime.now()
+        if total_crimes is None:
+            total_crimes = self.scorer.district_total(district) or 0
+        return self.submit(lat, lon, when.hour + when.minute / 60.0, total_crimes).result(timeout=timeout)
+
+    def predict_many(self, lats, lons, hours, crime_totals):
+        """Scores arrays of points directly (the caller already has a batch); returns (N,) scores."""
+        self._maybe_reload()
+        started = time.perf_counter()
+        scores = self.model.predict_proba(self.scorer.build_features(lats, lons, hours, crime_totals))
+        self.batch_sizes.observe(len(scores))
+        self.latency_ms.observe(1000 * (time.perf_counter() - started), len(scores))
+        self.batches += 1
+        return scores
+
+    # --- Model versions ---
+    def swap_model(self, model_or_path):
+        """Replaces the model for all later batches. Accepts a loaded model or a path for load_risk_model."""
+        model = load_risk_model(model_or_path) if isinstance(model_or_path, str) else model_or_path
+        with self._swap_lock:
+            previous = self.model
+            # The scorer is shared with direct score_location callers, so they switch too
+            self.model = self.scorer.model = model
+            self.swaps += 1
+        print(f"Serving: Swapped risk model {previous.version} -> {model.version}.")
+        return model
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        """Reloads the model if its file changed; checked at most every reload_check_seconds."""
+        now = time.monotonic()
+        if now - self._last_reload_check < self.reload_check_seconds:
+            return
+        self._last_reload_check = now
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._model_mtime:
+            self._model_mtime = mtime
+            self.swap_model(self.model_path)
+
+    # --- Batching loop ---
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sefi-model-server", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.reload_check_seconds)
+            except queue.Empty:
+                self._maybe_reload()
+                continue
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._maybe_reload()
+            self._score(batch)
+
+    def _score(self, batch):
+        model = self.model # Same model for the whole batch even if a swap happens meanwhile
+        try:
+            features = self.scorer.build_features([r.lat for r in batch], [r.lon for r in batch],
+                                                  [r.hour for r in batch], [r.total_crimes for r in batch])
+            scores = model.predict_proba(features)
+        except Exception as e:
+            self.errors += 1
+            print(f"Serving: Batch of {len(batch)} failed: {e}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.batches += 1
+        self.batch_sizes.observe(len(batch))
+        finished = time.perf_counter()
+        for i, request in enumerate(batch):
+            request.future.set_result(self.scorer.describe(float(scores[i]), features[i:i + 1], model))
+            self.latency_ms.observe(1000 * (finished - request.submitted))
+
+    def stats(self):
+        return {
+            "model_version": self.model.version,
+            "batches": self.batches,
+            "errors": self.errors,
+            "swaps": self.swaps,
+            "queued": self._queue.qsize(),
+            "latency_ms": self.latency_ms.snapshot(),
+            "batch_size": self.batch_sizes.snapshot(),
+        }
+
+
+_server = None
+_server_lock = threading.Lock()
+
+def get_model_server():
+    """Process-wide model server; the model is loaded on first use and shared by all sessions."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ModelServer()
+            print(f"Serving: Model server ready with risk model {_server.model.version} "
+                  f"(batch window {_server.batch_window * 1000:.0f} ms, max batch {_server.max_batch_size}).")
+        return _server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Risk model serving.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    benchmark = sub.add_parser("benchmark", help="Score random points from concurrent threads on a new server in this "
+                                                 "process and print its statistics (not those of a running app).")
+    benchmark.add_argument("--threads", type=int, default=32)
+    benchmark.add_argument("--requests", type=int, default=50, help="Requests per thread.")
+    args = parser.parse_args()
+
+    server = get_model_server()
+
+    def client(seed):
+        rng = np.random.default_rng(seed)
+        for lat, lon in zip(rng.uniform(8, 35, args.requests), rng.uniform(70, 95, args.requests)):
+            server.predict(lat, lon, total_crimes=int(rng.integers(0, 100)))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{args.threads * args.requests} predictions in {elapsed:.2f}s "
+          f"({args.threads * args.requests / elapsed:,.0f}/s).")
+    for key, value in server.stats().items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# page_profiler.py
+# Opt-in profiling of page renders, to find out what makes a page slow on the real server.
+# Enabled for every render with SEFI_PROFILE=<mode>, or for one render by an admin (an email listed in
+# SEFI_ADMIN_EMAILS) adding ?profile=<mode> to the URL. "1" means sample; any other value
+# ("0", "off", "false", ...) leaves profiling off. Modes:
+#   - sample:   a background thread samples the page's call stack every few milliseconds
+#               (low overhead, safe on a loaded server)
+#   - cprofile: sampling plus cProfile (exact call counts and per-function times, slower)
+#   - full:     cprofile plus tracemalloc allocation tracking (slowest; allocations made by other
+#               sessions rendering at the same time are counted too)
+# Each profiled render writes into profiles/<page_key>/:
+#   <stamp>.folded  sampled stacks in the folded format read by flamegraph.pl and speedscope
+#   <stamp>.prof    cProfile stats (python -m pstats, snakeviz), cprofile/full only
+#   <stamp>.json    wall/CPU time, allocations and the top functions
+#   summary.jsonl   one line per profiled render, for comparing renders over time
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# --- Configuration ---
+PROFILE_MODE = os.environ.get("SEFI_PROFILE", "").strip().lower()
+PROFILES_DIR = os.environ.get("SEFI_PROFILES_DIR", "profiles")
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("SEFI_ADMIN_EMAILS", "").split(",") if e.strip()}
+SAMPLE_INTERVAL_SECONDS = float(os.environ.get("SEFI_PROFILE_INTERVAL_MS", "5")) / 1000.0
+TOP_FUNCTIONS = 25
+MODES = ("sample", "cprofile", "full")
+ENABLE_VALUES = {"1": "sample"}
+
+# cProfile and tracemalloc are process-wide, so only one render at a time uses them; others
+# fall back to sampling only
+_exclusive_lock = threading.Lock()
+
+
+def is_admin(user):
+    """True for a logged-in user whose email is listed in SEFI_ADMIN_EMAILS."""
+    return isinstance(user, dict) and str(user.get("email", "")).lower() in ADMIN_EMAILS
+
+
+def _mode(value):
+    """A mode name for an SEFI_PROFILE/?profile= value, or None for anything that is not a mode or "1"."""
+    value = str(value or "").strip().lower()
+    return value if value in MODES else ENABLE_VALUES.get(value)
+
+
+def requested_mode(query_value=None, user=None):
+    """The profiling mode for this render, or None. SEFI_PROFILE wins; the query parameter needs an admin user."""
+    if _mode(PROFILE_MODE):
+        return _mode(PROFILE_MODE)
+    if query_value and is_admin(user):
+        return _mode(query_value)
+    return None
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples one thread's Python stack at a fixed interval and counts identical stacks.
+    Frames from `root_code` outwards (the profiler and Streamlit's script runner) are left out,
+    so the stacks start at the page function.
+    """
+
+    def __init__(self, target_thread_id, root_code=None, interval=SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name="sefi-page-sampler", daemon=True)
+        self.target = target_thread_id
+        self.root_code = root_code
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _top_functions(profiler):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                     "own_ms": round(own * 1000, 2), "cumulative_ms": round(cumulative * 1000, 2)})
+    rows.sort(key=lambda r: -r["cumulative_ms"])
+    return rows[:TOP_FUNCTIONS]
+
+
+def _sampled_top_functions(sampler):
+    """Share of samples in which each function was on the stack (inclusive), when cProfile did not run."""
+    inclusive = Counter()
+    for stack, count in sampler.stacks.items():
+        for function in set(stack.split(";")):
+            inclusive[function] += count
+    total = max(sampler.samples, 1)
+    return [{"function": f, "samples": n, "share": round(n / total, 3)} for f, n in inclusive.most_common(TOP_FUNCTIONS)]
+
+
+def profile_page(page_key, page_func, mode="sample"):
+    """
+    Runs page_func() under the profiler and writes the results to PROFILES_DIR/<page_key>/.
+    Exceptions from the page (including Streamlit's rerun/stop signals) propagate unchanged.
+    Returns the report dict (it is also available when the page raised, via the written files).
+    """
+    exclusive = mode in ("cprofile", "full") and _exclusive_lock.acquire(blocking=False)
+    profiler = cProfile.Profile() if exclusive else None
+    trace_allocations = exclusive and mode == "full" and not tracemalloc.is_tracing()
+    sampler = StackSampler(threading.get_ident(), root_code=profile_page.__code__)
+    report = {"page": page_key, "mode": mode if exclusive or mode == "sample" else "sample", "started_at": time.time()}
+    outcome = "ok"
+
+    if trace_allocations:
+        tracemalloc.start()
+    sampler.start()
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    if profiler:
+        profiler.enable()
+    try:
+        page_func()
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        report["wall_ms"] = round((time.perf_counter() - wall_started) * 1000, 2)
+        report["cpu_ms"] = round((time.thread_time() - cpu_started) * 1000, 2)
+        sampler.stop()
+        report["outcome"] = outcome
+        report["samples"] = sampler.samples
+        if trace_allocations:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report["allocated_kib"] = round(current / 1024, 1)
+            report["peak_kib"] = round(peak / 1024, 1)
+            report["top_allocations"] = [{"site": str(stat.traceback[0]), "kib": round(stat.size / 1024, 1), "count": stat.count}
+                                         for stat in snapshot.statistics("lineno")[:TOP_FUNCTIONS]]
+        report["top_functions"] = _top_functions(profiler) if profiler else _sampled_top_functions(sampler)
+        try:
+            _write(page_key, report, sampler, profiler)
+        except OSError as e:
+            print(f"Profiler: Could not write profile for {page_key}: {e}")
+        if exclusive:
+            _exclusive_lock.release()
+    return report
+
+
+def _write(page_key, report, sampler, profiler):
+    directory = os.path.join(PROFILES_DIR, "".join(c if c.isalnum() or c in "-_" else "_" for c in page_key))
+    os.makedirs(directory, exist_ok=True)
+    started = report["started_at"]
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}-{int(started * 1000) % 1000:03d}-{threading.get_ident() % 100000:05d}"
+    base = os.path.join(directory, stamp)
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.write(sampler.folded())
+    if profiler:
+        profiler.dump_stats(base + ".prof")
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    summary = {k: report.get(k) for k in ("page", "mode", "started_at", "wall_ms", "cpu_ms", "peak_kib", "samples", "outcome")}
+    with open(os.path.join(directory, "summary.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(summary) + "\n")
+    print(f"Profiler: {page_key} rendered in {report['wall_ms']} ms ({report['mode']}); wrote {base}.*")
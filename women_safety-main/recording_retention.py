@@ -0,0 +1,235 @@
+# recording_retention.py
+# Retention and quota management for saved recordings.
+# A daemon thread periodically evicts recordings that are too old, trims each user back
+# under their quota (oldest first) and keeps the whole directory under a global budget.
+# It can also transcode old recordings to a smaller codec. Pages only ever schedule work
+# here, so eviction and transcoding never run on the request path.
+# A segment whose upload job (video_upload) is still pending or uploading is never evicted or
+# transcoded: it may be the only copy of SOS evidence, and the upload reads the file as it was
+# queued. Failed jobs (out of attempts, or cancelled) are final and protect nothing, and no job
+# protects its file for longer than the maximum age, so a storage outage (or an upload stuck in
+# 'uploading') cannot keep files past the age, quota and budget limits; dropping such a file is logged.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import threading
+import time
+
+from recordings_catalog import ALL_OWNERS, get_catalog
+
+# --- Configuration ---
+USER_QUOTA_BYTES = int(float(os.environ.get("SEFI_RECORDING_QUOTA_MB", "2048")) * 1024 * 1024)
+TOTAL_BUDGET_BYTES = int(float(os.environ.get("SEFI_RECORDINGS_MAX_TOTAL_MB", "20480")) * 1024 * 1024)
+MAX_AGE_SECONDS = float(os.environ.get("SEFI_RECORDING_MAX_AGE_DAYS", "90")) * 86400
+# 0 disables background transcoding
+TRANSCODE_AFTER_SECONDS = float(os.environ.get("SEFI_RECORDING_TRANSCODE_AFTER_DAYS", "0")) * 86400
+TRANSCODE_CODEC = os.environ.get("SEFI_RECORDING_TRANSCODE_CODEC", "libx265")
+TRANSCODE_CRF = os.environ.get("SEFI_RECORDING_TRANSCODE_CRF", "32")
+RUN_INTERVAL_SECONDS = float(os.environ.get("SEFI_RETENTION_INTERVAL_SECONDS", "600"))
+# Recordings younger than this are never evicted by quota, so an SOS in progress keeps its evidence
+MIN_KEEP_SECONDS = 3600
+EVICTION_BATCH = 200
+TRANSCODE_BATCH = 5
+
+
+def transcode_file(path, codec=TRANSCODE_CODEC, crf=TRANSCODE_CRF):
+    """
+    Re-encodes a recording in place with a smaller codec. The new file replaces the old one
+    only if it is actually smaller. Returns True if the file was replaced.
+    """
+    import av
+
+    tmp_path = path + ".transcode.mp4"
+    try:
+        with av.open(path) as source:
+            in_stream = source.streams.video[0]
+            with av.open(tmp_path, mode="w", format="mp4") as target:
+                out_stream = target.add_stream(codec, rate=in_stream.average_rate or 15)
+                out_stream.width = in_stream.codec_context.width
+                out_stream.height = in_stream.codec_context.height
+                out_stream.pix_fmt = "yuv420p"
+                out_stream.options = {"crf": str(crf), "preset": "medium"}
+                for frame in source.decode(in_stream):
+                    frame.pts = None # Let the encoder assign monotonically increasing timestamps
+                    for packet in out_stream.encode(frame):
+                        target.mux(packet)
+                for packet in out_stream.encode():
+                    target.mux(packet)
+        if os.path.getsize(tmp_path) < os.path.getsize(path):
+            os.replace(tmp_path, path)
+            return True
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class RetentionManager(threading.Thread):
+    """Background retention for one recordings directory, driven by its catalog."""
+
+    def __init__(self, recordings_dir, user_quota=USER_QUOTA_BYTES, total_budget=TOTAL_BUDGET_BYTES,
+                 max_age=MAX_AGE_SECONDS, transcode_after=TRANSCODE_AFTER_SECONDS, interval=RUN_INTERVAL_SECONDS):
+        super().__init__(name="recording-retention", daemon=True)
+        self.catalog = get_catalog(recordings_dir)
+        self.user_quota = user_quota
+        self.total_budget = total_budget
+        self.max_age = max_age
+        self.transcode_after = transcode_after
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pending_purges = [] # Owners whose recordings were cleared from the UI
+        self._upload_queue = None
+        self.last_run = None
+
+    def request_run(self):
+        """Asks the thread to run a pass now instead of waiting for the next interval."""
+        self._wakeup.set()
+
+    def schedule_purge(self, owner):
+        """Queues deletion of all of an owner's recordings."""
+        if owner is None:
+            raise ValueError("Clearing recordings needs a logged-in owner.")
+        with self._lock:
+            self._pending_purges.append(owner)
+        self.request_run()
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Retention: Pass failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def run_once(self):
+        started = time.time()
+        removed = self._purge_requested()
+        removed += self._evict_expired()
+        removed += self._enforce_user_quotas()
+        removed += self._enforce_total_budget()
+        compacted = self._compact_old() if self.transcode_after else 0
+        self.last_run = {"at": started, "removed": removed, "compacted": compacted, "seconds": round(time.time() - started, 2)}
+        if removed or compacted:
+            print(f"Retention: Removed {removed} and compacted {compacted} recording(s) in {self.last_run['seconds']}s.")
+        return self.last_run
+
+    def _purge_requested(self):
+        with self._lock:
+            owners, self._pending_purges = self._pending_purges, []
+        removed = 0
+        for owner in owners:
+            removed += self.catalog.remove(self.catalog.ids(owner=owner))
+        return removed
+
+    def _upload_pending(self, row):
+        """True while the file's upload job is still pending or uploading."""
+        if row.get("upload_job_id") is None:
+            return False
+        from video_upload import UploadQueue, STATUS_PENDING, STATUS_UPLOADING, STATUS_FAILED
+        if self._upload_queue is None:
+            self._upload_queue = UploadQueue()
+        job = self._upload_queue.get(row["upload_job_id"])
+        if job is None:
+            return False
+        if job["status"] == STATUS_FAILED:
+            print(f"Retention: Upload of {row['path']} failed ({job['error']}); the local copy is no longer kept for it.")
+            return False
+        if job["status"] not in (STATUS_PENDING, STATUS_UPLOADING):
+            return False
+        if self.max_age and time.time() - job["created_at"] > self.max_age:
+            print(f"Retention: Upload of {row['path']} still {job['status']} after {self.max_age / 86400:.0f} days; the local copy is no longer kept for it.")
+            return False
+        return True
+
+    def _evict_expired(self):
+        if not self.max_age:
+            return 0
+        cutoff = time.time() - self.max_age
+        removed = kept = 0
+        while True:
+            # Kept rows stay at the front of the list, so they are skipped with the offset
+            batch = self.catalog.oldest(limit=EVICTION_BATCH, created_before=cutoff, offset=kept)
+            if not batch:
+                break
+            victims = [row["id"] for row in batch if not self._upload_pending(row)]
+            kept += len(batch) - len(victims)
+            removed += self.catalog.remove(victims)
+        if kept:
+            print(f"Retention: Keeping {kept} expired recording file(s) until their upload finishes.")
+        return removed
+
+    def _evict_until(self, used, limit, owner=None):
+        """Removes oldest evictable recordings (optionally of one owner) until `used` <= `limit`."""
+        removed = kept = 0
+        protected_after = time.time() - MIN_KEEP_SECONDS
+        while used > limit:
+            batch = self.catalog.oldest(owner=owner, limit=EVICTION_BATCH, created_before=protected_after, offset=kept)
+            if not batch:
+                break
+            victims = []
+            for row in batch:
+                if used <= limit:
+                    break
+                if self._upload_pending(row):
+                    kept += 1
+                    continue
+                victims.append(row["id"])
+                used -= row["size"]
+            removed += self.catalog.remove(victims)
+        if kept:
+            print(f"Retention: {kept} recording file(s) of {owner or 'all owners'} are over the limit but still uploading; kept for now.")
+        return removed
+
+    def _enforce_user_quotas(self):
+        if not self.user_quota:
+            return 0
+        removed = 0
+        for owner in self.catalog.owners():
+            if owner is None:
+                continue
+            used = self.catalog.total_size(owner=owner)
+            if used > self.user_quota:
+                removed += self._evict_until(used, self.user_quota, owner=owner)
+        return removed
+
+    def _enforce_total_budget(self):
+        if not self.total_budget:
+            return 0
+        used = self.catalog.total_size(owner=ALL_OWNERS)
+        return self._evict_until(used, self.total_budget) if used > self.total_budget else 0
+
+    def _compact_old(self):
+        compacted = 0
+        # Files still queued for upload are left alone (the job's size was fixed when it was queued)
+        candidates = self.catalog.compaction_candidates(time.time() - self.transcode_after, limit=TRANSCODE_BATCH * 4)
+        for row in [row for row in candidates if not self._upload_pending(row)][:TRANSCODE_BATCH]:
+            path = self.catalog.absolute_path(row["path"])
+            try:
+                if transcode_file(path):
+                    compacted += 1
+            except ImportError:
+                print("Retention: PyAV not installed, disabling transcoding.")
+                self.transcode_after = 0
+                break
+            except Exception as e:
+                print(f"Retention: Could not transcode {row['path']}: {e}")
+            # Flag it even if it did not shrink, so it is not retried on every pass
+            if os.path.exists(path):
+                self.catalog.mark_compacted(row["id"])
+        return compacted
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_retention_manager(recordings_dir):
+    """Returns the process-wide retention manager for a directory, starting it on first use."""
+    with _managers_lock:
+        manager = _managers.get(recordings_dir)
+        if manager is None or not manager.is_alive():
+            manager = RetentionManager(recordings_dir)
+            manager.start()
+            _managers[recordings_dir] = manager
+        return manager
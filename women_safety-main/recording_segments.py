@@ -0,0 +1,200 @@
+# recording_segments.py
+# Bookkeeping for segmented SOS recordings.
+# The recorder writes N-second MP4 segments through FFmpeg's segment muxer, which appends
+# each finished segment to a CSV list. SegmentWatcher follows that list, records every
+# finished segment in a JSON manifest and hands it to the background uploader, so evidence
+# leaves the device at most one segment length after it was captured. A snapshot of the
+# manifest is queued with every segment, so the remote copy can be reassembled after a crash.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import json
+import os
+import threading
+import time
+
+MANIFEST_FILENAME = "manifest.json"
+SEGMENT_LIST_FILENAME = "segments.csv"
+SEGMENT_PATTERN = "segment_%05d.mp4"
+MANIFEST_SNAPSHOT_PATTERN = "manifest.upload-%05d.json"
+
+
+class SegmentManifest:
+    """
+    JSON manifest tying the segments of one recording together.
+    It is rewritten atomically after every change, so a crash never leaves a torn file.
+    """
+
+    def __init__(self, recording_dir, recording_id, owner=None, segment_seconds=None):
+        self.path = os.path.join(recording_dir, MANIFEST_FILENAME)
+        self._snapshots = 0
+        self._lock = threading.Lock()
+        self.data = {
+            "recording_id": recording_id,
+            "owner": owner,
+            "segment_seconds": segment_seconds,
+            "started_at": time.time(),
+            "finished_at": None,
+            "complete": False,
+            "segments": [],
+        }
+        self._write()
+
+    def _write(self, path=None):
+        path = path or self.path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def snapshot(self):
+        """
+        Writes the current manifest to a new file that is never changed afterwards and returns its path.
+        Uploads read the file after they are queued, so they are given a snapshot, not the live file.
+        """
+        with self._lock:
+            self._snapshots += 1
+            path = os.path.join(os.path.dirname(self.path), MANIFEST_SNAPSHOT_PATTERN % self._snapshots)
+            self._write(path)
+            return path
+
+    def add_segment(self, filename, start_time, end_time, size, upload_job_id=None):
+        with self._lock:
+            segment = {
+                "index": len(self.data["segments"]),
+                "filename": filename,
+                "start": start_time,
+                "end": end_time,
+                "size": size,
+                "upload_job_id": upload_job_id,
+                "completed_at": time.time(),
+            }
+            self.data["segments"].append(segment)
+            self._write()
+            return segment
+
+    def mark_complete(self):
+        with self._lock:
+            self.data["complete"] = True
+            self.data["finished_at"] = time.time()
+            self._write()
+
+
+def load_manifest(recording_dir):
+    """Returns the manifest dictionary for a recording directory, or None if it has none."""
+    path = os.path.join(recording_dir, MANIFEST_FILENAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SegmentWatcher(threading.Thread):
+    """
+    Follows the segment list written by FFmpeg and processes each newly finished segment.
+    `on_segment(path, segment)` is an optional hook called after a segment is recorded.
+    """
+
+    def __init__(self, recording_dir, manifest, upload_prefix, poll_interval=1.0, upload=True, on_segment=None):
+        super().__init__(name=f"segment-watcher-{manifest.data['recording_id']}", daemon=True)
+        self.recording_dir = recording_dir
+        self.list_path = os.path.join(recording_dir, SEGMENT_LIST_FILENAME)
+        self.manifest = manifest
+        self.upload_prefix = upload_prefix
+        self.poll_interval = poll_interval
+        self.upload = upload
+        self.on_segment = on_segment
+        self._seen = 0
+        self._manifest_jobs = [] # (snapshot path, upload job id), oldest first
+        self._stop_event = threading.Event()
+        self._poll_lock = threading.Lock()
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.poll()
+
+    def stop(self):
+        """Stops the thread after one final poll, picking up the segment closed with the container."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=5)
+        self.poll()
+
+    def poll(self):
+        with self._poll_lock:
+            if not os.path.exists(self.list_path):
+                return
+            with open(self.list_path) as f:
+                # Only complete lines; FFmpeg may be halfway through writing the last one
+                lines = [line for line in f.read().split("\n")[:-1] if line.strip()]
+            for line in lines[self._seen:]:
+                self._handle_line(line)
+                self._seen += 1
+
+    def _handle_line(self, line):
+        # CSV list entries are 'filename,start_time,end_time'
+        try:
+            filename, start_time, end_time = line.rsplit(",", 2)
+            start_time, end_time = float(start_time), float(end_time)
+        except ValueError:
+            print(f"Recording: Could not parse segment list entry: {line!r}")
+            return
+
+        segment_path = os.path.join(self.recording_dir, os.path.basename(filename))
+        if not os.path.exists(segment_path):
+            print(f"Recording: Segment listed but missing on disk: {segment_path}")
+            return
+
+        upload_job_id = None
+        if self.upload:
+            try:
+                # Imported here so recording still works when the uploader cannot be configured
+                from video_upload import enqueue_video_upload
+                upload_job_id = enqueue_video_upload(segment_path, f"{self.upload_prefix}/{os.path.basename(segment_path)}")
+            except Exception as e:
+                print(f"Recording: Could not queue segment upload for {segment_path}: {e}")
+
+        segment = self.manifest.add_segment(os.path.basename(segment_path), start_time, end_time,
+                                            os.path.getsize(segment_path), upload_job_id)
+        if self.upload:
+            self.upload_manifest()
+        print(f"Recording: Segment {segment['index']} finished ({end_time - start_time:.1f}s), upload job {upload_job_id}.")
+        if self.on_segment:
+            try:
+                self.on_segment(segment_path, segment)
+            except Exception as e:
+                print(f"Recording: Segment hook error for {segment_path}: {e}")
+
+    def upload_manifest(self):
+        """
+        Queues a snapshot of the manifest for upload next to the segments. An older snapshot that has
+        not started uploading is cancelled (the new one replaces it), and snapshots whose upload has
+        ended are deleted.
+        """
+        try:
+            from video_upload import enqueue_video_upload, cancel_upload, get_upload_status, STATUS_DONE, STATUS_FAILED
+            snapshot_path = self.manifest.snapshot()
+            job_id = enqueue_video_upload(snapshot_path, f"{self.upload_prefix}/{MANIFEST_FILENAME}", content_type="application/json")
+        except Exception as e:
+            print(f"Recording: Could not queue manifest upload: {e}")
+            return
+        remaining = []
+        for old_path, old_job_id in self._manifest_jobs:
+            cancel_upload(old_job_id)
+            job = get_upload_status(old_job_id)
+            if job is None or job["status"] in (STATUS_DONE, STATUS_FAILED):
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            else:
+                remaining.append((old_path, old_job_id)) # Still uploading; removed on a later call
+        self._manifest_jobs = remaining + [(snapshot_path, job_id)]
+
+    def finish(self):
+        """Marks the manifest complete and queues it for upload next to the segments."""
+        self.manifest.mark_complete()
+        if self.upload:
+            self.upload_manifest()
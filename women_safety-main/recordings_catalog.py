@@ -0,0 +1,297 @@
+# recordings_catalog.py
+# SQLite index of saved recordings (size, duration, owner, checksum).
+# Rows are written when a segment finishes recording, so pages can list and paginate
+# recordings with one indexed query instead of listing and stat-ing RECORDINGS_DIR on every rerun.
+# There is one row per segment file; pages list whole recordings (segments grouped by recording_id)
+# and download them as one archive. Queries for owner None return nothing: recordings are only
+# ever shown to their logged-in owner.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+
+from recording_segments import MANIFEST_FILENAME
+
+CATALOG_DB = os.environ.get("SEFI_RECORDINGS_CATALOG_DB", "recordings_catalog.db")
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# Owner filter that matches every recording; only for maintenance (retention), never for pages
+ALL_OWNERS = object()
+# Segments of one recording share its recording_id; files imported from disk without one stand alone
+RECORDING_KEY = "COALESCE(recording_id, path)"
+
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks so large recordings are never held in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_duration(path):
+    """Duration in seconds using PyAV if it is installed, otherwise None."""
+    try:
+        import av
+        with av.open(path) as container:
+            if container.duration:
+                return container.duration / 1_000_000.0 # av.time_base is microseconds
+    except Exception:
+        pass
+    return None
+
+
+class RecordingsCatalog:
+    """Indexed list of recording files under `recordings_dir`. Paths are stored relative to it."""
+
+    def __init__(self, recordings_dir, db_path=CATALOG_DB):
+        self.recordings_dir = recordings_dir
+        self.db_path = db_path
+        self._sync_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS recordings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL UNIQUE,
+                    recording_id TEXT,
+                    owner TEXT,
+                    size INTEGER NOT NULL,
+                    duration REAL,
+                    checksum TEXT,
+                    created_at REAL NOT NULL
+                )""")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(recordings)")}
+            if "compacted" not in columns:
+                # Set once a recording has been transcoded to the smaller archive codec
+                conn.execute("ALTER TABLE recordings ADD COLUMN compacted INTEGER NOT NULL DEFAULT 0")
+            if "upload_job_id" not in columns:
+                # video_upload job of the segment; retention keeps the file until that job is done
+                conn.execute("ALTER TABLE recordings ADD COLUMN upload_job_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS recordings_owner_created ON recordings (owner, created_at DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS recordings_created ON recordings (created_at DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS recordings_owner_recording ON recordings (owner, recording_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def absolute_path(self, relative_path):
+        return os.path.join(self.recordings_dir, relative_path)
+
+    def add_file(self, path, owner=None, recording_id=None, duration=None, created_at=None, upload_job_id=None):
+        """Indexes (or re-indexes) one recording file. Called by the recorder when a segment finishes."""
+        relative_path = os.path.relpath(path, self.recordings_dir)
+        if duration is None:
+            duration = probe_duration(path)
+        row = (relative_path, recording_id, owner, os.path.getsize(path), duration, file_checksum(path),
+               created_at if created_at is not None else os.path.getmtime(path), upload_job_id)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO recordings (path, recording_id, owner, size, duration, checksum, created_at, upload_job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET recording_id = excluded.recording_id, owner = excluded.owner, size = excluded.size, "
+                "duration = excluded.duration, checksum = excluded.checksum, created_at = excluded.created_at, upload_job_id = excluded.upload_job_id",
+                row)
+        return relative_path
+
+    def segment_hook(self, owner=None, recording_id=None):
+        """Returns an `on_segment(path, segment)` callback for SegmentWatcher that indexes each segment."""
+        def on_segment(path, segment):
+            duration = segment.get("end", 0) - segment.get("start", 0)
+            self.add_file(path, owner=owner, recording_id=recording_id, duration=duration if duration > 0 else None,
+                          created_at=segment.get("completed_at"), upload_job_id=segment.get("upload_job_id"))
+        return on_segment
+
+    def _where(self, owner):
+        if owner is ALL_OWNERS:
+            return "", ()
+        if owner is None:
+            return "WHERE 0", () # No logged-in owner, no recordings
+        return "WHERE owner = ?", (owner,)
+
+    def count_recordings(self, owner=None):
+        """Number of recordings (not segment files) of an owner."""
+        where, params = self._where(owner)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(DISTINCT {RECORDING_KEY}) FROM recordings {where}", params).fetchone()[0]
+
+    def list_recordings(self, owner=None, page=0, page_size=10):
+        """
+        Returns one page of an owner's recordings (newest first), each with its segments grouped:
+        recording_key, recording_id, segments, size, duration, started_at, ended_at.
+        """
+        where, params = self._where(owner)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {RECORDING_KEY} AS recording_key, recording_id, COUNT(*) AS segments, SUM(size) AS size, "
+                f"SUM(duration) AS duration, MIN(created_at) AS started_at, MAX(created_at) AS ended_at "
+                f"FROM recordings {where} GROUP BY recording_key ORDER BY ended_at DESC LIMIT ? OFFSET ?",
+                (*params, page_size, page * page_size)).fetchall()
+        return [dict(row) for row in rows]
+
+    def recording_files(self, owner, recording_key):
+        """The segment rows of one of an owner's recordings, in recording order."""
+        where, params = self._where(owner)
+        condition = f"{where} AND" if where else "WHERE"
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM recordings {condition} {RECORDING_KEY} = ? ORDER BY path",
+                                (*params, recording_key)).fetchall()
+        return [dict(row) for row in rows]
+
+    def write_archive(self, owner, recording_key, fileobj):
+        """
+        Writes one recording to `fileobj` as an uncompressed ZIP: its segments in order plus its
+        manifest when there is one. Returns the number of segments written.
+        """
+        written = 0
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_STORED) as archive:
+            recording_dir = None
+            for row in self.recording_files(owner, recording_key):
+                path = self.absolute_path(row["path"])
+                try:
+                    archive.write(path, arcname=os.path.basename(row["path"]))
+                    written += 1
+                except FileNotFoundError:
+                    continue # Removed by retention after the listing
+                if row["recording_id"]:
+                    recording_dir = os.path.dirname(path)
+            manifest_path = os.path.join(recording_dir, MANIFEST_FILENAME) if recording_dir else None
+            if manifest_path and os.path.exists(manifest_path):
+                archive.write(manifest_path, arcname=MANIFEST_FILENAME)
+        return written
+
+    def recording_archive(self, owner, recording_key):
+        """The archive of one recording in a temporary file (deleted once closed), positioned at the start."""
+        fileobj = tempfile.TemporaryFile()
+        self.write_archive(owner, recording_key, fileobj)
+        fileobj.seek(0)
+        return fileobj
+
+    def get(self, recording_row_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM recordings WHERE id = ?", (recording_row_id,)).fetchone()
+        return dict(row) if row else None
+
+    def total_size(self, owner=None):
+        where, params = self._where(owner)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM recordings {where}", params).fetchone()[0]
+
+    def remove(self, recording_row_ids, delete_files=True):
+        """Removes rows (and by default their files). Returns the number of rows removed."""
+        removed = 0
+        with self._connect() as conn:
+            for row_id in recording_row_ids:
+                row = conn.execute("SELECT path FROM recordings WHERE id = ?", (row_id,)).fetchone()
+                if row is None:
+                    continue
+                if delete_files:
+                    try:
+                        os.remove(self.absolute_path(row["path"]))
+                    except FileNotFoundError:
+                        pass
+                    # Drop the recording directory once its last segment is gone
+                    recording_dir = os.path.dirname(self.absolute_path(row["path"]))
+                    if os.path.abspath(recording_dir) != os.path.abspath(self.recordings_dir) and os.path.isdir(recording_dir) and not any(
+                            name.endswith(".mp4") for name in os.listdir(recording_dir)):
+                        shutil.rmtree(recording_dir, ignore_errors=True)
+                conn.execute("DELETE FROM recordings WHERE id = ?", (row_id,))
+                removed += 1
+        return removed
+
+    def owners(self):
+        """Distinct owners with recordings (None for recordings without an owner)."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT owner FROM recordings")]
+
+    def oldest(self, owner=None, limit=100, created_before=None, offset=0):
+        """
+        Recording files oldest first, optionally for one owner (None here means every owner) and only
+        those created before a timestamp. `offset` skips that many rows (files the caller is keeping).
+        """
+        clauses, params = [], []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        if created_before is not None:
+            clauses.append("created_at < ?")
+            params.append(created_before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM recordings {where} ORDER BY created_at ASC, id ASC LIMIT ? OFFSET ?",
+                                (*params, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def compaction_candidates(self, created_before, limit=10):
+        """Recordings older than `created_before` that have not been transcoded yet, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM recordings WHERE compacted = 0 AND created_at < ? ORDER BY created_at ASC LIMIT ?",
+                (created_before, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_compacted(self, recording_row_id):
+        """Refreshes size and checksum after a file was transcoded in place and flags it as compacted."""
+        row = self.get(recording_row_id)
+        if row is None:
+            return
+        path = self.absolute_path(row["path"])
+        with self._connect() as conn:
+            conn.execute("UPDATE recordings SET size = ?, checksum = ?, duration = COALESCE(?, duration), compacted = 1 WHERE id = ?",
+                         (os.path.getsize(path), file_checksum(path), probe_duration(path), recording_row_id))
+
+    def ids(self, owner=None):
+        where, params = self._where(owner)
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(f"SELECT id FROM recordings {where}", params)]
+
+    def sync_from_disk(self, force=False):
+        """
+        One-off import of recordings written before the catalog existed.
+        Runs once per catalog (tracked in catalog_meta) unless `force` is set.
+        """
+        with self._sync_lock:
+            with self._connect() as conn:
+                done = conn.execute("SELECT value FROM catalog_meta WHERE key = 'disk_synced'").fetchone()
+            if done and not force:
+                return 0
+            added = 0
+            if os.path.isdir(self.recordings_dir):
+                with self._connect() as conn:
+                    known = {row[0] for row in conn.execute("SELECT path FROM recordings")}
+                for dir_path, _, filenames in os.walk(self.recordings_dir):
+                    for filename in filenames:
+                        if not filename.endswith(".mp4"):
+                            continue
+                        path = os.path.join(dir_path, filename)
+                        if os.path.relpath(path, self.recordings_dir) in known:
+                            continue
+                        recording_id = os.path.basename(dir_path) if os.path.abspath(dir_path) != os.path.abspath(self.recordings_dir) else None
+                        try:
+                            self.add_file(path, recording_id=recording_id)
+                            added += 1
+                        except OSError as e:
+                            print(f"Catalog: Could not index {path}: {e}")
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('disk_synced', ?)", (str(time.time()),))
+            if added:
+                print(f"Catalog: Indexed {added} existing recording file(s).")
+            return added
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog(recordings_dir):
+    """Returns the process-wide catalog for a recordings directory."""
+    with _catalogs_lock:
+        if recordings_dir not in _catalogs:
+            _catalogs[recordings_dir] = RecordingsCatalog(recordings_dir)
+        return _catalogs[recordings_dir]
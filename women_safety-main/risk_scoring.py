@@ -0,0 +1,412 @@
+# risk_scoring.py
+# Location risk scoring.
+# Combines the signals the app already has into one score between 0 (low risk) and 1 (high risk):
+#   - crime:        reported crimes (rape + murder) for the district in the latest year
+#   - police_km:    distance to the nearest police station (coverage_grid.py)
+#   - hospital_km:  distance to the nearest hospital (coverage_grid.py)
+#   - danger_zone:  1 if the point lies in a zone from danger_zones.json
+#   - hour_sin/cos: time of day on the unit circle, so 23:00 and 01:00 are close
+# Features are assembled as an (N, 6) array and scored in one vectorised call, so the same code
+# serves a single location check and batch scoring. The model is a serialized LinearRiskModel
+# (models/risk_model.json) or any pickled classifier with predict_proba (e.g. the XGBoost model
+# from train_safety_model.py); without one, built-in default weights are used. Pickled tree
+# ensembles are compiled at load (compile_classifier) so a single point scores well under 1 ms.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import json
+import math
+import os
+import pickle
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from datasets import DATA_DIR, dataset_path, dataset_version
+
+# --- Configuration ---
+# Relative paths are under DATA_DIR, like the datasets
+RISK_MODEL_PATH = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_RISK_MODEL", os.path.join("models", "risk_model.json"))))
+DANGER_ZONES_PATH = dataset_path("danger_zones")
+CRIME_DATA_PATH = dataset_path("crime")
+UNSAFE_THRESHOLD = float(os.environ.get("SEFI_RISK_THRESHOLD", "0.5"))
+# Used when the coverage grid has no value for the point
+FALLBACK_SERVICE_KM = 30.0
+
+FEATURE_NAMES = ("crime", "police_km", "hospital_km", "danger_zone", "hour_sin", "hour_cos")
+
+
+def _transform(features):
+    """Raw features -> model inputs. Counts and distances are compressed with log1p."""
+    x = np.array(features, dtype=float, copy=True)
+    x[:, 0:3] = np.log1p(np.maximum(x[:, 0:3], 0.0))
+    return x
+
+
+class LinearRiskModel:
+    """
+    Logistic model over the transformed features: sigmoid(bias + weights . (x - center)).
+    The default weights put a location with 20 recent crimes (the old fixed safe/unsafe
+    threshold), 5 km from police and hospital, outside danger zones, at 06:00/18:00 at 0.5.
+    """
+
+    DEFAULT = {
+        "weights": [1.0, 0.6, 0.3, 2.0, 0.0, 0.5],
+        "center": [math.log1p(20), math.log1p(5), math.log1p(5), 0.0, 0.0, 0.0],
+        "bias": 0.0,
+    }
+
+    def __init__(self, weights, center, bias=0.0, version="default"):
+        self.weights = np.asarray(weights, dtype=float)
+        self.center = np.asarray(center, dtype=float)
+        self.bias = float(bias)
+        self.version = version
+
+    @classmethod
+    def default(cls):
+        return cls(**cls.DEFAULT)
+
+    @classmethod
+    def from_dict(cls, data, version=None):
+        return cls(data["weights"], data["center"], data.get("bias", 0.0), version or data.get("version", "unversioned"))
+
+    def to_dict(self):
+        return {"weights": self.weights.tolist(), "center": self.center.tolist(), "bias": self.bias,
+                "version": self.version, "features": list(FEATURE_NAMES)}
+
+    def predict_proba(self, features):
+        """(N, 6) raw features -> (N,) risk scores."""
+        logits = self.bias + (_transform(features) - self.center) @ self.weights
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def contributions(self, features):
+        """Per-feature share of the logit for one row, to explain a score."""
+        x = _transform(np.atleast_2d(features))[0]
+        return dict(zip(FEATURE_NAMES, ((x - self.center) * self.weights).round(3).tolist()))
+
+
+class CompiledTrees:
+    """
+    A fitted scikit-learn HistGradientBoostingClassifier flattened into NumPy arrays. The library's
+    predict_proba costs milliseconds per call whatever the batch size; here all trees are walked
+    together one level per step, so one point is a few array lookups. Leaves point back at
+    themselves, so every row can take the same number of steps.
+    """
+
+    # Rows scored per step, to bound the (rows x trees) index arrays
+    CHUNK_ROWS = 4096
+
+    def __init__(self, feature, threshold, missing_left, left, right, value, roots, depth, baseline):
+        self.feature = feature
+        self.threshold = threshold
+        self.missing_left = missing_left
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.baseline = baseline
+
+    @classmethod
+    def from_hist_gbm(cls, model):
+        """Arrays for a binary HistGradientBoostingClassifier without categorical features."""
+        if model.n_trees_per_iteration_ != 1 or model.is_categorical_ is not None:
+            raise ValueError("only binary models on numeric features can be compiled")
+        trees = [predictors[0].nodes for predictors in model._predictors]
+        offsets = np.cumsum([0] + [len(nodes) for nodes in trees[:-1]])
+        nodes = np.concatenate(trees)
+        index = np.arange(len(nodes))
+        offset = np.repeat(offsets, [len(t) for t in trees])
+        leaf = nodes["is_leaf"].astype(bool)
+        return cls(
+            feature=np.where(leaf, 0, nodes["feature_idx"]).astype(np.intp),
+            threshold=nodes["num_threshold"].astype(float),
+            missing_left=nodes["missing_go_to_left"].astype(bool),
+            left=np.where(leaf, index, nodes["left"] + offset).astype(np.intp),
+            right=np.where(leaf, index, nodes["right"] + offset).astype(np.intp),
+            value=np.where(leaf, nodes["value"], 0.0),
+            roots=offsets.astype(np.intp),
+            depth=int(nodes["depth"].max()),
+            baseline=float(np.ravel(model._baseline_prediction)[0]),
+        )
+
+    def decision_function(self, features):
+        x = np.asarray(features, dtype=float)
+        logits = np.empty(len(x))
+        for start in range(0, len(x), self.CHUNK_ROWS):
+            chunk = x[start:start + self.CHUNK_ROWS]
+            rows = np.arange(len(chunk))[:, None]
+            node = np.broadcast_to(self.roots, (len(chunk), len(self.roots)))
+            for _ in range(self.depth):
+                values = chunk[rows, self.feature[node]]
+                go_left = np.where(np.isnan(values), self.missing_left[node], values <= self.threshold[node])
+                node = np.where(go_left, self.left[node], self.right[node])
+            logits[start:start + len(chunk)] = self.baseline + self.value[node].sum(axis=1)
+        return logits
+
+    def predict_proba(self, features):
+        p = 1.0 / (1.0 + np.exp(-self.decision_function(features)))
+        return np.column_stack((1 - p, p))
+
+
+class BoosterInplace:
+    """An XGBoost classifier scored through Booster.inplace_predict, skipping the DMatrix construction."""
+
+    def __init__(self, booster):
+        self.booster = booster
+
+    def predict_proba(self, features):
+        p = np.asarray(self.booster.inplace_predict(np.asarray(features, dtype=float)), dtype=float)
+        return np.column_stack((1 - p, p))
+
+
+def compile_classifier(model):
+    """
+    The fast scoring path for a pickled classifier: CompiledTrees for scikit-learn's
+    HistGradientBoostingClassifier, BoosterInplace for XGBoost, the model itself otherwise.
+    TimeOfDayAdjusted models have their inner classifier compiled.
+    """
+    if isinstance(model, TimeOfDayAdjusted):
+        return TimeOfDayAdjusted(compile_classifier(model.model), model.hour_weights)
+    try:
+        if type(model).__name__ == "HistGradientBoostingClassifier":
+            return CompiledTrees.from_hist_gbm(model)
+        if hasattr(model, "get_booster"):
+            return BoosterInplace(model.get_booster())
+    except Exception as e:
+        print(f"Risk: Could not compile {type(model).__name__}, scoring through the library: {e}")
+    return model
+
+
+class PickledModel:
+    """Wraps a pickled classifier (predict_proba over the same (N, 6) raw features)."""
+
+    def __init__(self, model, version):
+        self.model = compile_classifier(model)
+        self.version = version
+
+    def predict_proba(self, features):
+        return np.asarray(self.model.predict_proba(np.asarray(features, dtype=float)))[:, 1]
+
+    def contributions(self, features):
+        return {}
+
+
+class TimeOfDayAdjusted:
+    """
+    A classifier trained on the location features only (crime, police_km, hospital_km, danger_zone;
+    the crime data has no time of day), with the default time-of-day weights added to its logit.
+    This is what train_safety_model.py pickles, so it takes and returns the usual (N, 6) / (N, 2) shapes.
+    """
+
+    def __init__(self, model, hour_weights=None):
+        self.model = model
+        self.hour_weights = np.asarray(hour_weights if hour_weights is not None else LinearRiskModel.DEFAULT["weights"][4:6], dtype=float)
+
+    def predict_proba(self, features):
+        features = np.asarray(features, dtype=float)
+        p = np.clip(np.asarray(self.model.predict_proba(features[:, :4]))[:, 1], 1e-6, 1 - 1e-6)
+        logits = np.log(p / (1 - p)) + features[:, 4:6] @ self.hour_weights
+        q = 1.0 / (1.0 + np.exp(-logits))
+        return np.column_stack((1 - q, q))
+
+
+def load_risk_model(path=RISK_MODEL_PATH):
+    """Loads the serialized model at `path`; falls back to the default weights if there is none."""
+    if not os.path.exists(path):
+        return LinearRiskModel.default()
+    try:
+        version = f"{os.path.basename(path)}:{os.stat(path).st_mtime_ns}"
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                return LinearRiskModel.from_dict(json.load(f), version)
+        with open(path, "rb") as f:
+            return PickledModel(pickle.load(f), version)
+    except Exception as e:
+        print(f"Risk: Could not load risk model {path}, using default weights: {e}")
+        return LinearRiskModel.default()
+
+
+# --- Danger zones ---
+class DangerZones:
+    """Polygon and point-radius zones from danger_zones.json, tested for many points at once."""
+
+    def __init__(self, zones):
+        self.polygons = []
+        self.circles = []
+        for zone in zones:
+            try:
+                if zone.get("type") == "polygon":
+                    self.polygons.append((zone.get("id"), np.asarray(zone["coordinates"], dtype=float)))
+                elif zone.get("type") == "point_radius":
+                    self.circles.append((zone.get("id"), float(zone["center"][0]), float(zone["center"][1]), float(zone["radius_km"])))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Risk: Skipping invalid danger zone {zone.get('id')}: {e}")
+
+    @classmethod
+    def load(cls, path=DANGER_ZONES_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls([])
+        except Exception as e:
+            print(f"Risk: Could not read danger zones {path}: {e}")
+            return cls([])
+
+    def contains(self, lats, lons):
+        """Boolean array: which points fall inside any zone."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        inside = np.zeros(lats.shape, dtype=bool)
+        for _, ring in self.polygons:
+            # Ray casting over all edges at once; coordinates are [lat, lon] pairs
+            y1, x1 = ring[:, 0][:, None], ring[:, 1][:, None]
+            y2, x2 = np.roll(ring[:, 0], -1)[:, None], np.roll(ring[:, 1], -1)[:, None]
+            crosses = (y1 > lats) != (y2 > lats)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_at = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+            inside |= (np.count_nonzero(crosses & (lons < x_at), axis=0) % 2) == 1
+        for _, lat, lon, radius_km in self.circles:
+            d_lat = np.radians(lats - lat)
+            d_lon = np.radians(lons - lon)
+            a = np.sin(d_lat / 2) ** 2 + np.cos(np.radians(lat)) * np.cos(np.radians(lats)) * np.sin(d_lon / 2) ** 2
+            inside |= 2 * 6371.0088 * np.arcsin(np.sqrt(np.minimum(a, 1.0))) <= radius_km
+        return inside
+
+    def __len__(self):
+        return len(self.polygons) + len(self.circles)
+
+
+# --- District crime table ---
+def read_crime_table(path=CRIME_DATA_PATH):
+    """
+    The crime CSV as DISTRICT (stripped, lower case), YEAR, RAPE, MURDER, TOTAL columns, or None.
+    Accepts either column casing; state-level "total" rows are dropped.
+    """
+    try:
+        df = pd.read_csv(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Risk: Could not read crime data {path}: {e}")
+        return None
+    columns = {c.upper(): c for c in df.columns}
+    if not all(c in columns for c in ("DISTRICT", "YEAR", "RAPE", "MURDER")):
+        print(f"Risk: Crime data {path} is missing DISTRICT/YEAR/RAPE/MURDER columns.")
+        return None
+    df = df.rename(columns={columns[c]: c for c in ("DISTRICT", "YEAR", "RAPE", "MURDER")})
+    df["DISTRICT"] = df["DISTRICT"].astype(str).str.strip().str.lower()
+    df["YEAR"] = pd.to_numeric(df["YEAR"], errors='coerce')
+    df = df[df["YEAR"].notna() & ~df["DISTRICT"].str.contains("total", regex=False)].copy()
+    df["YEAR"] = df["YEAR"].astype(int)
+    df["TOTAL"] = pd.to_numeric(df["RAPE"], errors='coerce').fillna(0) + pd.to_numeric(df["MURDER"], errors='coerce').fillna(0)
+    return df
+
+
+def load_district_crime(path=CRIME_DATA_PATH):
+    """{district (lower case): rape + murder in the latest year}."""
+    df = read_crime_table(path)
+    if df is None:
+        return {}
+    latest = df[df["YEAR"] == df.groupby("DISTRICT")["YEAR"].transform("max")]
+    return latest.groupby("DISTRICT")["TOTAL"].sum().to_dict()
+
+
+def hour_features(hours):
+    """Time of day (hours, may be fractional) -> (sin, cos) on the 24 h circle."""
+    angle = 2 * np.pi * np.asarray(hours, dtype=float) / 24.0
+    return np.sin(angle), np.cos(angle)
+
+
+class RiskScorer:
+    """Holds the model, danger zones and crime table, loaded once, and builds/scores feature arrays."""
+
+    def __init__(self, model=None, zones=None, district_crime=None, threshold=UNSAFE_THRESHOLD):
+        self.model = model or LinearRiskModel.default()
+        self.zones = zones if zones is not None else DangerZones([])
+        self.district_crime = district_crime or {}
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls):
+        return cls(load_risk_model(), DangerZones.load(), load_district_crime())
+
+    def district_total(self, district):
+        """Latest crime total for a district name (exact, then substring match), or None."""
+        if not district:
+            return None
+        key = str(district).strip().lower()
+        if key in self.district_crime:
+            return self.district_crime[key]
+        matches = [total for name, total in self.district_crime.items() if key in name]
+        return max(matches) if matches else None
+
+    def build_features(self, lats, lons, hours, crime_totals):
+        """(N, 6) raw feature array for arrays of points, hours of day and district crime totals."""
+        from coverage_grid import get_coverage_grid
+
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        features = np.empty((len(lats), len(FEATURE_NAMES)))
+        features[:, 0] = np.nan_to_num(np.broadcast_to(np.asarray(crime_totals, dtype=float), lats.shape), nan=0.0)
+        grid = get_coverage_grid()
+        if grid is not None:
+            features[:, 1] = np.nan_to_num(grid.lookup_many(lats, lons, "police"), nan=FALLBACK_SERVICE_KM)
+            features[:, 2] = np.nan_to_num(grid.lookup_many(lats, lons, "hospital"), nan=FALLBACK_SERVICE_KM)
+        else:
+            features[:, 1:3] = FALLBACK_SERVICE_KM
+        features[:, 3] = self.zones.contains(lats, lons) if len(self.zones) else 0.0
+        features[:, 4], features[:, 5] = hour_features(np.broadcast_to(np.asarray(hours, dtype=float), lats.shape))
+        return features
+
+    def score_batch(self, lats, lons, hours, crime_totals):
+        """Risk scores (N,) for many points in one call."""
+        return self.model.predict_proba(self.build_features(lats, lons, hours, crime_totals))
+
+    def score_location(self, lat, lon, when=None, total_crimes=None, district=None):
+        """
+        Scores one location. `total_crimes` (or a `district` to look it up) gives the crime feature.
+        Returns {'score', 'label' ('safe'/'unsafe'), 'features', 'contributions', 'model_version'}.
+        """
+        when = when or datetime.now()
+        if total_crimes is None:
+            total_crimes = self.district_total(district) or 0
+        features = self.build_features([lat], [lon], when.hour + when.minute / 60.0, total_crimes)
+        return self.describe(float(self.model.predict_proba(features)[0]), features, self.model)
+
+    def describe(self, score, features, model):
+        """Result dict for one scored (1, 6) feature row."""
+        return {
+            "score": round(score, 3),
+            "label": "unsafe" if score >= self.threshold else "safe",
+            "features": dict(zip(FEATURE_NAMES, features[0].round(3).tolist())),
+            "contributions": model.contributions(features),
+            "model_version": model.version,
+        }
+
+
+_scorer = None
+_scorer_data_versions = None
+_scorer_lock = threading.Lock()
+
+def get_risk_scorer():
+    """
+    Process-wide scorer; the model, zones and crime table are loaded on first use. The zones and
+    crime table are loaded again (into the same scorer) when their files' content changes.
+    """
+    global _scorer, _scorer_data_versions
+    versions = (dataset_version(DANGER_ZONES_PATH), dataset_version(CRIME_DATA_PATH))
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = RiskScorer.load()
+            print(f"Risk: Loaded risk model {_scorer.model.version} with {len(_scorer.zones)} danger zones "
+                  f"and {len(_scorer.district_crime)} districts.")
+        elif versions != _scorer_data_versions:
+            _scorer.zones = DangerZones.load()
+            _scorer.district_crime = load_district_crime()
+            print(f"Risk: Danger zones or crime data changed; reloaded {len(_scorer.zones)} danger zones "
+                  f"and {len(_scorer.district_crime)} districts.")
+        _scorer_data_versions = versions
+        return _scorer
@@ -0,0 +1,309 @@
+# service_cache.py
+# Cache in front of emergency_services.find_nearest_services.
+# SOS alerts and area checks from the same neighbourhood ask for the same nearest hospitals and
+# police stations. Points are grouped into geohash cells, and for each
+# (service type, cell, radius, number of results, dataset version) the cache keeps a small
+# candidate set that is guaranteed to contain the answer for ANY point inside the cell:
+#   - with a radius r:   every service within r of the point is within r + h of the cell centre
+#   - top k:             the k-th nearest service of the point is at most d_k(centre) + h away, so
+#                        all of the point's k nearest are within d_k(centre) + 2h of the centre
+# (h = distance from the cell centre to its farthest corner, d_k = k-th nearest distance).
+# On a hit only the candidates are ranked again by their exact distance from the true point,
+# so results are identical to an uncached search, just without scanning the whole dataset.
+# Entries are keyed by the dataset's version (DataFrame.attrs['dataset_version']), so reloading
+# a changed dataset invalidates them.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from emergency_services import find_nearest_services, _GEOPY_AVAILABLE
+
+# --- Configuration ---
+# Geohash precision 6 gives cells of about 1.2 km x 0.6 km
+GEOHASH_PRECISION = int(os.environ.get("SEFI_SERVICE_CACHE_PRECISION", "6"))
+CACHE_SIZE = int(os.environ.get("SEFI_SERVICE_CACHE_SIZE", "4096"))
+EARTH_RADIUS_KM = 6371.0088
+# WGS-84 ellipsoid, the same model geopy's geodesic distance uses
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+# Candidates are selected with spherical (haversine) distances, which differ from the
+# ellipsoidal distances used for the results by less than 0.6%; this margin covers that
+DISTANCE_MARGIN = 1.01
+# Below this many points, distances are computed with plain floats instead of NumPy
+SCALAR_DISTANCE_LIMIT = 16
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_cell(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a point and the bounds of its cell: (hash, (lat_min, lat_max), (lon_min, lon_max))."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude (even) and latitude (odd)
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars), tuple(lat_range), tuple(lon_range)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance (km) from one point to arrays of points."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def ellipsoidal_km(lat, lon, lats, lons, max_iterations=20):
+    """
+    Distance (km) on the WGS-84 ellipsoid from one point to arrays of points (Vincenty's inverse
+    formula, vectorised). Agrees with geopy's geodesic to well below a metre at these distances,
+    at a fraction of the cost of one geopy call per pair.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if len(lats) <= SCALAR_DISTANCE_LIMIT:
+        # For a handful of points NumPy's per-call overhead dominates; plain floats are much faster
+        return np.array([_vincenty_km(lat, lon, la, lo, max_iterations) for la, lo in zip(lats.tolist(), lons.tolist())])
+    f = WGS84_F
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lats)))
+    big_l = np.radians(lons - lon)
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    lam = big_l
+    for _ in range(max_iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = big_l + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if np.all(np.abs(lam - previous) < 1e-12):
+            break
+    u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * big_a * (sigma - delta_sigma)
+
+
+def _vincenty_km(lat1, lon1, lat2, lon2, max_iterations=20):
+    """Scalar version of ellipsoidal_km for a single pair of points."""
+    f = WGS84_F
+    u1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    u2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    big_l = math.radians(lon2 - lon1)
+    sin_u1, cos_u1 = math.sin(u1), math.cos(u1)
+    sin_u2, cos_u2 = math.sin(u2), math.cos(u2)
+    lam = big_l
+    for _ in range(max_iterations):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        if sin_sigma == 0:
+            return 0.0 # Same point
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha != 0 else 0.0
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = big_l + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if abs(lam - previous) < 1e-12:
+            break
+    u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * big_a * (sigma - delta_sigma)
+
+
+class NearestServiceCache:
+    """LRU cache of per-cell candidate sets. Thread-safe; one instance is shared per process."""
+
+    def __init__(self, max_entries=CACHE_SIZE, precision=GEOHASH_PRECISION):
+        self.max_entries = max_entries
+        self.precision = precision
+        self._entries = OrderedDict()
+        self._datasets = {} # (service_type, dataset_version, columns) -> prepared coordinate arrays
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, user_lat, user_lon, services_df, service_type='Service', name_col='Name', lat_col='Latitude',
+             lon_col='Longitude', num_results=5, radius_km=10.0):
+        """Same arguments and results as emergency_services.find_nearest_services."""
+        has_radius = radius_km is not None and radius_km != float('inf')
+        k = num_results if num_results is not None and num_results > 0 else None
+        if (not _GEOPY_AVAILABLE or services_df is None or services_df.empty or (k is None and not has_radius)
+                or not all(col in services_df.columns for col in (lat_col, lon_col, name_col))):
+            # Nothing worth caching (or an error/info answer); the plain search handles these cases
+            return find_nearest_services(user_lat, user_lon, services_df, service_type, name_col, lat_col, lon_col, num_results, radius_km)
+
+        try:
+            dataset = self._dataset(services_df, service_type, name_col, lat_col, lon_col)
+            cell, lat_bounds, lon_bounds = geohash_cell(user_lat, user_lon, self.precision)
+            key = (service_type, dataset["version"], cell, radius_km if has_radius else None, k)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if entry is None:
+                entry = self._build_entry(dataset, lat_bounds, lon_bounds, radius_km if has_radius else None, k)
+                with self._lock:
+                    self._entries[key] = entry
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return self._rank(entry, user_lat, user_lon, service_type, radius_km if has_radius else None, k)
+        except Exception as e:
+            print(f"ServiceCache: Cache lookup failed ({e}), searching the full {service_type} dataset.")
+            return find_nearest_services(user_lat, user_lon, services_df, service_type, name_col, lat_col, lon_col, num_results, radius_km)
+
+    def _dataset(self, services_df, service_type, name_col, lat_col, lon_col):
+        """Coordinates and display fields of a dataset, prepared once per dataset version."""
+        # DataFrames without a version tag are versioned by identity and size
+        version = services_df.attrs.get('dataset_version') or f"id:{id(services_df)}:{len(services_df)}"
+        key = (service_type, version, name_col, lat_col, lon_col)
+        with self._lock:
+            dataset = self._datasets.get(key)
+        if dataset is not None:
+            return dataset
+
+        lats = pd.to_numeric(services_df[lat_col], errors='coerce').to_numpy(dtype=float)
+        lons = pd.to_numeric(services_df[lon_col], errors='coerce').to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+        rows = services_df.iloc[valid]
+        # Same fallbacks as find_nearest_services uses when formatting its results
+        if 'address' in rows.columns:
+            addresses = rows['address'].tolist()
+        elif 'Address' in rows.columns:
+            addresses = rows['Address'].tolist()
+        elif 'Location' in rows.columns:
+            addresses = rows['Location'].tolist()
+        else:
+            addresses = ['N/A Address'] * len(rows)
+        dataset = {
+            "version": version,
+            "lats": lats[valid],
+            "lons": lons[valid],
+            "names": rows[name_col].tolist(),
+            "addresses": addresses,
+        }
+        with self._lock:
+            # Versions of the same service type replace each other
+            for old in [old for old in self._datasets if old[0] == service_type and old[1] != version]:
+                del self._datasets[old]
+            self._datasets[key] = dataset
+        print(f"ServiceCache: Prepared {len(valid)} {service_type} locations (dataset version {version}).")
+        return dataset
+
+    def _build_entry(self, dataset, lat_bounds, lon_bounds, radius_km, k):
+        """Candidate set that contains the answer for every point of the cell."""
+        center_lat = (lat_bounds[0] + lat_bounds[1]) / 2
+        center_lon = (lon_bounds[0] + lon_bounds[1]) / 2
+        corners_lat = np.array([lat_bounds[0], lat_bounds[0], lat_bounds[1], lat_bounds[1]])
+        corners_lon = np.array([lon_bounds[0], lon_bounds[1], lon_bounds[0], lon_bounds[1]])
+        half_diagonal = float(haversine_km(center_lat, center_lon, corners_lat, corners_lon).max())
+
+        distances = haversine_km(center_lat, center_lon, dataset["lats"], dataset["lons"])
+        limit = float('inf')
+        if radius_km is not None:
+            limit = radius_km * DISTANCE_MARGIN + half_diagonal
+        if k is not None and len(distances) > k:
+            kth = float(np.partition(distances, k - 1)[k - 1])
+            limit = min(limit, (kth + 2 * half_diagonal) * DISTANCE_MARGIN)
+        candidates = np.flatnonzero(distances <= limit)
+        return {
+            "lats": dataset["lats"][candidates],
+            "lons": dataset["lons"][candidates],
+            "names": [dataset["names"][i] for i in candidates],
+            "addresses": [dataset["addresses"][i] for i in candidates],
+        }
+
+    def _rank(self, entry, user_lat, user_lon, service_type, radius_km, k):
+        """Exact re-ranking of a cell's candidates from the true point, formatted like find_nearest_services."""
+        # Exact (ellipsoidal) distances, as in the uncached search, but only for the cell's candidates
+        distances = ellipsoidal_km(user_lat, user_lon, entry["lats"], entry["lons"])
+        order = np.argsort(distances, kind='stable')
+        if radius_km is not None:
+            order = order[distances[order] <= radius_km]
+        if k is not None:
+            order = order[:k]
+        ranked = [(float(distances[i]), int(i)) for i in order]
+        if not ranked:
+            if radius_km is not None:
+                return [{"info": f"No {service_type} found within {radius_km} km based on available data."}]
+            return [{"info": f"No {service_type} found matching search criteria (within radius or top N)."}]
+
+        return [{
+            'Type': service_type,
+            'Name': entry["names"][i],
+            'Latitude': float(entry["lats"][i]),
+            'Longitude': float(entry["lons"][i]),
+            'Distance (km)': round(distance, 2),
+            'Address': entry["addresses"][i],
+        } for distance, i in ranked]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._datasets.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_service_cache():
+    """Returns the process-wide nearest-service cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = NearestServiceCache()
+        return _cache
+
+
+def find_nearest_services_cached(user_lat, user_lon, services_df, service_type='Service', name_col='Name', lat_col='Latitude',
+                                 lon_col='Longitude', num_results=5, radius_km=10.0):
+    """Drop-in replacement for find_nearest_services that goes through the process-wide cache."""
+    return get_service_cache().find(user_lat, user_lon, services_df, service_type, name_col, lat_col, lon_col, num_results, radius_km)
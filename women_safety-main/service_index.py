@@ -0,0 +1,297 @@
+# service_index.py
+# Bulk nearest-service queries for batch analysis (e.g. coverage distance from every district
+# centroid to its nearest police station).
+# A ServiceIndex is built once over a service dataset and answers N query points at a time,
+# returning (N, k) arrays of dataset row positions and distances in km instead of one list of
+# dicts per point. Points are stored as unit vectors on the sphere; nearest neighbours by
+# straight-line (chord) distance are also nearest by great-circle distance, so a k-d tree
+# (scipy, if installed) or a chunked NumPy scan over dot products finds them directly.
+# Distances are great-circle (spherical) distances, within 0.6% of the ellipsoidal distances
+# shown in the app, which is plenty for coverage statistics.
+# When a dataset changes by a delta (datasets.py), the index is updated instead of rebuilt:
+# removed rows become tombstones in the existing tree and added rows go to a small overlay that
+# is scanned directly; once the changes exceed COMPACT_FRACTION of the index it is rebuilt.
+#
+# Command line:
+#     python service_index.py points.csv --services police --k 3 --out nearest.csv
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Optional k-d tree for large batches
+try:
+    from scipy.spatial import cKDTree
+    _SCIPY_AVAILABLE = True
+except ImportError:
+    _SCIPY_AVAILABLE = False
+
+EARTH_RADIUS_KM = 6371.0088
+# Upper bound on the (points x services) block compared at once by the NumPy fallback (~32 MB of float64)
+MAX_BLOCK_ELEMENTS = 4_000_000
+# Rebuild an updated index once tombstones + overlay entries exceed this share of it
+COMPACT_FRACTION = 0.1
+# Indexes kept by get_service_index (older dataset versions are dropped first)
+MAX_CACHED_INDEXES = 8
+
+# Dataset presets (column names as loaded by emergency_services.load_service_frames)
+SERVICE_PRESETS = {
+    "police": {"service_type": "Police Station", "name_col": "name", "lat_col": "lat", "lon_col": "lng"},
+    "hospital": {"service_type": "Hospital", "name_col": "id", "lat_col": "Latitude", "lon_col": "Longitude"},
+}
+
+
+def to_unit_vectors(lats, lons):
+    """(N, 3) unit vectors for arrays of latitudes/longitudes in degrees."""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_km(chord):
+    """Great-circle distance (km) for straight-line distances between unit vectors."""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class ServiceIndex:
+    """Spatial index over one service dataset for vectorised k-nearest queries."""
+
+    def __init__(self, lats, lons, use_tree=None):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        # Rows without valid coordinates are left out; `positions` maps index entries back to dataset rows
+        valid = ~np.isnan(lats) & ~np.isnan(lons)
+        self.positions = np.flatnonzero(valid)
+        self.vectors = to_unit_vectors(lats[valid], lons[valid])
+        self.use_tree = _SCIPY_AVAILABLE if use_tree is None else (use_tree and _SCIPY_AVAILABLE)
+        self._tree = cKDTree(self.vectors) if self.use_tree and len(self.vectors) else None
+        # Delta state (see updated()): entries removed since the build, and entries added since
+        self.dead = None
+        self.extra_positions = np.empty(0, dtype=np.int64)
+        self.extra_vectors = np.empty((0, 3))
+
+    @classmethod
+    def from_frame(cls, services_df, lat_col, lon_col, use_tree=None):
+        return cls(pd.to_numeric(services_df[lat_col], errors='coerce').to_numpy(dtype=float),
+                   pd.to_numeric(services_df[lon_col], errors='coerce').to_numpy(dtype=float), use_tree)
+
+    def __len__(self):
+        dead = int(self.dead.sum()) if self.dead is not None else 0
+        return len(self.positions) - dead + len(self.extra_positions)
+
+    def updated(self, remap, added_lats, added_lons, added_positions):
+        """
+        Index for the dataset after a delta, sharing this index's tree. `remap` maps every old
+        dataset row position to its new position (-1 if the row was removed or replaced);
+        the added rows' coordinates and new positions go to the overlay.
+        """
+        new = copy.copy(self)
+        # Entries already removed by an earlier delta stay removed (-1)
+        new.positions = np.where(self.positions >= 0, remap[np.maximum(self.positions, 0)], -1)
+        dead = new.positions < 0
+        new.dead = dead if dead.any() else None
+        kept = remap[self.extra_positions]
+        added_lats = np.asarray(added_lats, dtype=float)
+        added_lons = np.asarray(added_lons, dtype=float)
+        valid = ~np.isnan(added_lats) & ~np.isnan(added_lons)
+        new.extra_positions = np.concatenate((kept[kept >= 0], np.asarray(added_positions, dtype=np.int64)[valid]))
+        new.extra_vectors = np.vstack((self.extra_vectors[kept >= 0], to_unit_vectors(added_lats[valid], added_lons[valid])))
+        return new
+
+    def needs_compaction(self):
+        changed = (int(self.dead.sum()) if self.dead is not None else 0) + len(self.extra_positions)
+        return changed > COMPACT_FRACTION * max(len(self.vectors), 1)
+
+    def query(self, lats, lons, k=1, radius_km=None):
+        """
+        Nearest services for N points at once.
+        Returns (indices, distances_km), both shaped (N, k) and sorted by distance. Indices are row
+        positions in the dataset the index was built from (use .iloc); slots with no service
+        (fewer than k services, invalid point, or beyond radius_km) hold -1 and inf.
+        """
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        n = len(lats)
+        indices = np.full((n, k), -1, dtype=np.int64)
+        distances = np.full((n, k), np.inf)
+        valid = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+        # Tombstoned entries may take some of the k nearest slots, so ask the tree for that many more
+        kk = min(k + (int(self.dead.sum()) if self.dead is not None else 0), len(self.vectors))
+        if (kk == 0 and len(self.extra_positions) == 0) or len(valid) == 0:
+            return indices, distances
+
+        points = to_unit_vectors(lats[valid], lons[valid])
+        if kk == 0:
+            chords, found = np.empty((len(points), 0)), np.empty((len(points), 0), dtype=np.int64)
+            missing = np.empty((len(points), 0), dtype=bool)
+        elif self._tree is not None:
+            bound = km_to_chord(radius_km) if radius_km is not None else np.inf
+            chords, found = self._tree.query(points, k=kk, distance_upper_bound=bound)
+            chords, found = chords.reshape(len(points), kk), found.reshape(len(points), kk)
+            missing = found >= len(self.vectors) # cKDTree marks "no neighbour" with n
+            found = np.where(missing, 0, found)
+        else:
+            chords, found = self._scan(points, kk)
+            missing = np.zeros(found.shape, dtype=bool)
+
+        km = chord_to_km(chords)
+        if radius_km is not None:
+            missing |= km > radius_km
+        if self.dead is None and len(self.extra_positions) == 0:
+            indices[valid, :kk] = np.where(missing, -1, self.positions[found])
+            distances[valid, :kk] = np.where(missing, np.inf, km)
+            return indices, distances
+
+        # Updated index: drop tombstones, merge in the overlay and keep the k nearest
+        if self.dead is not None:
+            missing |= self.dead[found]
+        rows = np.where(missing, -1, self.positions[found])
+        km = np.where(missing, np.inf, km)
+        if len(self.extra_positions):
+            extra_chords, extra_found = self._scan(points, min(k, len(self.extra_positions)), self.extra_vectors)
+            extra_km = chord_to_km(extra_chords)
+            extra_rows = self.extra_positions[extra_found]
+            if radius_km is not None:
+                extra_rows = np.where(extra_km > radius_km, -1, extra_rows)
+                extra_km = np.where(extra_km > radius_km, np.inf, extra_km)
+            rows = np.hstack((rows, extra_rows))
+            km = np.hstack((km, extra_km))
+        order = np.argsort(km, axis=1, kind='stable')[:, :k]
+        kk = order.shape[1]
+        indices[valid, :kk] = np.take_along_axis(rows, order, axis=1)
+        distances[valid, :kk] = np.take_along_axis(km, order, axis=1)
+        return indices, distances
+
+    def _scan(self, points, k, vectors=None):
+        """Brute-force k nearest by dot product (among `vectors`, default the index's), in blocks that bound memory use."""
+        vectors = self.vectors if vectors is None else vectors
+        chunk = max(1, MAX_BLOCK_ELEMENTS // len(vectors))
+        found = np.empty((len(points), k), dtype=np.int64)
+        chords = np.empty((len(points), k))
+        for start in range(0, len(points), chunk):
+            block = points[start:start + chunk]
+            # Largest dot product = smallest angle
+            similarity = block @ vectors.T
+            if k < similarity.shape[1]:
+                top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(similarity.shape[1]), (len(block), similarity.shape[1]))
+            top_similarity = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_similarity, axis=1)
+            found[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+            dots = np.take_along_axis(top_similarity, order, axis=1)
+            chords[start:start + len(block)] = np.sqrt(np.maximum(2 - 2 * dots, 0.0))
+        return chords, found
+
+
+# --- Shared indexes ---
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_service_index(services_df, lat_col, lon_col):
+    """Index for a dataset, built once per dataset version (DataFrame.attrs['dataset_version'])."""
+    version = services_df.attrs.get('dataset_version') or f"id:{id(services_df)}:{len(services_df)}"
+    key = (version, lat_col, lon_col)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+        else:
+            started = time.perf_counter()
+            index = ServiceIndex.from_frame(services_df, lat_col, lon_col)
+            _indexes[key] = index
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+            print(f"ServiceIndex: Indexed {len(index)} locations ({'k-d tree' if index.use_tree else 'NumPy scan'}) "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        return index
+
+
+def register_service_index(services_df, lat_col, lon_col, index):
+    """Makes an index built elsewhere (e.g. updated by a delta) the one get_service_index returns for this dataset version."""
+    key = (services_df.attrs.get('dataset_version'), lat_col, lon_col)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+
+
+def nearest_services_batch(lats, lons, services_df, lat_col, lon_col, k=1, radius_km=None):
+    """Convenience wrapper: (N, k) indices and distances (km) to the nearest rows of `services_df`."""
+    return get_service_index(services_df, lat_col, lon_col).query(lats, lons, k=k, radius_km=radius_km)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest emergency services for every point in a CSV file.")
+    parser.add_argument("points", help="CSV file with one point per row.")
+    parser.add_argument("--lat-col", default="lat", help="Latitude column of the points CSV.")
+    parser.add_argument("--lon-col", default="lng", help="Longitude column of the points CSV.")
+    parser.add_argument("--services", default="police",
+                        help="'police', 'hospital' or the path of a services CSV (then set --services-lat-col etc.).")
+    parser.add_argument("--services-lat-col")
+    parser.add_argument("--services-lon-col")
+    parser.add_argument("--services-name-col")
+    parser.add_argument("--k", type=int, default=1, help="Number of nearest services per point.")
+    parser.add_argument("--radius-km", type=float, help="Ignore services farther than this.")
+    parser.add_argument("--out", help="Output CSV (default: print a summary only).")
+    args = parser.parse_args()
+
+    from emergency_services import load_service_frames, HOSPITAL_CSV_PATH, POLICE_CSV_PATH
+    if args.services in SERVICE_PRESETS:
+        preset = dict(SERVICE_PRESETS[args.services])
+        hospital_df, police_df, errors = load_service_frames(HOSPITAL_CSV_PATH, POLICE_CSV_PATH)
+        services_df = police_df if args.services == "police" else hospital_df
+        if services_df is None:
+            raise SystemExit(f"Could not load the {args.services} dataset: {'; '.join(errors)}")
+    else:
+        preset = {"service_type": "Service", "name_col": args.services_name_col,
+                  "lat_col": args.services_lat_col or "lat", "lon_col": args.services_lon_col or "lng"}
+        services_df = pd.read_csv(args.services)
+    for column in ("lat_col", "lon_col", "name_col"):
+        override = getattr(args, f"services_{column}")
+        if override:
+            preset[column] = override
+
+    points = pd.read_csv(args.points)
+    started = time.perf_counter()
+    index = get_service_index(services_df, preset["lat_col"], preset["lon_col"])
+    built = time.perf_counter()
+    indices, distances = index.query(pd.to_numeric(points[args.lat_col], errors='coerce'),
+                                     pd.to_numeric(points[args.lon_col], errors='coerce'),
+                                     k=args.k, radius_km=args.radius_km)
+    done = time.perf_counter()
+    print(f"Queried {len(points)} points (k={args.k}) in {done - built:.3f}s "
+          f"({len(points) / max(done - built, 1e-9):,.0f} points/s; index build {built - started:.3f}s).")
+
+    nearest = distances[:, 0]
+    found = np.isfinite(nearest)
+    if found.any():
+        print(f"Distance to nearest {preset['service_type']} (km): median {np.median(nearest[found]):.2f}, "
+              f"90th percentile {np.percentile(nearest[found], 90):.2f}, max {nearest[found].max():.2f}; "
+              f"{(~found).sum()} points without a match.")
+
+    if args.out:
+        for j in range(args.k):
+            points[f"nearest_{j + 1}_row"] = indices[:, j]
+            points[f"nearest_{j + 1}_km"] = np.round(distances[:, j], 3)
+            if preset.get("name_col"):
+                names = services_df[preset["name_col"]].to_numpy()
+                points[f"nearest_{j + 1}_name"] = np.where(indices[:, j] >= 0, names[np.maximum(indices[:, j], 0)], None)
+        points.to_csv(args.out, index=False)
+        print(f"Wrote {args.out}.")
+
+
+if __name__ == "__main__":
+    main()
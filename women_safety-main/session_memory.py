@@ -0,0 +1,206 @@
+# session_memory.py
+# Session state memory accounting and trimming.
+# Every session keeps its own copies of contact lists, nearest-service lists, address details,
+# the safety check history and so on in st.session_state; with thousands of sessions on one
+# server these add up. This module
+#   - measures the approximate deep size of every session state key (deep_size / inspect),
+#   - applies a per-key policy on every rerun: lists that only grow are trimmed, and values
+#     that a page can rebuild are dropped once the session has been away from that page for
+#     a while,
+#   - enforces a per-session budget: when a session is still over it, the largest rebuildable
+#     values not needed by the current page are dropped first,
+#   - keeps the latest report per session so the biggest sessions can be listed (top_sessions).
+# The caller (app.py) passes st.session_state in, so this module never imports Streamlit.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+
+# --- Configuration ---
+SESSION_BUDGET_BYTES = int(os.environ.get("SEFI_SESSION_BUDGET_KB", "2048")) * 1024
+# Drop rebuildable values after the session has been away from their pages this long
+STALE_SECONDS = float(os.environ.get("SEFI_SESSION_STALE_SECONDS", "300"))
+# Sizes are measured at most this often per session (deep sizing is not free)
+INSPECT_INTERVAL_SECONDS = float(os.environ.get("SEFI_SESSION_INSPECT_SECONDS", "30"))
+HISTORY_LIMIT = int(os.environ.get("SEFI_SESSION_HISTORY_LIMIT", "50"))
+NEAREST_SERVICES_LIMIT = 5
+MAX_DEPTH = 8
+# Reports of sessions not seen for this long are forgotten
+REPORT_TTL_SECONDS = 3600
+META_KEY = "_session_memory"
+
+# Policy per session state key:
+#   keep_last / keep_first: trim a list to this many entries (newest / first)
+#   pages: the pages that use the value; away from all of them for STALE_SECONDS it is dropped
+#          (the page rebuilds it from the database, the datasets or the dispatch job)
+POLICY = {
+    'safety_history': {"keep_last": HISTORY_LIMIT},
+    'nearest_hospitals': {"keep_first": NEAREST_SERVICES_LIMIT, "pages": ("dashboard",)},
+    'nearest_police_stations': {"keep_first": NEAREST_SERVICES_LIMIT, "pages": ("dashboard",)},
+    'address_details': {"pages": ("dashboard",)},
+    'dashboard_contacts_list': {"pages": ("dashboard",)},
+    'contact_id_map': {"pages": ("add_contacts_page",)},
+    'risk_result': {"pages": ("check_area_safety_page",)},
+    'audio_trigger_processor': {"pages": ("triggers_page",)},
+    'voice_trigger_data': {"pages": ("triggers_page",)},
+}
+
+_ATOMIC = (str, bytes, bytearray, int, float, complex, bool, type(None))
+_SHARED = (types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.ModuleType, type)
+
+
+def deep_size(obj, seen=None, depth=0):
+    """
+    Approximate bytes held by `obj` and everything it references. DataFrames and arrays report
+    their buffers; functions, classes and modules count only themselves (they are shared by all
+    sessions); objects referenced twice are counted once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    pd = sys.modules.get("pandas")
+    np = sys.modules.get("numpy")
+    if pd is not None and isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if np is not None and isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.flags.owndata else obj.nbytes)
+    try:
+        size = sys.getsizeof(obj)
+    except TypeError:
+        size = 0
+    if isinstance(obj, _ATOMIC) or isinstance(obj, _SHARED) or depth >= MAX_DEPTH:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_size(k, seen, depth + 1) + deep_size(v, seen, depth + 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return size + sum(deep_size(item, seen, depth + 1) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen, depth + 1)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_size(getattr(obj, slot), seen, depth + 1)
+    return size
+
+
+def inspect(state):
+    """[(key, bytes, type name)] for every session state key, largest first."""
+    rows = []
+    for key in list(state.keys()):
+        if key == META_KEY:
+            continue
+        try:
+            value = state[key]
+        except KeyError:
+            continue
+        rows.append((key, deep_size(value), type(value).__name__))
+    rows.sort(key=lambda row: -row[1])
+    return rows
+
+
+class SessionMemoryManager:
+    """Applies POLICY and the budget to sessions and keeps their latest reports."""
+
+    def __init__(self, policy=POLICY, budget_bytes=SESSION_BUDGET_BYTES, stale_seconds=STALE_SECONDS,
+                 inspect_interval=INSPECT_INTERVAL_SECONDS):
+        self.policy = policy
+        self.budget = budget_bytes
+        self.stale_seconds = stale_seconds
+        self.inspect_interval = inspect_interval
+        self.reports = {}
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, state, key, reason, meta):
+        try:
+            del state[key]
+        except KeyError:
+            return
+        meta["evicted"].append((time.time(), key, reason))
+        del meta["evicted"][:-20] # Only the latest evictions are kept for the report
+        with self._lock:
+            self.evicted += 1
+
+    def enforce(self, state, page, session_id=None, now=None):
+        """
+        Runs the policy for one session (call once per rerun, before the page renders).
+        Returns the latest size report for the session, or None if it was not measured this time.
+        """
+        now = now or time.time()
+        if META_KEY not in state:
+            state[META_KEY] = {"page_seen": {}, "inspected_at": 0.0, "evicted": []}
+        meta = state[META_KEY]
+        meta["page_seen"][page] = now
+
+        for key, rule in self.policy.items():
+            if key not in state:
+                continue
+            value = state[key]
+            # Stale: the session has not been on any page that uses the value for a while
+            pages = rule.get("pages")
+            if pages and page not in pages:
+                last_seen = max((meta["page_seen"].get(p, 0.0) for p in pages), default=0.0)
+                if now - last_seen > self.stale_seconds:
+                    self._drop(state, key, "stale", meta)
+                    continue
+            # Compaction of growing lists (in place, so references held by the page stay valid)
+            if isinstance(value, list):
+                if "keep_last" in rule and len(value) > rule["keep_last"]:
+                    del value[:len(value) - rule["keep_last"]]
+                elif "keep_first" in rule and len(value) > rule["keep_first"]:
+                    del value[rule["keep_first"]:]
+
+        if now - meta["inspected_at"] < self.inspect_interval:
+            return None
+        meta["inspected_at"] = now
+        rows = inspect(state)
+        total = sum(size for _, size, _ in rows)
+        if total > self.budget:
+            # Over budget: drop the largest rebuildable values the current page does not use
+            for key, size, _ in rows:
+                rule = self.policy.get(key)
+                if total <= self.budget:
+                    break
+                if rule and rule.get("pages") and page not in rule["pages"]:
+                    self._drop(state, key, "budget", meta)
+                    total -= size
+            if total > self.budget:
+                print(f"SessionMemory: Session {session_id} is {total / 1024:.0f} KiB, over the "
+                      f"{self.budget / 1024:.0f} KiB budget; largest keys: {[(k, s) for k, s, _ in rows[:3]]}")
+        report = {"session_id": session_id, "page": page, "total_bytes": total, "keys": rows, "measured_at": now,
+                  "evicted": list(meta["evicted"])}
+        if session_id is not None:
+            with self._lock:
+                self.reports[session_id] = report
+                for old in [sid for sid, r in self.reports.items() if now - r["measured_at"] > REPORT_TTL_SECONDS]:
+                    del self.reports[old]
+        return report
+
+    def top_sessions(self, n=10):
+        """Largest sessions by their latest report: [(session_id, total_bytes, page, top 3 keys)]."""
+        with self._lock:
+            reports = sorted(self.reports.values(), key=lambda r: -r["total_bytes"])[:n]
+        return [(r["session_id"], r["total_bytes"], r["page"], r["keys"][:3]) for r in reports]
+
+    def totals(self):
+        """Sessions reported, their combined size and the number of evictions so far."""
+        with self._lock:
+            return {"sessions": len(self.reports), "total_bytes": sum(r["total_bytes"] for r in self.reports.values()),
+                    "evicted": self.evicted}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_session_memory_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionMemoryManager()
+        return _manager
@@ -0,0 +1,470 @@
+# sos_dispatch.py
+# SOS dispatch service.
+# Every SOS (button, voice, loud sound) is written to an SQLite job queue and handled by a
+# worker that owns the whole pipeline: reverse geocoding, nearest hospitals/police, building
+# the alert and emailing every contact. Because the job lives in the queue, an alert completes
+# even if the page that raised it reruns, navigates away or is closed.
+#
+# Run dedicated workers with:
+#     python sos_dispatch.py worker [--processes N]
+# Several workers (on the same machine/database) can run at once; jobs are claimed atomically
+# and a job whose worker stops heartbeating is picked up by another one. If no dedicated worker
+# is alive, the app starts an in-process worker thread so alerts are never left waiting.
+# The SOS button queues its job as soon as it is pressed, held for up to LOCATION_WAIT_SECONDS
+# so the browser's location fix can be attached (attach_sos_location), which releases it at
+# once. A fix that arrives after the alert went out is sent to the contacts as a follow-up.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# --- Configuration ---
+SOS_QUEUE_DB = os.environ.get("SEFI_SOS_QUEUE_DB", "sos_jobs.db")
+HEARTBEAT_SECONDS = 5.0
+# A running job whose worker has not heartbeated for this long is handed to another worker
+STALE_JOB_SECONDS = 30.0
+# A worker not seen for this long is considered gone (the app then starts its own worker thread)
+WORKER_TIMEOUT_SECONDS = 20.0
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5.0 # Seconds, doubled after every failed attempt
+POLL_INTERVAL = 0.5
+INPROCESS_WORKER = os.environ.get("SEFI_SOS_INPROCESS_WORKER", "auto") # 'auto', 'always' or 'never'
+# How long a button SOS waits for the browser location before it is sent without it
+LOCATION_WAIT_SECONDS = float(os.environ.get("SEFI_SOS_LOCATION_WAIT_SECONDS", "15"))
+
+# Job states
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+FINAL_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+
+class SOSJobQueue:
+    """SQLite-backed SOS job queue. Each call opens its own connection, so it is safe across threads and processes."""
+
+    def __init__(self, db_path=SOS_QUEUE_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Readers (status polling) do not block the workers
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sos_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    incident_id TEXT UNIQUE,
+                    user_id TEXT,
+                    source TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    heartbeat_at REAL,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS sos_jobs_status ON sos_jobs (status, next_attempt_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sos_workers (
+                    worker_id TEXT PRIMARY KEY,
+                    host TEXT,
+                    pid INTEGER,
+                    last_seen REAL NOT NULL
+                )""")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, payload, user_id=None, source=None, incident_id=None, hold_seconds=0):
+        """
+        Adds an SOS job and returns its id. `incident_id` is an idempotency key: enqueuing the
+        same incident twice returns the existing job instead of sending a second alert.
+        A job with `hold_seconds` is not claimed before then unless release() is called.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            if incident_id:
+                row = conn.execute("SELECT id FROM sos_jobs WHERE incident_id = ?", (incident_id,)).fetchone()
+                if row:
+                    return row["id"]
+            cursor = conn.execute(
+                "INSERT INTO sos_jobs (incident_id, user_id, source, payload, status, stage, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (incident_id, str(user_id) if user_id is not None else None, source,
+                 json.dumps(payload, default=str), STATUS_PENDING, "queued", now + hold_seconds, now, now))
+            return cursor.lastrowid
+
+    def release(self, job_id, location=None):
+        """
+        Makes a held job due now, first replacing its location if one is given. Returns False if
+        the job is no longer pending (a worker already took it).
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT payload FROM sos_jobs WHERE id = ? AND status = ? AND attempts = 0",
+                               (job_id, STATUS_PENDING)).fetchone()
+            if row is None:
+                return False
+            payload = json.loads(row["payload"])
+            if location is not None:
+                payload["location"] = location
+            conn.execute("UPDATE sos_jobs SET payload = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                         (json.dumps(payload, default=str), now, now, job_id))
+            return True
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM sos_jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(row)
+
+    def ids_created_since(self, since):
+        """Ids of the jobs queued at or after `since` (a time.time() value), oldest first."""
+        with self._connect() as conn:
+            return [row["id"] for row in conn.execute("SELECT id FROM sos_jobs WHERE created_at >= ? ORDER BY id", (since,))]
+
+    def claim_next(self, worker_id):
+        """Atomically claims the oldest due pending job (or a stale running one) for `worker_id`."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM sos_jobs WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND heartbeat_at < ?) "
+                "ORDER BY id LIMIT 1",
+                (STATUS_PENDING, now, STATUS_RUNNING, now - STALE_JOB_SECONDS)).fetchone()
+            if row is None:
+                return None
+            if row["status"] == STATUS_RUNNING:
+                print(f"SOS: Job {row['id']} lost its worker {row['worker_id']}, taking it over.")
+            conn.execute(
+                "UPDATE sos_jobs SET status = ?, worker_id = ?, heartbeat_at = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (STATUS_RUNNING, worker_id, now, now, row["id"]))
+            job = _decode(row)
+            job.update(status=STATUS_RUNNING, worker_id=worker_id, attempts=row["attempts"] + 1)
+            return job
+
+    def heartbeat(self, job_id, worker_id, stage=None, result=None):
+        """Refreshes the job's heartbeat (and progress). Returns False if another worker owns it now."""
+        now = time.time()
+        fields, params = ["heartbeat_at = ?", "updated_at = ?"], [now, now]
+        if stage is not None:
+            fields.append("stage = ?")
+            params.append(stage)
+        if result is not None:
+            fields.append("result = ?")
+            params.append(json.dumps(result, default=str))
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE sos_jobs SET {', '.join(fields)} WHERE id = ? AND worker_id = ? AND status = ?",
+                (*params, job_id, worker_id, STATUS_RUNNING))
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, worker_id, result):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sos_jobs SET status = ?, stage = ?, result = ?, error = NULL, updated_at = ? WHERE id = ? AND worker_id = ?",
+                (STATUS_DONE, "done", json.dumps(result, default=str), now, job_id, worker_id))
+
+    def fail(self, job_id, worker_id, error, attempts, result=None):
+        """Schedules a retry with exponential backoff, or marks the job failed after MAX_ATTEMPTS."""
+        now = time.time()
+        final = attempts >= MAX_ATTEMPTS
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sos_jobs SET status = ?, error = ?, result = COALESCE(?, result), next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ?",
+                (STATUS_FAILED if final else STATUS_PENDING, str(error),
+                 json.dumps(result, default=str) if result is not None else None,
+                 now + RETRY_BASE_DELAY * (2 ** (attempts - 1)), now, job_id, worker_id))
+        return final
+
+    # --- Worker registry ---
+    def register_worker(self, worker_id):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sos_workers (worker_id, host, pid, last_seen) VALUES (?, ?, ?, ?)",
+                         (worker_id, socket.gethostname(), os.getpid(), time.time()))
+
+    def unregister_worker(self, worker_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sos_workers WHERE worker_id = ?", (worker_id,))
+
+    def live_workers(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM sos_workers WHERE last_seen >= ?", (time.time() - WORKER_TIMEOUT_SECONDS,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def _decode(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"]) if job.get("payload") else {}
+    job["result"] = json.loads(job["result"]) if job.get("result") else {}
+    return job
+
+
+# --- Pipeline ---
+def _load_services(hospital_csv_path, police_csv_path):
+    """Service datasets, shared with the app's sessions through the dataset registry."""
+    from datasets import get_service_datasets
+    datasets = get_service_datasets(hospital_csv_path, police_csv_path)
+    return datasets.hospital_df, datasets.police_df
+
+
+def run_pipeline(job, progress):
+    """
+    Runs the SOS steps for one job. `progress(stage, result)` is called after every step so the
+    job's state is visible while it runs. Results of steps that already completed in an earlier
+    attempt are reused, so a retry never sends an email twice.
+    """
+    from emergency_services import get_address_from_coords, build_sos_email_body, valid_contact_emails
+    from service_cache import find_nearest_services_cached
+
+    payload = job["payload"]
+    result = dict(job.get("result") or {})
+    location = payload.get("location")
+    has_coordinates = isinstance(location, dict) and 'latitude' in location and 'longitude' in location and 'error' not in location
+
+    # 1. Address of the location
+    if "address_details" not in result:
+        progress("geocoding", result)
+        if has_coordinates:
+            result["address_details"] = get_address_from_coords(location['latitude'], location['longitude'])
+        else:
+            result["address_details"] = None
+        progress("geocoded", result)
+
+    # 2. Nearest emergency services
+    if "nearest_hospitals" not in result:
+        progress("finding_services", result)
+        if has_coordinates:
+            hospital_df, police_df = _load_services(payload.get("hospital_csv_path"), payload.get("police_csv_path"))
+            lat, lon = location['latitude'], location['longitude']
+            result["nearest_hospitals"] = find_nearest_services_cached(
+                lat, lon, hospital_df, service_type='Hospital', name_col='id', lat_col='Latitude', lon_col='Longitude',
+                num_results=5, radius_km=10.0) if hospital_df is not None else [{"info": "Hospital data not available for search."}]
+            result["nearest_police_stations"] = find_nearest_services_cached(
+                lat, lon, police_df, service_type='Police Station', name_col='name', lat_col='lat', lon_col='lng',
+                num_results=5, radius_km=10.0) if police_df is not None else [{"info": "Police station data not available for search."}]
+        else:
+            result["nearest_hospitals"] = [{"info": "Location not available, nearest services not searched."}]
+            result["nearest_police_stations"] = [{"info": "Location not available, nearest services not searched."}]
+        progress("services_found", result)
+
+    # 3. Fan-out to contacts (each address is only emailed once across retries)
+    emails = valid_contact_emails(payload.get("contacts"))
+    notified = set(result.get("notified", []))
+    pending = [email for email in emails if email not in notified]
+    if not emails:
+        result["notify_info"] = "No valid email contacts."
+    elif pending:
+        progress("notifying", result)
+        from email_alert import send_alert_email
+        user = payload.get("user") or {}
+        body = build_sos_email_body(user.get('name', 'User'), user.get('email', 'N/A User'), location,
+                                    result["address_details"], result["nearest_hospitals"], result["nearest_police_stations"])
+        if payload.get("location_update_for"):
+            body = "Location update: the browser's location became available after the first SOS alert was sent.\n\n" + body
+        elif payload.get("source") and payload["source"] != "button":
+            body = f"Triggered automatically by {payload['source']} detection ({payload.get('keyword', 'unknown')}).\n\n" + body
+        send_alert_email(contacts=pending,
+                         location={'raw': location, 'detailed': result["address_details"], 'email_body_string': body},
+                         video_link=payload.get("video_link"))
+        result["notified"] = sorted(notified | set(pending))
+        result["notified_at"] = time.time()
+    return result
+
+
+class SOSWorker:
+    """Claims SOS jobs from the queue and runs the pipeline, heartbeating while a job runs."""
+
+    def __init__(self, queue=None, worker_id=None):
+        self.queue = queue or SOSJobQueue()
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run_forever(self):
+        print(f"SOS: Worker {self.worker_id} started (queue {self.queue.db_path}).")
+        last_registered = 0
+        try:
+            while not self._stop_event.is_set():
+                if time.time() - last_registered >= HEARTBEAT_SECONDS:
+                    self.queue.register_worker(self.worker_id)
+                    last_registered = time.time()
+                if not self.run_once():
+                    self._stop_event.wait(POLL_INTERVAL)
+        finally:
+            self.queue.unregister_worker(self.worker_id)
+            print(f"SOS: Worker {self.worker_id} stopped.")
+
+    def run_once(self):
+        """Processes one job if one is due. Returns True if a job was processed."""
+        job = self.queue.claim_next(self.worker_id)
+        if job is None:
+            return False
+        started = time.time()
+        print(f"SOS: Worker {self.worker_id} processing job {job['id']} (attempt {job['attempts']}, source {job['source']}).")
+
+        # Heartbeat from a side thread, so slow geocoding or SMTP calls do not make the job look stale
+        done = threading.Event()
+        def beat():
+            while not done.wait(HEARTBEAT_SECONDS):
+                self.queue.heartbeat(job["id"], self.worker_id)
+        threading.Thread(target=beat, name=f"sos-heartbeat-{job['id']}", daemon=True).start()
+
+        state = {"result": job.get("result") or {}}
+        def progress(stage, result):
+            state["result"] = result
+            self.queue.heartbeat(job["id"], self.worker_id, stage=stage, result=result)
+
+        try:
+            result = run_pipeline(job, progress)
+            result["completed_in_seconds"] = round(time.time() - started, 2)
+            self.queue.finish(job["id"], self.worker_id, result)
+            print(f"SOS: Job {job['id']} completed in {result['completed_in_seconds']}s.")
+        except Exception as e:
+            final = self.queue.fail(job["id"], self.worker_id, e, job["attempts"], state["result"])
+            print(f"SOS: Job {job['id']} failed ({'giving up' if final else 'will retry'}): {e}")
+        finally:
+            done.set()
+        return True
+
+
+# --- App-side helpers ---
+_queue = None
+_local_worker = None
+_local_worker_lock = threading.Lock()
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = SOSJobQueue()
+    return _queue
+
+
+def ensure_worker():
+    """
+    Makes sure someone will process the queue: if no dedicated worker process is alive
+    (or SEFI_SOS_INPROCESS_WORKER=always), a worker thread is started in this process.
+    """
+    global _local_worker
+    if INPROCESS_WORKER == "never":
+        return
+    with _local_worker_lock:
+        if _local_worker is not None and _local_worker[1].is_alive():
+            return
+        if INPROCESS_WORKER != "always" and get_queue().live_workers():
+            return
+        worker = SOSWorker(get_queue())
+        thread = threading.Thread(target=worker.run_forever, name="sos-dispatch-worker", daemon=True)
+        thread.start()
+        _local_worker = (worker, thread)
+
+
+def enqueue_sos(user, source="button", location=None, contacts=None, incident_id=None, keyword=None,
+                hospital_csv_path=None, police_csv_path=None, video_link=None, wait_for_location=False):
+    """
+    Queues an SOS alert and returns the job id. Everything the worker needs is captured in
+    the payload now, so nothing depends on the page that raised the alert afterwards.
+    With `wait_for_location` the job is held for LOCATION_WAIT_SECONDS (see attach_sos_location)
+    and then sent with `location`, which may be None.
+    """
+    user = user or {}
+    payload = {
+        "user": {"id": user.get('id'), "name": user.get('name'), "email": user.get('email')},
+        "source": source,
+        "keyword": keyword,
+        "location": location,
+        "contacts": [{"email": c.get('email'), "name": c.get('name')} for c in contacts or [] if isinstance(c, dict)],
+        "hospital_csv_path": hospital_csv_path,
+        "police_csv_path": police_csv_path,
+        "video_link": video_link,
+        "requested_at": time.time(),
+    }
+    job_id = get_queue().enqueue(payload, user_id=user.get('id'), source=source, incident_id=incident_id,
+                                 hold_seconds=LOCATION_WAIT_SECONDS if wait_for_location else 0)
+    ensure_worker()
+    print(f"SOS: Queued job {job_id} for user {user.get('id')} (source {source}).")
+    return job_id
+
+
+def attach_sos_location(job_id, location):
+    """
+    Gives a queued SOS the location that arrived after it was raised, and sends it now (pass
+    None when the location failed, to stop waiting). If the alert has already gone out, a
+    follow-up alert with the location is queued. Returns the id of the job that carries it.
+    """
+    queue = get_queue()
+    if queue.release(job_id, location):
+        print(f"SOS: Job {job_id} released{' with the browser location' if location is not None else ''}.")
+        return job_id
+    job = queue.get(job_id)
+    if location is None or job is None:
+        return job_id
+    payload = dict(job["payload"], location=location, location_update_for=job_id, requested_at=time.time())
+    follow_up = queue.enqueue(payload, user_id=job.get("user_id"), source=job.get("source"))
+    ensure_worker()
+    print(f"SOS: Job {job_id} already started; queued location update {follow_up}.")
+    return follow_up
+
+
+def get_sos_job(job_id):
+    return get_queue().get(job_id)
+
+
+def _run_worker_process():
+    SOSWorker().run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SOS dispatch worker.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="Process SOS jobs until interrupted.")
+    worker.add_argument("--processes", type=int, default=1, help="Number of worker processes to run.")
+    status = sub.add_parser("status", help="Show live workers and recent jobs.")
+    status.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        if args.processes <= 1:
+            try:
+                SOSWorker().run_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+        import multiprocessing
+        processes = [multiprocessing.Process(target=_run_worker_process, name=f"sos-worker-{i}") for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+    elif args.command == "status":
+        queue = get_queue()
+        print(f"Live workers: {[w['worker_id'] for w in queue.live_workers()]}")
+        with queue._connect() as conn:
+            rows = conn.execute("SELECT id, source, status, stage, attempts, error, created_at FROM sos_jobs ORDER BY id DESC LIMIT ?",
+                                (args.limit,)).fetchall()
+        for row in rows:
+            print(dict(row))
+
+
+if __name__ == "__main__":
+    main()
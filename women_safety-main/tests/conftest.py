@@ -0,0 +1,5 @@
+# The app's modules live next to this directory rather than in a package
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from audio_trigger import LOUD_ON_DBFS, frame_features, to_mono_float
+
+SAMPLE_RATE = 48000
+
+
+def fake_frame(samples, channels, planar):
+    """Stands in for an av.AudioFrame: to_ndarray() returns (channels, n) when planar, else (1, n * channels)."""
+    return SimpleNamespace(to_ndarray=lambda: samples, layout=SimpleNamespace(channels=[None] * channels),
+                           format=SimpleNamespace(is_planar=planar))
+
+
+def tone(dbfs, seconds=0.2):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    # Peak amplitude of a sine with the given RMS level
+    return np.sqrt(2) * 10 ** (dbfs / 20) * np.sin(2 * np.pi * 440 * t)
+
+
+def as_int16(signal):
+    return np.round(signal * 32768).astype(np.int16)
+
+
+@pytest.mark.parametrize("channels, planar", [(1, False), (2, False), (2, True)])
+def test_int16_frames_are_scaled_to_full_scale(channels, planar):
+    mono = as_int16(tone(-43))
+    if planar:
+        samples = np.vstack([mono] * channels)
+    else:
+        samples = np.repeat(mono, channels).reshape(1, -1) # Interleaved L, R, L, R, ...
+    out = to_mono_float(fake_frame(samples, channels, planar))
+    assert out.dtype == np.float32
+    assert len(out) == len(mono)
+    assert np.abs(out).max() <= 1.0
+    levels = frame_features(out, SAMPLE_RATE)["rms_dbfs"]
+    np.testing.assert_allclose(levels, -43, atol=0.5)
+    assert (levels < LOUD_ON_DBFS).all()
+
+
+def test_int16_extremes_stay_within_range():
+    samples = np.array([[-32768, 32767, 0, -1]], dtype=np.int16)
+    out = to_mono_float(fake_frame(samples, 1, False))
+    assert out[0] == -1.0
+    assert out[1] < 1.0
+    assert out[2] == 0.0
+
+
+def test_float_frames_are_not_rescaled():
+    mono = tone(-10).astype(np.float32)
+    out = to_mono_float(fake_frame(np.vstack([mono, mono]), 2, True))
+    np.testing.assert_allclose(out, mono, atol=1e-6)
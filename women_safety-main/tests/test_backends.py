@@ -0,0 +1,47 @@
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from backends import InMemoryCollection
+
+
+@pytest.fixture
+def collection():
+    collection = InMemoryCollection("contacts")
+    collection.create_index([("user_id", 1), ("phone", 1)], unique=True)
+    return collection
+
+
+def contact(phone):
+    return InsertOne({"user_id": "u1", "phone": phone})
+
+
+def test_unordered_bulk_write_continues_past_duplicates(collection):
+    with pytest.raises(BulkWriteError) as raised:
+        collection.bulk_write([contact("1"), contact("1"), contact("2"), contact("2")], ordered=False)
+    details = raised.value.details
+    assert details["nInserted"] == 2
+    assert [(error["index"], error["code"]) for error in details["writeErrors"]] == [(1, 11000), (3, 11000)]
+    assert collection.count_documents({}) == 2
+
+
+def test_ordered_bulk_write_stops_at_the_first_error(collection):
+    with pytest.raises(BulkWriteError) as raised:
+        collection.bulk_write([contact("1"), contact("1"), contact("2")])
+    assert raised.value.details["nInserted"] == 1
+    assert [error["index"] for error in raised.value.details["writeErrors"]] == [1]
+    assert collection.count_documents({}) == 1
+
+
+def test_bulk_write_counts_deletes(collection):
+    collection.bulk_write([contact("1"), contact("2")])
+    result = collection.bulk_write([DeleteOne({"phone": "1"}), DeleteOne({"phone": "9"})], ordered=False)
+    assert (result.inserted_count, result.deleted_count) == (0, 1)
+
+
+def test_unsupported_requests_are_rejected_before_any_write(collection):
+    with pytest.raises(TypeError):
+        collection.bulk_write([contact("1"), UpdateOne({"phone": "1"}, {"$set": {"name": "A"}})])
+    assert collection.count_documents({}) == 0
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import coverage_grid
+
+BOUNDS = {"lat_min": 12.0, "lat_max": 14.0, "lon_min": 79.0, "lon_max": 81.0}
+
+
+def service_frames(police_version):
+    hospital = pd.DataFrame({"Latitude": [13.0], "Longitude": [80.2]})
+    hospital.attrs["dataset_version"] = "sha256:hospital"
+    police = pd.DataFrame({"lat": [13.1], "lng": [80.3]})
+    police.attrs["dataset_version"] = police_version
+    return hospital, police
+
+
+def serve_versions(monkeypatch, hospital, police):
+    monkeypatch.setattr(coverage_grid, "get_service_datasets", lambda: SimpleNamespace(versions=(hospital, police)))
+
+
+def test_grid_records_the_versions_it_was_built_from(tmp_path, monkeypatch):
+    path = str(tmp_path / "grid.npz")
+    coverage_grid.build_coverage_grid(*service_frames("sha256:base"), resolution=0.5, bounds=BOUNDS).save(path)
+    monkeypatch.setattr(coverage_grid, "_grid", None)
+    serve_versions(monkeypatch, "sha256:hospital", "sha256:base")
+    grid = coverage_grid.get_coverage_grid(path)
+    assert grid is not None
+    assert grid.meta["dataset_versions"] == {"police": "sha256:base", "hospital": "sha256:hospital"}
+
+
+def test_grid_is_ignored_once_a_delta_changes_the_served_version(tmp_path, monkeypatch):
+    path = str(tmp_path / "grid.npz")
+    coverage_grid.build_coverage_grid(*service_frames("sha256:base"), resolution=0.5, bounds=BOUNDS).save(path)
+    monkeypatch.setattr(coverage_grid, "_grid", None)
+    # Same base file, one published delta: the registry's chained version differs
+    serve_versions(monkeypatch, "sha256:hospital", "sha256:chained")
+    assert coverage_grid.get_coverage_grid(path) is None
+    serve_versions(monkeypatch, "sha256:hospital", "sha256:base")
+    assert coverage_grid.get_coverage_grid(path) is not None
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datasets import apply_delta, read_delta
+
+
+def police_frame():
+    return pd.DataFrame({
+        "name": ["A", "B", "C", "D"],
+        "lat": [28.6, 19.0, 13.0, 22.5],
+        "lng": [77.2, 72.8, 80.2, 88.3],
+        "district": ["Delhi", "Mumbai", "Chennai", "Kolkata"],
+    })
+
+
+def write_delta(tmp_path, rows):
+    path = tmp_path / "changes.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return read_delta(str(path), "police")
+
+
+def test_add_appends_new_rows(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "add", "name": "E", "lat": 26.9, "lng": 75.8, "district": "Jaipur"}])
+    frame, remap, added, counts = apply_delta(police_frame(), delta, "police")
+    assert list(frame["name"]) == ["A", "B", "C", "D", "E"]
+    assert list(remap) == [0, 1, 2, 3]
+    assert list(added) == [4]
+    assert counts == {"added": 1, "updated": 0, "deleted": 0, "missing_deletes": 0}
+
+
+def test_update_replaces_row_and_keeps_blank_columns(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "update", "name": "B", "lat": 19.1, "lng": None, "district": None}])
+    frame, remap, added, counts = apply_delta(police_frame(), delta, "police")
+    assert list(frame["name"]) == ["A", "C", "D", "B"]
+    assert list(remap) == [0, -1, 1, 2]
+    assert list(added) == [3]
+    updated = frame.iloc[3]
+    assert updated["lat"] == 19.1
+    assert updated["lng"] == 72.8 # Left blank in the delta, so taken from the current row
+    assert updated["district"] == "Mumbai"
+    assert counts["updated"] == 1 and counts["added"] == 0
+
+
+def test_update_of_missing_key_adds_it(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "update", "name": "Z", "lat": 10.0, "lng": 76.0, "district": "Kochi"}])
+    frame, _, added, counts = apply_delta(police_frame(), delta, "police")
+    assert frame.iloc[added[0]]["name"] == "Z"
+    assert counts["added"] == 1 and counts["updated"] == 0
+
+
+def test_add_of_existing_key_replaces_it(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "add", "name": "A", "lat": 28.7, "lng": 77.1, "district": "New Delhi"}])
+    frame, remap, _, counts = apply_delta(police_frame(), delta, "police")
+    assert list(frame["name"]) == ["B", "C", "D", "A"]
+    assert remap[0] == -1
+    assert frame.iloc[3]["district"] == "New Delhi"
+    assert counts["updated"] == 1
+
+
+def test_delete_removes_rows_and_counts_missing_keys(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "delete", "name": "C"}, {"op": "delete", "name": "nope"}])
+    frame, remap, added, counts = apply_delta(police_frame(), delta, "police")
+    assert list(frame["name"]) == ["A", "B", "D"]
+    assert list(remap) == [0, 1, -1, 2]
+    assert len(added) == 0
+    assert counts == {"added": 0, "updated": 0, "deleted": 1, "missing_deletes": 1}
+
+
+def test_last_row_for_a_key_wins(tmp_path):
+    delta = write_delta(tmp_path, [
+        {"op": "add", "name": "E", "lat": 26.9, "lng": 75.8, "district": "Jaipur"},
+        {"op": "delete", "name": "E"},
+    ])
+    frame, _, _, counts = apply_delta(police_frame(), delta, "police")
+    assert "E" not in set(frame["name"])
+    assert counts["missing_deletes"] == 1
+
+
+def test_original_frame_is_not_modified(tmp_path):
+    original = police_frame()
+    before = original.copy()
+    delta = write_delta(tmp_path, [{"op": "delete", "name": "A"}, {"op": "update", "name": "B", "lat": 1.0}])
+    apply_delta(original, delta, "police")
+    pd.testing.assert_frame_equal(original, before)
+
+
+@pytest.mark.parametrize("rows, message", [
+    ([{"op": "rename", "name": "A"}], "unknown op"),
+    ([{"op": "add", "name": "E", "lat": "x", "lng": 75.8}], "non-numeric"),
+    ([{"op": "delete", "name": None}], "without a name"),
+])
+def test_unusable_deltas_are_rejected(tmp_path, rows, message):
+    with pytest.raises(ValueError, match=message):
+        write_delta(tmp_path, rows)
+
+
+def test_remap_keeps_positions_of_untouched_rows(tmp_path):
+    delta = write_delta(tmp_path, [{"op": "delete", "name": "A"}, {"op": "add", "name": "E", "lat": 26.9, "lng": 75.8}])
+    old = police_frame()
+    frame, remap, _, _ = apply_delta(old, delta, "police")
+    for i, new_position in enumerate(remap):
+        if new_position >= 0:
+            assert frame.iloc[new_position]["name"] == old.iloc[i]["name"]
+    assert np.count_nonzero(remap >= 0) == 3
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from risk_scoring import CompiledTrees, PickledModel, TimeOfDayAdjusted, compile_classifier
+
+ensemble = pytest.importorskip("sklearn.ensemble")
+
+
+@pytest.fixture(scope="module")
+def hist_gbm():
+    rng = np.random.default_rng(0)
+    x = np.column_stack((rng.integers(0, 100, 1500), rng.random(1500) * 20, rng.random(1500) * 20,
+                         (rng.random(1500) > 0.9).astype(float)))
+    x[::13, 1] = np.nan
+    y = ((x[:, 0] + rng.normal(0, 20, 1500)) > 60).astype(int)
+    return ensemble.HistGradientBoostingClassifier(max_iter=50, max_depth=4, random_state=0).fit(x, y), x
+
+
+def test_compiled_trees_match_the_library(hist_gbm):
+    model, x = hist_gbm
+    compiled = compile_classifier(model)
+    assert isinstance(compiled, CompiledTrees)
+    np.testing.assert_allclose(compiled.predict_proba(x), model.predict_proba(x), atol=1e-12)
+
+
+def test_compiled_trees_send_missing_values_like_the_library(hist_gbm):
+    model, x = hist_gbm
+    x = x.copy()
+    x[:, 2] = np.nan
+    np.testing.assert_allclose(compile_classifier(model).predict_proba(x), model.predict_proba(x), atol=1e-12)
+
+
+def test_pickled_time_of_day_model_is_compiled_at_load(hist_gbm):
+    model, x = hist_gbm
+    wrapped = TimeOfDayAdjusted(model)
+    features = np.column_stack((x, np.sin(x[:, 1]), np.cos(x[:, 1])))
+    served = PickledModel(wrapped, "test")
+    assert isinstance(served.model.model, CompiledTrees)
+    np.testing.assert_allclose(served.predict_proba(features), wrapped.predict_proba(features)[:, 1], atol=1e-12)
+    assert served.predict_proba(features[:1]).shape == (1,)
+
+
+def test_other_classifiers_are_served_as_they_are():
+    model = ensemble.RandomForestClassifier(n_estimators=2).fit([[0.0], [1.0]], [0, 1])
+    assert compile_classifier(model) is model
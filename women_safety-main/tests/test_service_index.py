@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import service_index
+from datasets import Dataset
+from service_index import ServiceIndex
+
+
+def random_police(rng, n):
+    return pd.DataFrame({
+        "name": [f"P{i}" for i in range(n)],
+        "lat": rng.uniform(8.0, 35.0, n),
+        "lng": rng.uniform(68.0, 97.0, n),
+    })
+
+
+def random_delta(rng, frame, n_add, n_update, n_delete, prefix):
+    names = frame["name"].to_numpy()
+    picked = rng.choice(len(names), n_update + n_delete, replace=False)
+    rows = [{"op": "delete", "name": names[i]} for i in picked[n_update:]]
+    rows += [{"op": "update", "name": names[i], "lat": rng.uniform(8.0, 35.0), "lng": rng.uniform(68.0, 97.0)}
+             for i in picked[:n_update]]
+    rows += [{"op": "add", "name": f"{prefix}{i}", "lat": rng.uniform(8.0, 35.0), "lng": rng.uniform(68.0, 97.0)}
+             for i in range(n_add)]
+    return pd.DataFrame(rows, columns=["op", "name", "lat", "lng"])
+
+
+def nearest_names(index, frame, points, k, radius_km=None):
+    indices, distances = index.query(points[:, 0], points[:, 1], k=k, radius_km=radius_km)
+    names = np.where(indices >= 0, frame["name"].to_numpy()[np.maximum(indices, 0)], None)
+    return names, distances
+
+
+@pytest.mark.parametrize("use_tree", [True, False])
+@pytest.mark.parametrize("radius_km", [None, 150.0])
+def test_updated_index_matches_a_fresh_build(monkeypatch, use_tree, radius_km):
+    # Keep the overlay path (no compaction) for the whole chain of deltas
+    monkeypatch.setattr(service_index, "COMPACT_FRACTION", 1.0)
+    rng = np.random.default_rng(7)
+    dataset = Dataset("police", "police.csv", random_police(rng, 400), "v0")
+    dataset._index = ServiceIndex(dataset.lats, dataset.lons, use_tree=use_tree)
+    points = np.column_stack((rng.uniform(8.0, 35.0, 300), rng.uniform(68.0, 97.0, 300)))
+    points[::50] = np.nan # Invalid points get no services
+
+    # Tombstones and overlay entries from one delta must survive the next one
+    for step in range(3):
+        delta = random_delta(rng, dataset.frame, n_add=15, n_update=10, n_delete=12, prefix=f"N{step}-")
+        dataset = dataset.with_delta(delta, (f"delta{step}.csv", f"v{step + 1}"))
+        assert dataset._index.dead is not None and len(dataset._index.extra_positions)
+
+        fresh = ServiceIndex(dataset.lats, dataset.lons, use_tree=use_tree)
+        assert len(dataset._index) == len(fresh) == len(dataset.frame)
+        for k in (1, 5):
+            names, distances = nearest_names(dataset._index, dataset.frame, points, k, radius_km)
+            fresh_names, fresh_distances = nearest_names(fresh, dataset.frame, points, k, radius_km)
+            np.testing.assert_allclose(distances, fresh_distances)
+            assert (names == fresh_names).all()
+
+
+def test_delta_deleting_everything_leaves_an_empty_result(monkeypatch):
+    monkeypatch.setattr(service_index, "COMPACT_FRACTION", 1.0)
+    rng = np.random.default_rng(3)
+    frame = random_police(rng, 20)
+    dataset = Dataset("police", "police.csv", frame, "v0")
+    dataset._index = ServiceIndex(dataset.lats, dataset.lons)
+    delta = pd.DataFrame({"op": "delete", "name": frame["name"]})
+    dataset = dataset.with_delta(delta, ("delete-all.csv", "v1"))
+    indices, distances = dataset._index.query([20.0], [78.0], k=3)
+    assert (indices == -1).all() and np.isinf(distances).all()
+    assert len(dataset._index) == 0
+
+
+def test_too_many_changes_rebuild_the_index():
+    rng = np.random.default_rng(11)
+    dataset = Dataset("police", "police.csv", random_police(rng, 100), "v0")
+    dataset._index = ServiceIndex(dataset.lats, dataset.lons)
+    delta = random_delta(rng, dataset.frame, n_add=30, n_update=0, n_delete=0, prefix="N")
+    dataset = dataset.with_delta(delta, ("big.csv", "v1"))
+    assert dataset._index.dead is None and len(dataset._index.extra_positions) == 0
+    assert len(dataset._index) == 130
@@ -0,0 +1,30 @@
+import pandas as pd
+
+import validate_datasets
+from datasets import dataset_version
+from emergency_services import load_service_frames
+
+
+def police_csv(tmp_path):
+    path = tmp_path / "police.csv"
+    pd.DataFrame({
+        "name": ["A", "B", "C"],
+        "lat": [28.6, 19.0, 13.0],
+        "lng": [77.2, 72.8, 80.2],
+        "address": ["a", "b", "c"],
+        "state": ["Delhi", "Maharashtra", "Tamil Nadu"],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_artifact_frames_are_versioned_apart_from_the_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(validate_datasets, "VALIDATED_DIR", str(tmp_path / "validated"))
+    path = police_csv(tmp_path)
+    _, csv_frame, _ = load_service_frames(str(tmp_path / "missing.csv"), path)
+    validate_datasets.validate_dataset("police", path)
+    _, artifact_frame, _ = load_service_frames(str(tmp_path / "missing.csv"), path)
+
+    assert artifact_frame.attrs["validated_artifact"]
+    assert csv_frame.attrs["dataset_version"] == dataset_version(path)
+    assert artifact_frame.attrs["dataset_version"] == validate_datasets.artifact_version(dataset_version(path), 3)
+    assert artifact_frame.attrs["dataset_version"] != csv_frame.attrs["dataset_version"]
@@ -0,0 +1,374 @@
+# train_safety_model.py
+# Training pipeline for the location risk model used by the safety check (risk_scoring.py).
+#
+# Training data: one row per (district, year) of the crime CSV.
+#   - label:   1 if the district's rape + murder total is in the top quarter of that year
+#   - crime:   the district's total in the previous year (so the label is not in the features)
+#   - police_km / hospital_km / danger_zone: measured at the district's centre, taken as the
+#     mean position of the district's hospitals (or of the police stations in a city of that name)
+# The crime data has no time of day, so the model is trained on these four features and the
+# default time-of-day weights are added on top (risk_scoring.TimeOfDayAdjusted).
+#
+# Features are built incrementally and cached under feature_cache/ (in SEFI_DATA_DIR, like models/):
+#   - districts.parquet: the per-district geographic features. Only districts not seen before are
+#     computed, unless the service datasets or danger zones changed.
+#   - year=<YYYY>.parquet: one partition per crime year. A partition is rebuilt only if the crime
+#     rows of that year or the year before changed, so adding a year or a district only
+#     recomputes the partitions it touches.
+# The model is a gradient-boosted tree ensemble trained on all CPU cores: XGBoost if installed,
+# otherwise scikit-learn's HistGradientBoostingClassifier. The artifact is written to
+# models/risk_model-<version>.pkl with a .meta.json next to it; point SEFI_RISK_MODEL at it or
+# use --promote to replace the model the app loads (the model server picks it up without a restart).
+# The app compiles the trees at load (risk_scoring.compile_classifier); the .meta.json records the
+# single-point latency of that compiled model against SINGLE_POINT_BUDGET_MS.
+#
+#     python train_safety_model.py [--crime-data path.csv] [--promote models/risk_model.pkl]
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import platform
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from datasets import DATA_DIR
+from risk_scoring import CRIME_DATA_PATH, DANGER_ZONES_PATH, DangerZones, PickledModel, TimeOfDayAdjusted, read_crime_table
+
+# Optional gradient boosting libraries
+try:
+    import xgboost
+    _XGBOOST_AVAILABLE = True
+except ImportError:
+    _XGBOOST_AVAILABLE = False
+
+try:
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    _SKLEARN_AVAILABLE = True
+except ImportError:
+    _SKLEARN_AVAILABLE = False
+
+# Parquet needs pyarrow or fastparquet; without either the cache is written as pickles
+try:
+    import pyarrow # noqa: F401
+    _PARQUET_AVAILABLE = True
+except ImportError:
+    try:
+        import fastparquet # noqa: F401
+        _PARQUET_AVAILABLE = True
+    except ImportError:
+        _PARQUET_AVAILABLE = False
+
+# --- Configuration ---
+# Relative paths are under DATA_DIR, like the datasets
+FEATURE_CACHE_DIR = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_FEATURE_CACHE", "feature_cache")))
+MODELS_DIR = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_MODELS_DIR", "models")))
+TRAIN_FEATURES = ("crime", "police_km", "hospital_km", "danger_zone")
+# Share of districts per year labelled unsafe
+UNSAFE_QUANTILE = 0.75
+RANDOM_SEED = 0
+MANIFEST_VERSION = 1
+# Latency target for scoring one location with the served (compiled) model
+SINGLE_POINT_BUDGET_MS = 1.0
+LATENCY_REPEATS = 500
+
+
+# --- Feature cache ---
+def _cache_path(name):
+    return os.path.join(FEATURE_CACHE_DIR, name + (".parquet" if _PARQUET_AVAILABLE else ".pkl"))
+
+
+def _write_frame(df, name):
+    path = _cache_path(name)
+    tmp_path = path + ".tmp"
+    if _PARQUET_AVAILABLE:
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_frame(name):
+    path = _cache_path(name)
+    return pd.read_parquet(path) if _PARQUET_AVAILABLE else pd.read_pickle(path)
+
+
+def _load_manifest():
+    try:
+        with open(os.path.join(FEATURE_CACHE_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("parquet") == _PARQUET_AVAILABLE:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "parquet": _PARQUET_AVAILABLE, "geo_version": None, "years": {}}
+
+
+def _save_manifest(manifest):
+    path = os.path.join(FEATURE_CACHE_DIR, "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _frame_hash(df):
+    """Order-independent content hash of a DataFrame's rows."""
+    row_hashes = np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+
+
+# --- District geography ---
+def district_centres(hospital_df, police_df):
+    """DataFrame DISTRICT, lat, lon: mean hospital position per district, police stations per city as a fallback."""
+    frames = []
+    for df, name_col, lat_col, lon_col in ((hospital_df, "District", "Latitude", "Longitude"), (police_df, "city", "lat", "lng")):
+        if df is None or name_col not in df.columns:
+            continue
+        points = pd.DataFrame({
+            "DISTRICT": df[name_col].astype(str).str.strip().str.lower(),
+            "lat": pd.to_numeric(df[lat_col], errors='coerce'),
+            "lon": pd.to_numeric(df[lon_col], errors='coerce'),
+        }).dropna()
+        frames.append(points.groupby("DISTRICT", as_index=False)[["lat", "lon"]].mean())
+    if not frames:
+        return pd.DataFrame(columns=["DISTRICT", "lat", "lon"])
+    # Earlier frames (hospital districts) win over later ones (police cities)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("DISTRICT", keep="first")
+
+
+def build_district_features(districts, centres, hospital_df, police_df, zones):
+    """Geographic features for the given district names (districts without a known centre are dropped)."""
+    from service_index import nearest_services_batch, SERVICE_PRESETS
+
+    geo = centres[centres["DISTRICT"].isin(set(districts))].reset_index(drop=True)
+    for layer, services_df in (("police", police_df), ("hospital", hospital_df)):
+        if services_df is None or geo.empty:
+            geo[f"{layer}_km"] = np.nan
+            continue
+        preset = SERVICE_PRESETS[layer]
+        _, distances = nearest_services_batch(geo["lat"], geo["lon"], services_df, preset["lat_col"], preset["lon_col"])
+        geo[f"{layer}_km"] = np.where(np.isfinite(distances[:, 0]), distances[:, 0], np.nan)
+    geo["danger_zone"] = zones.contains(geo["lat"].to_numpy(), geo["lon"].to_numpy()).astype(float) if len(zones) else 0.0
+    return geo
+
+
+def build_year_partition(crime, year):
+    """(district, year) rows for one year: previous-year crime as the feature, this year's rank as the label."""
+    current = crime[crime["YEAR"] == year].groupby("DISTRICT", as_index=False)["TOTAL"].sum()
+    previous = crime[crime["YEAR"] == year - 1].groupby("DISTRICT")["TOTAL"].sum().rename("crime")
+    rows = current.join(previous, on="DISTRICT", how="inner")
+    rows["YEAR"] = year
+    rows["label"] = (rows["TOTAL"] >= rows["TOTAL"].quantile(UNSAFE_QUANTILE)).astype(int)
+    return rows[["DISTRICT", "YEAR", "crime", "TOTAL", "label"]]
+
+
+def build_features(crime_path=CRIME_DATA_PATH, rebuild=False):
+    """Updates the feature cache and returns the full training table."""
+    from emergency_services import load_service_frames, dataset_file_version, HOSPITAL_CSV_PATH, POLICE_CSV_PATH
+
+    crime = read_crime_table(crime_path)
+    if crime is None or crime.empty:
+        raise SystemExit(f"No usable crime data at {crime_path} (needs DISTRICT, YEAR, RAPE and MURDER columns).")
+    crime = crime[["DISTRICT", "YEAR", "TOTAL"]]
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    manifest = {"version": MANIFEST_VERSION, "parquet": _PARQUET_AVAILABLE, "geo_version": None, "years": {}} if rebuild else _load_manifest()
+
+    # Per-district geography: only new districts, unless the inputs changed
+    hospital_df, police_df, errors = load_service_frames(HOSPITAL_CSV_PATH, POLICE_CSV_PATH)
+    for error in errors:
+        print(f"Training: {error}")
+    geo_version = {
+        "hospital": hospital_df.attrs.get("dataset_version") if hospital_df is not None else None,
+        "police": police_df.attrs.get("dataset_version") if police_df is not None else None,
+        "danger_zones": dataset_file_version(DANGER_ZONES_PATH) if os.path.exists(DANGER_ZONES_PATH) else None,
+    }
+    centres = district_centres(hospital_df, police_df)
+    zones = DangerZones.load()
+    geo = None
+    if manifest["geo_version"] == geo_version:
+        try:
+            geo = _read_frame("districts")
+        except (OSError, ValueError):
+            geo = None
+    if geo is None:
+        geo = build_district_features(crime["DISTRICT"].unique(), centres, hospital_df, police_df, zones)
+        print(f"Training: Computed geographic features for {len(geo)} districts.")
+    else:
+        new = np.setdiff1d(crime["DISTRICT"].unique(), geo["DISTRICT"].to_numpy())
+        if len(new):
+            added = build_district_features(new, centres, hospital_df, police_df, zones)
+            geo = pd.concat([geo, added], ignore_index=True)
+            print(f"Training: Computed geographic features for {len(added)} new districts ({len(new) - len(added)} without a location).")
+    _write_frame(geo, "districts")
+    manifest["geo_version"] = geo_version
+
+    # Per-year partitions: rebuilt when that year's or the previous year's rows changed
+    years = sorted(crime["YEAR"].unique().tolist())
+    rebuilt = 0
+    partitions = []
+    for year in years[1:]:
+        input_hash = _frame_hash(crime[crime["YEAR"].isin((year, year - 1))])
+        entry = manifest["years"].get(str(year))
+        partition = None
+        if entry and entry.get("input_hash") == input_hash:
+            try:
+                partition = _read_frame(f"year={year}")
+            except (OSError, ValueError):
+                partition = None
+        if partition is None:
+            partition = build_year_partition(crime, year)
+            _write_frame(partition, f"year={year}")
+            manifest["years"][str(year)] = {"input_hash": input_hash, "rows": len(partition)}
+            rebuilt += 1
+        partitions.append(partition)
+    # Years no longer in the data
+    for year in list(manifest["years"]):
+        if int(year) not in years[1:]:
+            del manifest["years"][year]
+            try:
+                os.remove(_cache_path(f"year={year}"))
+            except OSError:
+                pass
+    _save_manifest(manifest)
+    print(f"Training: {len(years) - 1} year partitions, {rebuilt} rebuilt, {len(years) - 1 - rebuilt} from cache.")
+
+    if not partitions:
+        raise SystemExit("Training needs at least two years of crime data.")
+    table = pd.concat(partitions, ignore_index=True).merge(geo, on="DISTRICT", how="inner")
+    return table, {"crime_data": dataset_file_version(crime_path), **geo_version}
+
+
+# --- Training ---
+def make_classifier(n_jobs=-1):
+    """CPU gradient boosting using all cores; XGBoost if installed, otherwise scikit-learn."""
+    if _XGBOOST_AVAILABLE:
+        return xgboost.XGBClassifier(n_estimators=400, max_depth=4, learning_rate=0.05, subsample=0.8,
+                                     tree_method="hist", n_jobs=n_jobs, random_state=RANDOM_SEED), "xgboost"
+    if _SKLEARN_AVAILABLE:
+        # Multi-threaded through OpenMP (OMP_NUM_THREADS limits it)
+        return HistGradientBoostingClassifier(max_iter=400, max_depth=4, learning_rate=0.05,
+                                              random_state=RANDOM_SEED), "sklearn-hist-gbm"
+    raise SystemExit("Training needs xgboost or scikit-learn (pip install xgboost).")
+
+
+def roc_auc(labels, scores):
+    """Area under the ROC curve via the rank-sum formula (ties get average ranks)."""
+    labels = np.asarray(labels)
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    if positives == 0 or negatives == 0:
+        return None
+    ranks = pd.Series(scores).rank().to_numpy()
+    return float((ranks[labels == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def single_point_latency(model, x):
+    """p50/p99 milliseconds of one-row predict_proba calls, scored the way the app loads the model."""
+    served = PickledModel(model, "latency-check")
+    rows = np.column_stack((x, np.zeros(len(x)), np.ones(len(x))))
+    timings = []
+    for i in range(LATENCY_REPEATS):
+        row = rows[i % len(rows)][None, :]
+        started = time.perf_counter()
+        served.predict_proba(row)
+        timings.append(time.perf_counter() - started)
+    p50, p99 = np.percentile(timings, [50, 99]) * 1000
+    scorer = type(getattr(served.model, "model", served.model)).__name__
+    return {"p50_ms": round(float(p50), 4), "p99_ms": round(float(p99), 4), "scorer": scorer,
+            "budget_ms": SINGLE_POINT_BUDGET_MS}
+
+
+def train(table, n_jobs=-1):
+    """Fits on all years but the latest, reports AUC on the latest, then refits on everything."""
+    table = table.sort_values(["YEAR", "DISTRICT"]).reset_index(drop=True)
+    x = table[list(TRAIN_FEATURES)].to_numpy(dtype=float)
+    y = table["label"].to_numpy(dtype=int)
+    latest = table["YEAR"].max()
+    holdout = (table["YEAR"] == latest).to_numpy()
+    metrics = {"rows": int(len(table)), "districts": int(table["DISTRICT"].nunique()),
+               "years": [int(table["YEAR"].min()), int(latest)], "positive_rate": round(float(y.mean()), 3)}
+
+    if holdout.any() and (~holdout).any() and len(np.unique(y[~holdout])) == 2:
+        model, backend = make_classifier(n_jobs)
+        started = time.perf_counter()
+        model.fit(x[~holdout], y[~holdout])
+        auc = roc_auc(y[holdout], model.predict_proba(x[holdout])[:, 1])
+        metrics["holdout_year"] = int(latest)
+        metrics["holdout_auc"] = round(auc, 4) if auc is not None else None
+        print(f"Training: Holdout {latest}: AUC {metrics['holdout_auc']} ({time.perf_counter() - started:.1f}s).")
+
+    model, backend = make_classifier(n_jobs)
+    started = time.perf_counter()
+    model.fit(x, y)
+    metrics["fit_seconds"] = round(time.perf_counter() - started, 2)
+    metrics["backend"] = backend
+    print(f"Training: Fitted {backend} on {len(x)} rows in {metrics['fit_seconds']}s.")
+    model = TimeOfDayAdjusted(model)
+    metrics["single_point_latency"] = latency = single_point_latency(model, x)
+    print(f"Training: Single-point scoring via {latency['scorer']}: p50 {latency['p50_ms']} ms, p99 {latency['p99_ms']} ms.")
+    if latency["p99_ms"] > SINGLE_POINT_BUDGET_MS:
+        print(f"Training: Warning: single-point p99 is over the {SINGLE_POINT_BUDGET_MS} ms budget.")
+    return model, metrics
+
+
+def save_artifact(model, metrics, inputs):
+    """Writes models/risk_model-<version>.pkl and its .meta.json; returns the artifact path."""
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    created = datetime.now(timezone.utc)
+    payload = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    version = f"{created.strftime('%Y%m%d%H%M%S')}-{hashlib.sha1(payload).hexdigest()[:8]}"
+    path = os.path.join(MODELS_DIR, f"risk_model-{version}.pkl")
+    with open(path + ".tmp", "wb") as f:
+        f.write(payload)
+    os.replace(path + ".tmp", path)
+    meta = {
+        "version": version, "created_at": created.isoformat(), "features": list(TRAIN_FEATURES) + ["hour_sin", "hour_cos"],
+        "unsafe_quantile": UNSAFE_QUANTILE, "inputs": inputs, "metrics": metrics,
+        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+        "xgboost": getattr(xgboost, "__version__", None) if _XGBOOST_AVAILABLE else None,
+    }
+    with open(os.path.join(MODELS_DIR, f"risk_model-{version}.meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+
+def promote(artifact_path, target):
+    """Atomically replaces `target` with the artifact (the model server reloads it when the file changes)."""
+    tmp_path = target + ".tmp"
+    shutil.copyfile(artifact_path, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the location risk model.")
+    parser.add_argument("--crime-data", default=CRIME_DATA_PATH, help="Crime CSV with DISTRICT, YEAR, RAPE and MURDER columns.")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the feature cache and recompute everything.")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="CPU threads for training (-1 = all cores).")
+    parser.add_argument("--promote", metavar="PATH", help="Also copy the artifact to PATH (e.g. the file SEFI_RISK_MODEL points at; relative to SEFI_DATA_DIR).")
+    args = parser.parse_args()
+    if args.promote and args.promote.endswith(".json"):
+        parser.error("--promote needs a .pkl path; .json paths are loaded as linear models.")
+
+    started = time.perf_counter()
+    table, inputs = build_features(args.crime_data, rebuild=args.rebuild)
+    print(f"Training: {len(table)} training rows ready in {time.perf_counter() - started:.1f}s.")
+    model, metrics = train(table, n_jobs=args.n_jobs)
+    path = save_artifact(model, metrics, inputs)
+    print(f"Training: Wrote {path}.")
+    if args.promote:
+        target = os.path.join(DATA_DIR, os.path.expanduser(args.promote))
+        promote(path, target)
+        print(f"Training: Promoted to {target}.")
+    else:
+        print(f"Training: Set SEFI_RISK_MODEL={path} (or use --promote) to serve this model.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# trigger_events.py
+# Ingestion of automatic SOS trigger events (voice, sound, keyword spotting).
+# Every event carries an idempotency key (event_id) and the time it was detected. Events are
+# appended to an SQLite log and classified in one transaction:
+#   - 'duplicate'  : the same event_id was already ingested (e.g. the component value is
+#                    re-delivered on a rerun) -> ignored
+#   - 'coalesced'  : another trigger for the same user started an incident within the
+#                    coalescing window -> attached to that incident, no new dispatch
+#   - 'dispatched' : first trigger of a new incident -> the caller raises one SOS
+# so a burst of detections turns into exactly one SOS dispatch and every trigger stays auditable.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+# --- Configuration ---
+TRIGGER_EVENTS_DB = os.environ.get("SEFI_TRIGGER_EVENTS_DB", "trigger_events.db")
+# Triggers for the same user within this many seconds of an incident's last trigger join that incident
+COALESCE_WINDOW_SECONDS = float(os.environ.get("SEFI_TRIGGER_COALESCE_SECONDS", "60"))
+# Client timestamps further than this from the server clock are not trusted for ordering
+MAX_CLOCK_SKEW_SECONDS = 300
+
+# Dispositions
+DISPOSITION_DISPATCHED = "dispatched"
+DISPOSITION_COALESCED = "coalesced"
+DISPOSITION_DUPLICATE = "duplicate"
+
+
+class TriggerEventLog:
+    """Append-only trigger log with per-user incident coalescing. Each call opens its own connection."""
+
+    def __init__(self, db_path=TRIGGER_EVENTS_DB, coalesce_window=COALESCE_WINDOW_SECONDS):
+        self.db_path = db_path
+        self.coalesce_window = coalesce_window
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trigger_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id TEXT NOT NULL,
+                    user_id TEXT,
+                    source TEXT,
+                    keyword TEXT,
+                    client_ts REAL,
+                    received_at REAL NOT NULL,
+                    disposition TEXT NOT NULL,
+                    incident_id TEXT,
+                    payload TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS trigger_events_event_id ON trigger_events (event_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS trigger_events_user ON trigger_events (user_id, received_at DESC)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def ingest(self, event, user_id=None):
+        """
+        Logs one trigger event and decides whether it starts a new incident.
+        Returns a dict with 'disposition', 'incident_id', 'event_id', 'dispatch' (True only for
+        the first trigger of an incident) and 'latency_ms' (detection to ingestion, if known).
+        """
+        received_at = time.time()
+        event_id = str(event.get("event_id") or "")
+        if not event_id:
+            # Old clients without idempotency keys: derive a stable key from the payload,
+            # so re-delivery of the same dict is still recognised
+            event_id = "derived-" + uuid.uuid5(uuid.NAMESPACE_URL, json.dumps(event, sort_keys=True, default=str)).hex
+        client_ts = _client_timestamp(event, received_at)
+        user_key = str(user_id) if user_id is not None else None
+
+        with self._connect() as conn:
+            # Serialises concurrent ingests so two triggers cannot both open an incident
+            conn.execute("BEGIN IMMEDIATE")
+            first = conn.execute(
+                "SELECT incident_id FROM trigger_events WHERE event_id = ? AND disposition != ? ORDER BY seq LIMIT 1",
+                (event_id, DISPOSITION_DUPLICATE)).fetchone()
+            if first is not None:
+                disposition, incident_id = DISPOSITION_DUPLICATE, first["incident_id"]
+            else:
+                incident_id = self._open_incident(conn, user_key, received_at)
+                if incident_id is None:
+                    disposition, incident_id = DISPOSITION_DISPATCHED, uuid.uuid4().hex
+                else:
+                    disposition = DISPOSITION_COALESCED
+            conn.execute(
+                "INSERT INTO trigger_events (event_id, user_id, source, keyword, client_ts, received_at, disposition, incident_id, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (event_id, user_key, event.get("source"), event.get("keyword"), client_ts, received_at,
+                 disposition, incident_id, json.dumps(event, default=str)))
+
+        latency_ms = round((received_at - client_ts) * 1000, 1) if client_ts is not None else None
+        if disposition != DISPOSITION_DUPLICATE:
+            print(f"Triggers: {event.get('source')}/{event.get('keyword')} for user {user_key} -> {disposition} (incident {incident_id}, latency {latency_ms} ms).")
+        return {
+            "event_id": event_id,
+            "disposition": disposition,
+            "incident_id": incident_id,
+            "dispatch": disposition == DISPOSITION_DISPATCHED,
+            "latency_ms": latency_ms,
+        }
+
+    def _open_incident(self, conn, user_key, now):
+        """Incident id of the user's most recent trigger if it falls inside the coalescing window."""
+        # The window slides: every trigger of an ongoing incident extends it
+        row = conn.execute(
+            "SELECT incident_id FROM trigger_events WHERE user_id IS ? AND disposition != ? AND received_at >= ? "
+            "ORDER BY received_at DESC LIMIT 1",
+            (user_key, DISPOSITION_DUPLICATE, now - self.coalesce_window)).fetchone()
+        return row["incident_id"] if row else None
+
+    def recent(self, user_id=None, limit=20):
+        """Most recent log entries for a user (newest first), for the audit view."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, event_id, source, keyword, client_ts, received_at, disposition, incident_id "
+                "FROM trigger_events WHERE user_id IS ? ORDER BY seq DESC LIMIT ?",
+                (str(user_id) if user_id is not None else None, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def incident(self, incident_id):
+        """All triggers that belong to one incident, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM trigger_events WHERE incident_id = ? ORDER BY seq", (incident_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def _client_timestamp(event, received_at):
+    """Detection time in epoch seconds from 'ts' (ms, browser Date.now()) or 'detected_at' (s, server)."""
+    ts = event.get("ts")
+    if ts is not None:
+        try:
+            ts = float(ts) / 1000.0
+        except (TypeError, ValueError):
+            ts = None
+    if ts is None:
+        ts = event.get("detected_at")
+    if ts is None or abs(received_at - float(ts)) > MAX_CLOCK_SKEW_SECONDS:
+        return None
+    return float(ts)
+
+
+_log = None
+
+def get_trigger_log():
+    """Returns the process-wide trigger event log."""
+    global _log
+    if _log is None:
+        _log = TriggerEventLog()
+    return _log
+
+
+def ingest_trigger(event, user_id=None):
+    """Convenience wrapper around the process-wide log; see TriggerEventLog.ingest."""
+    return get_trigger_log().ingest(event, user_id)
@@ -1,11 +1,51 @@
 # triggers_page.py
 import streamlit as st
 import streamlit.components.v1 as components
-
-def voice_trigger_component():
+import html
+import json
+import time
+from audio_trigger import AudioTriggerProcessor
+from trigger_events import ingest_trigger, get_trigger_log
+from sos_dispatch import enqueue_sos
+from keyword_spotting import (load_keyword_config, save_keyword_config, load_spotter, read_wav,
+                              KeywordTemplates, SUPPORTED_LANGUAGES)
+
+# Browser geolocation, so alerts raised on this page carry the user's position
+try:
+    import streamlit_js_eval
+    _STREAMLIT_JS_EVAL_AVAILABLE = True
+except ImportError:
+    print("Warning: streamlit-js-eval not installed. Trigger alerts will use the last known location only.")
+    _STREAMLIT_JS_EVAL_AVAILABLE = False
+
+_TRIGGERS_LOCATION_KEY = "triggers_location_component_result"
+_LOCATION_JS = """
+    new Promise((resolve) => {
+        if (!navigator.geolocation) {
+            resolve({error: "Geolocation not supported by browser", source: "Browser API"});
+            return;
+        }
+        navigator.geolocation.getCurrentPosition(
+            (position) => { resolve({ latitude: position.coords.latitude, longitude: position.coords.longitude, accuracy: position.coords.accuracy, source: "Browser Geolocation" }); },
+            (error) => { resolve({error: "Browser geolocation error " + error.code, code: error.code, source: "Browser Geolocation Error"}); },
+            {maximumAge: 60000, timeout: 15000}
+        );
+    });
+"""
+
+# Optional server-side sound detection over WebRTC audio
+try:
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    WEBRTC_AVAILABLE = True
+except ImportError:
+    print("Warning: streamlit-webrtc not installed. Server-side sound detection is unavailable.")
+    WEBRTC_AVAILABLE = False
+
+def voice_trigger_component(keywords, language):
     """
     Creates a Streamlit component that uses the Web Speech API for voice recognition
     and Web Audio API for sound detection.
+    `keywords` are matched as whole words in `language` (a BCP 47 tag such as 'en-IN').
     Returns the value sent from the JavaScript component.
     """
     # JavaScript code for speech recognition and sound detection
@@ -15,6 +55,11 @@ def voice_trigger_component():
 
         // Function to send message to Streamlit
         function sendMessageToStreamlit(message) {
+            // Idempotency key and detection time: the server ignores re-delivered events
+            // and coalesces bursts of triggers into one SOS
+            message.event_id = message.event_id || ((window.crypto && crypto.randomUUID) ?
+                crypto.randomUUID() : Date.now() + '-' + Math.random().toString(36).slice(2));
+            message.ts = message.ts || Date.now();
             console.log("Sending message to Streamlit:", message);
             window.parent.postMessage({
                 type: "streamlit:setComponentValue",
@@ -59,7 +104,14 @@ def voice_trigger_component():
 
             recognition.continuous = true; // Keep listening
             recognition.interimResults = true; // Get interim results for faster response
-            recognition.lang = 'en-US'; // Set language
+            recognition.lang = __RECOGNITION_LANG__; // Set language
+
+            // Trigger words are matched as whole words only, so "helpful" does not trigger "help".
+            // Letters, marks and digits of any script count as word characters (\\b only knows ASCII).
+            const TRIGGER_KEYWORDS = __TRIGGER_KEYWORDS__;
+            const escapeRegExp = (s) => s.replace(/[.*+?^${}()|[\\]\\\\]/g, '\\\\$&');
+            const keywordPattern = new RegExp(
+                '(?:^|[^\\\\p{L}\\\\p{M}\\\\p{N}])(' + TRIGGER_KEYWORDS.map(escapeRegExp).join('|') + ')(?=$|[^\\\\p{L}\\\\p{M}\\\\p{N}])', 'u');
 
             let isRecognizing = false;
 
@@ -72,18 +124,11 @@ def voice_trigger_component():
                 console.log("Transcript:", transcript);
                 transcriptSpan.textContent = transcript;
 
-                // Check for trigger words - making it more flexible with partial matches
-                if (!alertTriggered && (
-                    transcript.includes('help') || 
-                    transcript.includes('danger') || 
-                    transcript.includes('emergency') || 
-                    transcript.includes('sos')
-                )) {
-                    const triggerWord = 
-                        transcript.includes('help') ? 'help' : 
-                        transcript.includes('danger') ? 'danger' : 
-                        transcript.includes('emergency') ? 'emergency' : 'sos';
-                        
+                // Check for trigger words as whole words
+                const keywordMatch = TRIGGER_KEYWORDS.length ? transcript.match(keywordPattern) : null;
+                if (!alertTriggered && keywordMatch) {
+                    const triggerWord = keywordMatch[1];
+
                     statusDiv.innerHTML = `<strong>ALERT:</strong> Detected trigger word "${triggerWord}"!`;
                     console.log("Trigger word detected:", triggerWord);
                     
@@ -422,7 +467,7 @@ def voice_trigger_component():
 
     <div class="recognition-container" id="recognition-status">
         <h3>🎤 Voice & Sound Detection</h3>
-        <p>Say <strong>"help"</strong>, <strong>"danger"</strong>, <strong>"emergency"</strong> or <strong>"SOS"</strong> OR make any loud sound to activate the SOS alert</p>
+        <p>Say __KEYWORD_LIST_HTML__ OR make any loud sound to activate the SOS alert</p>
         <p><strong>Automatic detection is ACTIVE</strong> - no need to press any buttons</p>
 
         <div class="button-container">
@@ -442,6 +487,13 @@ def voice_trigger_component():
         </div>
     </div>
     """
+    # Fill in the user's trigger words and language (plain replace: the JS is full of braces)
+    keyword_list_html = " or ".join(f"<strong>\"{html.escape(k)}\"</strong>" for k in keywords)
+    speech_recognition_js = (speech_recognition_js
+                             .replace("__TRIGGER_KEYWORDS__", json.dumps(keywords))
+                             .replace("__RECOGNITION_LANG__", json.dumps(language))
+                             .replace("__KEYWORD_LIST_HTML__", keyword_list_html))
+
     # Use the HTML component with a specified height, increased for the additional UI elements
     component_value = components.html(speech_recognition_js, height=380)
 
@@ -450,7 +502,7 @@ def voice_trigger_component():
 
 
 # Define the voice_trigger_ui function (it calls voice_trigger_component)
-def voice_trigger_ui():
+def voice_trigger_ui(keyword_config, user_id=None):
     """
     Displays the voice and sound trigger UI in a Streamlit app and processes its output.
     """
@@ -459,7 +511,7 @@ def voice_trigger_ui():
         st.session_state.voice_trigger_data = None
 
     # Display the recognition component and get its return value
-    component_value = voice_trigger_component()
+    component_value = voice_trigger_component(keyword_config['keywords'], keyword_config['language'])
 
     # --- Debug print to see what value is received ---
     print(f"voice_trigger_ui received component_value: {component_value}")
@@ -469,24 +521,193 @@ def voice_trigger_ui():
     # The component sends a dictionary when a trigger word or sound is detected
     if component_value is not None and isinstance(component_value, dict) and component_value.get('action') == 'trigger':
         # A trigger was detected by the JavaScript
-        source = component_value.get('source', 'unknown')
-        keyword = component_value.get('keyword', 'unknown')
-        
         print(f"Streamlit detected trigger action from component: {component_value}") # Debug print
-        
-        # Set trigger flag and additional info in session state
-        st.session_state.trigger_sos = True
-        st.session_state.trigger_source = source
-        st.session_state.trigger_keyword = keyword
-        
-        if source == 'voice':
-            transcript = component_value.get('transcript', '')
-            st.session_state.trigger_transcript = transcript
-        elif source == 'sound':
-            level = component_value.get('level', 0)
-            st.session_state.trigger_sound_level = level
-            
-        st.rerun()  # Trigger rerun immediately
+        if handle_trigger_event(component_value, user_id):
+            st.rerun()  # Trigger rerun immediately
+
+
+def handle_trigger_event(trigger, user_id=None):
+    """
+    Logs a trigger event and applies it only if it starts a new incident.
+    Re-delivered events and triggers inside the coalescing window are logged but do not
+    cause another rerun or SOS. Returns True if the trigger was applied.
+    """
+    try:
+        result = ingest_trigger(trigger, user_id)
+    except Exception as e:
+        # Never lose a trigger because the log is unavailable
+        print(f"Could not log trigger event, applying it directly: {e}")
+        result = {"dispatch": True, "incident_id": None}
+    if not result['dispatch']:
+        return False
+    apply_trigger(trigger)
+    st.session_state.trigger_incident_id = result['incident_id']
+    dispatch_trigger_sos(trigger, result['incident_id'])
+    return True
+
+
+def _has_coordinates(location):
+    return isinstance(location, dict) and 'latitude' in location and 'longitude' in location and 'error' not in location
+
+
+def request_trigger_location():
+    """Asks the browser for its position while this page is open (the result arrives on a later rerun)."""
+    if not _STREAMLIT_JS_EVAL_AVAILABLE:
+        return
+    try:
+        result = streamlit_js_eval.streamlit_js_eval(js_expressions=_LOCATION_JS, want_output=True, key=_TRIGGERS_LOCATION_KEY)
+    except Exception as e:
+        print(f"Triggers: Could not request browser location: {e}")
+        return
+    if _has_coordinates(result):
+        st.session_state.trigger_location = result
+
+
+def trigger_location():
+    """
+    The location to send with a trigger alert: this page's browser position, else the last position
+    the dashboard or the live video page obtained. None if no position is known.
+    """
+    for key in ('trigger_location', 'last_known_location_data', 'last_known_location'):
+        if _has_coordinates(st.session_state.get(key)):
+            return st.session_state[key]
+    return None
+
+
+def dispatch_trigger_sos(trigger, incident_id=None):
+    """
+    Queues the SOS alert for a trigger with the dispatch service (sos_dispatch.py), which looks up
+    the address and nearest services and emails the user's contacts in the background.
+    The incident id makes the job idempotent, so one incident never sends two alerts.
+    """
+    st.session_state.trigger_sos_job_id = None
+    user = st.session_state.get('user')
+    if not user:
+        print("Trigger SOS not dispatched: no logged-in user.")
+        return None
+    try:
+        import db
+        contacts = db.get_contacts(user.get('id')) or []
+    except Exception as e:
+        print(f"Could not load contacts for trigger SOS: {e}")
+        contacts = []
+    location = trigger_location()
+    if location is None:
+        print("Trigger SOS: no location known yet; the alert is sent without one.")
+    try:
+        job_id = enqueue_sos(user, source=trigger.get('source', 'unknown'), keyword=trigger.get('keyword'),
+                             location=location, contacts=contacts, incident_id=incident_id)
+    except Exception as e:
+        print(f"Could not queue trigger SOS: {e}")
+        return None
+    st.session_state.trigger_sos_job_id = job_id
+    return job_id
+
+
+def apply_trigger(trigger):
+    """Stores a trigger dict (from the browser component or the server-side detector) in session state."""
+    source = trigger.get('source', 'unknown')
+    keyword = trigger.get('keyword', 'unknown')
+
+    # Set trigger flag and additional info in session state
+    st.session_state.trigger_sos = True
+    st.session_state.trigger_source = source
+    st.session_state.trigger_keyword = keyword
+
+    if source == 'voice':
+        st.session_state.trigger_transcript = trigger.get('transcript', '')
+    elif source == 'sound':
+        st.session_state.trigger_sound_level = trigger.get('level', 0)
+
+
+def server_sound_trigger_ui(user_id=None):
+    """
+    Optional server-side loud-sound detection. Microphone audio is streamed over WebRTC and
+    analysed by AudioTriggerProcessor on the server, so detection does not depend on the
+    browser's audio APIs. Detected events are picked up from the processor's queue here.
+    If the user has enrolled trigger words, they are also spotted offline on the same audio.
+    """
+    if not WEBRTC_AVAILABLE:
+        st.info("Server-side sound detection needs 'streamlit-webrtc' (pip install streamlit-webrtc av).")
+        return
+
+    # The processor lives in session state so it survives reruns; the WebRTC worker thread
+    # keeps calling the same instance while the stream is running
+    if 'audio_trigger_processor' not in st.session_state:
+        try:
+            spotter = load_spotter(user_id)
+        except Exception as e:
+            print(f"Could not load keyword templates: {e}")
+            spotter = None
+        st.session_state.audio_trigger_processor = AudioTriggerProcessor(keyword_spotter=spotter)
+    processor = st.session_state.audio_trigger_processor
+    if processor.keyword_spotter is not None:
+        st.caption(f"Offline keyword spotting active for: {', '.join(processor.keyword_spotter.keywords)}")
+
+    ctx = webrtc_streamer(
+        key="server_sound_trigger",
+        mode=WebRtcMode.SENDONLY,
+        media_constraints={"audio": True, "video": False},
+        rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
+        audio_frame_callback=processor,
+    )
+
+    def poll_detections():
+        dispatched = False
+        for event in processor.poll_events():
+            print(f"Server-side sound trigger: {event}")
+            dispatched = handle_trigger_event(event, user_id) or dispatched
+        if dispatched:
+            st.rerun()
+        stats = processor.stats()
+        if stats['audio_seconds']:
+            cost = stats['cpu_per_audio_second'] or 0
+            st.caption(f"Level: {stats['last_level_dbfs']} dBFS | analysed {stats['audio_seconds']}s of audio | server CPU: {cost * 100:.2f}% of one core")
+
+    if ctx.state.playing:
+        st.success("Streaming microphone audio to the server for sound detection.")
+        # Poll the event queue about once a second without rerunning the whole page
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=1)(poll_detections)()
+        else:
+            poll_detections()
+
+
+def keyword_settings_ui(user_id, keyword_config):
+    """Lets the user choose their trigger words and language, and enroll samples for offline spotting."""
+    with st.expander("⚙️ Trigger Words & Language"):
+        with st.form("trigger_keywords_form"):
+            keywords_text = st.text_input("Trigger words (comma separated)", value=", ".join(keyword_config['keywords']))
+            language = st.selectbox("Recognition language", SUPPORTED_LANGUAGES,
+                                    index=SUPPORTED_LANGUAGES.index(keyword_config['language']) if keyword_config['language'] in SUPPORTED_LANGUAGES else 0)
+            if st.form_submit_button("Save Trigger Words"):
+                keywords = [k.strip() for k in keywords_text.split(",") if k.strip()]
+                if not keywords:
+                    st.error("Enter at least one trigger word.")
+                else:
+                    save_keyword_config(user_id, keywords, language)
+                    st.session_state.pop('audio_trigger_processor', None) # Rebuilt with the new words
+                    st.success("Trigger words saved.")
+                    st.rerun()
+
+        st.markdown("**Offline keyword spotting** (used by server-side detection)")
+        templates = KeywordTemplates.load(user_id, keyword_config['language'])
+        enrolled = {k: len(templates.templates[k]) for k in templates.keywords()}
+        st.write("Enrolled samples: " + (", ".join(f"{k} ({n})" for k, n in enrolled.items()) if enrolled else "none yet"))
+        if not hasattr(st, "audio_input"):
+            st.info("Recording samples here needs a newer Streamlit. You can enroll WAV files with: python keyword_spotting.py enroll")
+            return
+        keyword = st.selectbox("Word to record", keyword_config['keywords'], key="enroll_keyword")
+        recording = st.audio_input(f"Say '{keyword}' once, clearly", key="enroll_recording")
+        if recording is not None and st.button("Add Sample", key="enroll_add_sample"):
+            try:
+                samples, sample_rate = read_wav(recording.getvalue())
+                count = templates.enroll(keyword, samples, sample_rate)
+                templates.save()
+                st.session_state.pop('audio_trigger_processor', None)
+                st.success(f"Saved sample {count} for '{keyword}'. Three or more samples make detection more reliable.")
+            except Exception as e:
+                st.error(f"Could not enroll sample: {e}")
 
 
 # Define the main triggers_page function (it calls voice_trigger_ui)
@@ -494,9 +715,16 @@ def triggers_page():
     st.title("📱 Triggers")
 
     st.write("This page is for configuring different methods to automatically activate the SOS alert.")
-    
+    # Ask for the position up front, so an alert raised later on this page can include it
+    request_trigger_location()
+
+    # Trigger words and recognition language are configurable per user
+    user_id = (st.session_state.get('user') or {}).get('id')
+    keyword_config = load_keyword_config(user_id)
+    keyword_list_md = ", ".join(f"**'{k}'**" for k in keyword_config['keywords'])
+
     # Add a notice about auto-activation
-    st.success("🎤 Voice & sound detection starts automatically when you open this page. Say **'help'**, **'danger'**, **'emergency'**, **'SOS'** or make any **loud noise** to activate the SOS alert.")
+    st.success(f"🎤 Voice & sound detection starts automatically when you open this page. Say {keyword_list_md} or make any **loud noise** to activate the SOS alert.")
 
     # Voice/sound trigger section
     trigger_tab, other_triggers_tab = st.tabs(["🎤 Voice & Sound Triggers", "📲 Other Triggers"])
@@ -531,22 +759,44 @@ def triggers_page():
                 
             # Reset the trigger immediately after displaying the alert
             st.session_state.trigger_sos = False
-            # In a real implementation, you would trigger the actual SOS alert function here
-            # from dashboard import trigger_sos_alert_sequence
-            # trigger_sos_alert_sequence()
+            # The alert itself was queued with the SOS dispatch service when the trigger was handled
+            if st.session_state.get('trigger_sos_job_id') is not None:
+                st.info("Your emergency contacts are being notified in the background.")
+            else:
+                st.warning("The SOS alert could not be queued. Use the SOS button on the dashboard.")
 
         # Display the trigger UI component and handle its output
-        voice_trigger_ui()
+        voice_trigger_ui(keyword_config, user_id)
+
+        if st.checkbox("Use server-side sound detection", key="use_server_sound_detection",
+                       help="Streams microphone audio to the server and detects loud sounds (and enrolled trigger words) there instead of in the browser."):
+            server_sound_trigger_ui(user_id)
+
+        keyword_settings_ui(user_id, keyword_config)
+
+        with st.expander("🧾 Trigger History"):
+            # Every trigger is logged, including the ones merged into an ongoing incident
+            try:
+                history = get_trigger_log().recent(user_id, limit=20)
+            except Exception as e:
+                history = []
+                st.error(f"Could not load trigger history: {e}")
+            if history:
+                for entry in history:
+                    received = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['received_at']))
+                    delay = f", {(entry['received_at'] - entry['client_ts']) * 1000:.0f} ms after detection" if entry['client_ts'] else ""
+                    st.write(f"{received} — {entry['source']} / {entry['keyword']}: **{entry['disposition']}** (incident {str(entry['incident_id'])[:8]}{delay})")
+            else:
+                st.info("No triggers recorded yet.")
 
         with st.expander("Voice & Sound Detection Help"):
-            st.markdown("""
+            keyword_lines = "\n".join(f'              - **"{k}"**' for k in keyword_config['keywords'])
+            st.markdown(f"""
             ### Voice Commands
             - Voice detection starts **automatically** when you open this page.
             - Say any of these words clearly to automatically trigger the SOS alert:
-              - **"help"**
-              - **"danger"**
-              - **"emergency"**
-              - **"SOS"**
+{keyword_lines}
+            - Words only trigger on their own ("helpful" does not trigger "help"). Change them under **Trigger Words & Language**.
             
             ### Sound Detection
             - The system will also listen for **loud sounds** like screams, crashes, or other noises that might indicate an emergency.
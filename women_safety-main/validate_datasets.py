@@ -0,0 +1,328 @@
+# validate_datasets.py
+# Build-time data-quality stage for the hospital and police datasets.
+# Run it whenever a dataset CSV changes:
+#     python validate_datasets.py [hospital|police ...] [--reject-state-mismatches]
+# For each dataset it
+#   - checks the schema (required columns, numeric coordinates, non-blank names),
+#   - rejects coordinates outside India, and warns about rows outside the bounding box of their
+#     state (the sample police data has stations like a "Tamil Nadu" one at 11.82N 83.72E, in the
+#     sea); the boxes are approximate, so such rows are only rejected on request,
+#   - detects duplicates: repeated keys (a delta could not address them) and repeated
+#     records at the same position,
+# and writes a clean artifact plus a report to SEFI_VALIDATED_DIR/<dataset>-<source hash>/.
+# When more than MAX_REJECTED_FRACTION of the rows are rejected, no artifact is written (and any
+# older one for the same source is removed), the script exits non-zero and the app keeps cleaning
+# the CSV itself. An artifact holds:
+#   <column>.npy   one array per column; numeric columns are memory-mapped when loaded
+#   manifest.json  source file, its content version, columns and row counts
+#   report.json    counts and examples per problem
+#   rejected.csv   the rejected rows with the reason
+# At runtime emergency_services.load_service_frames loads the artifact whose source version
+# matches the current CSV as a trusted, already-clean frame (no parsing or cleaning; numeric
+# columns are zero-copy views of the mapped files) and only falls back to reading and cleaning
+# the CSV when no artifact has been built for it.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from datasets import DATA_DIR, SERVICE_COLUMNS, dataset_path, dataset_version
+
+# --- Configuration ---
+VALIDATED_DIR = os.path.join(DATA_DIR, os.path.expanduser(os.environ.get("SEFI_VALIDATED_DIR", "validated")))
+ARTIFACT_FORMAT = 1
+INDIA_BOUNDS = {"lat_min": 6.0, "lat_max": 37.5, "lon_min": 68.0, "lon_max": 97.5}
+# Tolerance around the state bounding boxes (degrees, about 20 km)
+STATE_MARGIN_DEGREES = 0.2
+# Records of the same service closer than this (coordinates rounded to 5 decimals, about 1 m) are duplicates
+DUPLICATE_DECIMALS = 5
+EXAMPLES_PER_PROBLEM = 5
+# More rejected rows than this means the checks (or the file) are wrong rather than the rows
+MAX_REJECTED_FRACTION = 0.5
+
+# Required columns per dataset (besides the key and coordinate columns) and the state column
+SCHEMAS = {
+    "hospital": {"required": ["City", "State"], "state_col": "State"},
+    "police": {"required": ["address", "state"], "state_col": "state"},
+}
+
+# Approximate state/UT bounding boxes: (lat_min, lat_max, lon_min, lon_max)
+STATE_BOUNDS = {
+    "andaman and nicobar islands": (6.7, 13.7, 92.2, 94.3),
+    "andhra pradesh": (12.6, 19.95, 76.75, 84.8),
+    "arunachal pradesh": (26.6, 29.5, 91.5, 97.45),
+    "assam": (24.1, 28.0, 89.7, 96.05),
+    "bihar": (24.3, 27.55, 83.3, 88.3),
+    "chandigarh": (30.65, 30.8, 76.65, 76.85),
+    "chhattisgarh": (17.75, 24.1, 80.25, 84.4),
+    "dadra and nagar haveli and daman and diu": (20.3, 20.75, 72.8, 73.25),
+    "delhi": (28.4, 28.9, 76.8, 77.35),
+    "goa": (14.85, 15.8, 73.65, 74.35),
+    "gujarat": (20.1, 24.75, 68.1, 74.5),
+    "haryana": (27.65, 30.95, 74.45, 77.6),
+    "himachal pradesh": (30.35, 33.25, 75.55, 79.0),
+    "jammu and kashmir": (32.25, 37.1, 72.5, 80.35),
+    "jharkhand": (21.95, 25.35, 83.3, 87.95),
+    "karnataka": (11.55, 18.5, 74.0, 78.6),
+    "kerala": (8.15, 12.8, 74.85, 77.45),
+    "ladakh": (32.3, 36.0, 75.3, 80.4),
+    "lakshadweep": (8.25, 12.35, 71.7, 74.0),
+    "madhya pradesh": (21.05, 26.9, 74.0, 82.85),
+    "maharashtra": (15.6, 22.05, 72.6, 80.9),
+    "manipur": (23.8, 25.7, 92.95, 94.8),
+    "meghalaya": (25.0, 26.15, 89.8, 92.85),
+    "mizoram": (21.9, 24.55, 92.25, 93.45),
+    "nagaland": (25.2, 27.05, 93.3, 95.25),
+    "odisha": (17.8, 22.6, 81.35, 87.5),
+    "puducherry": (10.8, 16.8, 75.5, 82.3), # Includes Mahe and Yanam
+    "punjab": (29.5, 32.55, 73.85, 76.95),
+    "rajasthan": (23.05, 30.2, 69.45, 78.3),
+    "sikkim": (27.05, 28.15, 88.0, 88.95),
+    "tamil nadu": (8.05, 13.6, 76.2, 80.35),
+    "telangana": (15.8, 19.95, 77.2, 81.35),
+    "tripura": (22.9, 24.55, 91.15, 92.35),
+    "uttar pradesh": (23.85, 30.45, 77.05, 84.65),
+    "uttarakhand": (28.7, 31.5, 77.55, 81.05),
+    "west bengal": (21.5, 27.25, 85.8, 89.9),
+}
+# Spellings found in the datasets
+STATE_ALIASES = {
+    "tamilnadu": "tamil nadu",
+    "chattisgarh": "chhattisgarh",
+    "orissa": "odisha",
+    "pondicherry": "puducherry",
+    "jammu kashmir": "jammu and kashmir",
+    "jammu & kashmir": "jammu and kashmir",
+    "new delhi": "delhi",
+    "nct of delhi": "delhi",
+}
+
+
+def normalise_state(names):
+    """Lower-case, single-spaced state names with the known aliases resolved."""
+    names = pd.Series(names, dtype="object").astype(str).str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+    return names.replace(STATE_ALIASES)
+
+
+class ValidationReport:
+    """Rejected and flagged rows per problem, with a few examples each."""
+
+    def __init__(self, kind, source, source_version, rows_in):
+        self.kind = kind
+        self.source = source
+        self.source_version = source_version
+        self.rows_in = rows_in
+        self.rejected = {}
+        self.warnings = {}
+        self.examples = {}
+        self._rejected_rows = []
+
+    def reject(self, problem, rows):
+        if len(rows):
+            self.rejected[problem] = self.rejected.get(problem, 0) + len(rows)
+            self.examples.setdefault(problem, rows.head(EXAMPLES_PER_PROBLEM).astype(str).to_dict("records"))
+            self._rejected_rows.append(rows.assign(rejected_because=problem))
+
+    def warn(self, problem, rows):
+        if len(rows):
+            self.warnings[problem] = self.warnings.get(problem, 0) + len(rows)
+            self.examples.setdefault(problem, rows.head(EXAMPLES_PER_PROBLEM).astype(str).to_dict("records"))
+
+    def rejected_frame(self):
+        return pd.concat(self._rejected_rows, ignore_index=True) if self._rejected_rows else pd.DataFrame(columns=["rejected_because"])
+
+    def to_dict(self, rows_out):
+        return {"dataset": self.kind, "source": self.source, "source_version": self.source_version,
+                "validated_at": time.time(), "rows_in": self.rows_in, "rows_out": rows_out,
+                "rejected": self.rejected, "warnings": self.warnings, "examples": self.examples}
+
+
+def validate_frame(df, kind, report, reject_state_mismatches=False):
+    """Runs every check on a raw dataset frame; returns the clean frame (rejected rows removed)."""
+    layout = SERVICE_COLUMNS[kind]
+    schema = SCHEMAS[kind]
+    key_col, lat_col, lon_col = layout["key_col"], layout["lat_col"], layout["lon_col"]
+
+    # Schema
+    missing = [c for c in [key_col, lat_col, lon_col] + schema["required"] if c not in df.columns]
+    if missing:
+        raise ValueError(f"{kind} data is missing required columns: {', '.join(missing)}")
+    df = df.copy()
+    df[key_col] = df[key_col].astype("object").where(df[key_col].notna(), "").astype(str).str.strip()
+    df[lat_col] = pd.to_numeric(df[lat_col], errors='coerce')
+    df[lon_col] = pd.to_numeric(df[lon_col], errors='coerce')
+
+    bad = df[key_col] == ""
+    report.reject(f"blank {key_col}", df[bad])
+    df = df[~bad]
+    bad = df[lat_col].isna() | df[lon_col].isna()
+    report.reject("missing or non-numeric coordinates", df[bad])
+    df = df[~bad]
+
+    # Geographic bounds: the country first, then the row's own state
+    b = INDIA_BOUNDS
+    outside = ~(df[lat_col].between(b["lat_min"], b["lat_max"]) & df[lon_col].between(b["lon_min"], b["lon_max"]))
+    report.reject("outside India", df[outside])
+    df = df[~outside]
+
+    states = normalise_state(df[schema["state_col"]]).to_numpy()
+    known = np.isin(states, list(STATE_BOUNDS))
+    report.warn("unknown state (position not checked)", df[~known])
+    boxes = np.array([STATE_BOUNDS.get(s, (-90.0, 90.0, -180.0, 180.0)) for s in states]).reshape(-1, 4)
+    m = STATE_MARGIN_DEGREES
+    lats, lons = df[lat_col].to_numpy(), df[lon_col].to_numpy()
+    in_state = ((lats >= boxes[:, 0] - m) & (lats <= boxes[:, 1] + m) & (lons >= boxes[:, 2] - m) & (lons <= boxes[:, 3] + m))
+    mismatched = df[~in_state]
+    if reject_state_mismatches:
+        report.reject("outside its state's bounds", mismatched)
+        df = df[in_state]
+    else:
+        report.warn("outside its state's bounds", mismatched)
+
+    # Duplicates: the same record twice (same key at the same position), then keys that are still repeated
+    position = df[lat_col].round(DUPLICATE_DECIMALS).astype(str) + "," + df[lon_col].round(DUPLICATE_DECIMALS).astype(str)
+    repeated = df.assign(_position=position).duplicated(subset=[key_col, "_position"], keep="first").to_numpy()
+    report.reject("duplicate record (same key and position)", df[repeated])
+    df, position = df[~repeated], position[~repeated]
+    repeated = df.duplicated(subset=[key_col], keep="first").to_numpy()
+    report.reject(f"duplicate {key_col} at a different position", df[repeated])
+    df, position = df[~repeated], position[~repeated]
+    report.warn("another service at the same position", df[position.duplicated(keep=False).to_numpy()])
+
+    return df.reset_index(drop=True)
+
+
+# --- Artifact ---
+def artifact_dir(kind, source_version):
+    """Directory of the artifact built from a given source version (content-addressed)."""
+    return os.path.join(VALIDATED_DIR, f"{kind}-{str(source_version).split(':')[-1]}")
+
+
+def artifact_version(source_version, rows):
+    """
+    dataset_version of a frame loaded from an artifact. The artifact holds the validated rows, not
+    the CSV as load_service_frames cleans it, so caches keyed by the version must tell the two apart
+    (and tell apart artifacts rebuilt from the same CSV with other options).
+    """
+    return f"{source_version}+validated.v{ARTIFACT_FORMAT}.{rows}"
+
+
+def write_artifact(df, kind, source, source_version, report):
+    """Writes the clean frame, manifest and report; the artifact directory appears atomically."""
+    target = artifact_dir(kind, source_version)
+    os.makedirs(VALIDATED_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{kind}-", dir=VALIDATED_DIR)
+    try:
+        columns = []
+        for i, column in enumerate(df.columns):
+            values = df[column].to_numpy()
+            if values.dtype.kind not in "biuf":
+                # Text as fixed-width unicode (memory-mappable, no pickled objects); missing values become ""
+                values = df[column].astype("object").where(df[column].notna(), "").astype(str).to_numpy().astype("U")
+            filename = f"{i:02d}.npy"
+            np.save(os.path.join(staging, filename), values, allow_pickle=False)
+            columns.append({"name": column, "file": filename, "dtype": values.dtype.str, "text": values.dtype.kind == "U"})
+        manifest = {"format": ARTIFACT_FORMAT, "dataset": kind, "source": os.path.abspath(source),
+                    "source_version": source_version, "rows": len(df), "columns": columns, "built_at": time.time()}
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        with open(os.path.join(staging, "report.json"), "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(len(df)), f, indent=2, default=str)
+        report.rejected_frame().to_csv(os.path.join(staging, "rejected.csv"), index=False)
+        if os.path.isdir(target):
+            shutil.rmtree(target) # Same source content: the old artifact is replaced by the new one
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return target
+
+
+def load_validated(kind, source_path):
+    """
+    The clean frame for a dataset CSV if an artifact was built from its current content, else None.
+    Numeric columns are read-only memory-mapped arrays; text columns are decoded from theirs.
+    """
+    version = dataset_version(source_path)
+    if version is None:
+        return None
+    directory = artifact_dir(kind, version)
+    try:
+        with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Validated: Could not read the {kind} artifact in {directory}: {e}")
+        return None
+    if manifest.get("format") != ARTIFACT_FORMAT or manifest.get("source_version") != version:
+        return None
+    columns = {}
+    for column in manifest["columns"]:
+        values = np.load(os.path.join(directory, column["file"]), mmap_mode="r", allow_pickle=False)
+        columns[column["name"]] = values.astype(object) if column["text"] else values
+    df = pd.DataFrame(columns, copy=False)
+    df.attrs['validated_artifact'] = directory
+    df.attrs['dataset_version'] = artifact_version(version, len(df))
+    print(f"Validated: Loaded {len(df)} {kind} rows from {directory}.")
+    return df
+
+
+def validate_dataset(kind, source_path=None, reject_state_mismatches=False):
+    """
+    Validates one dataset CSV and writes its artifact; returns (artifact directory, report dict).
+    The directory is None when too many rows were rejected and no artifact was written.
+    """
+    source_path = source_path or dataset_path(kind)
+    version = dataset_version(source_path)
+    if version is None:
+        raise SystemExit(f"{kind}: {source_path} not found.")
+    raw = pd.read_csv(source_path)
+    report = ValidationReport(kind, source_path, version, len(raw))
+    clean = validate_frame(raw, kind, report, reject_state_mismatches)
+    if len(raw) - len(clean) > MAX_REJECTED_FRACTION * len(raw):
+        stale = artifact_dir(kind, version)
+        if os.path.isdir(stale):
+            shutil.rmtree(stale)
+            print(f"Validated: Removed the earlier {kind} artifact {stale}.")
+        return None, report.to_dict(len(clean))
+    directory = write_artifact(clean, kind, source_path, version, report)
+    return directory, report.to_dict(len(clean))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the service datasets and build their clean artifacts.")
+    parser.add_argument("datasets", nargs="*", help=f"Datasets to validate: {', '.join(sorted(SERVICE_COLUMNS))} (default: all).")
+    parser.add_argument("--reject-state-mismatches", action="store_true",
+                        help="Reject rows outside their state's bounds instead of only reporting them as warnings.")
+    args = parser.parse_args()
+    unknown = set(args.datasets) - set(SERVICE_COLUMNS)
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(sorted(unknown))}")
+
+    refused = []
+    for kind in args.datasets or sorted(SERVICE_COLUMNS):
+        directory, report = validate_dataset(kind, reject_state_mismatches=args.reject_state_mismatches)
+        print(f"\n{kind}: {report['rows_in']} rows in, {report['rows_out']} clean -> {directory or 'no artifact'}")
+        for problem, count in report["rejected"].items():
+            print(f"  rejected  {count:>6}  {problem}")
+        for problem, count in report["warnings"].items():
+            print(f"  warning   {count:>6}  {problem}")
+        if directory is None:
+            print(f"  More than {MAX_REJECTED_FRACTION:.0%} of the {kind} rows were rejected; no artifact was written.")
+            for problem in report["rejected"]:
+                print(f"  e.g. {problem}: {report['examples'][problem][0]}")
+            refused.append(kind)
+    if refused:
+        raise SystemExit(f"No artifact written for: {', '.join(refused)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# video_processing.py
+# Frame-processing stage for the WebRTC recording pipeline.
+# Every recording gets a RecordingProfile (max resolution, max fps, x264 preset/CRF) picked
+# from a quality ladder according to how many recordings the server is already encoding.
+# AdaptiveFrameProcessor enforces that profile per stream: it downscales frames in the
+# WebRTC frame callback and decimates the frame rate when the encoder falls behind.
+# Streams stay registered with the governor only while frames arrive, so streams that end
+# without the recorder stopping (receive-only streams, closed tabs) stop counting after a while.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import threading
+import time
+
+# --- Configuration (upper bounds; the ladder below never exceeds these) ---
+MAX_WIDTH = int(os.environ.get("SEFI_RECORDING_MAX_WIDTH", "1280"))
+MAX_HEIGHT = int(os.environ.get("SEFI_RECORDING_MAX_HEIGHT", "720"))
+MAX_FPS = int(os.environ.get("SEFI_RECORDING_MAX_FPS", "24"))
+MIN_FPS = int(os.environ.get("SEFI_RECORDING_MIN_FPS", "5"))
+# A registered stream that has not delivered a frame for this long no longer counts as active
+STREAM_IDLE_SECONDS = float(os.environ.get("SEFI_RECORDING_IDLE_SECONDS", "10"))
+
+
+class RecordingProfile:
+    """Resolution, frame rate and encoder settings applied to one recording."""
+
+    def __init__(self, name, max_width, max_height, max_fps, preset, crf):
+        self.name = name
+        self.max_width = min(max_width, MAX_WIDTH)
+        self.max_height = min(max_height, MAX_HEIGHT)
+        self.max_fps = min(max_fps, MAX_FPS)
+        self.preset = preset
+        self.crf = crf
+
+    def encoder_options(self):
+        """libx264 options for the video stream (applied when the stream is created)."""
+        return {"preset": self.preset, "crf": str(self.crf), "tune": "zerolatency"}
+
+    def __repr__(self):
+        return f"RecordingProfile({self.name}, {self.max_width}x{self.max_height}@{self.max_fps}, {self.preset}/crf{self.crf})"
+
+
+# Quality ladder, best first. Cheaper presets trade file size for CPU, which matters
+# more than size when many SOS recordings are encoded on one server at once.
+QUALITY_LADDER = [
+    # (profile, max concurrent recordings that still get this level)
+    (RecordingProfile("high", 1280, 720, 24, "veryfast", 26), 2),
+    (RecordingProfile("medium", 960, 540, 20, "superfast", 28), 6),
+    (RecordingProfile("low", 640, 360, 15, "ultrafast", 30), 16),
+    (RecordingProfile("minimal", 426, 240, 10, "ultrafast", 32), None),
+]
+
+
+class RecordingLoadGovernor:
+    """
+    Process-wide count of active recordings and their encode pressure.
+    New recordings get a cheaper profile as concurrency rises, and one level cheaper again
+    while existing streams report that their encoders are falling behind.
+    """
+
+    def __init__(self, idle_seconds=STREAM_IDLE_SECONDS):
+        self._lock = threading.Lock()
+        self.idle_seconds = idle_seconds
+        self._streams = {} # id(processor) -> time of its latest frame (or registration)
+        self._congested = set()
+
+    def _expire(self, now):
+        for key in [k for k, seen in self._streams.items() if now - seen > self.idle_seconds]:
+            del self._streams[key]
+            self._congested.discard(key)
+
+    @property
+    def active(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._streams)
+
+    def register(self, processor):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._streams[id(processor)] = now
+            active = len(self._streams)
+            level = 0
+            for i, (profile, limit) in enumerate(QUALITY_LADDER):
+                level = i
+                if limit is None or active <= limit:
+                    break
+            if self._congested:
+                level = min(level + 1, len(QUALITY_LADDER) - 1)
+            profile = QUALITY_LADDER[level][0]
+        print(f"Video: Recording registered ({active} active), using {profile}.")
+        return profile
+
+    def touch(self, processor):
+        """Marks a registered stream as still delivering frames (re-adding it if it had expired)."""
+        with self._lock:
+            self._streams[id(processor)] = time.monotonic()
+
+    def unregister(self, processor):
+        with self._lock:
+            self._streams.pop(id(processor), None)
+            self._congested.discard(id(processor))
+
+    def set_congested(self, processor, congested):
+        with self._lock:
+            if congested:
+                self._congested.add(id(processor))
+            else:
+                self._congested.discard(id(processor))
+
+
+governor = RecordingLoadGovernor()
+
+
+def _letterbox(frame, fit_width, fit_height, width, height):
+    """Scales a frame to fit_width x fit_height and centres it on a black width x height frame."""
+    import av
+    import numpy as np
+
+    image = frame.reformat(width=fit_width, height=fit_height, format="rgb24").to_ndarray()
+    canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    top, left = (height - fit_height) // 2, (width - fit_width) // 2
+    canvas[top:top + fit_height, left:left + fit_width] = image
+    return av.VideoFrame.from_ndarray(canvas, format="rgb24").reformat(format=frame.format.name)
+
+
+def scaled_dimensions(width, height, max_width, max_height):
+    """Largest even width/height that fits in max_width x max_height and keeps the aspect ratio."""
+    scale = min(1.0, max_width / float(width), max_height / float(height))
+    # x264 with yuv420p needs even dimensions
+    new_width = max(2, int(width * scale) // 2 * 2)
+    new_height = max(2, int(height * scale) // 2 * 2)
+    return new_width, new_height
+
+
+class AdaptiveFrameProcessor:
+    """
+    Per-stream frame stage.
+    - `__call__` is the WebRTC video_frame_callback: it downscales frames to the profile.
+    - `admit` is called by the recorder before encoding and drops frames above the current
+      frame rate; the rate is lowered while frames queue up or encoding takes longer than the
+      frame budget, and raised again once the encoder has caught up.
+    One processor serves one stream at a time; close() resets it for the next stream.
+    """
+
+    # Frames waiting between the callback and the encoder before the stream counts as backed up
+    BACKLOG_HIGH = 8
+    BACKLOG_LOW = 2
+    # Fraction of the frame interval the encoder may spend per frame before we back off
+    ENCODE_BUDGET = 0.8
+    RECOVERY_FRAMES = 30 # Consecutive healthy frames before raising the frame rate again
+    TOUCH_INTERVAL = 1.0 # Seconds between liveness updates to the governor
+
+    def __init__(self, profile=None, load_governor=None):
+        self.governor = load_governor or governor
+        # The profile is chosen when the stream actually starts (not when the page renders),
+        # so reruns that never stream do not count as active recordings
+        self.profile = profile
+        self._fixed_profile = profile is not None
+        self._registered = False
+        self._last_touch = 0.0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.target_fps = float(self.profile.max_fps) if self.profile else float(MAX_FPS)
+        self.output_size = None # (width, height) of the encoder, fixed by the stream's first frame
+        self._next_due = None # Time the next frame may be encoded at the current frame rate
+        self._pending = 0
+        self._encode_ewma = 0.0
+        self._healthy_frames = 0
+        self.frames_in = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        """Registers the stream with the load governor and returns its profile."""
+        with self._lock:
+            if not self._registered:
+                profile = self.governor.register(self)
+                self._registered = True
+                self._last_touch = time.monotonic()
+                if not self._fixed_profile:
+                    self.profile = profile
+                    self.target_fps = float(profile.max_fps)
+            return self.profile
+
+    def close(self):
+        """Unregisters the stream and resets the processor, so a later stream starts afresh."""
+        with self._lock:
+            if self._registered:
+                self.governor.unregister(self)
+                self._registered = False
+            if not self._fixed_profile:
+                self.profile = None
+            self._reset()
+
+    # --- WebRTC callback ---
+    def __call__(self, frame):
+        self.start()
+        with self._lock:
+            self.frames_in += 1
+            self._pending += 1
+            if self.output_size is None:
+                self.output_size = scaled_dimensions(frame.width, frame.height, self.profile.max_width, self.profile.max_height)
+            width, height = self.output_size
+            now = time.monotonic()
+            if now - self._last_touch >= self.TOUCH_INTERVAL:
+                self._last_touch = now
+                self.governor.touch(self)
+        if (frame.width, frame.height) == (width, height):
+            return frame
+        # Encoder dimensions are fixed for the recording. Frames are scaled to fit them; a frame
+        # with another aspect ratio (the camera changed resolution mid-stream) is letterboxed
+        scale = min(width / float(frame.width), height / float(frame.height))
+        fit_width = min(width, max(2, int(frame.width * scale) // 2 * 2))
+        fit_height = min(height, max(2, int(frame.height * scale) // 2 * 2))
+        if width - fit_width <= 2 and height - fit_height <= 2: # Same aspect ratio (up to rounding)
+            scaled = frame.reformat(width=width, height=height)
+        else:
+            scaled = _letterbox(frame, fit_width, fit_height, width, height)
+        scaled.pts = frame.pts
+        scaled.time_base = frame.time_base
+        return scaled
+
+    # --- Recorder side ---
+    def admit(self, frame_time):
+        """Returns True if the frame at `frame_time` (seconds) should be encoded."""
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+            backlog = self._pending
+            interval = 1.0 / self.target_fps
+            if self._next_due is not None and frame_time < self._next_due - 0.002:
+                self.frames_dropped += 1
+                return False
+            self._adapt(backlog)
+            # Advance by whole intervals so the average rate matches target_fps even when the
+            # camera rate is not a multiple of it; resync after gaps in the stream
+            if self._next_due is None or frame_time - self._next_due > interval:
+                self._next_due = frame_time + interval
+            else:
+                self._next_due += interval
+            return True
+
+    def report_encode(self, seconds):
+        """Records how long the encoder took for one admitted frame."""
+        with self._lock:
+            self._encode_ewma = seconds if not self._encode_ewma else 0.8 * self._encode_ewma + 0.2 * seconds
+
+    def _adapt(self, backlog):
+        frame_budget = self.ENCODE_BUDGET / self.target_fps
+        overloaded = backlog >= self.BACKLOG_HIGH or self._encode_ewma > frame_budget
+        if overloaded:
+            self._healthy_frames = 0
+            if self.target_fps > MIN_FPS:
+                self.target_fps = max(float(MIN_FPS), self.target_fps * 0.75)
+                print(f"Video: Encoder backed up (backlog {backlog}, {self._encode_ewma * 1000:.1f} ms/frame), lowering to {self.target_fps:.1f} fps.")
+            self.governor.set_congested(self, True)
+        elif backlog <= self.BACKLOG_LOW and self._encode_ewma < frame_budget * 0.5:
+            self._healthy_frames += 1
+            if self._healthy_frames >= self.RECOVERY_FRAMES and self.target_fps < self.profile.max_fps:
+                self.target_fps = min(float(self.profile.max_fps), self.target_fps * 1.25)
+                self._healthy_frames = 0
+                if self.target_fps >= self.profile.max_fps:
+                    self.governor.set_congested(self, False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "profile": self.profile.name,
+                "output_size": self.output_size,
+                "target_fps": round(self.target_fps, 1),
+                "frames_in": self.frames_in,
+                "frames_dropped": self.frames_dropped,
+                "encode_ms": round(self._encode_ewma * 1000, 2),
+                "backlog": self._pending,
+            }
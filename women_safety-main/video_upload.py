@@ -0,0 +1,446 @@
+# video_upload.py
+# Background, resumable uploads of SOS video evidence.
+# Uploads are recorded in a small SQLite queue so they survive restarts, are sent in
+# fixed-size chunks (resuming from the last committed byte after a failure) and run on a
+# daemon thread so the page that recorded the video never blocks on the network.
+# It should NOT import or directly interact with Streamlit's UI or session state.
+
+import os
+import sqlite3
+import threading
+import time
+
+# --- Configuration ---
+UPLOAD_QUEUE_DB = os.environ.get("SEFI_UPLOAD_QUEUE_DB", "upload_queue.db")
+REMOTE_VIDEO_PREFIX = "sos_videos"
+
+# Google Cloud Storage requires every chunk except the last to be a multiple of 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 32 * CHUNK_ALIGNMENT # 8 MiB
+# Bytes per second; 0 disables throttling
+DEFAULT_BANDWIDTH_LIMIT = int(os.environ.get("SEFI_UPLOAD_BANDWIDTH_LIMIT", "0"))
+MAX_UPLOAD_ATTEMPTS = 8
+RETRY_BASE_DELAY = 2.0 # Seconds, doubled after every failed attempt
+RETRY_MAX_DELAY = 300.0
+
+FIREBASE_KEY_FILE = "firebase_key.json"
+FIREBASE_BUCKET = 'sos-alert-1bf56.appspot.com'
+LOCAL_STORAGE_DIR = os.environ.get("SEFI_LOCAL_STORAGE_DIR", "local_blob_store")
+
+# Job states
+STATUS_PENDING = "pending"
+STATUS_UPLOADING = "uploading"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class UploadSessionExpired(Exception):
+    """Raised by a backend when a resumable session can no longer be continued."""
+
+
+# --- Storage Backends ---
+class StorageBackend:
+    """
+    Minimal interface for a resumable blob store.
+    A session is an opaque string created once per upload and persisted in the queue,
+    so an interrupted upload can be continued from `query_offset` after a restart.
+    """
+    name = "base"
+
+    def start_session(self, remote_path, total_size, content_type):
+        raise NotImplementedError
+
+    def query_offset(self, session, remote_path, total_size):
+        """Returns the number of bytes the backend has durably stored for this session."""
+        raise NotImplementedError
+
+    def upload_chunk(self, session, remote_path, data, offset, total_size):
+        """Stores `data` at `offset` and returns the new committed offset."""
+        raise NotImplementedError
+
+    def finalize(self, session, remote_path):
+        """Completes the upload and returns a URL for the stored object."""
+        raise NotImplementedError
+
+
+class LocalFileStorageBackend(StorageBackend):
+    """
+    Stores blobs under a local directory. Used for tests and offline runs in place of
+    Firebase; partially uploaded objects live next to their final path as '.part' files.
+    """
+    name = "local"
+
+    def __init__(self, root_dir=LOCAL_STORAGE_DIR):
+        self.root_dir = root_dir
+
+    def _paths(self, remote_path):
+        final_path = os.path.join(self.root_dir, *remote_path.split("/"))
+        return final_path, final_path + ".part"
+
+    def start_session(self, remote_path, total_size, content_type):
+        final_path, part_path = self._paths(remote_path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        # Truncate any stale partial file from an earlier, abandoned session
+        open(part_path, "wb").close()
+        return part_path
+
+    def query_offset(self, session, remote_path, total_size):
+        final_path, part_path = self._paths(remote_path)
+        if os.path.exists(final_path) and not os.path.exists(part_path):
+            return total_size
+        if not os.path.exists(part_path):
+            raise UploadSessionExpired(f"Partial file missing for {remote_path}")
+        return os.path.getsize(part_path)
+
+    def upload_chunk(self, session, remote_path, data, offset, total_size):
+        final_path, part_path = self._paths(remote_path)
+        with open(part_path, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        return offset + len(data)
+
+    def finalize(self, session, remote_path):
+        final_path, part_path = self._paths(remote_path)
+        if os.path.exists(part_path):
+            os.replace(part_path, final_path)
+        return "file://" + os.path.abspath(final_path)
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """
+    Firebase Storage (Google Cloud Storage) backend using the resumable upload protocol.
+    Firebase is initialized lazily on first use, so importing this module never needs credentials.
+    """
+    name = "firebase"
+
+    def __init__(self, key_file=FIREBASE_KEY_FILE, bucket_name=FIREBASE_BUCKET):
+        self.key_file = key_file
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                import firebase_admin
+                from firebase_admin import credentials, storage
+                if not firebase_admin._apps:
+                    cred = credentials.Certificate(self.key_file)
+                    firebase_admin.initialize_app(cred, {'storageBucket': self.bucket_name})
+                self._bucket = storage.bucket()
+            return self._bucket
+
+    def start_session(self, remote_path, total_size, content_type):
+        blob = self._get_bucket().blob(remote_path)
+        return blob.create_resumable_upload_session(content_type=content_type, size=total_size)
+
+    def _parse_committed(self, response):
+        # A 308 response carries 'Range: bytes=0-N' once at least one byte is stored
+        range_header = response.headers.get("Range")
+        if not range_header:
+            return 0
+        return int(range_header.rsplit("-", 1)[1]) + 1
+
+    def query_offset(self, session, remote_path, total_size):
+        import requests
+        response = requests.put(session, headers={"Content-Range": f"bytes */{total_size}", "Content-Length": "0"}, timeout=30)
+        if response.status_code in (200, 201):
+            return total_size
+        if response.status_code == 308:
+            return self._parse_committed(response)
+        if response.status_code in (404, 410):
+            raise UploadSessionExpired(f"Resumable session expired ({response.status_code})")
+        response.raise_for_status()
+        return 0
+
+    def upload_chunk(self, session, remote_path, data, offset, total_size):
+        import requests
+        end = offset + len(data) - 1
+        headers = {"Content-Range": f"bytes {offset}-{end}/{total_size}", "Content-Length": str(len(data))}
+        response = requests.put(session, data=data, headers=headers, timeout=120)
+        if response.status_code in (200, 201):
+            return total_size
+        if response.status_code == 308:
+            return self._parse_committed(response)
+        if response.status_code in (404, 410):
+            raise UploadSessionExpired(f"Resumable session expired ({response.status_code})")
+        response.raise_for_status()
+        return offset
+
+    def finalize(self, session, remote_path):
+        blob = self._get_bucket().blob(remote_path)
+        blob.make_public()
+        return blob.public_url
+
+
+def get_storage_backend(name=None):
+    """Returns the configured storage backend ('firebase' by default, 'local' for offline runs or SEFI_BACKEND=local)."""
+    import backends
+    name = name or os.environ.get("SEFI_STORAGE_BACKEND", "local" if backends.use_local_backends() else "firebase")
+    if name == "local":
+        return LocalFileStorageBackend()
+    return FirebaseStorageBackend()
+
+
+# --- Bandwidth Limiting ---
+class BandwidthLimiter:
+    """Token bucket shared by all uploads of one uploader; `consume` sleeps when over budget."""
+
+    def __init__(self, bytes_per_second=0):
+        self.bytes_per_second = bytes_per_second
+        self._allowance = float(bytes_per_second)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.bytes_per_second, self._allowance + (now - self._last) * self.bytes_per_second)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.bytes_per_second if self._allowance < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# --- Persistent Upload Queue ---
+class UploadQueue:
+    """SQLite-backed list of upload jobs. Each call opens its own connection, so it is thread-safe."""
+
+    def __init__(self, db_path=UPLOAD_QUEUE_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    local_path TEXT NOT NULL,
+                    remote_path TEXT NOT NULL,
+                    content_type TEXT NOT NULL,
+                    total_size INTEGER NOT NULL,
+                    backend TEXT NOT NULL,
+                    session TEXT,
+                    uploaded_bytes INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    public_url TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_status ON uploads (status, next_attempt_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, local_path, remote_path, backend_name, content_type="video/mp4"):
+        total_size = os.path.getsize(local_path)
+        if total_size == 0:
+            # A resumable session cannot be finalised without any bytes (the Firebase backend rejects it)
+            raise ValueError(f"{local_path} is empty; there is nothing to upload.")
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO uploads (local_path, remote_path, content_type, total_size, backend, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (local_path, remote_path, content_type, total_size, backend_name, STATUS_PENDING, now, now))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def claim_next(self):
+        """Atomically moves the oldest due pending job to 'uploading' and returns it, or None."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM uploads WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+                (STATUS_PENDING, time.time())).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE uploads SET status = ?, updated_at = ? WHERE id = ?", (STATUS_UPLOADING, time.time(), row["id"]))
+            job = dict(row)
+            job["status"] = STATUS_UPLOADING
+            return job
+
+    def cancel(self, job_id):
+        """Fails a job that has not started uploading yet; returns True if it was cancelled."""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE uploads SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                                  (STATUS_FAILED, "cancelled", time.time(), job_id, STATUS_PENDING))
+            return cursor.rowcount > 0
+
+    def requeue_interrupted(self):
+        """Jobs left in 'uploading' by a process that died are made pending again (they resume, not restart)."""
+        with self._connect() as conn:
+            conn.execute("UPDATE uploads SET status = ? WHERE status = ?", (STATUS_PENDING, STATUS_UPLOADING))
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE uploads SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+# --- Background Uploader ---
+class BackgroundUploader(threading.Thread):
+    """
+    Daemon thread that drains the upload queue.
+    Progress is persisted after every chunk, so a crash or network failure resumes from
+    the last committed byte instead of starting the file from zero.
+    """
+
+    def __init__(self, queue=None, backend=None, chunk_size=DEFAULT_CHUNK_SIZE, bandwidth_limit=DEFAULT_BANDWIDTH_LIMIT, poll_interval=1.0):
+        super().__init__(name="sos-video-uploader", daemon=True)
+        self.queue = queue or UploadQueue()
+        self.backend = backend or get_storage_backend()
+        # Round down to the alignment required by resumable uploads
+        self.chunk_size = max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+        self.limiter = BandwidthLimiter(bandwidth_limit)
+        self.poll_interval = poll_interval
+        self._callbacks = {} # job_id -> list of progress callbacks
+        self._callbacks_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+
+    def add_progress_callback(self, job_id, callback):
+        """Registers callback(job_id, uploaded_bytes, total_bytes) for a job."""
+        with self._callbacks_lock:
+            self._callbacks.setdefault(job_id, []).append(callback)
+
+    def _notify(self, job_id, uploaded, total):
+        with self._callbacks_lock:
+            callbacks = list(self._callbacks.get(job_id, []))
+        for callback in callbacks:
+            try:
+                callback(job_id, uploaded, total)
+            except Exception as e:
+                print(f"Upload: Progress callback error for job {job_id}: {e}")
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def run(self):
+        self.queue.requeue_interrupted()
+        while not self._stop_event.is_set():
+            job = self.queue.claim_next()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        job_id = job["id"]
+        total = job["total_size"]
+        try:
+            if not os.path.exists(job["local_path"]):
+                raise FileNotFoundError(f"Local file missing: {job['local_path']}")
+
+            session = job["session"]
+            offset = 0
+            if session:
+                try:
+                    offset = self.backend.query_offset(session, job["remote_path"], total)
+                except UploadSessionExpired as e:
+                    print(f"Upload: Session for job {job_id} expired ({e}), restarting upload.")
+                    session = None
+            if not session:
+                session = self.backend.start_session(job["remote_path"], total, job["content_type"])
+                offset = 0
+                self.queue.update(job_id, session=session, uploaded_bytes=0)
+
+            with open(job["local_path"], "rb") as f:
+                while offset < total and not self._stop_event.is_set():
+                    f.seek(offset)
+                    data = f.read(self.chunk_size)
+                    self.limiter.consume(len(data))
+                    offset = self.backend.upload_chunk(session, job["remote_path"], data, offset, total)
+                    self.queue.update(job_id, uploaded_bytes=offset)
+                    self._notify(job_id, offset, total)
+
+            if offset < total:
+                # Stopping mid-upload; leave the job to be resumed on the next start
+                self.queue.update(job_id, status=STATUS_PENDING)
+                return
+
+            public_url = self.backend.finalize(session, job["remote_path"])
+            self.queue.update(job_id, status=STATUS_DONE, public_url=public_url, error=None)
+            print(f"✅ Uploaded video: {public_url}")
+            with self._callbacks_lock:
+                self._callbacks.pop(job_id, None)
+
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            if attempts >= MAX_UPLOAD_ATTEMPTS:
+                print(f"❌ Upload job {job_id} failed permanently after {attempts} attempts: {e}")
+                self.queue.update(job_id, status=STATUS_FAILED, attempts=attempts, error=str(e))
+            else:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+                print(f"Upload: Job {job_id} attempt {attempts} failed ({e}), retrying in {delay:.0f}s.")
+                self.queue.update(job_id, status=STATUS_PENDING, attempts=attempts, error=str(e), next_attempt_at=time.time() + delay)
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+def get_uploader():
+    """Returns the process-wide uploader, starting it on first use."""
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None or not _uploader.is_alive():
+            _uploader = BackgroundUploader()
+            _uploader.start()
+        return _uploader
+
+
+def enqueue_video_upload(local_video_path, video_filename, on_progress=None, content_type="video/mp4"):
+    """
+    Queues a video for background upload and returns the job id immediately.
+    Raises ValueError for an empty file.
+    `on_progress(job_id, uploaded_bytes, total_bytes)` is called after every chunk.
+    """
+    uploader = get_uploader()
+    job_id = uploader.queue.enqueue(local_video_path, f"{REMOTE_VIDEO_PREFIX}/{video_filename}", uploader.backend.name, content_type)
+    if on_progress:
+        uploader.add_progress_callback(job_id, on_progress)
+    uploader.wake()
+    print(f"Upload: Queued {video_filename} as job {job_id}.")
+    return job_id
+
+
+def get_upload_status(job_id):
+    """Returns the queue row for a job (status, uploaded_bytes, total_size, public_url, error) or None."""
+    return get_uploader().queue.get(job_id)
+
+
+def cancel_upload(job_id):
+    """Cancels a queued job that has not started uploading; returns True if it was cancelled."""
+    return get_uploader().queue.cancel(job_id)
+
+
+def wait_for_upload(job_id, timeout=None):
+    """Blocks until a job is done or failed (or the timeout passes) and returns its public URL or None."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = get_upload_status(job_id)
+        if job is None or job["status"] == STATUS_FAILED:
+            return None
+        if job["status"] == STATUS_DONE:
+            return job["public_url"]
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        time.sleep(0.5)